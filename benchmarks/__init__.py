@@ -0,0 +1,2 @@
+# benchmarks包初始化文件
+# 性能基准测试脚本，使用 python -m benchmarks.<脚本名> 运行
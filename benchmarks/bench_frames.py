@@ -0,0 +1,66 @@
+"""
+流式帧编码基准测试
+
+对比每帧的编码开销：
+- 旧实现：json.dumps 得到字符串，web_server 拼接 '\\n'，再由响应层编码为UTF-8字节
+- 新实现：encode_frame 直接输出带换行的字节（orjson，原生处理NumPy类型和NaN）
+
+帧内容取自实际流式输出：技术指标帧（含NumPy标量）、AI分析片段帧、完成帧
+
+用法:
+    python -m benchmarks.bench_frames [--frames 200000]
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from utils.frame_encoder import encode_frame, orjson
+
+
+def make_frames():
+    """技术指标帧、AI分析片段帧和完成帧"""
+    indicator = {
+        "stock_code": "600519", "status": "analyzing", "rsi": float(np.float64(62.31)),
+        "price": float(np.float64(1688.5)), "price_change": float(np.float64(1.25)),
+        "ma_trend": "UP", "macd_signal": "BUY", "volume_status": "HIGH"
+    }
+    chunk = {"stock_code": "600519", "ai_analysis_chunk": "趋势向上，MACD金叉，成交量放大。支撑位12.5元。" * 4,
+             "status": "analyzing"}
+    completed = {"stock_code": "600519", "status": "completed", "score": 85, "recommendation": "建议买入"}
+    return [indicator, chunk, completed]
+
+
+def legacy(frame) -> bytes:
+    return (json.dumps(frame) + '\n').encode()
+
+
+def main(args) -> None:
+    frames = make_frames()
+    total_bytes = {}
+    for name, encode in (("json.dumps", legacy), ("encode_frame", encode_frame)):
+        started = time.perf_counter()
+        size = 0
+        for i in range(args.frames):
+            size += len(encode(frames[i % len(frames)]))
+        elapsed = time.perf_counter() - started
+        total_bytes[name] = size
+        print(f"{name:13s} {elapsed / args.frames * 1e6:6.2f}us/帧  共 {size / 1024 / 1024:.1f}MB")
+    # 旧实现按ASCII转义中文，新实现直接输出UTF-8
+    print(f"字节数比例: {total_bytes['encode_frame'] / total_bytes['json.dumps']:.2f}  orjson={'是' if orjson else '否'}")
+
+    # NumPy标量：旧实现遇到np.int64抛出TypeError
+    numpy_frame = {"stock_code": "600519", "score": np.int64(85), "rsi": np.float64("nan")}
+    try:
+        legacy(numpy_frame)
+        print("json.dumps 可以编码NumPy帧")
+    except TypeError as e:
+        print(f"json.dumps 编码NumPy帧失败: {e}")
+    print(f"encode_frame 编码NumPy帧: {encode_frame(numpy_frame)!r}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='流式帧编码基准测试')
+    parser.add_argument('--frames', type=int, default=200000)
+    main(parser.parse_args())
@@ -0,0 +1,113 @@
+"""
+提示词大小与首token延迟基准测试
+
+对比旧版提示词（df.tail(14).to_dict('records') 直接嵌入）与紧凑表格提示词的字符数、估算token数，
+配置了API时还会以流式请求测量两种提示词的首token延迟（TTFT）
+
+用法:
+    python -m benchmarks.bench_prompt [--api-url URL --api-key KEY --api-model MODEL] [--runs 3]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+import numpy as np
+import pandas as pd
+
+from services.prompt_builder import PromptBuilder, estimate_tokens
+from services.technical_indicator import TechnicalIndicator
+from utils.api_utils import APIUtils
+from utils.http_client import get_http_client, get_http_client_pool
+
+
+def make_frame(periods: int = 120) -> pd.DataFrame:
+    """生成带技术指标的模拟日K数据"""
+    rng = np.random.default_rng(7)
+    close = 20 + np.cumsum(rng.normal(0, 0.3, periods))
+    df = pd.DataFrame({
+        'Open': close + rng.normal(0, 0.1, periods),
+        'High': close + 0.3,
+        'Low': close - 0.3,
+        'Close': close,
+        'Volume': rng.integers(100000, 500000, periods).astype(float),
+    }, index=pd.date_range(end='2024-09-30', periods=periods, freq='B'))
+    df['Change_pct'] = df['Close'].pct_change() * 100
+    return TechnicalIndicator().calculate_indicators(df)
+
+
+def legacy_prompt(df: pd.DataFrame, stock_code: str, technical_summary: dict) -> str:
+    """旧版A股提示词"""
+    recent_data = df.tail(14).to_dict('records')
+    return f"""
+                分析A股 {stock_code}：
+
+                技术指标概要：
+                {technical_summary}
+                
+                近14日交易数据：
+                {recent_data}
+                
+                请提供：
+                1. 趋势分析（包含支撑位和压力位）
+                2. 成交量分析及其含义
+                3. 风险评估（包含波动率分析）
+                4. 短期和中期目标价位
+                5. 关键技术位分析
+                6. 根据威科夫交易体系分析
+                7. 具体交易建议（包含止损位）
+                
+                请基于技术指标和A股市场特点进行分析，美观的输出，并给出具体数据支持。
+                """
+
+
+async def measure_ttft(api_url: str, api_key: str, model: str, prompt: str) -> float:
+    """流式请求并返回首个内容片段到达的耗时（毫秒）"""
+    url = APIUtils.format_api_url(api_url)
+    client = get_http_client(url, 60)
+    start = time.perf_counter()
+    async with client.stream("POST", url, headers={"Authorization": f"Bearer {api_key}"}, json={
+        "model": model, "messages": [{"role": "user", "content": prompt}], "stream": True, "max_tokens": 16
+    }) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith("data: ") or line == "data: [DONE]":
+                continue
+            delta = json.loads(line[6:]).get("choices", [{}])[0].get("delta", {})
+            if delta.get("content"):
+                break
+    return (time.perf_counter() - start) * 1000
+
+
+async def main(args) -> None:
+    df = make_frame()
+    last = df.iloc[-1]
+    summary = {
+        'trend': 'upward' if last['MA5'] > last['MA20'] else 'downward',
+        'volatility': f"{last['Volatility']:.2f}%",
+        'volume_trend': 'increasing' if last['Volume_Ratio'] > 1 else 'decreasing',
+    }
+    prompts = {
+        'legacy': legacy_prompt(df, '600519', {**summary, 'rsi_level': last['RSI']}),
+        'compact': PromptBuilder().build(df, '600519', 'A', {**summary, 'rsi_level': round(float(last['RSI']), 2)})[0],
+    }
+
+    for name, prompt in prompts.items():
+        print(f"{name:8s} chars={len(prompt):6d} est_tokens={estimate_tokens(prompt):6d}")
+
+    if args.api_url:
+        for name, prompt in prompts.items():
+            samples = [await measure_ttft(args.api_url, args.api_key, args.api_model, prompt) for _ in range(args.runs)]
+            print(f"{name:8s} ttft_ms median={statistics.median(samples):.1f} min={min(samples):.1f}")
+        await get_http_client_pool().aclose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='提示词大小与首token延迟基准测试')
+    parser.add_argument('--api-url', default=os.getenv('API_URL'))
+    parser.add_argument('--api-key', default=os.getenv('API_KEY', ''))
+    parser.add_argument('--api-model', default=os.getenv('API_MODEL', 'gpt-3.5-turbo'))
+    parser.add_argument('--runs', type=int, default=3)
+    asyncio.run(main(parser.parse_args()))
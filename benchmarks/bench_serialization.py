@@ -0,0 +1,123 @@
+"""
+搜索/详情结果格式化基准测试
+
+构造与美股行情列表同规模的合成数据（含缺失值和百分比字符串），对比：
+- 旧实现：每次请求 str.contains 过滤后 iterrows，逐单元格 pd.notna/float 判断，百分比逐行 strip('%')
+- 新实现：按列清洗一次（frame_records）并建立索引（SymbolSnapshot），请求时只查索引
+
+用法:
+    python -m benchmarks.bench_serialization [--rows 12000] [--requests 200]
+"""
+import argparse
+import random
+import time
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+
+from services.us_stock_service_async import US_DETAIL_FIELDS, US_SEARCH_FIELDS
+from utils.frame_records import frame_records
+from utils.symbol_index import SymbolSnapshot
+
+NUMERIC_COLUMNS = ["price", "price_change", "open", "high", "low", "pre_close", "market_value", "pe_ratio",
+                   "volume", "turnover"]
+
+
+def make_frame(rows: int, seed: int = 1) -> pd.DataFrame:
+    """合成美股行情列表，约5%的数值缺失"""
+    rng = np.random.default_rng(seed)
+    letters = np.array(list("ABCDEFGHIJKLMNOPQRSTUVWXYZ"))
+    symbols = ["105." + "".join(rng.choice(letters, 4)) + str(i) for i in range(rows)]
+    data: Dict[str, Any] = {"symbol": symbols, "name": [f"公司{i}科技" for i in range(rows)]}
+    for column in NUMERIC_COLUMNS:
+        values = rng.uniform(1, 1000, rows)
+        values[rng.random(rows) < 0.05] = np.nan
+        data[column] = values
+    percent = [f"{v:.2f}%" for v in rng.uniform(-10, 10, rows)]
+    for i in rng.choice(rows, rows // 20, replace=False):
+        percent[i] = None
+    data["price_change_percent"] = percent
+    return pd.DataFrame(data)
+
+
+def legacy_search(df: pd.DataFrame, keyword: str) -> List[Dict[str, Any]]:
+    """旧实现的搜索格式化"""
+    results = df[df['name'].str.contains(keyword, case=False, na=False)]
+    formatted = []
+    for _, row in results.iterrows():
+        formatted.append({
+            'name': row['name'] if pd.notna(row['name']) else '',
+            'symbol': str(row['symbol']) if pd.notna(row['symbol']) else '',
+            'price': float(row['price']) if pd.notna(row['price']) else 0.0,
+            'market_value': float(row['market_value']) if pd.notna(row['market_value']) else 0.0
+        })
+        if len(formatted) >= 10:
+            break
+    return formatted
+
+
+def legacy_detail(df: pd.DataFrame, symbol: str) -> Dict[str, Any]:
+    """旧实现的详情格式化"""
+    return legacy_detail_row(df[df['symbol'] == symbol].iloc[0])
+
+
+def legacy_records(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """旧实现逐行格式化整张表"""
+    return [legacy_detail_row(row) for _, row in df.iterrows()]
+
+
+def legacy_detail_row(row: pd.Series) -> Dict[str, Any]:
+    """旧实现逐单元格判断缺失值"""
+    detail = {'name': row['name'] if pd.notna(row['name']) else '',
+              'symbol': str(row['symbol']) if pd.notna(row['symbol']) else ''}
+    for column in NUMERIC_COLUMNS:
+        detail[column] = float(row[column]) if pd.notna(row[column]) else 0.0
+    detail['price_change_percent'] = (float(row['price_change_percent'].strip('%')) / 100
+                                      if pd.notna(row['price_change_percent']) else 0.0)
+    return detail
+
+
+def timed(fn: Callable[[], Any], repeat: int = 1) -> float:
+    """返回每次调用的平均耗时（毫秒）"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) * 1000 / repeat
+
+
+def main(args) -> None:
+    df = make_frame(args.rows)
+    rng = random.Random(2)
+    keywords = [str(rng.randint(0, args.rows)) for _ in range(args.requests)]
+    symbols = [df['symbol'].iloc[rng.randrange(args.rows)] for _ in range(args.requests)]
+
+    print(f"rows={args.rows} requests={args.requests}")
+    print(f"全表格式化   iterrows={timed(lambda: legacy_records(df)):9.1f}ms  "
+          f"frame_records={timed(lambda: frame_records(df, US_DETAIL_FIELDS)):7.1f}ms")
+
+    build_ms = timed(lambda: SymbolSnapshot.from_frame(df, US_SEARCH_FIELDS, US_DETAIL_FIELDS))
+    snapshot = SymbolSnapshot.from_frame(df, US_SEARCH_FIELDS, US_DETAIL_FIELDS)
+    print(f"快照构建（每次刷新一次） {build_ms:.1f}ms")
+
+    legacy_search_ms = timed(lambda: [legacy_search(df, k) for k in keywords]) / args.requests
+    snapshot_search_ms = timed(lambda: [snapshot.search(k) for k in keywords]) / args.requests
+    legacy_detail_ms = timed(lambda: [legacy_detail(df, s) for s in symbols]) / args.requests
+    snapshot_detail_ms = timed(lambda: [snapshot.detail(s) for s in symbols]) / args.requests
+    print(f"单次搜索     legacy={legacy_search_ms:9.3f}ms  snapshot={snapshot_search_ms:9.4f}ms")
+    print(f"单次详情     legacy={legacy_detail_ms:9.3f}ms  snapshot={snapshot_detail_ms:9.4f}ms")
+
+    # 校验两种实现的详情结果一致
+    mismatched = 0
+    for symbol in symbols:
+        expected, actual = legacy_detail(df, symbol), snapshot.detail(symbol)
+        if any(abs(expected[k] - actual[k]) > 1e-9 for k in NUMERIC_COLUMNS + ['price_change_percent']):
+            mismatched += 1
+    print(f"详情结果不一致: {mismatched}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='搜索/详情结果格式化基准测试')
+    parser.add_argument('--rows', type=int, default=12000)
+    parser.add_argument('--requests', type=int, default=200)
+    main(parser.parse_args())
@@ -0,0 +1,113 @@
+"""
+流式AI输出解码与帧合并基准测试
+
+构造高频的合成SSE token流（事件在任意位置被切分到不同网络分块），对比：
+- 旧实现：按分块split换行逐行解析，每个token发送一帧
+- 新实现：增量SSE解码 + 按字符数/时间阈值合并帧
+
+用法:
+    python -m benchmarks.bench_sse [--tokens 20000] [--rate 0]
+    --rate 为每秒token数，0表示不限速（测CPU开销），>0时模拟真实的输出速度
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import AsyncGenerator, List
+
+from utils.sse import TextCoalescer, decode_sse, iterate_with_timeout
+
+
+def make_sse_body(tokens: int) -> List[str]:
+    """生成OpenAI兼容格式的SSE事件文本"""
+    words = ["趋势", "向上", "，", "支撑位", "12.5", "元", "\n", "MACD", "金叉", "。"]
+    events = [
+        "data: " + json.dumps({"choices": [{"delta": {"content": words[i % len(words)]}}]}, ensure_ascii=False) + "\n\n"
+        for i in range(tokens)
+    ]
+    events.append("data: [DONE]\n\n")
+    return events
+
+
+def fragment(events: List[str], seed: int = 1) -> List[str]:
+    """将事件流随机切分为网络分块，分块边界可能落在事件中间"""
+    body = "".join(events)
+    rng = random.Random(seed)
+    chunks, pos = [], 0
+    while pos < len(body):
+        size = rng.randint(8, 160)
+        chunks.append(body[pos:pos + size])
+        pos += size
+    return chunks
+
+
+async def source(chunks: List[str], tokens: int, rate: float) -> AsyncGenerator[str, None]:
+    """按给定token速率产出分块"""
+    interval = (tokens / rate) / len(chunks) if rate else 0
+    for chunk in chunks:
+        if interval:
+            await asyncio.sleep(interval)
+        yield chunk
+
+
+async def legacy(chunks, tokens, rate):
+    """旧实现：每个分块按换行分割，被切断的事件解析失败后丢弃"""
+    frames, text, dropped = 0, "", 0
+    async for chunk in source(chunks, tokens, rate):
+        for line in chunk.strip().split('\n'):
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("data: "):
+                line = line[6:]
+            if line == "[DONE]":
+                continue
+            try:
+                content = json.loads(line)["choices"][0]["delta"].get("content")
+            except (json.JSONDecodeError, KeyError, TypeError, AttributeError):
+                dropped += 1
+                continue
+            if content:
+                text += content
+                json.dumps({"stock_code": "600519", "ai_analysis_chunk": content, "status": "analyzing"})
+                frames += 1
+    return frames, text, dropped
+
+
+async def coalesced(chunks, tokens, rate):
+    """新实现：增量解码并合并帧"""
+    frames, parts = 0, []
+    coalescer = TextCoalescer()
+    async for data in iterate_with_timeout(decode_sse(source(chunks, tokens, rate)), coalescer.timeout):
+        if data is None or data == "[DONE]":
+            text = coalescer.flush()
+        else:
+            content = json.loads(data)["choices"][0]["delta"].get("content")
+            parts.append(content)
+            text = coalescer.add(content)
+        if text:
+            json.dumps({"stock_code": "600519", "ai_analysis_chunk": text, "status": "analyzing"})
+            frames += 1
+    if coalescer.flush():
+        frames += 1
+    return frames, "".join(parts), 0
+
+
+async def main(args) -> None:
+    events = make_sse_body(args.tokens)
+    expected = "".join(json.loads(e[6:])["choices"][0]["delta"]["content"] for e in events[:-1])
+    chunks = fragment(events)
+    for name, impl in (("legacy", legacy), ("coalesced", coalesced)):
+        start = time.perf_counter()
+        frames, text, dropped = await impl(chunks, args.tokens, args.rate)
+        elapsed = time.perf_counter() - start
+        print(f"{name:10s} time={elapsed * 1000:8.1f}ms frames={frames:6d} dropped_events={dropped:5d} "
+              f"text_intact={text == expected}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='流式AI输出解码与帧合并基准测试')
+    parser.add_argument('--tokens', type=int, default=20000)
+    parser.add_argument('--rate', type=float, default=0)
+    asyncio.run(main(parser.parse_args()))
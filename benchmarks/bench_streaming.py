@@ -0,0 +1,105 @@
+"""
+流式分析链路吞吐基准测试
+
+在本地启动桩AI服务（benchmarks.stub_llm_server），并发运行 AIAnalyzer.get_ai_analysis 的流式分析，
+统计每次分析的首帧延迟（TTFT）、总耗时、发送帧数，以及整体输出吞吐
+端点并发受 AI_MAX_CONCURRENCY 限制，超出的请求在调度器中排队，排队时间计入TTFT
+
+用法:
+    python -m benchmarks.bench_streaming [--requests 30] [--concurrency 10] [--tps 100] [--tokens 400]
+                                         [--first-token-ms 200] [--fragment-bytes 64]
+"""
+import argparse
+import asyncio
+import json
+import math
+import time
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.stub_llm_server import StubLLMConfig, run_stub_server
+from services.ai_analyzer import AIAnalyzer
+
+
+def make_frame(bars: int = 60) -> pd.DataFrame:
+    """构造包含技术指标列的合成K线数据"""
+    close = np.linspace(10, 20, bars)
+    return pd.DataFrame({
+        "Open": close, "High": close + 0.5, "Low": close - 0.5, "Close": close, "Volume": 1e6,
+        "MA5": close, "MA20": close - 1, "RSI": 60.0, "MACD": 0.1, "MACD_Signal": 0.05,
+        "Volatility": 1.5, "Volume_Ratio": 1.2, "Change_pct": 0.5
+    }, index=pd.date_range(end="2024-09-30", periods=bars))
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+async def analyze_once(analyzer: AIAnalyzer, df: pd.DataFrame, index: int) -> Dict[str, float]:
+    """运行一次流式分析，返回客户端视角的耗时"""
+    start = time.perf_counter()
+    first_chunk = None
+    frames = chars = 0
+    status = None
+    async for frame in analyzer.get_ai_analysis(df, f"{600000 + index}", stream=True):
+        frames += 1
+        data = json.loads(frame)
+        if "ai_analysis_chunk" in data:
+            if first_chunk is None:
+                first_chunk = time.perf_counter()
+            chars += len(data["ai_analysis_chunk"])
+        status = data.get("status", status)
+    end = time.perf_counter()
+    return {
+        "ttft_ms": ((first_chunk or end) - start) * 1000,
+        "total_ms": (end - start) * 1000,
+        "frames": frames,
+        "chars": chars,
+        "ok": status == "completed"
+    }
+
+
+async def run(base_url: str, args) -> List[Dict[str, float]]:
+    analyzer = AIAnalyzer(custom_api_url=base_url, custom_api_key="stub", custom_api_model="stub-model")
+    df = make_frame()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(index: int) -> Dict[str, float]:
+        async with semaphore:
+            return await analyze_once(analyzer, df, index)
+
+    return await asyncio.gather(*(limited(i) for i in range(args.requests)))
+
+
+def main(args) -> None:
+    config = StubLLMConfig(first_token_ms=args.first_token_ms, tokens_per_sec=args.tps,
+                           output_tokens=args.tokens, fragment_bytes=args.fragment_bytes, seed=1)
+    with run_stub_server(config) as (base_url, stub):
+        start = time.perf_counter()
+        results = asyncio.run(run(base_url, args))
+        elapsed = time.perf_counter() - start
+
+    ttft = [r["ttft_ms"] for r in results]
+    total = [r["total_ms"] for r in results]
+    chars = sum(r["chars"] for r in results)
+    frames = sum(r["frames"] for r in results)
+    print(f"requests={len(results)} ok={sum(r['ok'] for r in results)} concurrency={args.concurrency} "
+          f"stub_tokens={stub.stats['tokens']}")
+    print(f"ttft_ms   p50={percentile(ttft, 0.5):8.1f} p95={percentile(ttft, 0.95):8.1f} max={max(ttft):8.1f}")
+    print(f"total_ms  p50={percentile(total, 0.5):8.1f} p95={percentile(total, 0.95):8.1f} max={max(total):8.1f}")
+    print(f"wall={elapsed:.2f}s throughput={chars / elapsed:,.0f} chars/s frames={frames} "
+          f"({frames / len(results):.1f}/request)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='流式分析链路吞吐基准测试')
+    parser.add_argument('--requests', type=int, default=30)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--tps', type=float, default=100)
+    parser.add_argument('--tokens', type=int, default=400)
+    parser.add_argument('--first-token-ms', type=float, default=200)
+    parser.add_argument('--fragment-bytes', type=int, default=64)
+    main(parser.parse_args())
@@ -0,0 +1,255 @@
+"""
+本地OpenAI兼容的桩AI服务，用于流式链路的压测和延迟测试
+
+实现 POST /v1/chat/completions（流式和非流式），可配置：
+- 首token延迟、每秒输出token数、输出token数
+- 网络分块大小：SSE事件在任意字节位置被切分到不同分块
+- 错误注入（500）和限流（429，带Retry-After与x-ratelimit响应头）
+提示词中包含批量分析的分隔标记（===STOCK:代码===）时，按股票分段输出
+
+用法:
+    python -m benchmarks.stub_llm_server [--port 8001] [--first-token-ms 300] [--tps 50] [--tokens 300]
+                                          [--fragment-bytes 0] [--error-rate 0] [--rate-limit-rate 0] [--rpm 0]
+    然后设置 API_URL=http://127.0.0.1:8001（由APIUtils.format_api_url补全为/v1/chat/completions）
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, AsyncGenerator, Deque, Dict, Iterator, List, Optional, Tuple
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from services.prompt_builder import SECTION_TAG
+
+# 输出内容的词表，循环使用以保证输出可复现
+VOCABULARY = ["趋势", "向上", "，", "支撑位", "12.5", "元", "\n", "MACD", "金叉", "，", "成交量", "放大", "。", "\n"]
+# 输出末尾的投资建议段落
+CLOSING = "\n## 投资建议\n持有\n"
+
+_SECTION = re.compile(r'===' + SECTION_TAG + r':([^\s=]+)===')
+
+
+class StubLLMConfig:
+    """桩服务的行为配置"""
+
+    def __init__(self, first_token_ms: float = 200, tokens_per_sec: float = 50, output_tokens: int = 300,
+                 fragment_bytes: int = 0, error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 rpm: int = 0, retry_after: float = 1.0, seed: Optional[int] = None):
+        """
+        Args:
+            first_token_ms: 收到请求到输出首个token的延迟（毫秒）
+            tokens_per_sec: 每秒输出的token数，0表示不限速
+            output_tokens: 每次（批量时为每只股票）输出的token数
+            fragment_bytes: 网络分块的最大字节数，分块大小在1到该值之间随机；0表示每个事件一个分块
+            error_rate: 返回500错误的概率
+            rate_limit_rate: 随机返回429的概率
+            rpm: 每分钟请求数上限，超出时返回429，0表示不限制
+            retry_after: 429响应的Retry-After秒数
+            seed: 随机数种子，用于复现分块和错误注入
+        """
+        self.first_token_ms = first_token_ms
+        self.tokens_per_sec = tokens_per_sec
+        self.output_tokens = output_tokens
+        self.fragment_bytes = fragment_bytes
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rpm = rpm
+        self.retry_after = retry_after
+        self.seed = seed
+
+
+def render_tokens(prompt: str, output_tokens: int) -> List[str]:
+    """
+    生成对提示词的输出token序列
+
+    Args:
+        prompt: 用户提示词
+        output_tokens: 每段输出的token数
+
+    Returns:
+        token列表，批量提示词按股票输出分隔标记和各自的内容
+    """
+    body = [VOCABULARY[i % len(VOCABULARY)] for i in range(output_tokens)] + [CLOSING]
+    codes = [code for code in dict.fromkeys(_SECTION.findall(prompt)) if code != '代码']
+    if not codes:
+        return body
+    tokens = []
+    for code in codes:
+        tokens.append(f"==={SECTION_TAG}:{code}===\n")
+        tokens.extend(body)
+    return tokens
+
+
+class StubLLMServer:
+    """桩服务的请求处理和统计"""
+
+    def __init__(self, config: StubLLMConfig):
+        self.config = config
+        self._random = random.Random(config.seed)
+        self._recent: Deque[float] = deque()
+        self.stats: Dict[str, int] = {"requests": 0, "completed": 0, "errors": 0, "rate_limited": 0,
+                                      "tokens": 0, "in_flight": 0}
+
+    def _rate_limit_headers(self, remaining: int) -> Dict[str, str]:
+        return {
+            "retry-after": f"{self.config.retry_after:g}",
+            "x-ratelimit-limit-requests": str(self.config.rpm),
+            "x-ratelimit-remaining-requests": str(max(0, remaining)),
+            "x-ratelimit-reset-requests": f"{self.config.retry_after:g}s"
+        }
+
+    def _check_limits(self) -> Optional[JSONResponse]:
+        """按配置注入限流和错误，正常处理时返回None"""
+        config = self.config
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] >= 60:
+            self._recent.popleft()
+        over_rpm = config.rpm and len(self._recent) >= config.rpm
+        if over_rpm or self._random.random() < config.rate_limit_rate:
+            self.stats["rate_limited"] += 1
+            return JSONResponse(status_code=429, headers=self._rate_limit_headers(0),
+                                content={"error": {"message": "Rate limit reached", "type": "rate_limit"}})
+        self._recent.append(now)
+        if self._random.random() < config.error_rate:
+            self.stats["errors"] += 1
+            return JSONResponse(status_code=500, content={"error": {"message": "Injected server error"}})
+        return None
+
+    def _fragment(self, payload: str) -> List[bytes]:
+        data = payload.encode()
+        if not self.config.fragment_bytes:
+            return [data]
+        chunks, pos = [], 0
+        while pos < len(data):
+            size = self._random.randint(1, self.config.fragment_bytes)
+            chunks.append(data[pos:pos + size])
+            pos += size
+        return chunks
+
+    async def _stream(self, model: str, tokens: List[str]) -> AsyncGenerator[bytes, None]:
+        config = self.config
+        created = int(time.time())
+        interval = 1 / config.tokens_per_sec if config.tokens_per_sec else 0
+        self.stats["in_flight"] += 1
+        try:
+            await asyncio.sleep(config.first_token_ms / 1000)
+            started = time.monotonic()
+            for index, token in enumerate(tokens):
+                # 按目标速率输出，睡眠误差不会累积
+                delay = started + index * interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                event = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created,
+                         "model": model, "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+                for chunk in self._fragment("data: " + json.dumps(event, ensure_ascii=False) + "\n\n"):
+                    yield chunk
+                self.stats["tokens"] += 1
+            done = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            for chunk in self._fragment("data: " + json.dumps(done) + "\n\ndata: [DONE]\n\n"):
+                yield chunk
+            self.stats["completed"] += 1
+        finally:
+            self.stats["in_flight"] -= 1
+
+    async def chat_completions(self, request: Request):
+        self.stats["requests"] += 1
+        body = await request.json()
+        rejected = self._check_limits()
+        if rejected is not None:
+            return rejected
+
+        model = body.get("model", "stub")
+        prompt = "".join(str(message.get("content", "")) for message in body.get("messages", []))
+        tokens = render_tokens(prompt, self.config.output_tokens)
+        if body.get("stream"):
+            return StreamingResponse(self._stream(model, tokens), media_type="text/event-stream")
+
+        config = self.config
+        await asyncio.sleep(config.first_token_ms / 1000
+                            + (len(tokens) / config.tokens_per_sec if config.tokens_per_sec else 0))
+        self.stats["tokens"] += len(tokens)
+        self.stats["completed"] += 1
+        return {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                         "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(prompt), "completion_tokens": len(tokens),
+                      "total_tokens": len(prompt) + len(tokens)}
+        }
+
+
+def create_app(config: Optional[StubLLMConfig] = None) -> FastAPI:
+    """创建桩服务应用，app.state.stub 为请求统计"""
+    stub = StubLLMServer(config or StubLLMConfig())
+    app = FastAPI(title="Stub LLM")
+    app.state.stub = stub
+    app.add_api_route("/v1/chat/completions", stub.chat_completions, methods=["POST"])
+
+    @app.get("/stats")
+    async def stats() -> Dict[str, Any]:
+        return stub.stats
+
+    return app
+
+
+@contextmanager
+def run_stub_server(config: Optional[StubLLMConfig] = None, host: str = "127.0.0.1",
+                    port: int = 0) -> Iterator[Tuple[str, StubLLMServer]]:
+    """
+    在后台线程中启动桩服务，供基准测试和回归测试使用
+
+    Args:
+        config: 桩服务配置
+        host: 监听地址
+        port: 监听端口，0表示随机分配
+
+    Returns:
+        上下文管理器，产出 (基础URL, StubLLMServer)
+    """
+    app = create_app(config)
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning", access_log=False))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("桩服务启动失败")
+        time.sleep(0.01)
+    bound_port = server.servers[0].sockets[0].getsockname()[1]
+    try:
+        yield f"http://{host}:{bound_port}", app.state.stub
+    finally:
+        server.should_exit = True
+        thread.join(timeout=5)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='本地OpenAI兼容的桩AI服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--first-token-ms', type=float, default=200)
+    parser.add_argument('--tps', type=float, default=50, help='每秒输出token数，0表示不限速')
+    parser.add_argument('--tokens', type=int, default=300, help='每次输出的token数')
+    parser.add_argument('--fragment-bytes', type=int, default=0, help='网络分块最大字节数，0表示按事件分块')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--rpm', type=int, default=0)
+    parser.add_argument('--retry-after', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    uvicorn.run(create_app(StubLLMConfig(
+        first_token_ms=args.first_token_ms, tokens_per_sec=args.tps, output_tokens=args.tokens,
+        fragment_bytes=args.fragment_bytes, error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+        rpm=args.rpm, retry_after=args.retry_after, seed=args.seed
+    )), host=args.host, port=args.port, log_level="warning")
@@ -129,6 +129,23 @@ export const apiService = {
     }
   },
   
+  // 证券代码自动补全（代码、名称或拼音首字母）
+  autocompleteSymbols: async (keyword: string, marketType?: string): Promise<SearchResult[]> => {
+    try {
+      const response = await axiosInstance.get('/symbols/autocomplete', {
+        params: { q: keyword, market_type: marketType }
+      });
+      return (response.data.results || []).map((item: any) => ({
+        symbol: item.code,
+        name: item.name,
+        market: item.market_type
+      }));
+    } catch (error) {
+      console.error('证券代码自动补全时出错:', error);
+      return [];
+    }
+  },
+  
   // 获取配置
   getConfig: async () => {
     try {
@@ -28,6 +28,7 @@ export interface StockInfo {
   marketValue?: number;
   analysis?: string;
   analysisStatus: 'waiting' | 'analyzing' | 'completed' | 'error';
+  queuePosition?: number;
   error?: string;
   score?: number;
   recommendation?: string;
@@ -92,7 +93,8 @@ export interface StreamInitMessage {
 export interface StreamAnalysisUpdate {
   stock_code: string;
   analysis?: string;
-  status: 'analyzing' | 'completed' | 'error';
+  status: 'waiting' | 'analyzing' | 'completed' | 'error';
+  queue_position?: number;
   error?: string;
   name?: string;
   price?: number;
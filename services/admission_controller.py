@@ -0,0 +1,244 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import Any, AsyncGenerator, Deque, Dict, List, Optional
+
+from services.llm_scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE
+from utils.logger import get_logger
+
+# 获取日志器
+logger = get_logger()
+
+# 同时运行的分析请求数（全局），以及每个用户同时运行的分析请求数
+ANALYZE_MAX_CONCURRENCY = int(os.getenv('ANALYZE_MAX_CONCURRENCY', 8))
+ANALYZE_MAX_PER_USER = int(os.getenv('ANALYZE_MAX_PER_USER', 2))
+# 排队上限（全局和每个用户），超出时直接返回429
+ANALYZE_MAX_QUEUE = int(os.getenv('ANALYZE_MAX_QUEUE', 32))
+ANALYZE_MAX_QUEUE_PER_USER = int(os.getenv('ANALYZE_MAX_QUEUE_PER_USER', 4))
+
+# 尚无完成记录时各优先级的预计耗时（秒），之后按实际耗时的指数移动平均更新
+DEFAULT_EXPECTED_SECONDS = {PRIORITY_INTERACTIVE: 20.0, PRIORITY_BATCH: 90.0}
+# 移动平均中最新一次耗时的权重
+EXPECTED_SECONDS_ALPHA = 0.2
+
+
+class AdmissionRejected(Exception):
+    """排队已满，请求被拒绝"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = retry_after
+
+
+class _Request:
+    """等待或正在运行的一个分析请求"""
+
+    __slots__ = ('user', 'priority', 'future', 'changed', 'enqueued_at', 'started_at')
+
+    def __init__(self, user: str, priority: int):
+        self.user = user
+        self.priority = priority
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.changed = asyncio.Event()
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+
+
+class AdmissionTicket:
+    """一次分析请求的准入凭证，获得许可后必须调用release归还名额"""
+
+    def __init__(self, controller: 'AdmissionController', request: _Request):
+        self._controller = controller
+        self._request = request
+        self._released = False
+
+    @property
+    def granted(self) -> bool:
+        return self._request.future.done()
+
+    async def wait(self) -> AsyncGenerator[int, None]:
+        """
+        等待获得运行许可
+
+        Returns:
+            排队位置变化的异步生成器（从1开始），获得许可后结束；无需排队时不产出任何位置
+        """
+        request = self._request
+        last_position = None
+        try:
+            while not request.future.done():
+                position = self._controller.position(request)
+                if position != last_position:
+                    last_position = position
+                    yield position
+                    continue
+                request.changed.clear()
+                changed = asyncio.ensure_future(request.changed.wait())
+                try:
+                    await asyncio.wait({request.future, changed}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    changed.cancel()
+        finally:
+            # 排队期间客户端断开时退出队列
+            if not request.future.done():
+                self._controller._remove(request)
+
+    def release(self) -> None:
+        """归还名额，重复调用无效"""
+        if self._released:
+            return
+        self._released = True
+        if self.granted:
+            self._controller._release(self._request)
+        else:
+            self._controller._remove(self._request)
+
+
+class AdmissionController:
+    """
+    分析请求的准入控制
+    限制全局和每个用户同时运行的分析数，超出的请求进入有界队列；交互式的单只分析优先于批量扫描，
+    同一优先级内先到先得，已达到个人并发上限的用户不阻塞其他用户。队列已满时立即拒绝并给出预计等待时间
+    """
+
+    def __init__(self, max_concurrency: int = ANALYZE_MAX_CONCURRENCY, max_per_user: int = ANALYZE_MAX_PER_USER,
+                 max_queue: int = ANALYZE_MAX_QUEUE, max_queue_per_user: int = ANALYZE_MAX_QUEUE_PER_USER):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_per_user = max(1, max_per_user)
+        self.max_queue = max(0, max_queue)
+        self.max_queue_per_user = max(0, max_queue_per_user)
+        self.expected_seconds = dict(DEFAULT_EXPECTED_SECONDS)
+        self._queues: Dict[int, Deque[_Request]] = {}
+        self._running: List[_Request] = []
+        self._running_by_user: Dict[str, int] = {}
+        self.admitted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+
+    def admit(self, user: str, priority: int = PRIORITY_INTERACTIVE) -> AdmissionTicket:
+        """
+        提交一个分析请求，名额允许时立即获得许可，否则排队
+
+        Args:
+            user: 用户标识
+            priority: 优先级，数值越小越优先
+
+        Returns:
+            准入凭证
+
+        Raises:
+            AdmissionRejected: 全局或该用户的排队已满
+        """
+        request = _Request(user or 'anonymous', priority)
+        self._queues.setdefault(priority, deque()).append(request)
+        self._dispatch()
+        if not request.future.done():
+            # 需要排队时检查排队上限（不含本请求）
+            queued = self.queue_length() - 1
+            user_queued = sum(1 for queue in self._queues.values() for r in queue if r.user == request.user) - 1
+            if queued >= self.max_queue or user_queued >= self.max_queue_per_user:
+                self._remove(request)
+                self.rejected += 1
+                retry_after = self.estimate_wait(priority)
+                reason = "您的排队请求已达上限" if user_queued >= self.max_queue_per_user else "排队请求已满"
+                logger.warning(f"拒绝分析请求: user={request.user}, {reason}, 预计等待 {retry_after:.0f} 秒")
+                raise AdmissionRejected(reason, retry_after)
+        return AdmissionTicket(self, request)
+
+    def _order(self) -> List[_Request]:
+        """按调度顺序排列的排队请求"""
+        return [request for priority in sorted(self._queues) for request in self._queues[priority]]
+
+    def queue_length(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def position(self, request: _Request) -> int:
+        """请求在队列中的位置，从1开始"""
+        for index, queued in enumerate(self._order()):
+            if queued is request:
+                return index + 1
+        return 0
+
+    def estimate_wait(self, priority: int = PRIORITY_INTERACTIVE) -> float:
+        """
+        估算该优先级的新请求需要等待的秒数：
+        排在前面的请求的预计耗时加上运行中请求的剩余耗时，按全局并发数分摊
+        """
+        if len(self._running) < self.max_concurrency and not self.queue_length():
+            return 0.0
+        now = time.monotonic()
+        running = sum(max(0.0, self._expected(r.priority) - (now - r.started_at)) for r in self._running)
+        ahead = sum(self._expected(r.priority) for r in self._order() if r.priority <= priority)
+        return (running + ahead) / self.max_concurrency
+
+    def _expected(self, priority: int) -> float:
+        return self.expected_seconds.get(priority, DEFAULT_EXPECTED_SECONDS[PRIORITY_BATCH])
+
+    def _remove(self, request: _Request) -> None:
+        queue = self._queues.get(request.priority)
+        if queue is None or request not in queue:
+            return
+        queue.remove(request)
+        if not queue:
+            del self._queues[request.priority]
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """按优先级放行排队请求，跳过已达到个人并发上限的用户"""
+        for priority in sorted(self._queues):
+            queue = self._queues[priority]
+            for request in list(queue):
+                if len(self._running) >= self.max_concurrency:
+                    break
+                if self._running_by_user.get(request.user, 0) >= self.max_per_user:
+                    continue
+                queue.remove(request)
+                request.started_at = time.monotonic()
+                self._running.append(request)
+                self._running_by_user[request.user] = self._running_by_user.get(request.user, 0) + 1
+                self.admitted += 1
+                self.total_wait += request.started_at - request.enqueued_at
+                request.future.set_result(None)
+            if not queue:
+                del self._queues[priority]
+        # 通知仍在排队的请求刷新位置
+        for queue in self._queues.values():
+            for request in queue:
+                request.changed.set()
+
+    def _release(self, request: _Request) -> None:
+        self._running.remove(request)
+        count = self._running_by_user[request.user] - 1
+        if count:
+            self._running_by_user[request.user] = count
+        else:
+            del self._running_by_user[request.user]
+        duration = time.monotonic() - request.started_at
+        expected = self._expected(request.priority)
+        self.expected_seconds[request.priority] = expected + EXPECTED_SECONDS_ALPHA * (duration - expected)
+        self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": len(self._running),
+            "queued": self.queue_length(),
+            "users": len(self._running_by_user),
+            "max_concurrency": self.max_concurrency,
+            "max_per_user": self.max_per_user,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.total_wait / self.admitted * 1000, 2) if self.admitted else None,
+            "estimated_wait": {
+                "interactive": round(self.estimate_wait(PRIORITY_INTERACTIVE), 1),
+                "batch": round(self.estimate_wait(PRIORITY_BATCH), 1)
+            }
+        }
+
+
+def retry_after_header(seconds: float) -> str:
+    """Retry-After响应头的值（整数秒，至少1秒）"""
+    return str(max(1, math.ceil(seconds)))
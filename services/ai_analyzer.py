@@ -1,24 +1,46 @@
 import pandas as pd
 import os
 import json
-import httpx
 import re
-from typing import AsyncGenerator
+import asyncio
+import time
+from typing import AsyncGenerator, Dict, List, Optional, Tuple
 from dotenv import load_dotenv
 from utils.logger import get_logger
-from utils.api_utils import APIUtils
+from utils.http_client import get_http_client
+from utils.frame_encoder import encode_frame
+from services.prompt_builder import PromptBuilder, SectionDemuxer, estimate_tokens
+from utils.sse import TextCoalescer, decode_sse, iterate_with_timeout
+from utils.llm_metrics import LLMCallTimer, endpoint_label
+from utils.cancel_metrics import get_cancel_metrics
+from utils.stage_metrics import get_stage_metrics
+from services.llm_router import LLMEndpoint, LLMEndpointError, LLMRouter, get_default_router
+from services.llm_response_cache import get_llm_response_cache, replay_text, response_cache_key
+from services.llm_scheduler import (AI_RATE_LIMIT_MAX_WAIT, AI_RATE_LIMIT_RETRIES, DEFAULT_RETRY_AFTER,
+                                    PRIORITY_BATCH, PRIORITY_INTERACTIVE, EndpointScheduler,
+                                    estimate_request_tokens, get_endpoint_scheduler, parse_retry_after)
 from datetime import datetime
 
 # 获取日志器
 logger = get_logger()
 
+
+def _is_queue_event(event: Tuple[str, object]) -> bool:
+    """排队位置事件不代表端点已开始输出"""
+    return event[0] == "queued"
+
+
 class AIAnalyzer:
     """
     异步AI分析服务
     负责调用AI API对股票数据进行分析
     """
     
-    def __init__(self, custom_api_url=None, custom_api_key=None, custom_api_model=None, custom_api_timeout=None):
+    # 提示词模板版本，修改提示词后需递增，使旧的缓存结果失效
+    PROMPT_VERSION = "2"
+    
+    def __init__(self, custom_api_url=None, custom_api_key=None, custom_api_model=None, custom_api_timeout=None,
+                 user_id=None):
         """
         初始化AI分析服务
         
@@ -27,6 +49,7 @@ class AIAnalyzer:
             custom_api_key: 自定义API密钥
             custom_api_model: 自定义API模型
             custom_api_timeout: 自定义API超时时间
+            user_id: 发起分析的用户，共享端点配额时在用户之间公平排队
         """
         # 加载环境变量
         load_dotenv()
@@ -36,10 +59,101 @@ class AIAnalyzer:
         self.API_KEY = custom_api_key or os.getenv('API_KEY')
         self.API_MODEL = custom_api_model or os.getenv('API_MODEL', 'gpt-3.5-turbo')
         self.API_TIMEOUT = int(custom_api_timeout or os.getenv('API_TIMEOUT', 60))
+        self.prompt_builder = PromptBuilder()
+        self.user_id = user_id or 'anonymous'
+        
+        # 指定了自定义API时只使用该端点，否则使用环境变量配置的端点列表（共享健康状态）
+        if custom_api_url or custom_api_key or custom_api_model:
+            self.router = LLMRouter([LLMEndpoint(self.API_URL, self.API_KEY, self.API_MODEL)], hedge_enabled=False)
+        else:
+            self.router = get_default_router()
         
         logger.debug(f"初始化AIAnalyzer: API_URL={self.API_URL}, API_MODEL={self.API_MODEL}, API_KEY={'已提供' if self.API_KEY else '未提供'}, API_TIMEOUT={self.API_TIMEOUT}")
     
-    async def get_ai_analysis(self, df: pd.DataFrame, stock_code: str, market_type: str = 'A', stream: bool = False) -> AsyncGenerator[str, None]:
+    def endpoint_keys(self) -> List[Tuple[str, str]]:
+        """
+        分析结果可能来自的端点
+
+        Returns:
+            (API URL, 模型) 列表，按配置顺序排列
+        """
+        return [(endpoint.url, endpoint.model) for endpoint in self.router.endpoints]
+    
+    def producing_endpoint(self, timings: Optional[Dict]) -> Optional[Tuple[str, str]]:
+        """
+        根据分析输出的耗时统计找到生成结果的端点
+        
+        Args:
+            timings: 耗时统计帧中的timings；命中AI响应缓存时endpoint为最初生成输出的端点，来源未知时为cache
+        
+        Returns:
+            (API URL, 模型)，无法确定时返回None
+        """
+        if not timings or timings.get('endpoint') == 'cache':
+            return None
+        for endpoint in self.router.endpoints:
+            if endpoint.model == timings.get('model') and timings.get('endpoint') == endpoint.label:
+                return endpoint.url, endpoint.model
+        return None
+    
+    @staticmethod
+    def _get_scheduler(endpoint: LLMEndpoint) -> EndpointScheduler:
+        """
+        获取API端点（URL + 密钥）共享的调度器
+        
+        Args:
+            endpoint: AI端点
+        
+        Returns:
+            限制该端点并发数和每分钟配额的调度器
+        """
+        return get_endpoint_scheduler(endpoint.url, endpoint.key, endpoint.label, endpoint.rpm, endpoint.tpm)
+    
+    def _indicator_frame(self, df: pd.DataFrame, stock_code: str) -> Tuple[Dict, Dict]:
+        """
+        提取最新的关键技术指标
+        
+        Returns:
+            (发送给前端的技术指标帧, 提示词中的技术指标概要)
+        """
+        latest_data = df.iloc[-1]
+        
+        # 确定MA趋势
+        ma_trend = 'UP' if latest_data.get('MA5', 0) > latest_data.get('MA20', 0) else 'DOWN'
+        
+        # 确定MACD信号
+        macd = latest_data.get('MACD', 0)
+        macd_signal = latest_data.get('MACD_Signal', 0)
+        macd_signal_type = 'BUY' if macd > macd_signal else 'SELL'
+        
+        # 确定成交量状态
+        volume_ratio = latest_data.get('Volume_Ratio', 1)
+        volume_status = 'HIGH' if volume_ratio > 1.5 else ('LOW' if volume_ratio < 0.5 else 'NORMAL')
+        
+        indicator_frame = {
+            "stock_code": stock_code,
+            "status": "analyzing",
+            "rsi": latest_data.get('RSI'),
+            "price": latest_data.get('Close'),
+            "price_change": latest_data.get('Change'),
+            "ma_trend": ma_trend,
+            "macd_signal": macd_signal_type,
+            "volume_status": volume_status,
+            # 获取当前日期作为分析日期
+            "analysis_date": datetime.now().strftime("%Y-%m-%d")
+        }
+        
+        # 包含trend, volatility, volume_trend, rsi_level的字典
+        technical_summary = {
+            'trend': 'upward' if latest_data['MA5'] > latest_data['MA20'] else 'downward',
+            'volatility': f"{latest_data['Volatility']:.2f}%",
+            'volume_trend': 'increasing' if latest_data['Volume_Ratio'] > 1 else 'decreasing',
+            'rsi_level': round(float(latest_data['RSI']), 2)
+        }
+        return indicator_frame, technical_summary
+    
+    async def get_ai_analysis(self, df: pd.DataFrame, stock_code: str, market_type: str = 'A', stream: bool = False,
+                              priority: int = PRIORITY_INTERACTIVE) -> AsyncGenerator[bytes, None]:
         """
         对股票数据进行AI分析
         
@@ -48,341 +162,654 @@ class AIAnalyzer:
             stock_code: 股票代码
             market_type: 市场类型，默认为'A'股
             stream: 是否使用流式响应
+            priority: 排队优先级，交互式分析优先于批量扫描
             
         Returns:
-            异步生成器，生成分析结果字符串
+            异步生成器，生成编码后的分析结果帧（NDJSON字节）
         """
         try:
             logger.info(f"开始AI分析 {stock_code}, 流式模式: {stream}")
             
             # 提取关键技术指标
-            latest_data = df.iloc[-1]
+            indicator_frame, technical_summary = self._indicator_frame(df, stock_code)
             
-            # 计算技术指标
-            rsi = latest_data.get('RSI')
-            price = latest_data.get('Close')
-            price_change = latest_data.get('Change')
+            # 构建紧凑的提示词，控制在市场对应的token预算内
+            prompt, prompt_tokens = self.prompt_builder.build(df, stock_code, market_type, technical_summary)
+            logger.debug(f"{stock_code} 提示词长度: {len(prompt)} 字符，约 {prompt_tokens} tokens")
             
-            # 确定MA趋势
-            ma_trend = 'UP' if latest_data.get('MA5', 0) > latest_data.get('MA20', 0) else 'DOWN'
+            # 准备请求数据，模型由所选端点决定
+            request_data = {
+                "messages": [{"role": "user", "content": prompt}],
+                "temperature": 0.7,
+                "stream": stream
+            }
             
-            # 确定MACD信号
-            macd = latest_data.get('MACD', 0)
-            macd_signal = latest_data.get('MACD_Signal', 0)
-            macd_signal_type = 'BUY' if macd > macd_signal else 'SELL'
+            # 先发送技术指标数据
+            yield encode_frame(indicator_frame)
             
-            # 确定成交量状态
-            volume_ratio = latest_data.get('Volume_Ratio', 1)
-            volume_status = 'HIGH' if volume_ratio > 1.5 else ('LOW' if volume_ratio < 0.5 else 'NORMAL')
+            # 每个端点的每次尝试单独计时，最终返回胜出端点的耗时
+            timers: Dict[str, LLMCallTimer] = {}
             
-            # AI 分析内容
-            # 最近14天的股票数据记录
-            recent_data = df.tail(14).to_dict('records')
+            def start_timer(endpoint: LLMEndpoint) -> LLMCallTimer:
+                timer = LLMCallTimer(endpoint.model, endpoint.label)
+                timers[endpoint.name] = timer
+                return timer
             
-            # 包含trend, volatility, volume_trend, rsi_level的字典
-            technical_summary = {
-                'trend': 'upward' if df.iloc[-1]['MA5'] > df.iloc[-1]['MA20'] else 'downward',
-                'volatility': f"{df.iloc[-1]['Volatility']:.2f}%",
-                'volume_trend': 'increasing' if df.iloc[-1]['Volume_Ratio'] > 1 else 'decreasing',
-                'rsi_level': df.iloc[-1]['RSI']
-            }
+            # 相同模型、温度和提示词的请求直接回放缓存的输出
+            started = time.perf_counter()
+            cache_keys = self._cache_keys(request_data)
+            cached = await self._lookup_cache(cache_keys)
             
-            # 根据市场类型调整分析提示
-            if market_type in ['ETF', 'LOF']:
-                prompt = f"""
-                分析基金 {stock_code}：
-
-                技术指标概要：
-                {technical_summary}
+            if stream:
+                if cached is not None:
+                    events = self._replay_events(cached[1])
+                else:
+                    # 流式响应处理：由路由器选择端点，失败时切换，首token超时时对冲
+                    events = self.router.stream(
+                        lambda ep: self._stream_events(ep, request_data, start_timer(ep), priority, prompt_tokens),
+                        is_progress=_is_queue_event
+                    )
+                endpoint = None
+                stream_failed = False
+                
+                # 增量解码后的内容片段合并成帧发送
+                parts = []
+                coalescer = TextCoalescer()
                 
-                近14日交易数据：
-                {recent_data}
+                def chunk_frame(text):
+                    return encode_frame({
+                        "stock_code": stock_code,
+                        "ai_analysis_chunk": text,
+                        "status": "analyzing"
+                    })
                 
-                请提供：
-                1. 净值走势分析（包含支撑位和压力位）
-                2. 成交量分析及其对净值的影响
-                3. 风险评估（包含波动率和折溢价分析）
-                4. 短期和中期净值预测
-                5. 关键价格位分析
-                6. 申购赎回建议（包含止损位）
+                try:
+                    async for event in iterate_with_timeout(events, coalescer.timeout):
+                        # 等待超时，发送已累积的内容
+                        if event is None:
+                            text = coalescer.flush()
+                            if text:
+                                yield chunk_frame(text)
+                            continue
+                        
+                        event_endpoint, (kind, value) = event
+                        if kind == "queued":
+                            # 端点限流或并发已满时报告排队位置，0表示已轮到
+                            yield encode_frame(self._queue_frame(stock_code, value))
+                            continue
+                        endpoint = event_endpoint
+                        if kind == "content":
+                            parts.append(value)
+                            text = coalescer.add(value)
+                            if text:
+                                yield chunk_frame(text)
+                        else:
+                            # 流中返回的错误
+                            stream_failed = True
+                            text = coalescer.flush()
+                            if text:
+                                yield chunk_frame(text)
+                            yield encode_frame({
+                                "stock_code": stock_code,
+                                "error": f"流式响应错误: {value}",
+                                "status": "error"
+                            })
+                except (asyncio.CancelledError, GeneratorExit):
+                    # 客户端已断开：关闭事件流会中止AI请求（或移出排队），不再生成无人读取的token
+                    if cached is None:
+                        get_cancel_metrics().add("llm_streams")
+                    raise
+                except LLMEndpointError as e:
+                    if endpoint is None:
+                        yield encode_frame({
+                            "stock_code": stock_code,
+                            "error": f"API请求失败: {e.message}",
+                            "status": "error"
+                        })
+                        return
+                    timers[endpoint.name].finish(error=True)
+                    text = coalescer.flush()
+                    if text:
+                        yield chunk_frame(text)
+                    yield encode_frame({
+                        "stock_code": stock_code,
+                        "error": e.message,
+                        "status": "error"
+                    })
+                    return
                 
-                请基于技术指标和市场表现进行分析，给出具体数据支持。
-                """
-            elif market_type == 'US':
-                prompt = f"""
-                分析美股 {stock_code}：
-
-                技术指标概要：
-                {technical_summary}
+                # 完整的分析内容
+                full_content = "".join(parts)
+                if cached is not None:
+                    timings = self._cache_timings(cached, started)
+                else:
+                    timings = timers[endpoint.name].finish()
+                    if not stream_failed:
+                        await self._store_cache(cache_keys, endpoint, full_content)
+                self._record_timings(timings, "single")
+                logger.info(f"AI流式处理完成，共收到 {timings['chunk_count']} 个内容片段，总长度: {len(full_content)}")
                 
-                近14日交易数据：
-                {recent_data}
+                # 如果内容不为空且不以换行符结束，补充一个换行符
+                if full_content and not full_content.endswith('\n'):
+                    coalescer.add("\n")
+                text = coalescer.flush()
+                if text:
+                    yield chunk_frame(text)
                 
-                请提供：
-                1. 趋势分析（包含支撑位和压力位，美元计价）
-                2. 成交量分析及其含义
-                3. 风险评估（包含波动率和美股市场特有风险）
-                4. 短期和中期目标价位（美元）
-                5. 关键技术位分析
-                6. 具体交易建议（包含止损位）
+                # 尝试从分析内容中提取投资建议
+                recommendation = self._extract_recommendation(full_content)
                 
-                请基于技术指标和美股市场特点进行分析，给出具体数据支持。
-                """
-            elif market_type == 'HK':
-                prompt = f"""
-                分析港股 {stock_code}：
-
-                技术指标概要：
-                {technical_summary}
+                # 计算分析评分
+                score = self._calculate_analysis_score(full_content, technical_summary)
                 
-                近14日交易数据：
-                {recent_data}
+                # 发送完成状态和评分、建议
+                yield encode_frame({
+                    "stock_code": stock_code,
+                    "status": "completed",
+                    "score": score,
+                    "recommendation": recommendation
+                })
                 
-                请提供：
-                1. 趋势分析（包含支撑位和压力位，港币计价）
-                2. 成交量分析及其含义
-                3. 风险评估（包含波动率和港股市场特有风险）
-                4. 短期和中期目标价位（港币）
-                5. 关键技术位分析
-                6. 具体交易建议（包含止损位）
+                # 最后发送本次调用的耗时统计
+                yield encode_frame({"stock_code": stock_code, "timings": timings})
+            else:
+                if cached is not None:
+                    analysis_text = cached[1]
+                    timings = self._cache_timings(cached, started)
+                else:
+                    # 非流式响应处理：依次尝试端点直到成功
+                    try:
+                        endpoint, analysis_text = await self.router.call(
+                            lambda ep: self._complete(ep, request_data, start_timer(ep), priority, prompt_tokens)
+                        )
+                    except asyncio.CancelledError:
+                        get_cancel_metrics().add("llm_calls")
+                        raise
+                    except LLMEndpointError as e:
+                        yield encode_frame({
+                            "stock_code": stock_code,
+                            "error": f"API请求失败: {e.message}",
+                            "status": "error"
+                        })
+                        return
+                    timings = timers[endpoint.name].finish()
+                    await self._store_cache(cache_keys, endpoint, analysis_text)
+                self._record_timings(timings, "single")
                 
-                请基于技术指标和港股市场特点进行分析，给出具体数据支持。
-                """
-            else:  # A股
-                prompt = f"""
-                分析A股 {stock_code}：
-
-                技术指标概要：
-                {technical_summary}
+                # 尝试从分析内容中提取投资建议
+                recommendation = self._extract_recommendation(analysis_text)
+                
+                # 计算分析评分
+                score = self._calculate_analysis_score(analysis_text, technical_summary)
                 
-                近14日交易数据：
-                {recent_data}
+                # 发送完整的分析结果
+                yield encode_frame({
+                    **indicator_frame,
+                    "status": "completed",
+                    "analysis": analysis_text,
+                    "score": score,
+                    "recommendation": recommendation
+                })
                 
-                请提供：
-                1. 趋势分析（包含支撑位和压力位）
-                2. 成交量分析及其含义
-                3. 风险评估（包含波动率分析）
-                4. 短期和中期目标价位
-                5. 关键技术位分析
-                6. 根据威科夫交易体系分析
-                7. 具体交易建议（包含止损位）
+                # 最后发送本次调用的耗时统计
+                yield encode_frame({"stock_code": stock_code, "timings": timings})
                 
-                请基于技术指标和A股市场特点进行分析，美观的输出，并给出具体数据支持。
-                """
+        except Exception as e:
+            logger.error(f"AI分析出错: {str(e)}", exc_info=True)
+            yield encode_frame({
+                "stock_code": stock_code,
+                "error": f"分析出错: {str(e)}",
+                "status": "error"
+            })
+    
+    async def get_batch_ai_analysis(self, stocks: List[Tuple[str, pd.DataFrame]], market_type: str = 'A',
+                                    stream: bool = False, priority: int = PRIORITY_BATCH) -> AsyncGenerator[bytes, None]:
+        """
+        在一次AI请求中分析多只股票
+        各股票的数据放在同一个提示词中，模型按分隔标记逐只输出，流式结果按股票拆分为各自的帧
+        
+        Args:
+            stocks: (股票代码, 包含技术指标的DataFrame) 列表
+            market_type: 市场类型
+            stream: 是否使用流式响应
+            priority: 排队优先级，默认为批量扫描
             
-            # 格式化API URL
-            api_url = APIUtils.format_api_url(self.API_URL)
+        Returns:
+            异步生成器，生成与单只分析相同格式的各股票帧，最后是批量请求的耗时统计帧
+        """
+        if len(stocks) == 1:
+            async for chunk in self.get_ai_analysis(stocks[0][1], stocks[0][0], market_type, stream, priority):
+                yield chunk
+            return
+        
+        codes = [code for code, _ in stocks]
+        try:
+            logger.info(f"开始批量AI分析 {codes}, 流式模式: {stream}")
+            
+            indicator_frames = {}
+            prompt_stocks = []
+            for code, df in stocks:
+                indicator_frames[code], technical_summary = self._indicator_frame(df, code)
+                prompt_stocks.append((df, code, technical_summary))
+                yield encode_frame(indicator_frames[code])
             
-            # 准备请求数据
+            prompt, prompt_tokens = self.prompt_builder.build_batch(prompt_stocks, market_type)
+            logger.debug(f"批量分析提示词长度: {len(prompt)} 字符，约 {prompt_tokens} tokens")
             request_data = {
-                "model": self.API_MODEL,
                 "messages": [{"role": "user", "content": prompt}],
                 "temperature": 0.7,
                 "stream": stream
             }
             
-            # 准备请求头
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.API_KEY}"
-            }
+            timers: Dict[str, LLMCallTimer] = {}
             
-            # 获取当前日期作为分析日期
-            analysis_date = datetime.now().strftime("%Y-%m-%d")
+            def start_timer(endpoint: LLMEndpoint) -> LLMCallTimer:
+                timer = LLMCallTimer(endpoint.model, endpoint.label)
+                timers[endpoint.name] = timer
+                return timer
+            
+            demuxer = SectionDemuxer(codes)
+            parts: Dict[str, List[str]] = {code: [] for code in codes}
+            output: List[str] = []
             
-            # 异步请求API
-            async with httpx.AsyncClient(timeout=self.API_TIMEOUT) as client:
-                # 记录请求
-                logger.debug(f"发送AI请求: URL={api_url}, MODEL={self.API_MODEL}, STREAM={stream}")
+            started = time.perf_counter()
+            cache_keys = self._cache_keys(request_data)
+            cached = await self._lookup_cache(cache_keys)
+            
+            if stream:
+                if cached is not None:
+                    events = self._replay_events(cached[1])
+                else:
+                    events = self.router.stream(
+                        lambda ep: self._stream_events(ep, request_data, start_timer(ep), priority, prompt_tokens),
+                        is_progress=_is_queue_event
+                    )
+                endpoint = None
+                # 流中返回错误时尚未输出完的股票，报告错误且不缓存
+                failed: List[str] = []
                 
-                # 先发送技术指标数据
-                yield json.dumps({
-                    "stock_code": stock_code,
-                    "status": "analyzing",
-                    "rsi": rsi,
-                    "price": price,
-                    "price_change": price_change,
-                    "ma_trend": ma_trend,
-                    "macd_signal": macd_signal_type,
-                    "volume_status": volume_status,
-                    "analysis_date": analysis_date
-                })
+                # 每只股票单独合并帧
+                coalescers = {code: TextCoalescer() for code in codes}
                 
-                if stream:
-                    # 流式响应处理
-                    async with client.stream("POST", api_url, json=request_data, headers=headers) as response:
-                        if response.status_code != 200:
-                            error_text = await response.aread()
-                            error_data = json.loads(error_text)
-                            error_message = error_data.get('error', {}).get('message', '未知错误')
-                            logger.error(f"AI API请求失败: {response.status_code} - {error_message}")
-                            yield json.dumps({
-                                "stock_code": stock_code,
-                                "error": f"API请求失败: {error_message}",
-                                "status": "error"
-                            })
-                            return
-                            
-                        # 处理流式响应
-                        buffer = ""
-                        collected_messages = []
-                        chunk_count = 0
-                        
-                        async for chunk in response.aiter_text():
-                            if chunk:
-                                # 分割多行响应（处理某些API可能在一个chunk中返回多行）
-                                lines = chunk.strip().split('\n')
-                                for line in lines:
-                                    line = line.strip()
-                                    if not line:
-                                        continue
-                                        
-                                    # 处理以data:开头的行
-                                    if line.startswith("data: "):
-                                        line = line[6:]  # 去除"data: "前缀
-                                     
-                                    if line == "[DONE]":
-                                        logger.debug("收到流结束标记 [DONE]")
-                                        continue
-                                        
-                                    try:
-                                        # 处理特殊错误情况
-                                        if "error" in line.lower():
-                                            error_msg = line
-                                            try:
-                                                error_data = json.loads(line)
-                                                error_msg = error_data.get("error", line)
-                                            except:
-                                                pass
-                                            
-                                            logger.error(f"流式响应中收到错误: {error_msg}")
-                                            yield json.dumps({
-                                                "stock_code": stock_code,
-                                                "error": f"流式响应错误: {error_msg}",
-                                                "status": "error"
-                                            })
-                                            continue
-                                        
-                                        # 尝试解析JSON
-                                        chunk_data = json.loads(line)
-                                        
-                                        # 检查是否有finish_reason
-                                        finish_reason = chunk_data.get("choices", [{}])[0].get("finish_reason")
-                                        if finish_reason == "stop":
-                                            logger.debug("收到finish_reason=stop，流结束")
-                                            continue
-                                        
-                                        # 获取delta内容
-                                        delta = chunk_data.get("choices", [{}])[0].get("delta", {})
-                                        
-                                        # 检查delta是否为空对象
-                                        if not delta or delta == {}:
-                                            logger.debug("收到空的delta对象，跳过")
-                                            continue
-                                        
-                                        content = delta.get("content", "")
-                                        
-                                        if content:
-                                            chunk_count += 1
-                                            buffer += content
-                                            collected_messages.append(content)
-                                            
-                                            # 直接发送每个内容片段，不累积
-                                            yield json.dumps({
-                                                "stock_code": stock_code,
-                                                "ai_analysis_chunk": content,
-                                                "status": "analyzing"
-                                            })
-                                    except json.JSONDecodeError:
-                                        # 记录解析错误并尝试恢复
-                                        logger.error(f"JSON解析错误，块内容: {line}")
-                                        
-                                        # 如果是特定错误模式，处理它
-                                        if "streaming failed after retries" in line.lower():
-                                            logger.error("检测到流式传输失败")
-                                            yield json.dumps({
-                                                "stock_code": stock_code,
-                                                "error": "流式传输失败，请稍后重试",
-                                                "status": "error"
-                                            })
-                                            return
-                                        continue
-                        
-                        logger.info(f"AI流式处理完成，共收到 {chunk_count} 个内容片段，总长度: {len(buffer)}")
-                        
-                        # 如果buffer不为空且不以换行符结束，发送一个换行符
-                        if buffer and not buffer.endswith('\n'):
-                            logger.debug("发送换行符")
-                            yield json.dumps({
-                                "stock_code": stock_code,
-                                "ai_analysis_chunk": "\n",
-                                "status": "analyzing"
-                            })
-                        
-                        # 完整的分析内容
-                        full_content = buffer
-                        
-                        # 尝试从分析内容中提取投资建议
-                        recommendation = self._extract_recommendation(full_content)
-                        
-                        # 计算分析评分
-                        score = self._calculate_analysis_score(full_content, technical_summary)
+                def next_timeout() -> Optional[float]:
+                    timeouts = [t for t in (c.timeout() for c in coalescers.values()) if t is not None]
+                    return min(timeouts) if timeouts else None
+                
+                def chunk_frame(code, text):
+                    return encode_frame({"stock_code": code, "ai_analysis_chunk": text, "status": "analyzing"})
+                
+                try:
+                    async for event in iterate_with_timeout(events, next_timeout):
+                        if event is None:
+                            for code, coalescer in coalescers.items():
+                                if coalescer.timeout() == 0:
+                                    yield chunk_frame(code, coalescer.flush())
+                            continue
                         
-                        # 发送完成状态和评分、建议
-                        yield json.dumps({
-                            "stock_code": stock_code,
-                            "status": "completed",
-                            "score": score,
-                            "recommendation": recommendation
-                        })
-                else:
-                    # 非流式响应处理
-                    response = await client.post(api_url, json=request_data, headers=headers)
-                    
-                    if response.status_code != 200:
-                        error_data = response.json()
-                        error_message = error_data.get('error', {}).get('message', '未知错误')
-                        logger.error(f"AI API请求失败: {response.status_code} - {error_message}")
-                        yield json.dumps({
-                            "stock_code": stock_code,
-                            "error": f"API请求失败: {error_message}",
-                            "status": "error"
-                        })
+                        event_endpoint, (kind, value) = event
+                        if kind == "queued":
+                            for code in codes:
+                                yield encode_frame(self._queue_frame(code, value))
+                            continue
+                        endpoint = event_endpoint
+                        if kind != "content":
+                            logger.error(f"批量分析流中收到错误: {value}")
+                            # 已经切换到下一只的股票视为输出完整，当前和尚未开始的股票报告错误
+                            for code in codes:
+                                if code in failed or (parts[code] and code != demuxer.current):
+                                    continue
+                                failed.append(code)
+                                text = coalescers[code].flush()
+                                if text:
+                                    yield chunk_frame(code, text)
+                                yield encode_frame({
+                                    "stock_code": code,
+                                    "error": f"流式响应错误: {value}",
+                                    "status": "error"
+                                })
+                            continue
+                        output.append(value)
+                        for code, text in demuxer.feed(value):
+                            parts[code].append(text)
+                            text = coalescers[code].add(text)
+                            if text:
+                                yield chunk_frame(code, text)
+                except (asyncio.CancelledError, GeneratorExit):
+                    if cached is None:
+                        get_cancel_metrics().add("llm_streams")
+                    raise
+                except LLMEndpointError as e:
+                    if endpoint is None:
+                        for code in codes:
+                            yield encode_frame({"stock_code": code, "error": f"API请求失败: {e.message}", "status": "error"})
                         return
-                    
-                    response_data = response.json()
-                    analysis_text = response_data.get("choices", [{}])[0].get("message", {}).get("content", "")
-                    
-                    # 尝试从分析内容中提取投资建议
-                    recommendation = self._extract_recommendation(analysis_text)
-                    
-                    # 计算分析评分
-                    score = self._calculate_analysis_score(analysis_text, technical_summary)
-                    
-                    # 发送完整的分析结果
-                    yield json.dumps({
-                        "stock_code": stock_code,
+                    timers[endpoint.name].finish(error=True)
+                    for code in codes:
+                        text = coalescers[code].flush()
+                        if text:
+                            yield chunk_frame(code, text)
+                        yield encode_frame({"stock_code": code, "error": e.message, "status": "error"})
+                    return
+                
+                for code, text in demuxer.flush():
+                    parts[code].append(text)
+                    coalescers[code].add(text)
+            elif cached is not None:
+                failed = []
+                output.append(cached[1])
+            else:
+                try:
+                    endpoint, analysis_text = await self.router.call(
+                        lambda ep: self._complete(ep, request_data, start_timer(ep), priority, prompt_tokens)
+                    )
+                except asyncio.CancelledError:
+                    get_cancel_metrics().add("llm_calls")
+                    raise
+                except LLMEndpointError as e:
+                    for code in codes:
+                        yield encode_frame({"stock_code": code, "error": f"API请求失败: {e.message}", "status": "error"})
+                    return
+                failed = []
+                output.append(analysis_text)
+            if not stream:
+                for code, text in demuxer.feed("".join(output)) + demuxer.flush():
+                    parts[code].append(text)
+            
+            # 逐只发送完成状态；模型遗漏的股票稍后单独分析
+            missing = []
+            for (code, df), (_, _, technical_summary) in zip(stocks, prompt_stocks):
+                if code in failed:
+                    continue
+                full_content = "".join(parts[code])
+                if not full_content.strip():
+                    missing.append((code, df))
+                    continue
+                recommendation = self._extract_recommendation(full_content)
+                score = self._calculate_analysis_score(full_content, technical_summary)
+                if stream:
+                    # 补齐换行，与单只分析的输出保持一致
+                    if not full_content.endswith('\n'):
+                        coalescers[code].add("\n")
+                    text = coalescers[code].flush()
+                    if text:
+                        yield chunk_frame(code, text)
+                    yield encode_frame({
+                        "stock_code": code,
                         "status": "completed",
-                        "analysis": analysis_text,
                         "score": score,
-                        "recommendation": recommendation,
-                        "rsi": rsi,
-                        "price": price,
-                        "price_change": price_change,
-                        "ma_trend": ma_trend,
-                        "macd_signal": macd_signal_type,
-                        "volume_status": volume_status,
-                        "analysis_date": analysis_date
+                        "recommendation": recommendation
                     })
-                    
+                else:
+                    yield encode_frame({
+                        **indicator_frames[code],
+                        "status": "completed",
+                        "analysis": full_content,
+                        "score": score,
+                        "recommendation": recommendation
+                    })
+            
+            if cached is not None:
+                timings = self._cache_timings(cached, started)
+            else:
+                timings = timers[endpoint.name].finish()
+                # 只缓存覆盖了所有股票的完整输出
+                if not missing and not failed:
+                    await self._store_cache(cache_keys, endpoint, "".join(output))
+            self._record_timings(timings, "batch")
+            logger.info(f"批量AI分析完成 {codes}, 耗时 {timings['total_ms']}ms, "
+                        f"遗漏: {[code for code, _ in missing]}, 出错: {failed}")
+            yield encode_frame({"stock_codes": codes, "timings": {**timings, "batch_size": len(codes)}})
+            
+            for code, df in missing:
+                async for chunk in self.get_ai_analysis(df, code, market_type, stream, priority):
+                    yield chunk
+        
         except Exception as e:
-            logger.error(f"AI分析出错: {str(e)}", exc_info=True)
-            yield json.dumps({
-                "stock_code": stock_code,
-                "error": f"分析出错: {str(e)}",
-                "status": "error"
-            })
+            logger.error(f"批量AI分析出错: {str(e)}", exc_info=True)
+            for code in codes:
+                yield encode_frame({"stock_code": code, "error": f"分析出错: {str(e)}", "status": "error"})
+    
+    def _cache_keys(self, request_data: Dict) -> Dict[str, str]:
+        """本次请求可能使用的各模型（按端点顺序）对应的响应缓存键"""
+        prompt = request_data["messages"][-1]["content"]
+        return {endpoint.model: response_cache_key(endpoint.model, request_data["temperature"], prompt)
+                for endpoint in self.router.endpoints}
+    
+    @staticmethod
+    async def _lookup_cache(cache_keys: Dict[str, str]) -> Optional[Tuple[str, str, str]]:
+        """查找响应缓存，返回(模型, 缓存的输出, 生成该输出的端点URL)"""
+        cache = get_llm_response_cache()
+        if cache is None or not cache_keys:
+            return None
+        try:
+            return await asyncio.to_thread(cache.lookup, cache_keys)
+        except Exception as e:
+            logger.warning(f"读取AI响应缓存失败: {str(e)}")
+            return None
+    
+    @staticmethod
+    async def _store_cache(cache_keys: Dict[str, str], endpoint: LLMEndpoint, text: str) -> None:
+        """保存成功完成的输出，同时记录生成它的端点"""
+        cache = get_llm_response_cache()
+        if cache is None or endpoint.model not in cache_keys or not text.strip():
+            return
+        try:
+            await asyncio.to_thread(cache.put, cache_keys[endpoint.model], endpoint.model, text, endpoint.url)
+        except Exception as e:
+            logger.warning(f"写入AI响应缓存失败: {str(e)}")
+    
+    @staticmethod
+    async def _replay_events(text: str) -> AsyncGenerator[Tuple[None, Tuple[str, str]], None]:
+        """将缓存的输出转换为与路由器输出相同格式的内容事件"""
+        async for piece in replay_text(text):
+            yield None, ("content", piece)
+    
+    @staticmethod
+    def _cache_timings(cached: Tuple[str, str, str], started: float) -> Dict:
+        """命中缓存时的耗时统计，endpoint为最初生成该输出的端点，来源未知时为cache"""
+        model, _, url = cached
+        return {
+            "model": model,
+            "endpoint": endpoint_label(url) if url else "cache",
+            "cache_hit": True,
+            "total_ms": round((time.perf_counter() - started) * 1000, 2),
+            "chunk_count": 0,
+            "error": False
+        }
+    
+    @staticmethod
+    def _record_timings(timings: Dict, mode: str) -> None:
+        """按来源（AI接口或缓存）和单只/批量记录一次分析的首token耗时和总耗时"""
+        metrics = get_stage_metrics()
+        source = "cache" if timings.get("cache_hit") else "llm"
+        if timings.get("ttft_ms") is not None:
+            metrics.observe("ai_ttft", timings["ttft_ms"], source=source, mode=mode)
+        if timings.get("total_ms") is not None:
+            metrics.observe("ai_total", timings["total_ms"], source=source, mode=mode)
+    
+    @staticmethod
+    def _queue_frame(stock_code: str, position: int) -> Dict:
+        """排队位置帧：排队中显示为等待状态，轮到时恢复为分析中"""
+        return {
+            "stock_code": stock_code,
+            "status": "waiting" if position else "analyzing",
+            "queue_position": position
+        }
+    
+    @staticmethod
+    def _request_headers(endpoint: LLMEndpoint) -> Dict[str, str]:
+        """构建请求头"""
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {endpoint.key}"
+        }
+    
+    @staticmethod
+    def _error_from_response(status_code: int, body: bytes, headers) -> LLMEndpointError:
+        """将非200响应转换为端点错误"""
+        try:
+            error_message = json.loads(body).get('error', {}).get('message', '未知错误')
+        except (ValueError, AttributeError):
+            error_message = body.decode(errors='replace')[:200] or '未知错误'
+        retry_after = parse_retry_after(headers)
+        logger.error(f"AI API请求失败: {status_code} - {error_message}")
+        return LLMEndpointError(error_message, status_code, retry_after)
+    
+    @staticmethod
+    def _retry_rate_limited(scheduler: EndpointScheduler, error: LLMEndpointError, attempt: int) -> bool:
+        """
+        处理429限流：暂停该端点的调度，等待时间可接受时重新排队
+        
+        Returns:
+            是否在同一端点重试
+        """
+        if error.status_code != 429:
+            return False
+        wait = error.retry_after if error.retry_after is not None else DEFAULT_RETRY_AFTER
+        scheduler.block(wait)
+        return attempt < AI_RATE_LIMIT_RETRIES and wait <= AI_RATE_LIMIT_MAX_WAIT
+    
+    async def _stream_events(self, endpoint: LLMEndpoint, request_data: Dict, timer: LLMCallTimer,
+                             priority: int, prompt_tokens: int) -> AsyncGenerator[Tuple[str, object], None]:
+        """
+        向单个端点发起流式请求
+        
+        Returns:
+            ("queued", 排队位置)、("content", 内容片段) 或 ("error", 错误信息) 的异步生成器，
+            请求失败时抛出LLMEndpointError
+        """
+        scheduler = self._get_scheduler(endpoint)
+        for attempt in range(AI_RATE_LIMIT_RETRIES + 1):
+            # 同一API端点的请求受并发数和每分钟配额限制，超出的请求在此按优先级和用户轮转排队
+            ticket = scheduler.enqueue(self.user_id, priority, estimate_request_tokens(prompt_tokens))
+            output = []
+            try:
+                queued = False
+                async for position in ticket.wait():
+                    queued = True
+                    yield "queued", position
+                if queued:
+                    yield "queued", 0
+                
+                timer.request_started()
+                # 复用进程级共享的长连接客户端，避免每次分析重新建立连接
+                client = get_http_client(endpoint.url, self.API_TIMEOUT)
+                logger.debug(f"发送AI请求: URL={endpoint.url}, MODEL={endpoint.model}, STREAM=True")
+                
+                try:
+                    async for event in self._read_stream(client, endpoint, request_data, timer, scheduler):
+                        if event[0] == "content":
+                            output.append(event[1])
+                        yield event
+                except LLMEndpointError as e:
+                    # 尚未输出内容时遇到429，等待后重新排队，而不是直接报错
+                    if not output and self._retry_rate_limited(scheduler, e, attempt):
+                        continue
+                    timer.finish(error=True)
+                    raise
+                except Exception:
+                    # 连接失败、读取超时等都计为一次失败的调用；被取消的对冲请求不计入
+                    timer.finish(error=True)
+                    raise
+                return
+            finally:
+                ticket.release(prompt_tokens + estimate_tokens("".join(output)) if output else None)
+    
+    async def _read_stream(self, client, endpoint: LLMEndpoint, request_data: Dict, timer: LLMCallTimer,
+                           scheduler: EndpointScheduler) -> AsyncGenerator[Tuple[str, str], None]:
+        """读取流式响应并解析为内容片段"""
+        async with client.stream("POST", endpoint.url, json={**request_data, "model": endpoint.model},
+                                 headers=self._request_headers(endpoint)) as response:
+            timer.headers_received()
+            scheduler.update_from_headers(response.headers)
+            if response.status_code != 200:
+                raise self._error_from_response(response.status_code, await response.aread(), response.headers)
             
+            # 增量解码SSE事件，网络分块切断的事件会在下一块到达后还原
+            async for data in decode_sse(response.aiter_text()):
+                data = data.strip()
+                if not data:
+                    continue
+                
+                if data == "[DONE]":
+                    logger.debug("收到流结束标记 [DONE]")
+                    continue
+                
+                try:
+                    chunk_data = json.loads(data)
+                except json.JSONDecodeError:
+                    # 记录解析错误并尝试恢复
+                    logger.error(f"JSON解析错误，块内容: {data}")
+                    
+                    # 如果是特定错误模式，处理它
+                    if "streaming failed after retries" in data.lower():
+                        logger.error("检测到流式传输失败")
+                        raise LLMEndpointError("流式传输失败，请稍后重试")
+                    continue
+                
+                # 处理流中返回的错误
+                if isinstance(chunk_data, dict) and chunk_data.get("error"):
+                    error_msg = chunk_data["error"]
+                    if isinstance(error_msg, dict):
+                        error_msg = error_msg.get("message", error_msg)
+                    logger.error(f"流式响应中收到错误: {error_msg}")
+                    yield "error", str(error_msg)
+                    continue
+                
+                choice = (chunk_data.get("choices") or [{}])[0]
+                
+                # 检查是否有finish_reason
+                if choice.get("finish_reason") == "stop":
+                    logger.debug("收到finish_reason=stop，流结束")
+                    continue
+                
+                # 获取delta内容，空delta直接跳过
+                content = (choice.get("delta") or {}).get("content")
+                if content:
+                    timer.delta(content)
+                    yield "content", content
+    
+    async def _complete(self, endpoint: LLMEndpoint, request_data: Dict, timer: LLMCallTimer,
+                        priority: int, prompt_tokens: int) -> str:
+        """
+        向单个端点发起非流式请求
+        
+        Returns:
+            分析文本，请求失败时抛出LLMEndpointError
+        """
+        scheduler = self._get_scheduler(endpoint)
+        for attempt in range(AI_RATE_LIMIT_RETRIES + 1):
+            ticket = scheduler.enqueue(self.user_id, priority, estimate_request_tokens(prompt_tokens))
+            analysis_text = None
+            try:
+                async for _ in ticket.wait():
+                    pass
+                timer.request_started()
+                client = get_http_client(endpoint.url, self.API_TIMEOUT)
+                logger.debug(f"发送AI请求: URL={endpoint.url}, MODEL={endpoint.model}, STREAM=False")
+                try:
+                    response = await client.post(endpoint.url, json={**request_data, "model": endpoint.model},
+                                                 headers=self._request_headers(endpoint))
+                except Exception:
+                    timer.finish(error=True)
+                    raise
+                timer.headers_received()
+                scheduler.update_from_headers(response.headers)
+                if response.status_code != 200:
+                    error = self._error_from_response(response.status_code, response.content, response.headers)
+                    if self._retry_rate_limited(scheduler, error, attempt):
+                        continue
+                    timer.finish(error=True)
+                    raise error
+                
+                response_data = response.json()
+                analysis_text = response_data.get("choices", [{}])[0].get("message", {}).get("content", "")
+                # 非流式响应的内容一次性到达
+                timer.delta(analysis_text)
+                return analysis_text
+            finally:
+                ticket.release(prompt_tokens + estimate_tokens(analysis_text) if analysis_text else None)
+        
     def _extract_recommendation(self, analysis_text: str) -> str:
         """从分析文本中提取投资建议"""
         # 查找投资建议部分
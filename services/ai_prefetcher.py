@@ -0,0 +1,342 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from utils.logger import get_logger
+from utils.frame_encoder import decode_frame
+from utils.sqlite_store import SQLiteStore
+from utils.trading_calendar import now_cn
+from services.analysis_cache import get_closed_session
+from services.llm_scheduler import PRIORITY_PREFETCH, scheduler_stats
+
+# 获取日志器
+logger = get_logger()
+
+# 是否启用AI分析预生成
+PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', 'false').lower() == 'true'
+# 每天最多预生成的分析次数（即AI调用次数）
+PREFETCH_DAILY_BUDGET = int(os.getenv('PREFETCH_DAILY_BUDGET', 50))
+# 每轮最多预生成的分析次数
+PREFETCH_BATCH = int(os.getenv('PREFETCH_BATCH', 5))
+# 距最近一次用户请求超过该秒数，且没有排队或进行中的AI请求时才视为空闲
+PREFETCH_IDLE_SECONDS = float(os.getenv('PREFETCH_IDLE_SECONDS', 120))
+# 允许预生成的时段（北京时间），如 "12:00-13:00,15:30-08:00"，为空表示任意时段
+PREFETCH_WINDOWS = os.getenv('PREFETCH_WINDOWS', '')
+# 统计请求历史和扫描结果的时间范围（小时）
+PREFETCH_LOOKBACK_HOURS = float(os.getenv('PREFETCH_LOOKBACK_HOURS', 24))
+
+
+def parse_windows(spec: str) -> List[Tuple[int, int]]:
+    """
+    解析允许运行的时段
+
+    Args:
+        spec: 逗号分隔的 "HH:MM-HH:MM"，结束早于开始时表示跨越午夜
+
+    Returns:
+        (开始分钟, 结束分钟) 列表
+    """
+    windows = []
+    for part in filter(None, (item.strip() for item in spec.split(','))):
+        start, end = (datetime.strptime(t.strip(), '%H:%M') for t in part.split('-'))
+        windows.append((start.hour * 60 + start.minute, end.hour * 60 + end.minute))
+    return windows
+
+
+def in_windows(windows: List[Tuple[int, int]], now: Optional[datetime] = None) -> bool:
+    """当前时间是否在允许的时段内，未配置时段时总是允许"""
+    if not windows:
+        return True
+    now = now or now_cn()
+    minute = now.hour * 60 + now.minute
+    for start, end in windows:
+        if start <= end and start <= minute < end:
+            return True
+        if start > end and (minute >= start or minute < end):
+            return True
+    return False
+
+
+class PrefetchStore(SQLiteStore):
+    """
+    预生成候选的统计数据
+    记录用户的分析请求和扫描结果，以及已预生成的(股票, 交易日)
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS analysis_requests (
+        stock_code TEXT NOT NULL,
+        market_type TEXT NOT NULL,
+        requested_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_analysis_requests_time ON analysis_requests (requested_at);
+    CREATE TABLE IF NOT EXISTS scan_candidates (
+        stock_code TEXT NOT NULL,
+        market_type TEXT NOT NULL,
+        score REAL NOT NULL,
+        seen_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_scan_candidates_time ON scan_candidates (seen_at);
+    CREATE TABLE IF NOT EXISTS prefetched (
+        stock_code TEXT NOT NULL,
+        market_type TEXT NOT NULL,
+        trade_date TEXT NOT NULL,
+        succeeded INTEGER NOT NULL,
+        prefetched_at REAL NOT NULL,
+        PRIMARY KEY (stock_code, market_type, trade_date)
+    );
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        super().__init__("prefetch.db", db_path)
+
+    def record_requests(self, stock_codes: Iterable[str], market_type: str) -> None:
+        """记录用户请求分析的股票"""
+        now = time.time()
+        self.executemany(
+            "INSERT INTO analysis_requests (stock_code, market_type, requested_at) VALUES (?, ?, ?)",
+            [(code, market_type, now) for code in stock_codes]
+        )
+
+    def record_scan_results(self, results: Iterable[Tuple[str, float]], market_type: str) -> None:
+        """记录扫描得分靠前的股票"""
+        now = time.time()
+        self.executemany(
+            "INSERT INTO scan_candidates (stock_code, market_type, score, seen_at) VALUES (?, ?, ?, ?)",
+            [(code, market_type, score, now) for code, score in results]
+        )
+
+    def last_activity_at(self) -> float:
+        """最近一次用户分析请求或扫描结果的时间，所有工作进程共用；没有记录时返回0"""
+        row = self.query_one(
+            "SELECT MAX(t) AS t FROM ("
+            "  SELECT MAX(requested_at) AS t FROM analysis_requests"
+            "  UNION ALL SELECT MAX(seen_at) FROM scan_candidates"
+            ")"
+        )
+        return row['t'] or 0.0
+
+    def rank_candidates(self, since: float, limit: int) -> List[Dict[str, Any]]:
+        """
+        按热度排序候选股票：每次用户请求计1分，扫描结果按评分/100计分
+
+        Returns:
+            [{"stock_code", "market_type", "rank"}]，按得分从高到低
+        """
+        rows = self.query(
+            "SELECT stock_code, market_type, SUM(weight) AS rank FROM ("
+            "  SELECT stock_code, market_type, 1.0 AS weight FROM analysis_requests WHERE requested_at >= ?"
+            "  UNION ALL"
+            "  SELECT stock_code, market_type, score / 100.0 AS weight FROM scan_candidates WHERE seen_at >= ?"
+            ") GROUP BY stock_code, market_type ORDER BY rank DESC LIMIT ?",
+            (since, since, limit)
+        )
+        return [dict(row) for row in rows]
+
+    def is_prefetched(self, stock_code: str, market_type: str, trade_date: str) -> bool:
+        row = self.query_one(
+            "SELECT 1 FROM prefetched WHERE stock_code = ? AND market_type = ? AND trade_date = ?",
+            (stock_code, market_type, trade_date)
+        )
+        return row is not None
+
+    def mark_prefetched(self, stock_code: str, market_type: str, trade_date: str, succeeded: bool) -> None:
+        self.execute(
+            "INSERT OR REPLACE INTO prefetched (stock_code, market_type, trade_date, succeeded, prefetched_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (stock_code, market_type, trade_date, int(succeeded), time.time())
+        )
+
+    def spent_since(self, since: float) -> int:
+        """指定时间之后已消耗的预生成次数"""
+        return self.query_one("SELECT COUNT(*) AS spent FROM prefetched WHERE prefetched_at >= ?", (since,))['spent']
+
+    def purge_before(self, before: float) -> None:
+        """删除过期的统计数据"""
+        self.execute("DELETE FROM analysis_requests WHERE requested_at < ?", (before,))
+        self.execute("DELETE FROM scan_candidates WHERE seen_at < ?", (before,))
+        self.execute("DELETE FROM prefetched WHERE prefetched_at < ?", (before,))
+
+
+class AIPrefetcher:
+    """
+    AI分析预生成器
+    根据近期扫描结果和请求历史挑选用户可能查看的股票，在空闲时段、每日预算内提前完成分析，
+    结果写入分析缓存和AI响应缓存，之后用户请求这些股票时直接回放
+    """
+
+    # 调度检查间隔（秒）
+    TICK_SECONDS = 60
+
+    def __init__(self, store: Optional[PrefetchStore] = None,
+                 analyzer_factory: Optional[Callable[[], Any]] = None,
+                 daily_budget: int = PREFETCH_DAILY_BUDGET, batch: int = PREFETCH_BATCH,
+                 idle_seconds: float = PREFETCH_IDLE_SECONDS, windows: str = PREFETCH_WINDOWS):
+        """
+        初始化预生成器
+
+        Args:
+            store: 候选统计存储
+            analyzer_factory: 创建StockAnalyzerService的函数，默认使用环境变量配置的AI端点
+            daily_budget: 每天最多预生成的分析次数
+            batch: 每轮最多预生成的分析次数
+            idle_seconds: 距最近一次用户请求的最短空闲时间
+            windows: 允许预生成的时段
+        """
+        self.store = store or PrefetchStore()
+        self.analyzer_factory = analyzer_factory
+        self.daily_budget = daily_budget
+        self.batch = batch
+        self.idle_seconds = idle_seconds
+        self.windows = parse_windows(windows)
+        self.prefetched = 0
+        self.failed = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def _create_analyzer(self):
+        if self.analyzer_factory is not None:
+            return self.analyzer_factory()
+        from services.stock_analyzer_service import StockAnalyzerService
+        return StockAnalyzerService(user_id='prefetch')
+
+    async def record_request(self, stock_codes: List[str], market_type: str) -> None:
+        """记录一次用户分析请求，同时标记系统不再空闲（记录在共用的存储中，对所有工作进程可见）"""
+        try:
+            await asyncio.to_thread(self.store.record_requests, stock_codes, market_type)
+        except Exception as e:
+            logger.warning(f"记录分析请求失败: {str(e)}")
+
+    async def record_scan_results(self, results: List[Dict[str, Any]], market_type: str) -> None:
+        """记录扫描得分靠前的结果"""
+        scored = [(r['stock_code'], float(r.get('score') or 0)) for r in results if r.get('status') != 'error']
+        if not scored:
+            return
+        try:
+            await asyncio.to_thread(self.store.record_scan_results, scored, market_type)
+        except Exception as e:
+            logger.warning(f"记录扫描结果失败: {str(e)}")
+
+    def _endpoints_idle(self) -> bool:
+        """在允许的时段内，且本进程的AI端点都没有排队或进行中的请求"""
+        if not in_windows(self.windows):
+            return False
+        return all(s['in_flight'] == 0 and s['queued'] == 0 for s in scheduler_stats().values())
+
+    def is_idle(self) -> bool:
+        """
+        在允许的时段内、所有工作进程近期都没有用户请求或扫描，且AI端点都没有排队或进行中的请求
+        （同步方法，需在线程池中调用）
+        """
+        return self._endpoints_idle() and time.time() - self.store.last_activity_at() >= self.idle_seconds
+
+    async def _check_idle(self) -> bool:
+        if not self._endpoints_idle():
+            return False
+        return time.time() - await asyncio.to_thread(self.store.last_activity_at) >= self.idle_seconds
+
+    def remaining_budget(self) -> int:
+        """今天剩余的预生成次数"""
+        midnight = now_cn().replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+        return max(0, self.daily_budget - self.store.spent_since(midnight))
+
+    async def run_once(self) -> int:
+        """
+        执行一轮预生成
+
+        Returns:
+            本轮预生成的分析数
+        """
+        if not await self._check_idle():
+            return 0
+        budget = min(self.batch, await asyncio.to_thread(self.remaining_budget))
+        if budget <= 0:
+            return 0
+
+        since = time.time() - PREFETCH_LOOKBACK_HOURS * 3600
+        candidates = await asyncio.to_thread(self.store.rank_candidates, since, budget * 4)
+        analyzer = None
+        done = 0
+        for candidate in candidates:
+            if done >= budget or not await self._check_idle():
+                break
+            code, market_type = candidate['stock_code'], candidate['market_type']
+            # 交易时段内行情仍在变化，预生成的结果很快过期
+            session = await get_closed_session(market_type)
+            if session is None:
+                continue
+            trade_date = session.isoformat()
+            if await asyncio.to_thread(self.store.is_prefetched, code, market_type, trade_date):
+                continue
+
+            analyzer = analyzer or self._create_analyzer()
+            succeeded = await self._analyze(analyzer, code, market_type)
+            await asyncio.to_thread(self.store.mark_prefetched, code, market_type, trade_date, succeeded)
+            done += 1
+        return done
+
+    async def _analyze(self, analyzer, stock_code: str, market_type: str) -> bool:
+        logger.info(f"预生成AI分析: {stock_code}, 市场: {market_type}")
+        succeeded = False
+        try:
+            async for chunk in analyzer.analyze_stock(stock_code, market_type, stream=False,
+                                                      priority=PRIORITY_PREFETCH):
+                frame = decode_frame(chunk)
+                if frame.get('status') == 'error' or 'error' in frame:
+                    succeeded = False
+                    break
+                if frame.get('status') == 'completed':
+                    succeeded = True
+        except Exception as e:
+            logger.warning(f"预生成 {stock_code} 的分析失败: {str(e)}")
+        if succeeded:
+            self.prefetched += 1
+        else:
+            self.failed += 1
+        return succeeded
+
+    def start(self) -> None:
+        """在当前事件循环中启动预生成"""
+        self._task = asyncio.create_task(self.run_forever())
+
+    async def stop(self) -> None:
+        """停止预生成"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def run_forever(self) -> None:
+        """定时检查是否空闲，空闲时预生成一轮"""
+        logger.info("AI分析预生成器已启动")
+        while True:
+            try:
+                await self.run_once()
+                await asyncio.to_thread(self.store.purge_before, time.time() - 7 * 86400)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"AI分析预生成出错: {str(e)}")
+                logger.exception(e)
+            await asyncio.sleep(self.TICK_SECONDS)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回预生成统计"""
+        return {
+            "enabled": self._task is not None,
+            "idle": self.is_idle(),
+            "prefetched": self.prefetched,
+            "failed": self.failed,
+            "remaining_budget": self.remaining_budget()
+        }
+
+
+_prefetcher: Optional[AIPrefetcher] = None
+
+
+def get_ai_prefetcher() -> Optional[AIPrefetcher]:
+    """获取共享的预生成器，未启用时返回None"""
+    global _prefetcher
+    if _prefetcher is None and PREFETCH_ENABLED:
+        _prefetcher = AIPrefetcher()
+    return _prefetcher
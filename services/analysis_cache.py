@@ -0,0 +1,204 @@
+import asyncio
+import json
+import os
+import time
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+from utils.logger import get_logger
+from utils.frame_encoder import decode_frame
+from utils.sqlite_store import SQLiteStore
+from utils.trading_calendar import get_trading_calendar
+
+# 获取日志器
+logger = get_logger()
+
+# 是否启用分析结果缓存，以及缓存保留天数
+ANALYSIS_CACHE_ENABLED = os.getenv('ANALYSIS_CACHE_ENABLED', 'true').lower() == 'true'
+ANALYSIS_CACHE_DAYS = int(os.getenv('ANALYSIS_CACHE_DAYS', 7))
+
+
+class AnalysisResultCache(SQLiteStore):
+    """
+    按交易日缓存的完整分析结果
+    收盘后同一股票、同一根K线、同一端点（URL和模型）和提示词版本的分析结果是确定的，缓存到本地磁盘，重启后仍然有效
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS analysis_results (
+        stock_code TEXT NOT NULL,
+        market_type TEXT NOT NULL,
+        bar_date TEXT NOT NULL,
+        endpoint TEXT NOT NULL,
+        model TEXT NOT NULL,
+        prompt_version TEXT NOT NULL,
+        basic_result TEXT NOT NULL,
+        indicator_frame TEXT NOT NULL,
+        ai_analysis TEXT NOT NULL,
+        completed_frame TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (stock_code, market_type, bar_date, endpoint, model, prompt_version)
+    );
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        super().__init__("analysis_cache.db", db_path)
+        # 旧版本的缓存只按模型区分，无法确定由哪个端点生成，直接丢弃重建
+        columns = {row['name'] for row in self.query("PRAGMA table_info(analysis_results)")}
+        if 'endpoint' not in columns:
+            self.execute("DROP TABLE analysis_results")
+            self._conn.executescript(self.SCHEMA)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, stock_code: str, market_type: str, bar_date: str,
+            endpoints: List[Tuple[str, str]], prompt_version: str) -> Optional[Dict[str, Any]]:
+        """
+        获取缓存的分析结果
+
+        Args:
+            endpoints: 可接受的端点 (URL, 模型)，按优先顺序排列
+        """
+        row = None
+        for endpoint, model in endpoints:
+            row = self.query_one(
+                "SELECT basic_result, indicator_frame, ai_analysis, completed_frame FROM analysis_results "
+                "WHERE stock_code = ? AND market_type = ? AND bar_date = ? AND endpoint = ? AND model = ? "
+                "AND prompt_version = ?",
+                (stock_code, market_type, bar_date, endpoint, model, prompt_version)
+            )
+            if row is not None:
+                break
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {
+            "basic_result": json.loads(row['basic_result']),
+            "indicator_frame": json.loads(row['indicator_frame']),
+            "ai_analysis": row['ai_analysis'],
+            "completed_frame": json.loads(row['completed_frame'])
+        }
+
+    def save(self, stock_code: str, market_type: str, bar_date: str, endpoint: str, model: str,
+             prompt_version: str, basic_result: Dict[str, Any], indicator_frame: Dict[str, Any],
+             ai_analysis: str, completed_frame: Dict[str, Any]) -> None:
+        """保存完整的分析结果，endpoint和model为实际生成该结果的端点URL和模型"""
+        self.execute(
+            "INSERT OR REPLACE INTO analysis_results (stock_code, market_type, bar_date, endpoint, model, prompt_version, "
+            "basic_result, indicator_frame, ai_analysis, completed_frame, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (stock_code, market_type, bar_date, endpoint, model, prompt_version, json.dumps(basic_result),
+             json.dumps(indicator_frame), ai_analysis, json.dumps(completed_frame), time.time())
+        )
+
+    def purge_expired(self, days: int = ANALYSIS_CACHE_DAYS) -> int:
+        """删除超过保留天数的缓存"""
+        return self.execute("DELETE FROM analysis_results WHERE created_at < ?", (time.time() - days * 86400,))
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计"""
+        row = self.query_one("SELECT COUNT(*) AS entries FROM analysis_results")
+        total = self.hits + self.misses
+        return {
+            "entries": row['entries'],
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+_cache: Optional[AnalysisResultCache] = None
+
+
+def get_analysis_cache() -> Optional[AnalysisResultCache]:
+    """获取共享的分析结果缓存，未启用时返回None"""
+    global _cache
+    if _cache is None and ANALYSIS_CACHE_ENABLED:
+        _cache = AnalysisResultCache()
+    return _cache
+
+
+async def get_closed_session(market_type: str) -> Optional[date]:
+    """
+    获取可缓存的最近收盘交易日
+
+    Returns:
+        市场处于交易时段时返回None（结果会随行情变化，不可缓存），否则返回最近一个已收盘交易日
+    """
+    def resolve() -> Optional[date]:
+        calendar = get_trading_calendar()
+        if calendar.is_in_session(market_type):
+            return None
+        return calendar.latest_closed_session(market_type)
+
+    try:
+        return await asyncio.to_thread(resolve)
+    except Exception as e:
+        logger.warning(f"判断交易时段失败，不使用分析缓存: {str(e)}")
+        return None
+
+
+def replay_frames(cached: Dict[str, Any], stream: bool) -> List[Dict[str, Any]]:
+    """
+    将缓存的分析结果还原为与实时分析相同格式的帧序列
+
+    Args:
+        cached: 缓存的分析结果
+        stream: 是否为流式响应
+
+    Returns:
+        帧字典列表
+    """
+    indicator_frame = cached['indicator_frame']
+    completed_frame = {**cached['completed_frame'], "cached": True}
+    frames = [cached['basic_result'], indicator_frame]
+
+    if stream:
+        frames.append({
+            "stock_code": indicator_frame['stock_code'],
+            "ai_analysis_chunk": cached['ai_analysis'],
+            "status": "analyzing"
+        })
+        frames.append(completed_frame)
+    else:
+        frames.append({**indicator_frame, **completed_frame, "analysis": cached['ai_analysis']})
+    return frames
+
+
+class AnalysisRecorder:
+    """在AI分析帧流经时收集可缓存的内容"""
+
+    def __init__(self):
+        self.indicator_frame: Optional[Dict[str, Any]] = None
+        self.completed_frame: Optional[Dict[str, Any]] = None
+        # AI分析器最后输出的耗时统计，包含生成结果的模型和端点
+        self.timings: Optional[Dict[str, Any]] = None
+        self.parts: List[str] = []
+        self.failed = False
+
+    def record(self, chunk: bytes) -> None:
+        """记录一帧AI分析输出"""
+        frame = decode_frame(chunk)
+        if frame.get('status') == 'error' or 'error' in frame:
+            self.failed = True
+        elif 'timings' in frame:
+            self.timings = frame['timings']
+        elif 'ai_analysis_chunk' in frame:
+            self.parts.append(frame['ai_analysis_chunk'])
+        elif frame.get('status') == 'completed':
+            if 'analysis' in frame:
+                self.parts.append(frame['analysis'])
+            self.completed_frame = {
+                "stock_code": frame['stock_code'],
+                "status": "completed",
+                "score": frame.get('score'),
+                "recommendation": frame.get('recommendation')
+            }
+        elif frame.get('status') == 'analyzing' and self.indicator_frame is None:
+            self.indicator_frame = frame
+
+    def result(self) -> Optional[Tuple[Dict[str, Any], str, Dict[str, Any]]]:
+        """返回(技术指标帧, AI分析全文, 完成帧)，分析未成功完成时返回None"""
+        if self.failed or self.indicator_frame is None or self.completed_frame is None:
+            return None
+        return self.indicator_frame, ''.join(self.parts), self.completed_frame
@@ -1,65 +1,71 @@
 import asyncio
+import os
 import pandas as pd
 from typing import List, Dict, Any, Optional
 from utils.logger import get_logger
-from datetime import datetime, timedelta
+from utils.snapshot_store import SnapshotStore
+from utils.frame_records import FLOAT, PERCENT, STR
+from utils.symbol_index import SymbolSnapshot
 
 # 获取日志器
 logger = get_logger()
 
+# 基金列表快照的有效期（秒），到期前在后台刷新
+FUND_SNAPSHOT_TTL = float(os.getenv('FUND_SNAPSHOT_TTL', 1800))
+
+# 搜索结果和详情的字段：输出字段 -> (列名, 类型)
+FUND_SEARCH_FIELDS = {
+    'name': ('name', STR),
+    'symbol': ('symbol', STR),
+    'price': ('price', FLOAT),
+    'volume': ('volume', FLOAT),
+    'market_value': ('market_value', FLOAT),
+    'total_value': ('total_value', FLOAT)
+}
+FUND_DETAIL_FIELDS = {
+    'name': ('name', STR),
+    'symbol': ('symbol', STR),
+    'price': ('price', FLOAT),
+    'price_change': ('price_change', FLOAT),
+    'price_change_percent': ('price_change_percent', PERCENT),
+    'volume': ('volume', FLOAT),
+    'market_value': ('market_value', FLOAT),
+    'total_value': ('total_value', FLOAT),
+    'discount_rate': ('discount_rate', PERCENT)
+}
+
 class FundServiceAsync:
     """
     异步基金服务
     提供基金数据的异步搜索和获取功能
+    ETF和LOF列表各自保存快照，过期前后台刷新，请求始终使用最近一次成功的快照
     """
     
-    def __init__(self):
-        """初始化异步基金服务"""
-        logger.debug("初始化FundServiceAsync")
+    def __init__(self, ttl: float = FUND_SNAPSHOT_TTL):
+        """
+        初始化异步基金服务
         
-        # 添加缓存
-        self._etf_cache = None
-        self._lof_cache = None
-        self._cache_timestamp = None
-        self._cache_duration = timedelta(minutes=30)  # 缓存30分钟
+        Args:
+            ttl: 快照有效期（秒）
+        """
+        logger.debug("初始化FundServiceAsync")
+        self.snapshots = SnapshotStore("基金列表", self._load_snapshot, ttl)
     
     async def search_funds(self, keyword: str, market_type: str = 'ETF') -> List[Dict[str, Any]]:
         """
         异步搜索基金代码
         
         Args:
-            keyword: 搜索关键词
+            keyword: 搜索关键词，匹配代码或名称
             market_type: 市场类型，'ETF'或'LOF'
             
         Returns:
-            匹配的基金列表
+            匹配的基金列表（最多10个）
         """
         try:
             logger.info(f"异步搜索基金: {keyword}, 类型: {market_type}")
-            
-            # 获取基金数据
-            df = await self._get_funds_data(market_type)
-            
-            # 模糊匹配搜索（同时匹配代码和名称）
-            mask = (df['name'].str.contains(keyword, case=False, na=False) | 
-                   df['symbol'].str.contains(keyword, case=False, na=False))
-            results = df[mask]
-            
-            # 格式化返回结果并处理 NaN 值
-            formatted_results = []
-            for _, row in results.iterrows():
-                formatted_results.append({
-                    'name': row['name'] if pd.notna(row['name']) else '',
-                    'symbol': str(row['symbol']) if pd.notna(row['symbol']) else '',
-                    'price': float(row['price']) if pd.notna(row['price']) else 0.0,
-                    'volume': float(row['volume']) if pd.notna(row['volume']) else 0.0,
-                    'market_value': float(row['market_value']) if pd.notna(row['market_value']) else 0.0,
-                    'total_value': float(row['total_value']) if pd.notna(row['total_value']) else 0.0,
-                })
-                # 限制只返回前10个结果
-                if len(formatted_results) >= 10:
-                    break
-            
+            snapshot = await self.snapshots.get(self._market(market_type))
+            formatted_results = snapshot.search(keyword, limit=10)
             logger.info(f"基金搜索完成，找到 {len(formatted_results)} 个匹配项（限制显示前10个）")
             return formatted_results
             
@@ -69,49 +75,33 @@ class FundServiceAsync:
             logger.exception(e)
             raise Exception(error_msg)
     
-    async def _get_funds_data(self, market_type: str = 'ETF') -> pd.DataFrame:
-        """
-        异步获取基金数据，支持缓存
-        
-        Args:
-            market_type: 市场类型，'ETF'或'LOF'
-            
-        Returns:
-            包含基金数据的DataFrame
-        """
-        # 检查缓存是否有效
-        now = datetime.now()
-        cache_valid = (
-            self._cache_timestamp is not None and 
-            (now - self._cache_timestamp) < self._cache_duration
-        )
-        
-        if market_type == 'ETF' and cache_valid and self._etf_cache is not None:
-            logger.debug("使用ETF缓存数据")
-            return self._etf_cache
-        elif market_type == 'LOF' and cache_valid and self._lof_cache is not None:
-            logger.debug("使用LOF缓存数据")
-            return self._lof_cache
-        
-        # 缓存无效，重新获取数据
-        try:
-            logger.debug(f"从API获取{market_type}数据")
-            
-            # 使用线程池执行同步的akshare调用
-            if market_type == 'ETF':
-                df = await asyncio.to_thread(self._get_etf_data)
-                self._etf_cache = df
-            else:
-                df = await asyncio.to_thread(self._get_lof_data)
-                self._lof_cache = df
-                
-            self._cache_timestamp = now
-            return df
-            
-        except Exception as e:
-            logger.error(f"获取{market_type}数据失败: {str(e)}")
-            logger.exception(e)
-            raise
+    @staticmethod
+    def _market(market_type: str) -> str:
+        """非ETF的类型都按LOF处理"""
+        return 'ETF' if market_type == 'ETF' else 'LOF'
+    
+    async def _load_snapshot(self, market_type: str) -> SymbolSnapshot:
+        """拉取某个市场的全量基金列表并建立索引"""
+        fetch = self._get_etf_data if market_type == 'ETF' else self._get_lof_data
+        df = await self.snapshots.fetch_shared(market_type, fetch)
+        return await asyncio.to_thread(self._build_snapshot, df)
+    
+    @staticmethod
+    def _build_snapshot(df: pd.DataFrame) -> SymbolSnapshot:
+        """按流通市值从高到低排序，并预先格式化搜索结果和详情"""
+        return SymbolSnapshot.from_frame(df, FUND_SEARCH_FIELDS, FUND_DETAIL_FIELDS)
+    
+    def start(self) -> None:
+        """在当前事件循环中启动后台刷新，并预先加载ETF和LOF列表"""
+        self.snapshots.start(['ETF', 'LOF'])
+    
+    async def stop(self) -> None:
+        """停止后台刷新"""
+        await self.snapshots.stop()
+    
+    def stats(self) -> Dict[str, Any]:
+        """返回各市场快照的年龄和刷新耗时"""
+        return self.snapshots.stats()
     
     def _get_etf_data(self) -> pd.DataFrame:
         """
@@ -193,31 +183,11 @@ class FundServiceAsync:
         try:
             logger.info(f"获取{market_type}基金详情: {symbol}")
             
-            # 获取基金数据
-            df = await self._get_funds_data(market_type)
-            
-            # 精确匹配基金代码
-            result = df[df['symbol'] == symbol]
-            
-            if len(result) == 0:
+            snapshot = await self.snapshots.get(self._market(market_type))
+            fund_detail = snapshot.detail(symbol)
+            if fund_detail is None:
                 raise Exception(f"未找到基金代码: {symbol}")
             
-            # 获取第一行数据
-            row = result.iloc[0]
-            
-            # 格式化为字典
-            fund_detail = {
-                'name': row['name'] if pd.notna(row['name']) else '',
-                'symbol': str(row['symbol']) if pd.notna(row['symbol']) else '',
-                'price': float(row['price']) if pd.notna(row['price']) else 0.0,
-                'price_change': float(row['price_change']) if pd.notna(row['price_change']) else 0.0,
-                'price_change_percent': float(row['price_change_percent'].strip('%'))/100 if pd.notna(row['price_change_percent']) else 0.0,
-                'volume': float(row['volume']) if pd.notna(row['volume']) else 0.0,
-                'market_value': float(row['market_value']) if pd.notna(row['market_value']) else 0.0,
-                'total_value': float(row['total_value']) if pd.notna(row['total_value']) else 0.0,
-                'discount_rate': float(row['discount_rate'].strip('%'))/100 if pd.notna(row['discount_rate']) else 0.0
-            }
-            
             logger.info(f"获取基金详情成功: {symbol}")
             return fund_detail
             
@@ -225,4 +195,4 @@ class FundServiceAsync:
             error_msg = f"获取基金详情失败: {str(e)}"
             logger.error(error_msg)
             logger.exception(e)
-            raise Exception(error_msg) 
\ No newline at end of file
+            raise Exception(error_msg)
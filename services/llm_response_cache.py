@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Any, AsyncGenerator, Dict, Optional, Tuple
+from utils.logger import get_logger
+from utils.sqlite_store import SQLiteStore
+from utils.sse import STREAM_FLUSH_CHARS
+
+# 获取日志器
+logger = get_logger()
+
+# 是否启用AI响应缓存，以及缓存占用的磁盘空间上限（MB）
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'true').lower() == 'true'
+LLM_CACHE_MAX_MB = float(os.getenv('LLM_CACHE_MAX_MB', 64))
+# 命中缓存时的回放速度（字符/秒），0表示一次性全速输出
+LLM_CACHE_REPLAY_CPS = float(os.getenv('LLM_CACHE_REPLAY_CPS', 0))
+
+# 每次淘汰时删除的条目数
+_EVICT_BATCH = 50
+
+
+def response_cache_key(model: str, temperature: float, prompt: str) -> str:
+    """按(模型, 温度, 提示词)计算内容寻址的缓存键"""
+    payload = json.dumps([model, temperature, prompt], ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class LLMResponseCache(SQLiteStore):
+    """
+    内容寻址的AI响应缓存
+    相同模型、温度和提示词的请求直接复用之前的完整输出，按最近访问时间淘汰，总大小不超过上限；
+    同时记录生成输出的端点URL，命中时可以确定输出的来源
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS llm_responses (
+        cache_key TEXT PRIMARY KEY,
+        model TEXT NOT NULL,
+        endpoint TEXT NOT NULL DEFAULT '',
+        response TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        last_access REAL NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_llm_responses_access ON llm_responses (last_access);
+    """
+
+    def __init__(self, db_path: Optional[str] = None, max_bytes: Optional[int] = None):
+        """
+        初始化AI响应缓存
+
+        Args:
+            db_path: 自定义数据库文件路径
+            max_bytes: 缓存内容的总字节数上限，默认按LLM_CACHE_MAX_MB
+        """
+        super().__init__("llm_response_cache.db", db_path)
+        # 旧版本创建的数据库没有记录端点，这些条目的来源视为未知
+        columns = {row['name'] for row in self.query("PRAGMA table_info(llm_responses)")}
+        if 'endpoint' not in columns:
+            self.execute("ALTER TABLE llm_responses ADD COLUMN endpoint TEXT NOT NULL DEFAULT ''")
+        self.max_bytes = max_bytes if max_bytes is not None else int(LLM_CACHE_MAX_MB * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def total_bytes(self) -> int:
+        """缓存内容的总字节数，每次从数据库统计，包含其他工作进程写入的条目"""
+        row = self.query_one("SELECT COALESCE(SUM(size), 0) AS total FROM llm_responses")
+        return row['total']
+
+    def lookup(self, cache_keys: Dict[str, str]) -> Optional[Tuple[str, str, str]]:
+        """
+        按顺序查找多个模型的缓存
+
+        Args:
+            cache_keys: 模型 -> 缓存键，按优先顺序排列
+
+        Returns:
+            (命中的模型, 缓存的输出, 生成该输出的端点URL，来源未知时为空字符串)，都未命中时返回None
+        """
+        for model, cache_key in cache_keys.items():
+            row = self.query_one("SELECT response, endpoint FROM llm_responses WHERE cache_key = ?", (cache_key,))
+            if row is not None:
+                self.execute("UPDATE llm_responses SET last_access = ?, hits = hits + 1 WHERE cache_key = ?",
+                             (time.time(), cache_key))
+                self.hits += 1
+                return model, row['response'], row['endpoint']
+        self.misses += 1
+        return None
+
+    def put(self, cache_key: str, model: str, response: str, endpoint: str = '') -> None:
+        """保存一次完整的输出及生成它的端点URL，超出总大小上限时淘汰最久未访问的条目"""
+        size = len(response.encode())
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        self.execute(
+            "INSERT OR REPLACE INTO llm_responses (cache_key, model, endpoint, response, size, created_at, last_access, hits) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+            (cache_key, model, endpoint, response, size, now, now)
+        )
+        self._evict()
+
+    def _evict(self) -> None:
+        # 多个工作进程共用同一个数据库，每批淘汰前重新统计总大小
+        while (total := self.total_bytes) > self.max_bytes:
+            rows = self.query("SELECT cache_key, size FROM llm_responses ORDER BY last_access LIMIT ?",
+                              (_EVICT_BATCH,))
+            if not rows:
+                return
+            evicted = []
+            for row in rows:
+                if total <= self.max_bytes:
+                    break
+                evicted.append((row['cache_key'],))
+                total -= row['size']
+            self.executemany("DELETE FROM llm_responses WHERE cache_key = ?", evicted)
+            self.evictions += len(evicted)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计"""
+        row = self.query_one("SELECT COUNT(*) AS entries FROM llm_responses")
+        total = self.hits + self.misses
+        return {
+            "entries": row['entries'],
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions
+        }
+
+
+_cache: Optional[LLMResponseCache] = None
+
+
+def get_llm_response_cache() -> Optional[LLMResponseCache]:
+    """获取共享的AI响应缓存，未启用时返回None"""
+    global _cache
+    if _cache is None and LLM_CACHE_ENABLED:
+        _cache = LLMResponseCache()
+    return _cache
+
+
+async def replay_text(text: str, chunk_chars: int = STREAM_FLUSH_CHARS,
+                      chars_per_sec: float = LLM_CACHE_REPLAY_CPS) -> AsyncGenerator[str, None]:
+    """
+    将缓存的输出按片段回放
+
+    Args:
+        text: 缓存的完整输出
+        chunk_chars: 每个片段的字符数
+        chars_per_sec: 回放速度（字符/秒），0表示不限速
+
+    Returns:
+        输出片段的异步生成器
+    """
+    started = time.monotonic()
+    for start in range(0, len(text), chunk_chars):
+        if chars_per_sec:
+            # 按目标速度计算每个片段的发送时间，睡眠误差不会累积
+            delay = started + start / chars_per_sec - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        yield text[start:start + chunk_chars]
@@ -0,0 +1,328 @@
+import asyncio
+import json
+import os
+import random
+import time
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from utils.api_utils import APIUtils
+from utils.llm_metrics import endpoint_label, get_llm_metrics
+from utils.logger import get_logger
+
+# 获取日志器
+logger = get_logger()
+
+T = TypeVar('T')
+
+# 对冲请求配置：首个片段迟迟未到时向另一个端点再发一次请求，采用先开始输出的那个
+AI_HEDGE_ENABLED = os.getenv('AI_HEDGE_ENABLED', 'false').lower() == 'true'
+AI_HEDGE_PERCENTILE = float(os.getenv('AI_HEDGE_PERCENTILE', 0.95))
+AI_HEDGE_MIN_DELAY_MS = float(os.getenv('AI_HEDGE_MIN_DELAY_MS', 500))
+AI_HEDGE_DEFAULT_DELAY_MS = float(os.getenv('AI_HEDGE_DEFAULT_DELAY_MS', 5000))
+# 统计端点首token延迟分位数所需的最少样本数
+AI_HEDGE_MIN_SAMPLES = 20
+
+# 端点连续失败后的冷却时间（秒），按失败次数指数增长
+ENDPOINT_COOLDOWN_BASE = 2.0
+ENDPOINT_COOLDOWN_MAX = 60.0
+# 健康度指数移动平均的平滑系数
+HEALTH_EWMA_ALPHA = 0.2
+
+
+class LLMEndpointError(Exception):
+    """AI端点请求失败"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class LLMEndpoint:
+    """单个OpenAI兼容的AI端点及其健康状态"""
+
+    def __init__(self, url: str, key: Optional[str], model: str, weight: float = 1.0, name: Optional[str] = None,
+                 rpm: Optional[int] = None, tpm: Optional[int] = None):
+        self.base_url = url
+        self.url = APIUtils.format_api_url(url)
+        self.key = key
+        self.model = model
+        self.weight = max(0.0, float(weight))
+        self.label = endpoint_label(self.url)
+        # 未指定名称时按 主机/模型 命名，同一主机上的不同模型不会重名
+        self.name = name or f"{self.label}/{model}"
+        # 每分钟请求数和token数上限，为空时使用全局配置
+        self.rpm = rpm
+        self.tpm = tpm
+        # 健康状态
+        self.health = 1.0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.successes = 0
+        self.failures = 0
+
+    def available(self, now: Optional[float] = None) -> bool:
+        """是否不在冷却期"""
+        return (now or time.monotonic()) >= self.cooldown_until
+
+    def score(self) -> float:
+        """选择权重：配置权重乘以健康度"""
+        return self.weight * max(self.health, 0.05)
+
+    def record_success(self) -> None:
+        self.successes += 1
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.health += HEALTH_EWMA_ALPHA * (1.0 - self.health)
+
+    def record_failure(self, retry_after: Optional[float] = None) -> None:
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.health -= HEALTH_EWMA_ALPHA * self.health
+        cooldown = min(ENDPOINT_COOLDOWN_MAX, ENDPOINT_COOLDOWN_BASE ** self.consecutive_failures)
+        if retry_after is not None:
+            cooldown = max(cooldown, retry_after)
+        self.cooldown_until = time.monotonic() + cooldown
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "endpoint": self.label,
+            "model": self.model,
+            "weight": self.weight,
+            "health": round(self.health, 3),
+            "available": self.available(),
+            "consecutive_failures": self.consecutive_failures,
+            "successes": self.successes,
+            "failures": self.failures
+        }
+
+
+def load_endpoints_from_env() -> List[LLMEndpoint]:
+    """
+    从环境变量读取AI端点配置
+    API_ENDPOINTS为JSON数组，如 [{"url": "...", "key": "...", "model": "...", "weight": 2, "rpm": 60, "tpm": 90000}]，
+    name可选，默认为 主机/模型；
+    未配置时使用API_URL/API_KEY/API_MODEL作为唯一端点
+    """
+    default_model = os.getenv('API_MODEL', 'gpt-3.5-turbo')
+    raw = os.getenv('API_ENDPOINTS', '').strip()
+    if raw:
+        try:
+            endpoints = [
+                LLMEndpoint(item['url'], item.get('key'), item.get('model') or default_model,
+                            item.get('weight', 1.0), item.get('name'), item.get('rpm'), item.get('tpm'))
+                for item in json.loads(raw)
+            ]
+            if endpoints:
+                return endpoints
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f"API_ENDPOINTS配置无效，使用API_URL: {str(e)}")
+    url = os.getenv('API_URL')
+    return [LLMEndpoint(url, os.getenv('API_KEY'), default_model)] if url else []
+
+
+class LLMRouter:
+    """
+    在多个AI端点之间按权重和健康度分配请求
+    失败时切换到下一个端点；启用对冲时，若超过首token延迟的p95仍无输出，再向另一个端点发起请求
+    """
+
+    def __init__(self, endpoints: List[LLMEndpoint], hedge_enabled: bool = AI_HEDGE_ENABLED,
+                 hedge_percentile: float = AI_HEDGE_PERCENTILE,
+                 hedge_min_delay_ms: float = AI_HEDGE_MIN_DELAY_MS,
+                 hedge_default_delay_ms: float = AI_HEDGE_DEFAULT_DELAY_MS):
+        self.endpoints = endpoints
+        # 名称用作计时和统计的键，重名时追加端点序号
+        seen = set()
+        for index, endpoint in enumerate(endpoints):
+            if endpoint.name in seen:
+                endpoint.name = f"{endpoint.name}#{index}"
+            seen.add(endpoint.name)
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay_ms = hedge_min_delay_ms
+        self.hedge_default_delay_ms = hedge_default_delay_ms
+        self.hedges_started = 0
+        self.hedges_won = 0
+        self.failovers = 0
+
+    def candidates(self) -> List[LLMEndpoint]:
+        """
+        返回本次请求尝试端点的顺序
+        可用端点按权重×健康度加权随机排序，冷却中或权重为0的端点排在最后作为兜底
+        """
+        now = time.monotonic()
+        available = [ep for ep in self.endpoints if ep.available(now) and ep.weight > 0]
+        cooling = sorted((ep for ep in self.endpoints if ep not in available), key=lambda ep: ep.cooldown_until)
+        ordered = []
+        while available:
+            chosen = random.choices(available, weights=[ep.score() for ep in available])[0]
+            available.remove(chosen)
+            ordered.append(chosen)
+        return ordered + cooling
+
+    def hedge_delay(self, endpoint: LLMEndpoint) -> float:
+        """对冲前等待的秒数：端点最近首token延迟的分位数，样本不足时使用默认值"""
+        metrics = get_llm_metrics()
+        delay_ms = self.hedge_default_delay_ms
+        if metrics.count(endpoint.model, endpoint.label, 'ttft_ms') >= AI_HEDGE_MIN_SAMPLES:
+            delay_ms = metrics.percentile(endpoint.model, endpoint.label, 'ttft_ms', self.hedge_percentile)
+        return max(delay_ms, self.hedge_min_delay_ms) / 1000
+
+    async def call(self, request: Callable[[LLMEndpoint], Awaitable[T]]) -> Tuple[LLMEndpoint, T]:
+        """
+        依次尝试端点直到请求成功（非流式请求）
+
+        Args:
+            request: 对指定端点发起请求的协程函数，失败时抛出异常
+
+        Returns:
+            (成功的端点, 请求结果)
+        """
+        last_error: Optional[LLMEndpointError] = None
+        for attempt, endpoint in enumerate(self.candidates()):
+            if attempt:
+                self.failovers += 1
+            try:
+                result = await request(endpoint)
+            except Exception as e:
+                last_error = self._on_failure(endpoint, e)
+                continue
+            endpoint.record_success()
+            return endpoint, result
+        raise last_error or LLMEndpointError("未配置可用的AI端点")
+
+    async def stream(self, open_stream: Callable[[LLMEndpoint], AsyncIterator[T]],
+                     is_progress: Optional[Callable[[T], bool]] = None
+                     ) -> AsyncGenerator[Tuple[LLMEndpoint, T], None]:
+        """
+        从最先开始输出的端点读取输出（流式请求）
+
+        Args:
+            open_stream: 对指定端点发起流式请求的函数，返回输出项的异步迭代器，失败时抛出异常
+            is_progress: 判断输出项是否为排队进度等过程信息的函数，过程信息直接转发，不视为端点已开始输出
+
+        Returns:
+            (端点, 输出项) 的异步生成器；所有端点都在开始输出前失败时抛出LLMEndpointError
+        """
+        candidates = self.candidates()
+        attempts: Dict[asyncio.Future, Tuple[LLMEndpoint, AsyncIterator[T]]] = {}
+        next_index = 0
+        hedged = False
+        hedge_endpoint: Optional[LLMEndpoint] = None
+        primary_started = 0.0
+        last_error: Optional[LLMEndpointError] = None
+        winner: Optional[Tuple[LLMEndpoint, T, AsyncIterator[T]]] = None
+
+        async def first_item(iterator: AsyncIterator[T]) -> Tuple[bool, Optional[T]]:
+            try:
+                return True, await iterator.__anext__()
+            except StopAsyncIteration:
+                return False, None
+
+        def launch() -> None:
+            nonlocal next_index, primary_started
+            endpoint = candidates[next_index]
+            next_index += 1
+            iterator = open_stream(endpoint).__aiter__()
+            attempts[asyncio.ensure_future(first_item(iterator))] = (endpoint, iterator)
+            if len(attempts) == 1:
+                primary_started = time.monotonic()
+
+        try:
+            while winner is None:
+                if not attempts:
+                    if next_index >= len(candidates):
+                        raise last_error or LLMEndpointError("未配置可用的AI端点")
+                    if next_index:
+                        self.failovers += 1
+                    launch()
+
+                timeout = None
+                if self.hedge_enabled and not hedged and next_index < len(candidates):
+                    primary = next(iter(attempts.values()))[0]
+                    timeout = max(0.0, primary_started + self.hedge_delay(primary) - time.monotonic())
+
+                done, _ = await asyncio.wait(attempts.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    hedge_endpoint = candidates[next_index]
+                    self.hedges_started += 1
+                    logger.info(f"AI端点 {primary.name} 首token超时，对冲请求 {hedge_endpoint.name}")
+                    launch()
+                    continue
+
+                for future in done:
+                    endpoint, iterator = attempts.pop(future)
+                    try:
+                        has_item, item = future.result()
+                        if not has_item:
+                            raise LLMEndpointError("AI端点返回了空响应")
+                    except Exception as e:
+                        last_error = self._on_failure(endpoint, e)
+                        await self._close(iterator)
+                        continue
+                    if is_progress is not None and is_progress(item):
+                        # 过程信息转发后继续等待该端点的下一项
+                        attempts[asyncio.ensure_future(first_item(iterator))] = (endpoint, iterator)
+                        yield endpoint, item
+                        continue
+                    winner = (endpoint, item, iterator)
+                    break
+        finally:
+            # 取消未胜出的请求
+            for future in attempts:
+                future.cancel()
+            await asyncio.gather(*attempts.keys(), return_exceptions=True)
+            for _, iterator in attempts.values():
+                await self._close(iterator)
+
+        endpoint, item, iterator = winner
+        endpoint.record_success()
+        if endpoint is hedge_endpoint:
+            self.hedges_won += 1
+        try:
+            yield endpoint, item
+            async for item in iterator:
+                yield endpoint, item
+        except Exception as e:
+            self._on_failure(endpoint, e)
+            raise
+        finally:
+            await self._close(iterator)
+
+    def _on_failure(self, endpoint: LLMEndpoint, error: Exception) -> LLMEndpointError:
+        """记录端点失败，并将连接错误等统一转换为LLMEndpointError"""
+        if not isinstance(error, LLMEndpointError):
+            error = LLMEndpointError(str(error) or type(error).__name__)
+        endpoint.record_failure(error.retry_after)
+        logger.warning(f"AI端点 {endpoint.name} 请求失败: {error.message}")
+        return error
+
+    @staticmethod
+    async def _close(iterator: AsyncIterator) -> None:
+        if hasattr(iterator, 'aclose'):
+            await iterator.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回端点健康状态和对冲、切换次数"""
+        return {
+            "endpoints": [ep.stats() for ep in self.endpoints],
+            "hedge_enabled": self.hedge_enabled,
+            "hedges_started": self.hedges_started,
+            "hedges_won": self.hedges_won,
+            "failovers": self.failovers
+        }
+
+
+_default_router: Optional[LLMRouter] = None
+
+
+def get_default_router() -> LLMRouter:
+    """获取按环境变量配置的共享路由器，端点健康状态在所有分析器之间共享"""
+    global _default_router
+    if _default_router is None:
+        _default_router = LLMRouter(load_endpoints_from_env())
+    return _default_router
@@ -0,0 +1,398 @@
+import asyncio
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict, deque
+from typing import Any, AsyncGenerator, Deque, Dict, List, Mapping, Optional, Tuple
+
+from utils.logger import get_logger
+
+# 获取日志器
+logger = get_logger()
+
+# 每个API端点（URL + 密钥）允许的最大并发AI请求数
+AI_MAX_CONCURRENCY = int(os.getenv('AI_MAX_CONCURRENCY', 3))
+# 每个端点每分钟允许的请求数和token数，0表示不限制；可在API_ENDPOINTS中按端点覆盖
+AI_RATE_LIMIT_RPM = int(os.getenv('AI_RATE_LIMIT_RPM', 0))
+AI_RATE_LIMIT_TPM = int(os.getenv('AI_RATE_LIMIT_TPM', 0))
+# 估算请求消耗的token时计入的预期输出token数
+AI_EXPECTED_OUTPUT_TOKENS = int(os.getenv('AI_EXPECTED_OUTPUT_TOKENS', 800))
+# 收到429后在同一端点重新排队的最大次数，以及可接受的最长等待（秒），超出时交由路由器切换端点或报错
+AI_RATE_LIMIT_RETRIES = int(os.getenv('AI_RATE_LIMIT_RETRIES', 3))
+AI_RATE_LIMIT_MAX_WAIT = float(os.getenv('AI_RATE_LIMIT_MAX_WAIT', 60))
+# 最多保留多少个端点调度器，用户自带密钥时每个密钥各有一个，超出后淘汰最久未使用的空闲调度器
+AI_MAX_SCHEDULERS = int(os.getenv('AI_MAX_SCHEDULERS', 256))
+
+# 优先级：交互式的单只分析优先于批量扫描，预生成分析最后
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+PRIORITY_PREFETCH = 2
+
+# 未提供Retry-After时429的默认等待时间（秒）
+DEFAULT_RETRY_AFTER = 1.0
+
+# 限流响应头的重置时间，如 "1s"、"6m0s"、"20ms"、"0.5"
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_DURATION_UNITS = {'h': 3600.0, 'm': 60.0, 's': 1.0, 'ms': 0.001}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """
+    解析限流响应头中的时间长度
+
+    Returns:
+        秒数，无法解析时返回None
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts or ''.join(number + unit for number, unit in parts) != value:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """从响应头读取建议的重试等待秒数，支持retry-after-ms和retry-after"""
+    retry_after_ms = headers.get('retry-after-ms')
+    if retry_after_ms is not None:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000)
+        except ValueError:
+            pass
+    return parse_duration(headers.get('retry-after'))
+
+
+class TokenBucket:
+    """按分钟配额匀速补充的令牌桶，配额为0时不限制"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """距离可以消耗amount个令牌还需等待的秒数，超过容量的请求在桶满时放行"""
+        if self.unlimited:
+            return 0.0
+        self._refill()
+        needed = min(amount, self.capacity) - self.tokens
+        return max(0.0, needed / self.rate)
+
+    def consume(self, amount: float) -> None:
+        """消耗令牌，实际用量修正时允许透支"""
+        if not self.unlimited:
+            self._refill()
+            self.tokens -= amount
+
+    def limit_remaining(self, remaining: float) -> None:
+        """按服务端报告的剩余配额收紧本地令牌数"""
+        if not self.unlimited:
+            self._refill()
+            self.tokens = min(self.tokens, remaining)
+
+
+class _Waiter:
+    """排队中的一个请求"""
+
+    __slots__ = ('user', 'priority', 'tokens', 'future', 'changed', 'enqueued_at')
+
+    def __init__(self, user: str, priority: int, tokens: int):
+        self.user = user
+        self.priority = priority
+        self.tokens = tokens
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.changed = asyncio.Event()
+        self.enqueued_at = time.monotonic()
+
+
+class SchedulerTicket:
+    """一次请求的排队凭证，获得许可后必须调用release归还并发名额"""
+
+    def __init__(self, scheduler: 'EndpointScheduler', waiter: _Waiter):
+        self._scheduler = scheduler
+        self._waiter = waiter
+        self._released = False
+
+    @property
+    def granted(self) -> bool:
+        return self._waiter.future.done()
+
+    async def wait(self) -> AsyncGenerator[int, None]:
+        """
+        等待获得请求许可
+
+        Returns:
+            排队位置变化的异步生成器（从1开始），获得许可后结束；无需排队时不产出任何位置
+        """
+        waiter = self._waiter
+        last_position = None
+        try:
+            while not waiter.future.done():
+                position = self._scheduler.position(waiter)
+                if position != last_position:
+                    last_position = position
+                    yield position
+                    continue
+                waiter.changed.clear()
+                changed = asyncio.ensure_future(waiter.changed.wait())
+                try:
+                    await asyncio.wait({waiter.future, changed}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    changed.cancel()
+        finally:
+            # 等待期间被取消（客户端断开、对冲失败方等）时退出队列
+            if not waiter.future.done():
+                self._scheduler._remove(waiter)
+
+    def release(self, actual_tokens: Optional[int] = None) -> None:
+        """
+        归还并发名额，重复调用无效
+
+        Args:
+            actual_tokens: 实际消耗的token数，用于修正排队时的估算
+        """
+        if self._released:
+            return
+        self._released = True
+        if self.granted:
+            self._scheduler._release(self._waiter, actual_tokens)
+        else:
+            self._scheduler._remove(self._waiter)
+
+
+class EndpointScheduler:
+    """
+    单个API端点的请求调度器
+    同时限制并发数、每分钟请求数和每分钟token数，遵循服务端的Retry-After和限流响应头；
+    排队请求按优先级分组，同一优先级内在用户之间轮转，避免单个用户的批量扫描占满配额
+    """
+
+    def __init__(self, name: str, max_concurrency: int = AI_MAX_CONCURRENCY,
+                 rpm: int = AI_RATE_LIMIT_RPM, tpm: int = AI_RATE_LIMIT_TPM):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        # 优先级 -> 用户 -> 该用户的排队请求，用户的先后顺序即轮转顺序
+        self._queues: Dict[int, 'OrderedDict[str, Deque[_Waiter]]'] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.granted = 0
+        self.rate_limited = 0
+        self.total_wait = 0.0
+        self.key_id = ''
+
+    def enqueue(self, user: str, priority: int = PRIORITY_INTERACTIVE, tokens: int = 0) -> SchedulerTicket:
+        """
+        提交一个请求，配额和并发名额允许时立即获得许可
+
+        Args:
+            user: 用户标识，同一优先级内按用户轮转
+            priority: 优先级，数值越小越优先
+            tokens: 预计消耗的token数
+
+        Returns:
+            排队凭证
+        """
+        waiter = _Waiter(user or 'anonymous', priority, tokens)
+        self._queues.setdefault(priority, OrderedDict()).setdefault(waiter.user, deque()).append(waiter)
+        self._dispatch()
+        return SchedulerTicket(self, waiter)
+
+    def _order(self) -> List[_Waiter]:
+        """按调度顺序排列的排队请求：高优先级在前，同一优先级内各用户轮流"""
+        ordered = []
+        for priority in sorted(self._queues):
+            queues = [list(queue) for queue in self._queues[priority].values()]
+            for depth in range(max((len(queue) for queue in queues), default=0)):
+                ordered.extend(queue[depth] for queue in queues if depth < len(queue))
+        return ordered
+
+    def queue_length(self) -> int:
+        return sum(len(queue) for users in self._queues.values() for queue in users.values())
+
+    def position(self, waiter: _Waiter) -> int:
+        """请求在队列中的位置，从1开始"""
+        for index, queued in enumerate(self._order()):
+            if queued is waiter:
+                return index + 1
+        return 0
+
+    def _head(self) -> Optional[_Waiter]:
+        for priority in sorted(self._queues):
+            for queue in self._queues[priority].values():
+                if queue:
+                    return queue[0]
+        return None
+
+    def _pop(self, waiter: _Waiter) -> None:
+        users = self._queues[waiter.priority]
+        queue = users.pop(waiter.user)
+        queue.popleft()
+        # 该用户还有请求时排到本优先级末尾，轮到其他用户
+        if queue:
+            users[waiter.user] = queue
+        if not users:
+            del self._queues[waiter.priority]
+
+    def _remove(self, waiter: _Waiter) -> None:
+        users = self._queues.get(waiter.priority)
+        queue = users.get(waiter.user) if users else None
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        if not queue:
+            del users[waiter.user]
+        if not users:
+            del self._queues[waiter.priority]
+        self._dispatch()
+
+    def _schedule(self, delay: float) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def _dispatch(self) -> None:
+        """在并发名额和配额允许时按顺序放行排队请求"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self.in_flight < self.max_concurrency:
+            waiter = self._head()
+            if waiter is None:
+                break
+            wait = max(self.blocked_until - time.monotonic(),
+                       self.requests.wait_time(1), self.tokens.wait_time(waiter.tokens))
+            if wait > 0:
+                self._schedule(wait)
+                break
+            self._pop(waiter)
+            self.requests.consume(1)
+            self.tokens.consume(waiter.tokens)
+            self.in_flight += 1
+            self.granted += 1
+            self.total_wait += time.monotonic() - waiter.enqueued_at
+            waiter.future.set_result(None)
+        # 通知仍在排队的请求刷新位置
+        for users in self._queues.values():
+            for queue in users.values():
+                for waiter in queue:
+                    waiter.changed.set()
+
+    def _release(self, waiter: _Waiter, actual_tokens: Optional[int]) -> None:
+        self.in_flight -= 1
+        if actual_tokens is not None:
+            self.tokens.consume(actual_tokens - waiter.tokens)
+        self._dispatch()
+
+    def block(self, seconds: float) -> None:
+        """在指定时间内暂停放行请求（收到429时调用）"""
+        self.rate_limited += 1
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        logger.warning(f"AI端点 {self.name} 触发限流，暂停 {seconds:.1f} 秒")
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """
+        根据OpenAI风格的限流响应头同步剩余配额
+        x-ratelimit-remaining-requests/tokens 为剩余量，x-ratelimit-reset-requests/tokens 为配额重置时间
+        """
+        for kind, bucket in (('requests', self.requests), ('tokens', self.tokens)):
+            remaining = headers.get(f'x-ratelimit-remaining-{kind}')
+            if remaining is None:
+                continue
+            try:
+                remaining = float(remaining)
+            except ValueError:
+                continue
+            bucket.limit_remaining(remaining)
+            reset = parse_duration(headers.get(f'x-ratelimit-reset-{kind}'))
+            if remaining <= 0 and reset:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + reset)
+
+    def is_idle(self) -> bool:
+        """没有进行中或排队的请求，也没有处于限流暂停中"""
+        return self.in_flight == 0 and not self._queues and self.blocked_until <= time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        blocked_for = self.blocked_until - time.monotonic()
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queue_length(),
+            "max_concurrency": self.max_concurrency,
+            "rpm": self.requests.capacity or None,
+            "tpm": self.tokens.capacity or None,
+            "blocked_for": round(blocked_for, 2) if blocked_for > 0 else 0,
+            "granted": self.granted,
+            "rate_limited": self.rate_limited,
+            "avg_wait_ms": round(self.total_wait / self.granted * 1000, 2) if self.granted else None
+        }
+
+
+# 按API端点共享的调度器，所有分析器实例共用，按最近使用顺序排列
+_schedulers: 'OrderedDict[Tuple[str, str], EndpointScheduler]' = OrderedDict()
+
+
+def _evict_idle_schedulers() -> None:
+    """调度器数量超出上限时，从最久未使用的开始淘汰空闲调度器；仍有请求的调度器保留"""
+    for cache_key in list(_schedulers):
+        if len(_schedulers) <= AI_MAX_SCHEDULERS:
+            return
+        if _schedulers[cache_key].is_idle():
+            del _schedulers[cache_key]
+
+
+def get_endpoint_scheduler(url: str, key: Optional[str], name: Optional[str] = None,
+                           rpm: Optional[int] = None, tpm: Optional[int] = None) -> EndpointScheduler:
+    """
+    获取API端点（URL + 密钥）共享的调度器
+
+    Args:
+        url: API URL
+        key: API密钥，不同密钥的配额相互独立
+        name: 日志和统计中使用的端点名称
+        rpm: 每分钟请求数上限，为空时使用全局配置
+        tpm: 每分钟token数上限，为空时使用全局配置
+    """
+    key_hash = hashlib.sha256((key or '').encode()).hexdigest()
+    cache_key = (url, key_hash)
+    scheduler = _schedulers.get(cache_key)
+    if scheduler is None:
+        scheduler = EndpointScheduler(
+            name or url,
+            rpm=AI_RATE_LIMIT_RPM if rpm is None else rpm,
+            tpm=AI_RATE_LIMIT_TPM if tpm is None else tpm
+        )
+        # 统计中用密钥哈希的前8位区分同一端点的不同密钥
+        scheduler.key_id = key_hash[:8]
+        _schedulers[cache_key] = scheduler
+        _evict_idle_schedulers()
+    else:
+        _schedulers.move_to_end(cache_key)
+    return scheduler
+
+
+def scheduler_stats() -> Dict[str, Any]:
+    """返回所有端点调度器的排队和限流统计，键为 端点名称#密钥哈希"""
+    return {f"{scheduler.name}#{scheduler.key_id}": scheduler.stats() for scheduler in list(_schedulers.values())}
+
+
+def estimate_request_tokens(prompt_tokens: int) -> int:
+    """估算一次请求消耗的token数：提示词加预期输出"""
+    return prompt_tokens + AI_EXPECTED_OUTPUT_TOKENS
@@ -0,0 +1,362 @@
+import argparse
+import asyncio
+import json
+import os
+import pickle
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import pandas as pd
+from utils.logger import get_logger
+from utils.sqlite_store import SQLiteStore, get_data_dir
+from utils.trading_calendar import get_trading_calendar, now_cn
+from utils.compute_executor import run_compute
+from services.stock_data_provider import StockDataProvider
+from services.technical_indicator import TechnicalIndicator
+from services.stock_scorer import StockScorer
+
+# 获取日志器
+logger = get_logger()
+
+# 各市场默认的预计算时间（北京时间，收盘后）
+DEFAULT_RUN_TIMES = {
+    'A': ['15:30'],
+    'ETF': ['15:30'],
+    'LOF': ['15:30'],
+    'HK': ['16:40'],
+    'US': ['06:00'],
+}
+
+# 每个市场保留最近多少个交易日的预计算结果
+PRECOMPUTE_KEEP_DAYS = int(os.getenv('PRECOMPUTE_KEEP_DAYS', 5))
+# 数据源尚未发布当日K线时的重试间隔（秒）和最多尝试次数，用尽后按已有结果完成（如停牌股票）
+PRECOMPUTE_STALE_RETRY_SECONDS = float(os.getenv('PRECOMPUTE_STALE_RETRY_SECONDS', 600))
+PRECOMPUTE_STALE_ATTEMPTS = int(os.getenv('PRECOMPUTE_STALE_ATTEMPTS', 6))
+
+
+class PrecomputeStore(SQLiteStore):
+    """
+    预计算结果存储
+    按(股票代码, 市场, 交易日)保存收盘后计算好的技术指标和评分
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS precomputed (
+        stock_code TEXT NOT NULL,
+        market_type TEXT NOT NULL,
+        trade_date TEXT NOT NULL,
+        summary TEXT NOT NULL,
+        indicators BLOB NOT NULL,
+        computed_at REAL NOT NULL,
+        PRIMARY KEY (stock_code, market_type, trade_date)
+    );
+    CREATE TABLE IF NOT EXISTS precompute_runs (
+        watchlist TEXT PRIMARY KEY,
+        market_type TEXT NOT NULL,
+        trade_date TEXT NOT NULL,
+        total INTEGER NOT NULL,
+        succeeded INTEGER NOT NULL,
+        duration REAL NOT NULL,
+        finished_at REAL NOT NULL
+    );
+    """
+
+    DB_NAME = "precompute.db"
+
+    def __init__(self, db_path: Optional[str] = None):
+        super().__init__(self.DB_NAME, db_path)
+
+    def save(self, stock_code: str, market_type: str, trade_date: str,
+             summary: Dict[str, Any], df: pd.DataFrame) -> None:
+        """保存单只股票的预计算结果"""
+        self.execute(
+            "INSERT OR REPLACE INTO precomputed (stock_code, market_type, trade_date, summary, indicators, computed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (stock_code, market_type, trade_date, json.dumps(summary),
+             pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL), time.time())
+        )
+
+    def get(self, stock_code: str, market_type: str, trade_date: str) -> Optional[pd.DataFrame]:
+        """获取预计算的技术指标DataFrame"""
+        row = self.query_one(
+            "SELECT indicators FROM precomputed WHERE stock_code = ? AND market_type = ? AND trade_date = ?",
+            (stock_code, market_type, trade_date)
+        )
+        return pickle.loads(row['indicators']) if row else None
+
+    def get_last_run(self, watchlist: str) -> Optional[Dict[str, Any]]:
+        """获取自选列表最近一次预计算记录"""
+        row = self.query_one("SELECT * FROM precompute_runs WHERE watchlist = ?", (watchlist,))
+        return dict(row) if row else None
+
+    def save_run(self, watchlist: str, market_type: str, trade_date: str,
+                 total: int, succeeded: int, duration: float) -> None:
+        """记录自选列表的预计算结果"""
+        self.execute(
+            "INSERT OR REPLACE INTO precompute_runs (watchlist, market_type, trade_date, total, succeeded, duration, finished_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (watchlist, market_type, trade_date, total, succeeded, duration, time.time())
+        )
+
+    def purge_before(self, trade_date: str, market_type: Optional[str] = None) -> int:
+        """删除指定交易日之前的预计算结果，指定市场时只删除该市场的结果"""
+        if market_type is None:
+            return self.execute("DELETE FROM precomputed WHERE trade_date < ?", (trade_date,))
+        return self.execute("DELETE FROM precomputed WHERE trade_date < ? AND market_type = ?",
+                            (trade_date, market_type))
+
+    def purge_old_sessions(self, market_type: str, keep: int) -> int:
+        """只保留某个市场最近keep个交易日的预计算结果，返回删除的条数"""
+        row = self.query_one(
+            "SELECT DISTINCT trade_date FROM precomputed WHERE market_type = ? "
+            "ORDER BY trade_date DESC LIMIT 1 OFFSET ?",
+            (market_type, max(keep, 1) - 1)
+        )
+        return self.purge_before(row['trade_date'], market_type) if row else 0
+
+
+_store: Optional[PrecomputeStore] = None
+
+
+def get_precompute_store() -> Optional[PrecomputeStore]:
+    """获取共享的预计算存储，未启用预计算且没有数据文件时返回None"""
+    global _store
+    if _store is None:
+        enabled = os.getenv('PRECOMPUTE_ENABLED', 'false').lower() == 'true'
+        if not enabled and not os.path.exists(os.path.join(get_data_dir(), PrecomputeStore.DB_NAME)):
+            return None
+        _store = PrecomputeStore()
+    return _store
+
+
+def _load_precomputed_sync(stock_codes: List[str], market_type: str) -> Dict[str, pd.DataFrame]:
+    store = get_precompute_store()
+    if store is None:
+        return {}
+    calendar = get_trading_calendar()
+    # 交易时段内需要实时数据，不使用预计算结果
+    if calendar.is_in_session(market_type):
+        return {}
+    trade_date = calendar.latest_closed_session(market_type).isoformat()
+    results = {}
+    for code in stock_codes:
+        df = store.get(code, market_type, trade_date)
+        if df is not None:
+            results[code] = df
+    return results
+
+
+async def load_precomputed(stock_codes: List[str], market_type: str = 'A') -> Dict[str, pd.DataFrame]:
+    """
+    获取最近一个已收盘交易日的预计算技术指标
+
+    Args:
+        stock_codes: 股票代码列表
+        market_type: 市场类型
+
+    Returns:
+        字典，键为股票代码，值为包含技术指标的DataFrame；没有预计算结果的代码不出现在结果中
+    """
+    try:
+        return await asyncio.to_thread(_load_precomputed_sync, stock_codes, market_type)
+    except Exception as e:
+        logger.warning(f"读取预计算结果失败: {str(e)}")
+        return {}
+
+
+class PrecomputeScheduler:
+    """
+    收盘后预计算调度器
+    在配置的时间对自选列表/股票池执行 数据获取 → 技术指标 → 评分，并写入预计算存储
+    按交易日历判断，节假日和已完成的交易日不会重复计算
+    """
+
+    # 调度检查间隔（秒）
+    TICK_SECONDS = 60
+
+    def __init__(self, store: Optional[PrecomputeStore] = None,
+                 watchlists_path: Optional[str] = None,
+                 max_concurrency: Optional[int] = None):
+        """
+        初始化预计算调度器
+
+        Args:
+            store: 预计算存储
+            watchlists_path: 自选列表配置文件路径，默认读取PRECOMPUTE_WATCHLISTS
+            max_concurrency: 数据获取并发数，默认读取PRECOMPUTE_CONCURRENCY
+        """
+        self.store = store or PrecomputeStore()
+        self.watchlists_path = watchlists_path or os.getenv('PRECOMPUTE_WATCHLISTS') or os.path.join(get_data_dir(), 'watchlists.json')
+        self.max_concurrency = max_concurrency or int(os.getenv('PRECOMPUTE_CONCURRENCY', 5))
+        self.keep_days = PRECOMPUTE_KEEP_DAYS
+        self.stale_retry_seconds = PRECOMPUTE_STALE_RETRY_SECONDS
+        self.stale_attempts = PRECOMPUTE_STALE_ATTEMPTS
+        # 自选列表 -> (交易日, 已尝试次数, 下次重试时间)，最新K线尚未发布时等待重试
+        self._pending: Dict[str, Tuple[str, int, float]] = {}
+        self.calendar = get_trading_calendar()
+        self.data_provider = StockDataProvider()
+        self.indicator = TechnicalIndicator()
+        self.scorer = StockScorer()
+        self._task: Optional[asyncio.Task] = None
+
+        logger.debug(f"初始化PrecomputeScheduler: watchlists={self.watchlists_path}")
+
+    def load_watchlists(self) -> Dict[str, Dict[str, Any]]:
+        """
+        读取自选列表配置
+
+        配置格式:
+            {
+                "自选": {"market_type": "A", "stock_codes": ["600519", "000858"]},
+                "沪深300": {"market_type": "A", "index": "000300"},
+                "美股": {"market_type": "US", "stock_codes": ["AAPL"], "times": ["06:30"]}
+            }
+        """
+        if not os.path.exists(self.watchlists_path):
+            return {}
+        with open(self.watchlists_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def start(self) -> None:
+        """在当前事件循环中启动调度"""
+        self._task = asyncio.create_task(self.run_forever())
+
+    async def stop(self) -> None:
+        """停止调度"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def run_forever(self) -> None:
+        """定时检查各自选列表是否到达预计算时间"""
+        logger.info("预计算调度器已启动")
+        while True:
+            try:
+                await self.run_due()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"预计算调度出错: {str(e)}")
+                logger.exception(e)
+            await asyncio.sleep(self.TICK_SECONDS)
+
+    async def run_due(self, force: bool = False) -> None:
+        """执行所有到期的自选列表"""
+        watchlists = await asyncio.to_thread(self.load_watchlists)
+        for name, config in watchlists.items():
+            if force or await asyncio.to_thread(self._is_due, name, config):
+                await self.run_watchlist(name, config)
+
+    def _is_due(self, name: str, config: Dict[str, Any]) -> bool:
+        market_type = config.get('market_type', 'A')
+        now = now_cn()
+        if self.calendar.is_in_session(market_type, now):
+            return False
+
+        run_times = config.get('times') or DEFAULT_RUN_TIMES.get(market_type, DEFAULT_RUN_TIMES['A'])
+        earliest = min(datetime.strptime(t, '%H:%M').time() for t in run_times)
+        if now.time() < earliest:
+            return False
+
+        # 最近收盘的交易日已计算过则跳过，节假日时该日期不变，因此不会重复运行
+        trade_date = self.calendar.latest_closed_session(market_type, now).isoformat()
+        pending = self._pending.get(name)
+        if pending is not None and pending[0] == trade_date and time.monotonic() < pending[2]:
+            return False
+        last_run = self.store.get_last_run(name)
+        return last_run is None or last_run['trade_date'] < trade_date
+
+    async def _resolve_codes(self, config: Dict[str, Any]) -> List[str]:
+        if config.get('stock_codes'):
+            return list(dict.fromkeys(config['stock_codes']))
+        if config.get('index'):
+            def get_index_codes():
+                import akshare as ak
+                df = ak.index_stock_cons_csindex(symbol=config['index'])
+                return df['成分券代码'].astype(str).tolist()
+            return await asyncio.to_thread(get_index_codes)
+        return []
+
+    async def run_watchlist(self, name: str, config: Dict[str, Any]) -> int:
+        """
+        预计算单个自选列表
+
+        Returns:
+            成功计算的股票数
+        """
+        start = time.monotonic()
+        market_type = config.get('market_type', 'A')
+        stock_codes = await self._resolve_codes(config)
+        trade_date = (await asyncio.to_thread(self.calendar.latest_closed_session, market_type)).isoformat()
+        logger.info(f"开始预计算 {name}: {len(stock_codes)} 只股票, 市场: {market_type}, 交易日: {trade_date}")
+
+        stock_data_dict = await self.data_provider.get_multiple_stocks_data(
+            stock_codes, market_type, max_concurrency=self.max_concurrency
+        )
+
+        succeeded = 0
+        stale = 0
+        for code, df in stock_data_dict.items():
+            if hasattr(df, 'error') or df.empty:
+                continue
+            try:
+                df_with_indicators = await run_compute(self.indicator.calculate_indicators, df)
+                score = self.scorer.calculate_score(df_with_indicators)
+                summary = {
+                    "stock_code": code,
+                    "score": score,
+                    "recommendation": self.scorer.get_recommendation(score),
+                    "price": float(df_with_indicators['Close'].iloc[-1]),
+                    "last_bar_date": str(df_with_indicators.index[-1])[:10]
+                }
+                # 数据源尚未发布该交易日的K线时不保存，否则整个交易日都会使用前一日的指标
+                if summary['last_bar_date'] < trade_date:
+                    stale += 1
+                    continue
+                await asyncio.to_thread(self.store.save, code, market_type, trade_date, summary, df_with_indicators)
+                succeeded += 1
+            except Exception as e:
+                logger.error(f"预计算 {code} 时出错: {str(e)}")
+
+        duration = time.monotonic() - start
+        attempts = self._pending[name][1] + 1 if name in self._pending and self._pending[name][0] == trade_date else 1
+        if stale and attempts < self.stale_attempts:
+            # 不记录本次运行，稍后重新计算该交易日
+            self._pending[name] = (trade_date, attempts, time.monotonic() + self.stale_retry_seconds)
+            logger.warning(f"预计算 {name}: {stale} 只股票缺少 {trade_date} 的K线，"
+                           f"{self.stale_retry_seconds:.0f}秒后重试（第{attempts}次）")
+        else:
+            self._pending.pop(name, None)
+            await asyncio.to_thread(self.store.save_run, name, market_type, trade_date, len(stock_codes), succeeded, duration)
+        logger.info(f"完成预计算 {name}: 成功 {succeeded}/{len(stock_codes)}, K线未更新 {stale}, 耗时 {duration:.1f}s")
+        if succeeded:
+            purged = await asyncio.to_thread(self.store.purge_old_sessions, market_type, self.keep_days)
+            if purged:
+                logger.info(f"已清理 {purged} 条 {self.keep_days} 个交易日之前的{market_type}预计算结果")
+        return succeeded
+
+    async def get_status(self) -> List[Dict[str, Any]]:
+        """获取各自选列表的预计算状态"""
+        watchlists = await asyncio.to_thread(self.load_watchlists)
+        status = []
+        for name, config in watchlists.items():
+            last_run = await asyncio.to_thread(self.store.get_last_run, name)
+            status.append({"watchlist": name, "market_type": config.get('market_type', 'A'), "last_run": last_run})
+        return status
+
+
+async def _main(run_once: bool) -> None:
+    scheduler = PrecomputeScheduler()
+    if run_once:
+        await scheduler.run_due(force=True)
+    else:
+        await scheduler.run_forever()
+
+
+if __name__ == '__main__':
+    # 独立进程运行：python -m services.precompute_scheduler [--once]
+    parser = argparse.ArgumentParser(description="收盘后预计算调度器")
+    parser.add_argument('--once', action='store_true', help="立即预计算所有自选列表后退出")
+    args = parser.parse_args()
+    asyncio.run(_main(args.once))
@@ -0,0 +1,296 @@
+import math
+import os
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from utils.logger import get_logger
+
+# 获取日志器
+logger = get_logger()
+
+# 提示词中展示的K线数量
+PROMPT_RECENT_BARS = int(os.getenv('PROMPT_RECENT_BARS', 14))
+# 提示词至少保留的K线数量，超出预算时从最早的K线开始裁剪
+PROMPT_MIN_BARS = 5
+# 默认的提示词token预算，可按市场类型覆盖，如 PROMPT_TOKEN_BUDGET_US=1000
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', 1200))
+
+# 近期交易数据表格的列：(DataFrame列名, 表头, 小数位数)，按重要性排序，超出预算时从末尾开始删除可选列
+TABLE_COLUMNS: List[Tuple[str, str, int]] = [
+    ('Open', '开', 2),
+    ('High', '高', 2),
+    ('Low', '低', 2),
+    ('Close', '收', 2),
+    ('Change_pct', '涨跌%', 2),
+    ('Volume', '量', 0),
+    ('MA5', 'MA5', 2),
+    ('MA20', 'MA20', 2),
+    ('RSI', 'RSI', 1),
+    ('MACD', 'MACD', 3),
+    ('Volume_Ratio', '量比', 2),
+]
+# 必须保留的列数（开高低收、涨跌幅和成交量）
+REQUIRED_COLUMNS = 6
+
+# 各市场的分析对象和分析要求
+MARKET_TEMPLATES: Dict[str, Tuple[str, str, str]] = {
+    'ETF': ('基金', """1. 净值走势分析（包含支撑位和压力位）
+2. 成交量分析及其对净值的影响
+3. 风险评估（包含波动率和折溢价分析）
+4. 短期和中期净值预测
+5. 关键价格位分析
+6. 申购赎回建议（包含止损位）""", "请基于技术指标和市场表现进行分析，给出具体数据支持。"),
+    'US': ('美股', """1. 趋势分析（包含支撑位和压力位，美元计价）
+2. 成交量分析及其含义
+3. 风险评估（包含波动率和美股市场特有风险）
+4. 短期和中期目标价位（美元）
+5. 关键技术位分析
+6. 具体交易建议（包含止损位）""", "请基于技术指标和美股市场特点进行分析，给出具体数据支持。"),
+    'HK': ('港股', """1. 趋势分析（包含支撑位和压力位，港币计价）
+2. 成交量分析及其含义
+3. 风险评估（包含波动率和港股市场特有风险）
+4. 短期和中期目标价位（港币）
+5. 关键技术位分析
+6. 具体交易建议（包含止损位）""", "请基于技术指标和港股市场特点进行分析，给出具体数据支持。"),
+    'A': ('A股', """1. 趋势分析（包含支撑位和压力位）
+2. 成交量分析及其含义
+3. 风险评估（包含波动率分析）
+4. 短期和中期目标价位
+5. 关键技术位分析
+6. 根据威科夫交易体系分析
+7. 具体交易建议（包含止损位）""", "请基于技术指标和A股市场特点进行分析，美观的输出，并给出具体数据支持。"),
+}
+MARKET_TEMPLATES['LOF'] = MARKET_TEMPLATES['ETF']
+
+# 批量分析分隔标记，如 ===STOCK:600519===
+SECTION_TAG = 'STOCK'
+_SECTION_PATTERN = re.compile(r'={2,}\s*' + SECTION_TAG + r'\s*[:：]\s*([^\s=]+)\s*={2,}', re.IGNORECASE)
+
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]')
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文本的token数量
+    中文字符和全角标点约每个字1个token，其余字符约每4个字符1个token
+    """
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def get_token_budget(market_type: str) -> int:
+    """获取市场类型对应的提示词token预算"""
+    return int(os.getenv(f'PROMPT_TOKEN_BUDGET_{market_type.upper()}', PROMPT_TOKEN_BUDGET))
+
+
+def _format_value(value: Any, decimals: int) -> str:
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return '-'
+    try:
+        return f"{float(value):.{decimals}f}"
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def _format_date(value: Any) -> str:
+    if isinstance(value, pd.Timestamp):
+        return value.strftime('%Y-%m-%d')
+    return str(value)[:10]
+
+
+def render_bars_table(df: pd.DataFrame, columns: List[Tuple[str, str, int]]) -> str:
+    """
+    将K线数据渲染为紧凑的竖线分隔表格，数值按列四舍五入
+
+    Args:
+        df: 包含技术指标的DataFrame，索引为日期
+        columns: 要展示的列
+
+    Returns:
+        表格文本
+    """
+    columns = [column for column in columns if column[0] in df.columns]
+    lines = ['|'.join(['日期'] + [header for _, header, _ in columns])]
+    values = [df[name].tolist() for name, _, _ in columns]
+    for row, index in enumerate(df.index):
+        lines.append('|'.join([_format_date(index)] + [
+            _format_value(values[col][row], decimals) for col, (_, _, decimals) in enumerate(columns)
+        ]))
+    return '\n'.join(lines)
+
+
+class PromptBuilder:
+    """
+    构建AI分析提示词
+    近期K线以紧凑表格呈现，只保留与分析相关的列，并将提示词控制在按市场配置的token预算内
+    """
+
+    def __init__(self, recent_bars: int = PROMPT_RECENT_BARS, token_budget: Optional[int] = None):
+        """
+        初始化提示词构建器
+
+        Args:
+            recent_bars: 提示词中展示的K线数量
+            token_budget: token预算，为空时按市场类型读取配置
+        """
+        self.recent_bars = recent_bars
+        self.token_budget = token_budget
+
+    @staticmethod
+    def _render_stock_data(technical_summary: Dict[str, Any], bars: pd.DataFrame,
+                           columns: List[Tuple[str, str, int]]) -> str:
+        summary = '，'.join(f"{key}={value}" for key, value in technical_summary.items())
+        return (
+            f"技术指标概要：{summary}\n"
+            f"近{len(bars)}日交易数据：\n"
+            f"{render_bars_table(bars, columns)}\n"
+        )
+
+    def _render(self, stock_code: str, market_type: str, technical_summary: Dict[str, Any],
+                bars: pd.DataFrame, columns: List[Tuple[str, str, int]]) -> str:
+        subject, requirements, closing = MARKET_TEMPLATES.get(market_type, MARKET_TEMPLATES['A'])
+        return (
+            f"分析{subject} {stock_code}：\n"
+            f"{self._render_stock_data(technical_summary, bars, columns)}"
+            f"请提供：\n{requirements}\n"
+            f"{closing}"
+        )
+
+    def _render_batch(self, stocks: List[Tuple[pd.DataFrame, str, Dict[str, Any]]], market_type: str,
+                      bar_count: int, columns: List[Tuple[str, str, int]]) -> str:
+        subject, requirements, closing = MARKET_TEMPLATES.get(market_type, MARKET_TEMPLATES['A'])
+        codes = '、'.join(code for _, code, _ in stocks)
+        sections = ''.join(
+            f"{section_marker(code)}\n{self._render_stock_data(summary, df.tail(bar_count), columns)}"
+            for df, code, summary in stocks
+        )
+        return (
+            f"分别分析以下{len(stocks)}只{subject}：{codes}\n"
+            f"按给出的顺序逐只输出，每只股票的分析必须以单独一行的分隔标记开头，"
+            f"格式为 {section_marker('代码')}，分隔标记前后不要添加其他内容。\n"
+            f"每只股票请提供：\n{requirements}\n"
+            f"{closing}\n\n"
+            f"{sections}"
+        )
+
+    def _fit(self, render: Callable[[int, int], str], max_bars: int, budget: int, label: str) -> Tuple[str, int]:
+        """在token预算内渲染提示词：先裁剪较早的K线，再删除可选的指标列"""
+        bar_count = max_bars
+        column_count = len(TABLE_COLUMNS)
+        while True:
+            prompt = render(bar_count, column_count)
+            tokens = estimate_tokens(prompt)
+            if tokens <= budget:
+                return prompt, tokens
+            if bar_count > PROMPT_MIN_BARS:
+                bar_count -= 1
+            elif column_count > REQUIRED_COLUMNS:
+                column_count -= 1
+            else:
+                logger.warning(f"{label} 提示词约 {tokens} tokens，超出预算 {budget}")
+                return prompt, tokens
+
+    def build(self, df: pd.DataFrame, stock_code: str, market_type: str,
+              technical_summary: Dict[str, Any]) -> Tuple[str, int]:
+        """
+        构建提示词
+
+        Args:
+            df: 包含技术指标的DataFrame
+            stock_code: 股票代码
+            market_type: 市场类型
+            technical_summary: 技术指标概要
+
+        Returns:
+            (提示词, 估算的token数)
+        """
+        budget = self.token_budget or get_token_budget(market_type)
+        return self._fit(
+            lambda bars, columns: self._render(stock_code, market_type, technical_summary,
+                                               df.tail(bars), TABLE_COLUMNS[:columns]),
+            min(self.recent_bars, len(df)), budget, stock_code
+        )
+
+    def build_batch(self, stocks: List[Tuple[pd.DataFrame, str, Dict[str, Any]]],
+                    market_type: str) -> Tuple[str, int]:
+        """
+        构建多只股票的批量分析提示词，分析要求只出现一次，各股票的数据以分隔标记分段
+
+        Args:
+            stocks: (包含技术指标的DataFrame, 股票代码, 技术指标概要) 列表
+            market_type: 市场类型
+
+        Returns:
+            (提示词, 估算的token数)
+        """
+        budget = (self.token_budget or get_token_budget(market_type)) * len(stocks)
+        return self._fit(
+            lambda bars, columns: self._render_batch(stocks, market_type, bars, TABLE_COLUMNS[:columns]),
+            min(self.recent_bars, max(len(df) for df, _, _ in stocks)), budget,
+            f"批量分析({len(stocks)}只)"
+        )
+
+
+def section_marker(stock_code: str) -> str:
+    """批量分析中每只股票分析结果开头的分隔标记"""
+    return f"==={SECTION_TAG}:{stock_code}==="
+
+
+class SectionDemuxer:
+    """
+    将批量分析的流式输出按分隔标记拆分到各股票
+    分隔标记可能被切分在多个片段中，疑似标记的不完整行会暂存到换行后再判断
+    """
+
+    def __init__(self, stock_codes: List[str]):
+        self._codes = {code.upper(): code for code in stock_codes}
+        self.current: Optional[str] = None
+        self._partial = ""
+
+    def _match(self, line: str) -> Optional[str]:
+        match = _SECTION_PATTERN.fullmatch(line.strip().strip('#*` '))
+        if match is None:
+            return None
+        return self._codes.get(match.group(1).upper())
+
+    def _emit(self, pieces: List[Tuple[str, str]], text: str) -> None:
+        if not text or self.current is None:
+            return
+        if pieces and pieces[-1][0] == self.current:
+            pieces[-1] = (self.current, pieces[-1][1] + text)
+        else:
+            pieces.append((self.current, text))
+
+    def feed(self, text: str) -> List[Tuple[str, str]]:
+        """
+        输入一段输出文本
+
+        Returns:
+            (股票代码, 文本) 列表，第一个分隔标记之前的内容会被丢弃
+        """
+        pieces: List[Tuple[str, str]] = []
+        self._partial += text
+        lines = self._partial.split('\n')
+        self._partial = lines.pop()
+        for line in lines:
+            code = self._match(line)
+            if code is not None:
+                self.current = code
+            else:
+                self._emit(pieces, line + '\n')
+        # 不可能是分隔标记的不完整行立即输出，减少延迟
+        head = self._partial.lstrip('#*` ')
+        if self._partial and head and not head.startswith('='):
+            self._emit(pieces, self._partial)
+            self._partial = ""
+        return pieces
+
+    def flush(self) -> List[Tuple[str, str]]:
+        """输出结束时处理剩余的内容"""
+        pieces: List[Tuple[str, str]] = []
+        if self._partial and self._match(self._partial) is None:
+            self._emit(pieces, self._partial)
+        self._partial = ""
+        return pieces
@@ -0,0 +1,560 @@
+import asyncio
+import json
+import os
+import socket
+import time
+import uuid
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
+import pandas as pd
+from utils.logger import get_logger
+from utils.frame_encoder import decode_frame
+from utils.sqlite_store import SQLiteStore
+from services.ai_prefetcher import get_ai_prefetcher
+from services.stock_analyzer_service import StockAnalyzerService, DEFAULT_AI_TOP_N, DEFAULT_AI_BATCH_SIZE
+
+# 获取日志器
+logger = get_logger()
+
+# 任务状态
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINISHED_STATUSES = (JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED)
+
+# 任务租约有效期（秒）：多个工作进程共用任务存储，持有租约的进程负责运行任务，
+# 进程退出后租约过期，其他进程接手续跑
+JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', 60))
+
+
+class ScanJobStore(SQLiteStore):
+    """
+    扫描任务存储
+    将任务参数和逐只股票的结果检查点持久化到SQLite，用于进度查询和重启后续跑
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS scan_jobs (
+        job_id TEXT PRIMARY KEY,
+        stock_codes TEXT NOT NULL,
+        market_type TEXT NOT NULL,
+        min_score INTEGER NOT NULL DEFAULT 0,
+        api_url TEXT,
+        api_model TEXT,
+        api_timeout TEXT,
+        status TEXT NOT NULL,
+        error TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        lease_owner TEXT,
+        lease_expires REAL
+    );
+    CREATE TABLE IF NOT EXISTS scan_job_results (
+        job_id TEXT NOT NULL,
+        stock_code TEXT NOT NULL,
+        status TEXT NOT NULL,
+        result TEXT NOT NULL,
+        ai_analysis TEXT,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (job_id, stock_code)
+    );
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        super().__init__("scan_jobs.db", db_path)
+        # 旧版本创建的数据库没有租约字段
+        columns = {row['name'] for row in self.query("PRAGMA table_info(scan_jobs)")}
+        for column, column_type in (('lease_owner', 'TEXT'), ('lease_expires', 'REAL')):
+            if column not in columns:
+                self.execute(f"ALTER TABLE scan_jobs ADD COLUMN {column} {column_type}")
+
+    def create_job(self, job_id: str, stock_codes: List[str], market_type: str, min_score: int,
+                   api_url: Optional[str], api_model: Optional[str], api_timeout: Optional[str]) -> None:
+        """创建任务记录"""
+        now = time.time()
+        self.execute(
+            "INSERT INTO scan_jobs (job_id, stock_codes, market_type, min_score, api_url, api_model, api_timeout, "
+            "status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, json.dumps(stock_codes), market_type, min_score, api_url, api_model, api_timeout,
+             JOB_PENDING, now, now)
+        )
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """获取任务记录"""
+        row = self.query_one("SELECT * FROM scan_jobs WHERE job_id = ?", (job_id,))
+        if row is None:
+            return None
+        job = dict(row)
+        job['stock_codes'] = json.loads(job['stock_codes'])
+        return job
+
+    def list_unfinished_jobs(self) -> List[str]:
+        """获取所有未完成的任务ID，按创建时间排序"""
+        rows = self.query(
+            "SELECT job_id FROM scan_jobs WHERE status IN (?, ?) ORDER BY created_at",
+            (JOB_PENDING, JOB_RUNNING)
+        )
+        return [row['job_id'] for row in rows]
+
+    def claim_job(self, job_id: str, owner: str, seconds: float) -> bool:
+        """为未完成的任务获取租约，租约空闲、已过期或本就属于owner时成功"""
+        now = time.time()
+        return self.execute(
+            "UPDATE scan_jobs SET lease_owner = ?, lease_expires = ? WHERE job_id = ? AND status IN (?, ?) "
+            "AND (lease_owner IS NULL OR lease_owner = ? OR lease_expires < ?)",
+            (owner, now + seconds, job_id, JOB_PENDING, JOB_RUNNING, owner, now)
+        ) == 1
+
+    def renew_leases(self, owner: str, job_ids: List[str], seconds: float) -> Dict[str, str]:
+        """
+        续租owner持有的任务
+
+        Returns:
+            仍由owner持有的各任务当前的状态，键为任务ID；租约已被其他进程接手的任务不在其中
+        """
+        if not job_ids:
+            return {}
+        placeholders = ', '.join('?' * len(job_ids))
+        renewed = self.execute(
+            f"UPDATE scan_jobs SET lease_expires = ? WHERE lease_owner = ? AND job_id IN ({placeholders})",
+            (time.time() + seconds, owner, *job_ids)
+        )
+        rows = self.query(f"SELECT job_id, status, lease_owner FROM scan_jobs WHERE job_id IN ({placeholders})",
+                          job_ids)
+        if renewed < len(job_ids):
+            rows = [row for row in rows if row['lease_owner'] == owner]
+        return {row['job_id']: row['status'] for row in rows}
+
+    def release_leases(self, owner: str) -> None:
+        """释放owner持有的全部租约，未完成的任务可立即被其他进程接手"""
+        self.execute("UPDATE scan_jobs SET lease_owner = NULL, lease_expires = NULL WHERE lease_owner = ?", (owner,))
+
+    def list_claimable_jobs(self) -> List[str]:
+        """获取没有有效租约的未完成任务ID，按创建时间排序"""
+        rows = self.query(
+            "SELECT job_id FROM scan_jobs WHERE status IN (?, ?) AND (lease_owner IS NULL OR lease_expires < ?) "
+            "ORDER BY created_at",
+            (JOB_PENDING, JOB_RUNNING, time.time())
+        )
+        return [row['job_id'] for row in rows]
+
+    def update_status(self, job_id: str, status: str, error: Optional[str] = None) -> None:
+        """更新任务状态"""
+        self.execute(
+            "UPDATE scan_jobs SET status = ?, error = ?, updated_at = ? WHERE job_id = ?",
+            (status, error, time.time(), job_id)
+        )
+
+    def save_result(self, job_id: str, stock_code: str, result: Dict[str, Any]) -> None:
+        """保存单只股票的评分结果检查点"""
+        self.execute(
+            "INSERT OR REPLACE INTO scan_job_results (job_id, stock_code, status, result, ai_analysis, updated_at) "
+            "VALUES (?, ?, ?, ?, NULL, ?)",
+            (job_id, stock_code, result.get('status', ''), json.dumps(result), time.time())
+        )
+
+    def save_ai_analysis(self, job_id: str, stock_code: str, ai_analysis: str) -> None:
+        """保存单只股票的AI分析结果检查点"""
+        self.execute(
+            "UPDATE scan_job_results SET ai_analysis = ?, updated_at = ? WHERE job_id = ? AND stock_code = ?",
+            (ai_analysis, time.time(), job_id, stock_code)
+        )
+
+    def get_results(self, job_id: str) -> Dict[str, Dict[str, Any]]:
+        """获取任务已完成的结果，键为股票代码"""
+        rows = self.query(
+            "SELECT stock_code, result, ai_analysis FROM scan_job_results WHERE job_id = ?", (job_id,)
+        )
+        results = {}
+        for row in rows:
+            result = json.loads(row['result'])
+            if row['ai_analysis'] is not None:
+                result['ai_analysis'] = row['ai_analysis']
+            results[row['stock_code']] = result
+        return results
+
+
+class _JobChannel:
+    """单个任务的进度事件通道，支持多个订阅者随时接入并从头回放"""
+
+    def __init__(self):
+        self.events: List[Dict[str, Any]] = []
+        self.finished = False
+        self.condition = asyncio.Condition()
+
+    async def publish(self, frame: Dict[str, Any], finished: bool = False) -> None:
+        async with self.condition:
+            self.events.append(frame)
+            self.finished = self.finished or finished
+            self.condition.notify_all()
+
+
+class ScanJobService:
+    """
+    后台扫描任务服务
+    以有界工作池执行批量扫描任务，逐只股票写入检查点，支持进度订阅、断线重连和重启续跑；
+    多个工作进程共用任务存储时，以租约保证每个任务只由一个进程运行
+    """
+
+    def __init__(self, store: Optional[ScanJobStore] = None,
+                 max_workers: Optional[int] = None,
+                 symbol_concurrency: Optional[int] = None,
+                 lease_seconds: float = JOB_LEASE_SECONDS):
+        """
+        初始化后台扫描任务服务
+
+        Args:
+            store: 任务存储，默认使用数据目录下的SQLite
+            max_workers: 同时运行的任务数，默认读取SCAN_JOB_WORKERS
+            symbol_concurrency: 单个任务内并发处理的股票数，默认读取SCAN_JOB_SYMBOL_CONCURRENCY
+            lease_seconds: 任务租约有效期（秒），每三分之一有效期续租一次
+        """
+        self.store = store or ScanJobStore()
+        self.max_workers = max_workers or int(os.getenv('SCAN_JOB_WORKERS', 2))
+        self.symbol_concurrency = symbol_concurrency or int(os.getenv('SCAN_JOB_SYMBOL_CONCURRENCY', 5))
+        self.ai_top_n = DEFAULT_AI_TOP_N
+        self.ai_batch_size = DEFAULT_AI_BATCH_SIZE
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._lease_task: Optional[asyncio.Task] = None
+        self._channels: Dict[str, _JobChannel] = {}
+        # API密钥只保存在内存中，不写入磁盘；重启或被其他进程接手后，使用自定义API的任务因缺少密钥而失败
+        self._api_keys: Dict[str, Optional[str]] = {}
+        self._cancelled: set = set()
+        # 本进程正在运行的任务，租约被其他进程接手时取消
+        self._running: Dict[str, asyncio.Task] = {}
+        self._lost: set = set()
+
+        logger.debug(f"初始化ScanJobService: max_workers={self.max_workers}, symbol_concurrency={self.symbol_concurrency}")
+
+    async def start(self) -> None:
+        """启动工作池，并将上次未完成且无人持有的任务重新入队"""
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.max_workers)]
+
+        recovered = await self._recover_jobs()
+        if recovered:
+            logger.info(f"恢复 {recovered} 个未完成的扫描任务")
+        self._lease_task = asyncio.create_task(self._lease_loop())
+
+    async def stop(self) -> None:
+        """停止工作池并释放租约，运行中的任务保持running状态，由其他进程或下次启动时续跑"""
+        tasks = self._workers + ([self._lease_task] if self._lease_task else [])
+        self._lost.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._lease_task = None
+        await asyncio.to_thread(self.store.release_leases, self.owner)
+
+    async def _recover_jobs(self) -> int:
+        """接手没有有效租约的未完成任务，返回接手的任务数"""
+        recovered = 0
+        for job_id in await asyncio.to_thread(self.store.list_claimable_jobs):
+            if job_id in self._channels:
+                continue
+            if await asyncio.to_thread(self.store.claim_job, job_id, self.owner, self.lease_seconds):
+                self._enqueue(job_id)
+                recovered += 1
+        return recovered
+
+    async def _lease_loop(self) -> None:
+        """定期续租本进程的任务，同步其他进程发起的取消，停止租约已丢失的任务，并接手租约过期的任务"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                job_ids = list(self._channels)
+                statuses = await asyncio.to_thread(
+                    self.store.renew_leases, self.owner, job_ids, self.lease_seconds
+                )
+                for job_id, status in statuses.items():
+                    if status == JOB_CANCELLED:
+                        self._cancelled.add(job_id)
+                for job_id in job_ids:
+                    task = self._running.get(job_id)
+                    if job_id not in statuses and task is not None:
+                        # 续租间隔超过租约有效期（如事件循环阻塞）时任务可能已被其他进程接手，停止本进程的运行避免重复执行
+                        logger.warning(f"扫描任务 {job_id} 的租约已被其他进程接手，停止本进程的运行")
+                        self._lost.add(job_id)
+                        task.cancel()
+                recovered = await self._recover_jobs()
+                if recovered:
+                    logger.info(f"接手 {recovered} 个租约过期的扫描任务")
+            except Exception as e:
+                logger.warning(f"扫描任务续租失败: {str(e)}")
+
+    async def submit(self, stock_codes: List[str], market_type: str = 'A', min_score: int = 0,
+                     api_url: Optional[str] = None, api_key: Optional[str] = None,
+                     api_model: Optional[str] = None, api_timeout: Optional[str] = None) -> str:
+        """
+        提交扫描任务
+
+        Returns:
+            任务ID
+        """
+        job_id = uuid.uuid4().hex
+        await asyncio.to_thread(
+            self.store.create_job, job_id, stock_codes, market_type, min_score, api_url, api_model, api_timeout
+        )
+        self._api_keys[job_id] = api_key
+        await asyncio.to_thread(self.store.claim_job, job_id, self.owner, self.lease_seconds)
+        self._enqueue(job_id)
+        logger.info(f"提交扫描任务 {job_id}: {len(stock_codes)} 只股票, 市场: {market_type}")
+        return job_id
+
+    async def cancel(self, job_id: str) -> bool:
+        """取消任务，返回任务是否存在"""
+        job = await asyncio.to_thread(self.store.get_job, job_id)
+        if job is None:
+            return False
+        if job['status'] not in FINISHED_STATUSES:
+            self._cancelled.add(job_id)
+            if job['status'] == JOB_PENDING or job_id not in self._channels:
+                # 排队中或由其他进程运行的任务直接标记取消，运行它的进程续租时停止
+                await asyncio.to_thread(self.store.update_status, job_id, JOB_CANCELLED)
+                await self._finish_channel(job_id, JOB_CANCELLED)
+                self._forget(job_id)
+        return True
+
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """获取任务状态、进度和已完成的结果"""
+        job = await asyncio.to_thread(self.store.get_job, job_id)
+        if job is None:
+            return None
+        results = await asyncio.to_thread(self.store.get_results, job_id)
+        return {
+            "job_id": job_id,
+            "status": job['status'],
+            "error": job['error'],
+            "market_type": job['market_type'],
+            "stock_codes": job['stock_codes'],
+            "min_score": job['min_score'],
+            "progress": self._progress(job['stock_codes'], results),
+            "results": [results[code] for code in job['stock_codes'] if code in results],
+            "created_at": job['created_at'],
+            "updated_at": job['updated_at']
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """返回本进程的任务排队和运行统计"""
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "active": len(self._channels),
+            "max_workers": self.max_workers
+        }
+
+    async def subscribe(self, job_id: str) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        订阅任务进度
+
+        运行中的任务从头回放全部事件后继续跟随；已结束或不在本进程运行的任务返回持久化的结果快照
+        """
+        channel = self._channels.get(job_id)
+        if channel is None:
+            job = await self.get_job(job_id)
+            if job is None:
+                return
+            yield {"stream_type": "batch", "stock_codes": job['stock_codes'], "job_id": job_id}
+            for result in job['results']:
+                yield {**result, "job_id": job_id}
+            yield {"job_id": job_id, "job_status": job['status'], "progress": job['progress']}
+            return
+
+        index = 0
+        while True:
+            async with channel.condition:
+                while index >= len(channel.events) and not channel.finished:
+                    await channel.condition.wait()
+                events = channel.events[index:]
+                finished = channel.finished
+            index += len(events)
+            for event in events:
+                yield event
+            if finished and index >= len(channel.events):
+                return
+
+    def _enqueue(self, job_id: str) -> None:
+        self._channels.setdefault(job_id, _JobChannel())
+        self._queue.put_nowait(job_id)
+
+    async def _finish_channel(self, job_id: str, status: str, **extra) -> None:
+        channel = self._channels.pop(job_id, None)
+        if channel is not None:
+            await channel.publish({"job_id": job_id, "job_status": status, **extra}, finished=True)
+
+    @staticmethod
+    def _progress(stock_codes: List[str], results: Dict[str, Dict[str, Any]]) -> Dict[str, int]:
+        failed = sum(1 for r in results.values() if r.get('status') == 'error')
+        return {"total": len(stock_codes), "completed": len(results) - failed, "failed": failed}
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            job_id = await self._queue.get()
+            task = asyncio.create_task(self._run_job(job_id))
+            self._running[job_id] = task
+            try:
+                await task
+            except asyncio.CancelledError:
+                if job_id not in self._lost:
+                    raise
+                # 任务由接手租约的进程继续运行，本进程的订阅者收到当前状态后可重新获取任务快照
+                self._lost.discard(job_id)
+                await self._finish_channel(job_id, JOB_RUNNING)
+                self._forget(job_id)
+            except Exception as e:
+                logger.error(f"扫描任务 {job_id} 执行失败: {str(e)}")
+                logger.exception(e)
+                await asyncio.to_thread(self.store.update_status, job_id, JOB_FAILED, str(e))
+                await self._finish_channel(job_id, JOB_FAILED, error=str(e))
+                self._forget(job_id)
+            finally:
+                self._running.pop(job_id, None)
+                self._queue.task_done()
+
+    async def _run_job(self, job_id: str) -> None:
+        job = await asyncio.to_thread(self.store.get_job, job_id)
+        if job is None or job['status'] in FINISHED_STATUSES:
+            self._forget(job_id)
+            return
+        if not await asyncio.to_thread(self.store.claim_job, job_id, self.owner, self.lease_seconds):
+            # 任务已被其他进程接手
+            self._channels.pop(job_id, None)
+            self._forget(job_id)
+            return
+        if job['api_url'] and job_id not in self._api_keys:
+            # 自定义API的密钥只保存在提交任务的进程内存中，重启或由其他进程接手后已丢失；
+            # 不能改用服务器的密钥访问用户指定的地址
+            error = "自定义API的密钥未保存，任务无法续跑，请填写API密钥后重新提交"
+            logger.warning(f"扫描任务 {job_id} 使用自定义API且密钥已丢失，标记为失败")
+            await asyncio.to_thread(self.store.update_status, job_id, JOB_FAILED, error)
+            await self._finish_channel(job_id, JOB_FAILED, error=error)
+            self._forget(job_id)
+            return
+
+        channel = self._channels.setdefault(job_id, _JobChannel())
+        await asyncio.to_thread(self.store.update_status, job_id, JOB_RUNNING)
+
+        stock_codes = job['stock_codes']
+        market_type = job['market_type']
+        min_score = job['min_score']
+        analyzer = StockAnalyzerService(
+            custom_api_url=job['api_url'],
+            custom_api_key=self._api_keys.get(job_id),
+            custom_api_model=job['api_model'],
+            custom_api_timeout=job['api_timeout'],
+            user_id=f"scan-job:{job_id}"
+        )
+
+        # 回放已有检查点，订阅者无需区分续跑和新任务
+        results = await asyncio.to_thread(self.store.get_results, job_id)
+        await channel.publish({"stream_type": "batch", "stock_codes": stock_codes, "job_id": job_id})
+        for code in stock_codes:
+            if code in results:
+                await channel.publish({**results[code], "job_id": job_id})
+
+        pending = [code for code in stock_codes if code not in results]
+        if len(pending) < len(stock_codes):
+            logger.info(f"扫描任务 {job_id} 续跑: 跳过已完成的 {len(stock_codes) - len(pending)} 只股票")
+
+        semaphore = asyncio.Semaphore(self.symbol_concurrency)
+        stock_dfs = {}
+
+        async def process(code: str) -> None:
+            async with semaphore:
+                if job_id in self._cancelled:
+                    return
+                result, df = await analyzer.evaluate_stock(code, market_type, min_score)
+                await asyncio.to_thread(self.store.save_result, job_id, code, result)
+                results[code] = result
+                if df is not None:
+                    stock_dfs[code] = df
+                await channel.publish({**result, "job_id": job_id})
+                await channel.publish({
+                    "job_id": job_id,
+                    "job_status": JOB_RUNNING,
+                    "progress": self._progress(stock_codes, results)
+                })
+
+        await asyncio.gather(*(process(code) for code in pending))
+
+        if job_id in self._cancelled:
+            await self._cancel_job(job_id)
+            return
+
+        # 对评分最高的股票并行进行AI分析（并发数受API端点限制），已有AI结果的直接回放
+        matched = [r for r in results.values() if r.get('status') != 'error' and r.get('score', 0) >= min_score]
+        matched.sort(key=lambda r: r['score'], reverse=True)
+        prefetcher = get_ai_prefetcher()
+        if prefetcher is not None:
+            await prefetcher.record_scan_results(matched, market_type)
+
+        async def load(result: Dict[str, Any]) -> Optional[Tuple[str, pd.DataFrame]]:
+            code = result['stock_code']
+            if result.get('ai_analysis') is not None:
+                await channel.publish({"stock_code": code, "ai_analysis_chunk": result['ai_analysis'], "job_id": job_id})
+                await channel.publish({"stock_code": code, "status": "completed", "job_id": job_id})
+                return None
+
+            df = stock_dfs.get(code)
+            if df is None:
+                _, df = await analyzer.evaluate_stock(code, market_type, min_score)
+            return (code, df) if df is not None else None
+
+        async def analyze(stocks: List[Tuple[str, pd.DataFrame]]) -> None:
+            codes = [code for code, _ in stocks]
+            for code in codes:
+                await channel.publish({"stock_code": code, "status": "analyzing", "job_id": job_id})
+            parts: Dict[str, List[str]] = {code: [] for code in codes}
+            failed = set()
+            async for chunk in analyzer.ai_analyzer.get_batch_ai_analysis(stocks, market_type, stream=True):
+                if job_id in self._cancelled:
+                    return
+                frame = decode_frame(chunk)
+                code = frame.get('stock_code')
+                if 'ai_analysis_chunk' in frame:
+                    parts[code].append(frame['ai_analysis_chunk'])
+                if frame.get('status') == 'error':
+                    failed.add(code)
+                elif frame.get('status') == 'completed':
+                    failed.discard(code)
+                await channel.publish({**frame, "job_id": job_id})
+
+            for code in codes:
+                if code not in failed and parts[code]:
+                    await asyncio.to_thread(self.store.save_ai_analysis, job_id, code, ''.join(parts[code]))
+
+        # 需要分析的股票按批合并到一次AI请求中，各批之间并行
+        to_analyze = [item for item in await asyncio.gather(*(load(r) for r in matched[:self.ai_top_n])) if item]
+        batch_size = max(1, self.ai_batch_size)
+        await asyncio.gather(*(analyze(to_analyze[i:i + batch_size]) for i in range(0, len(to_analyze), batch_size)))
+
+        if job_id in self._cancelled:
+            await self._cancel_job(job_id)
+            return
+
+        await asyncio.to_thread(self.store.update_status, job_id, JOB_COMPLETED)
+        await channel.publish({
+            "scan_completed": True,
+            "total_scanned": len(results),
+            "total_matched": len(matched),
+            "job_id": job_id
+        })
+        await self._finish_channel(job_id, JOB_COMPLETED, progress=self._progress(stock_codes, results))
+        self._forget(job_id)
+        logger.info(f"扫描任务 {job_id} 完成, 共 {len(results)} 只, 符合条件: {len(matched)}")
+
+    async def _cancel_job(self, job_id: str) -> None:
+        await asyncio.to_thread(self.store.update_status, job_id, JOB_CANCELLED)
+        await self._finish_channel(job_id, JOB_CANCELLED)
+        self._forget(job_id)
+        logger.info(f"扫描任务 {job_id} 已取消")
+
+    def _forget(self, job_id: str) -> None:
+        """任务结束或交由其他进程后，清除本进程保存的取消标记和API密钥"""
+        self._cancelled.discard(job_id)
+        self._api_keys.pop(job_id, None)
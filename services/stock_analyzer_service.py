@@ -1,22 +1,36 @@
-import json
+import asyncio
+import os
 from datetime import datetime
-from typing import List, AsyncGenerator
+import pandas as pd
+from typing import List, AsyncGenerator, Optional, Tuple
 from utils.logger import get_logger
 from services.stock_data_provider import StockDataProvider
 from services.technical_indicator import TechnicalIndicator
 from services.stock_scorer import StockScorer
 from services.ai_analyzer import AIAnalyzer
+from services.llm_scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE
+from services.precompute_scheduler import load_precomputed
+from services.analysis_cache import AnalysisResultCache, AnalysisRecorder, get_analysis_cache, get_closed_session, replay_frames
+from utils.compute_executor import run_compute, chunked
+from utils.stream_utils import merge_streams
+from utils.frame_encoder import encode_frame
 
 # 获取日志器
 logger = get_logger()
 
+# 批量扫描时默认进行AI分析的股票数
+DEFAULT_AI_TOP_N = int(os.getenv('SCAN_AI_TOP_N', 5))
+# 扫描时每次AI请求合并分析的股票数，为1时逐只分析
+DEFAULT_AI_BATCH_SIZE = int(os.getenv('SCAN_AI_BATCH_SIZE', 5))
+
 class StockAnalyzerService:
     """
     股票分析服务
     作为门面类协调数据提供、指标计算、评分和AI分析等组件
     """
     
-    def __init__(self, custom_api_url=None, custom_api_key=None, custom_api_model=None, custom_api_timeout=None):
+    def __init__(self, custom_api_url=None, custom_api_key=None, custom_api_model=None, custom_api_timeout=None,
+                 user_id=None):
         """
         初始化股票分析服务
         
@@ -25,6 +39,7 @@ class StockAnalyzerService:
             custom_api_key: 自定义API密钥
             custom_api_model: 自定义API模型
             custom_api_timeout: 自定义API超时时间
+            user_id: 发起分析的用户，用于AI请求的公平排队
         """
         # 初始化各个组件
         self.data_provider = StockDataProvider()
@@ -34,12 +49,14 @@ class StockAnalyzerService:
             custom_api_url=custom_api_url,
             custom_api_key=custom_api_key,
             custom_api_model=custom_api_model,
-            custom_api_timeout=custom_api_timeout
+            custom_api_timeout=custom_api_timeout,
+            user_id=user_id
         )
         
         logger.info("初始化StockAnalyzerService完成")
     
-    async def analyze_stock(self, stock_code: str, market_type: str = 'A', stream: bool = False) -> AsyncGenerator[str, None]:
+    async def analyze_stock(self, stock_code: str, market_type: str = 'A', stream: bool = False,
+                            priority: int = PRIORITY_INTERACTIVE) -> AsyncGenerator[bytes, None]:
         """
         分析单只股票
         
@@ -47,6 +64,7 @@ class StockAnalyzerService:
             stock_code: 股票代码
             market_type: 市场类型，默认为'A'股
             stream: 是否使用流式响应
+            priority: AI请求的排队优先级，默认为交互式
             
         Returns:
             异步生成器，生成分析结果的JSON字符串
@@ -54,35 +72,52 @@ class StockAnalyzerService:
         try:
             logger.info(f"开始分析股票: {stock_code}, 市场: {market_type}")
             
-            # 获取股票数据
-            df = await self.data_provider.get_stock_data(stock_code, market_type)
+            # 收盘后优先回放当日已缓存的完整分析结果
+            cache = get_analysis_cache()
+            closed_session = await get_closed_session(market_type) if cache is not None else None
+            if closed_session is not None:
+                cached = await self._get_cached_analysis(cache, stock_code, market_type, closed_session.isoformat())
+                if cached is not None:
+                    logger.info(f"回放缓存的分析结果: {stock_code}, 交易日: {closed_session}")
+                    for frame in replay_frames(cached, stream):
+                        yield encode_frame(frame)
+                    return
             
-            # 检查是否有错误
-            if hasattr(df, 'error'):
-                error_msg = df.error
-                logger.error(f"获取股票数据时出错: {error_msg}")
-                yield json.dumps({
-                    "stock_code": stock_code,
-                    "market_type": market_type,
-                    "error": error_msg,
-                    "status": "error"
-                })
-                return
-            
-            # 检查数据是否为空
-            if df.empty:
-                error_msg = f"获取到的股票 {stock_code} 数据为空"
-                logger.error(error_msg)
-                yield json.dumps({
-                    "stock_code": stock_code,
-                    "market_type": market_type,
-                    "error": error_msg,
-                    "status": "error"
-                })
-                return
-            
-            # 计算技术指标
-            df_with_indicators = self.indicator.calculate_indicators(df)
+            # 优先使用收盘后预计算的技术指标
+            precomputed = await load_precomputed([stock_code], market_type)
+            df_with_indicators = precomputed.get(stock_code)
+            if df_with_indicators is not None:
+                logger.info(f"使用预计算数据: {stock_code}")
+            else:
+                # 获取股票数据
+                df = await self.data_provider.get_stock_data(stock_code, market_type)
+                
+                # 检查是否有错误
+                if hasattr(df, 'error'):
+                    error_msg = df.error
+                    logger.error(f"获取股票数据时出错: {error_msg}")
+                    yield encode_frame({
+                        "stock_code": stock_code,
+                        "market_type": market_type,
+                        "error": error_msg,
+                        "status": "error"
+                    })
+                    return
+                
+                # 检查数据是否为空
+                if df.empty:
+                    error_msg = f"获取到的股票 {stock_code} 数据为空"
+                    logger.error(error_msg)
+                    yield encode_frame({
+                        "stock_code": stock_code,
+                        "market_type": market_type,
+                        "error": error_msg,
+                        "status": "error"
+                    })
+                    return
+                
+                # 计算技术指标
+                df_with_indicators = await run_compute(self.indicator.calculate_indicators, df)
             
             # 计算评分
             score = self.scorer.calculate_score(df_with_indicators)
@@ -158,12 +193,38 @@ class StockAnalyzerService:
             }
             
             # 输出基本分析结果
-            logger.info(f"基本分析结果: {json.dumps(basic_result)}")
-            yield json.dumps(basic_result)
+            logger.info(f"基本分析结果: {basic_result}")
+            yield encode_frame(basic_result)
+            
+            # 只有最新K线所在交易日已收盘时，分析结果才可缓存（停牌股票的最新K线早于最近交易日）
+            bar_date = pd.Timestamp(df_with_indicators.index[-1]).date()
+            cacheable = closed_session is not None and bar_date <= closed_session
+            if cacheable and bar_date != closed_session:
+                cached = await self._get_cached_analysis(cache, stock_code, market_type, bar_date.isoformat())
+                if cached is not None:
+                    logger.info(f"回放缓存的分析结果: {stock_code}, K线日期: {bar_date}")
+                    for frame in replay_frames(cached, stream)[1:]:
+                        yield encode_frame(frame)
+                    return
             
             # 使用AI进行深入分析
-            async for analysis_chunk in self.ai_analyzer.get_ai_analysis(df_with_indicators, stock_code, market_type, stream):
+            recorder = AnalysisRecorder()
+            async for analysis_chunk in self.ai_analyzer.get_ai_analysis(df_with_indicators, stock_code, market_type,
+                                                                         stream, priority=priority):
+                if cacheable:
+                    recorder.record(analysis_chunk)
                 yield analysis_chunk
+            
+            recorded = recorder.result() if cacheable else None
+            # 按实际生成结果的端点（URL和模型）缓存，包括自定义的API地址
+            producer = self.ai_analyzer.producing_endpoint(recorder.timings)
+            if recorded is not None and producer is not None:
+                indicator_frame, ai_analysis, completed_frame = recorded
+                await asyncio.to_thread(
+                    cache.save, stock_code, market_type, bar_date.isoformat(), *producer,
+                    self.ai_analyzer.PROMPT_VERSION, basic_result, indicator_frame,
+                    ai_analysis, completed_frame
+                )
                 
             logger.info(f"完成股票分析: {stock_code}")
             
@@ -171,9 +232,116 @@ class StockAnalyzerService:
             error_msg = f"分析股票 {stock_code} 时出错: {str(e)}"
             logger.error(error_msg)
             logger.exception(e)
-            yield json.dumps({"error": error_msg})
+            yield encode_frame({"error": error_msg})
+    
+    async def _get_cached_analysis(self, cache: AnalysisResultCache, stock_code: str, market_type: str, bar_date: str) -> Optional[dict]:
+        """查询当前分析器可用端点和提示词版本下的缓存分析结果"""
+        try:
+            return await asyncio.to_thread(
+                cache.get, stock_code, market_type, bar_date, self.ai_analyzer.endpoint_keys(),
+                self.ai_analyzer.PROMPT_VERSION
+            )
+        except Exception as e:
+            logger.warning(f"读取分析缓存失败: {str(e)}")
+            return None
+    
+    def build_scan_result(self, code: str, score: int, rec: str, df, min_score: int = 0) -> dict:
+        """
+        构建批量扫描中单只股票的基本评分结果
+        
+        Args:
+            code: 股票代码
+            score: 评分
+            rec: 投资建议
+            df: 包含技术指标的DataFrame
+            min_score: 最低评分阈值
+            
+        Returns:
+            扫描结果字典
+        """
+        # 获取最新数据
+        latest_data = df.iloc[-1]
+        previous_data = df.iloc[-2] if len(df) > 1 else latest_data
+        
+        # 价格变动绝对值
+        price_change_value = latest_data['Close'] - previous_data['Close']
+        
+        # 获取涨跌幅
+        change_percent = latest_data.get('Change_pct')
+        
+        return {
+            "stock_code": code,
+            "score": score,
+            "recommendation": rec,
+            "price": float(latest_data.get('Close', 0)),
+            "price_change_value": float(price_change_value),  # 价格变动绝对值
+            "price_change": change_percent,  # 兼容旧版前端，传递涨跌幅
+            "change_percent": change_percent,  # 涨跌幅百分比，新字段
+            "rsi": float(latest_data.get('RSI', 0)) if 'RSI' in latest_data else None,
+            "ma_trend": "UP" if latest_data.get('MA5', 0) > latest_data.get('MA20', 0) else "DOWN",
+            "macd_signal": "BUY" if latest_data.get('MACD', 0) > latest_data.get('MACD_Signal', 0) else "SELL",
+            "volume_status": "HIGH" if latest_data.get('Volume_Ratio', 1) > 1.5 else ("LOW" if latest_data.get('Volume_Ratio', 1) < 0.5 else "NORMAL"),
+            "status": "completed" if score < min_score else "waiting"
+        }
     
-    async def scan_stocks(self, stock_codes: List[str], market_type: str = 'A', min_score: int = 0, stream: bool = False) -> AsyncGenerator[str, None]:
+    async def evaluate_stock(self, stock_code: str, market_type: str = 'A', min_score: int = 0) -> Tuple[dict, Optional[pd.DataFrame]]:
+        """
+        获取单只股票数据并完成指标计算和评分，供后台扫描任务逐只处理
+        
+        Args:
+            stock_code: 股票代码
+            market_type: 市场类型
+            min_score: 最低评分阈值
+            
+        Returns:
+            (扫描结果字典, 包含技术指标的DataFrame)，出错时DataFrame为None
+        """
+        try:
+            precomputed = await load_precomputed([stock_code], market_type)
+            if stock_code in precomputed:
+                df_with_indicators = precomputed[stock_code]
+                score = self.scorer.calculate_score(df_with_indicators)
+                rec = self.scorer.get_recommendation(score)
+                return self.build_scan_result(stock_code, score, rec, df_with_indicators, min_score), df_with_indicators
+            
+            df = await self.data_provider.get_stock_data(stock_code, market_type)
+            if hasattr(df, 'error'):
+                return {"stock_code": stock_code, "error": df.error, "status": "error"}, None
+            if df.empty:
+                return {"stock_code": stock_code, "error": f"获取到的股票 {stock_code} 数据为空", "status": "error"}, None
+            
+            df_with_indicators = await run_compute(self.indicator.calculate_indicators, df)
+            score = self.scorer.calculate_score(df_with_indicators)
+            rec = self.scorer.get_recommendation(score)
+            return self.build_scan_result(stock_code, score, rec, df_with_indicators, min_score), df_with_indicators
+        except Exception as e:
+            logger.error(f"评估股票 {stock_code} 时出错: {str(e)}")
+            return {"stock_code": stock_code, "error": f"评估股票时出错: {str(e)}", "status": "error"}, None
+    
+    async def _analyze_top_stock(self, df: pd.DataFrame, stock_code: str, market_type: str, stream: bool) -> AsyncGenerator[bytes, None]:
+        """输出正在分析的状态后转发单只股票的AI分析结果"""
+        yield encode_frame({
+            "stock_code": stock_code,
+            "status": "analyzing"
+        })
+        
+        async for analysis_chunk in self.ai_analyzer.get_ai_analysis(df, stock_code, market_type, stream,
+                                                                     priority=PRIORITY_BATCH):
+            yield analysis_chunk
+    
+    async def _analyze_top_batch(self, stocks: List[Tuple[str, pd.DataFrame]], market_type: str, stream: bool) -> AsyncGenerator[bytes, None]:
+        """输出各股票正在分析的状态后，在一次AI请求中分析这批股票"""
+        for stock_code, _ in stocks:
+            yield encode_frame({
+                "stock_code": stock_code,
+                "status": "analyzing"
+            })
+        
+        async for analysis_chunk in self.ai_analyzer.get_batch_ai_analysis(stocks, market_type, stream):
+            yield analysis_chunk
+    
+    async def scan_stocks(self, stock_codes: List[str], market_type: str = 'A', min_score: int = 0, stream: bool = False,
+                          ai_top_n: Optional[int] = None) -> AsyncGenerator[bytes, None]:
         """
         批量扫描股票
         
@@ -182,6 +350,7 @@ class StockAnalyzerService:
             market_type: 市场类型
             min_score: 最低评分阈值
             stream: 是否使用流式响应
+            ai_top_n: 进行AI分析的股票数，默认读取SCAN_AI_TOP_N
             
         Returns:
             异步生成器，生成扫描结果的JSON字符串
@@ -190,32 +359,39 @@ class StockAnalyzerService:
             logger.info(f"开始批量扫描 {len(stock_codes)} 只股票, 市场: {market_type}")
             
             # 输出初始状态 - 发送批量分析初始化消息
-            yield json.dumps({
+            yield encode_frame({
                 "stream_type": "batch",
                 "stock_codes": stock_codes,
                 "market_type": market_type,
                 "min_score": min_score
             })
             
+            # 优先使用收盘后预计算的技术指标，只获取缺失的股票数据
+            stock_with_indicators = await load_precomputed(stock_codes, market_type)
+            if stock_with_indicators:
+                logger.info(f"使用预计算数据 {len(stock_with_indicators)} 只")
+            missing_codes = [code for code in stock_codes if code not in stock_with_indicators]
+            
             # 批量获取股票数据
-            stock_data_dict = await self.data_provider.get_multiple_stocks_data(stock_codes, market_type)
-            
-            # 计算技术指标
-            stock_with_indicators = {}
-            for code, df in stock_data_dict.items():
-                try:
-                    stock_with_indicators[code] = self.indicator.calculate_indicators(df)
-                except Exception as e:
-                    logger.error(f"计算 {code} 技术指标时出错: {str(e)}")
+            stock_data_dict = await self.data_provider.get_multiple_stocks_data(missing_codes, market_type)
+            
+            # 分批在计算线程池中计算技术指标，批与批之间让出事件循环
+            for chunk in chunked(stock_data_dict):
+                calculated, errors = await run_compute(self.indicator.batch_calculate_indicators, chunk)
+                stock_with_indicators.update(calculated)
+                for code, error in errors.items():
                     # 发送错误状态
-                    yield json.dumps({
+                    yield encode_frame({
                         "stock_code": code,
-                        "error": f"计算技术指标时出错: {str(e)}",
+                        "error": f"计算技术指标时出错: {error}",
                         "status": "error"
                     })
             
-            # 评分股票
-            results = self.scorer.batch_score_stocks(stock_with_indicators)
+            # 分批评分股票
+            results = []
+            for chunk in chunked(stock_with_indicators):
+                results.extend(await run_compute(self.scorer.batch_score_stocks, chunk))
+            results.sort(key=lambda x: x[1], reverse=True)
             
             # 过滤低于最低评分的股票
             filtered_results = [r for r in results if r[1] >= min_score]
@@ -224,52 +400,35 @@ class StockAnalyzerService:
             for code, score, rec in results:
                 df = stock_with_indicators.get(code)
                 if df is not None and len(df) > 0:
-                    # 获取最新数据
-                    latest_data = df.iloc[-1]
-                    previous_data = df.iloc[-2] if len(df) > 1 else latest_data
-                    
-                    # 价格变动绝对值
-                    price_change_value = latest_data['Close'] - previous_data['Close']
-                    
-                    # 获取涨跌幅
-                    change_percent = latest_data.get('Change_pct')
-                    
                     # 发送股票基本信息和评分
-                    yield json.dumps({
-                        "stock_code": code,
-                        "score": score,
-                        "recommendation": rec,
-                        "price": float(latest_data.get('Close', 0)),
-                        "price_change_value": float(price_change_value),  # 价格变动绝对值
-                        "price_change": change_percent,  # 兼容旧版前端，传递涨跌幅
-                        "change_percent": change_percent,  # 涨跌幅百分比，新字段
-                        "rsi": float(latest_data.get('RSI', 0)) if 'RSI' in latest_data else None,
-                        "ma_trend": "UP" if latest_data.get('MA5', 0) > latest_data.get('MA20', 0) else "DOWN",
-                        "macd_signal": "BUY" if latest_data.get('MACD', 0) > latest_data.get('MACD_Signal', 0) else "SELL",
-                        "volume_status": "HIGH" if latest_data.get('Volume_Ratio', 1) > 1.5 else ("LOW" if latest_data.get('Volume_Ratio', 1) < 0.5 else "NORMAL"),
-                        "status": "completed" if score < min_score else "waiting"
-                    })
+                    yield encode_frame(self.build_scan_result(code, score, rec, df, min_score))
             
-            # 如果需要进一步分析，对评分较高的股票进行AI分析
+            # 如果需要进一步分析，对评分较高的股票并行进行AI分析，各股票的输出按stock_code交错合并
             if stream and filtered_results:
-                # 只分析前5只评分最高的股票，避免分析过多导致前端卡顿
-                top_stocks = filtered_results[:5]
+                # 只分析评分最高的前N只股票，避免分析过多导致前端卡顿
+                top_stocks = filtered_results[:DEFAULT_AI_TOP_N if ai_top_n is None else ai_top_n]
                 
-                for stock_code, score, _ in top_stocks:
-                    df = stock_with_indicators.get(stock_code)
-                    if df is not None:
-                        # 输出正在分析的股票信息
-                        yield json.dumps({
-                            "stock_code": stock_code,
-                            "status": "analyzing"
-                        })
-                        
-                        # AI分析
-                        async for analysis_chunk in self.ai_analyzer.get_ai_analysis(df, stock_code, market_type, stream):
-                            yield analysis_chunk
+                top_with_data = [
+                    (stock_code, stock_with_indicators[stock_code])
+                    for stock_code, _, _ in top_stocks
+                    if stock_code in stock_with_indicators
+                ]
+                if DEFAULT_AI_BATCH_SIZE > 1:
+                    # 多只股票合并到一次AI请求中，减少请求数和重复的分析要求
+                    streams = [
+                        self._analyze_top_batch(top_with_data[i:i + DEFAULT_AI_BATCH_SIZE], market_type, stream)
+                        for i in range(0, len(top_with_data), DEFAULT_AI_BATCH_SIZE)
+                    ]
+                else:
+                    streams = [
+                        self._analyze_top_stock(df, stock_code, market_type, stream)
+                        for stock_code, df in top_with_data
+                    ]
+                async for analysis_chunk in merge_streams(streams):
+                    yield analysis_chunk
             
             # 输出扫描完成信息
-            yield json.dumps({
+            yield encode_frame({
                 "scan_completed": True,
                 "total_scanned": len(results),
                 "total_matched": len(filtered_results)
@@ -281,4 +440,4 @@ class StockAnalyzerService:
             error_msg = f"批量扫描股票时出错: {str(e)}"
             logger.error(error_msg)
             logger.exception(e)
-            yield json.dumps({"error": error_msg})
+            yield encode_frame({"error": error_msg})
@@ -1,12 +1,30 @@
 import pandas as pd
 from datetime import datetime, timedelta
 import asyncio
+import os
 from typing import Dict, List, Optional, Tuple, Any
 from utils.logger import get_logger
+from utils.cancel_metrics import count_cancelled, get_cancel_metrics
+from utils.shared_cache import get_shared_cache
+from utils.stage_metrics import get_stage_metrics
+from utils.trading_calendar import get_trading_calendar
 
 # 获取日志器
 logger = get_logger()
 
+# 历史行情在跨进程共享缓存中的有效期（秒）：交易时段内和收盘后
+BAR_CACHE_TTL = float(os.getenv('BAR_CACHE_TTL', 60))
+BAR_CACHE_CLOSED_TTL = float(os.getenv('BAR_CACHE_CLOSED_TTL', 6 * 3600))
+
+# 各市场历史行情使用的akshare函数，用作耗时指标的标签
+AKSHARE_SOURCES = {
+    'A': 'stock_zh_a_hist',
+    'HK': 'stock_hk_daily',
+    'US': 'stock_us_daily',
+    'ETF': 'fund_etf_hist_em',
+    'LOF': 'fund_lof_hist_em'
+}
+
 class StockDataProvider:
     """
     异步股票数据提供服务
@@ -33,14 +51,52 @@ class StockDataProvider:
             包含历史数据的DataFrame
         """
         # 使用线程池执行同步的akshare调用
-        return await asyncio.to_thread(
-            self._get_stock_data_sync, 
-            stock_code, 
-            market_type, 
-            start_date, 
-            end_date
+        # 请求被取消时，尚未被线程池执行的调用随之取消；已开始的调用无法中断，结果被丢弃
+        started = False
+        
+        def fetch() -> pd.DataFrame:
+            nonlocal started
+            started = True
+            return self._get_stock_data_cached(stock_code, market_type, start_date, end_date)
+        
+        try:
+            return await asyncio.to_thread(fetch)
+        except asyncio.CancelledError:
+            get_cancel_metrics().add("fetches_abandoned" if started else "fetches_skipped")
+            raise
+    
+    def _get_stock_data_cached(self, stock_code: str, market_type: str,
+                               start_date: Optional[str], end_date: Optional[str]) -> pd.DataFrame:
+        """
+        经过跨进程共享缓存获取历史数据，各工作进程复用同一份数据
+        交易时段内短时间缓存；收盘后按最近收盘的交易日缓存，开盘或新的收盘后自动换用新的缓存键
+        """
+        cache = get_shared_cache()
+        if cache is None:
+            return self._get_stock_data_timed(stock_code, market_type, start_date, end_date)
+        calendar = get_trading_calendar()
+        if calendar.is_in_session(market_type):
+            session, ttl = 'live', BAR_CACHE_TTL
+        else:
+            session, ttl = calendar.latest_closed_session(market_type).isoformat(), BAR_CACHE_CLOSED_TTL
+        return cache.get_or_fetch(
+            "bars", f"{market_type}:{stock_code}:{start_date}:{end_date}:{session}",
+            lambda: self._get_stock_data_timed(stock_code, market_type, start_date, end_date), ttl,
+            # 出错和空数据不缓存
+            cacheable=lambda df: not hasattr(df, 'error') and not df.empty
         )
     
+    def _get_stock_data_timed(self, stock_code: str, market_type: str,
+                              start_date: Optional[str], end_date: Optional[str]) -> pd.DataFrame:
+        """访问上游接口获取历史数据，按市场和akshare函数记录耗时和失败次数"""
+        metrics = get_stage_metrics()
+        source = AKSHARE_SOURCES.get(market_type, 'unknown')
+        with metrics.time("data_fetch", market=market_type, source=source):
+            df = self._get_stock_data_sync(stock_code, market_type, start_date, end_date)
+        metrics.inc("data_fetches", market=market_type, source=source,
+                    status="error" if hasattr(df, 'error') else "ok")
+        return df
+    
     def _get_stock_data_sync(self, stock_code: str, market_type: str = 'A', 
                            start_date: Optional[str] = None, 
                            end_date: Optional[str] = None) -> pd.DataFrame:
@@ -234,6 +290,8 @@ class StockDataProvider:
                 
                 # 替换原始df
                 df = new_df
+                # 港股和美股数据没有涨跌幅列，按收盘价计算（百分比），与A股和基金的Change_pct一致
+                df['Change_pct'] = df['Close'].pct_change() * 100
                 
             elif market_type in ['ETF', 'LOF']:
                 # 基金数据可能有不同的列
@@ -282,12 +340,16 @@ class StockDataProvider:
         semaphore = asyncio.Semaphore(max_concurrency)
         
         async def get_with_semaphore(code):
-            async with semaphore:
-                try:
-                    return code, await self.get_stock_data(code, market_type, start_date, end_date)
-                except Exception as e:
-                    logger.error(f"获取股票 {code} 数据时出错: {str(e)}")
-                    return code, None
+            # 仍在等待并发许可时被取消，说明这只股票的数据获取尚未开始
+            with count_cancelled("fetches_skipped"):
+                await semaphore.acquire()
+            try:
+                return code, await self.get_stock_data(code, market_type, start_date, end_date)
+            except Exception as e:
+                logger.error(f"获取股票 {code} 数据时出错: {str(e)}")
+                return code, None
+            finally:
+                semaphore.release()
         
         # 创建异步任务
         tasks = [get_with_semaphore(code) for code in stock_codes]
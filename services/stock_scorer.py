@@ -1,6 +1,8 @@
+import time
 import pandas as pd
 from typing import Dict, List, Tuple
 from utils.logger import get_logger
+from utils.stage_metrics import get_stage_metrics
 
 # 获取日志器
 logger = get_logger()
@@ -25,6 +27,7 @@ class StockScorer:
         Returns:
             股票评分（0-100的整数）
         """
+        started = time.perf_counter()
         try:
             # 使用最新的数据点进行评分
             latest = df.iloc[-1]
@@ -77,6 +80,8 @@ class StockScorer:
             logger.error(f"计算评分时出错: {str(e)}")
             logger.exception(e)
             raise
+        finally:
+            get_stage_metrics().observe("scoring", (time.perf_counter() - started) * 1000)
             
     def get_recommendation(self, score: int) -> str:
         """
@@ -0,0 +1,210 @@
+import asyncio
+import importlib.util
+import json
+import os
+import sys
+import time
+from array import array
+from typing import Any, Dict, List, Optional
+import pandas as pd
+from utils.logger import get_logger
+from utils.snapshot_store import SnapshotStore
+from utils.sqlite_store import get_data_dir
+from utils.frame_records import str_column
+from utils.symbol_index import SymbolIndex
+
+# 获取日志器
+logger = get_logger()
+
+# 证券目录的刷新周期（秒），默认每天
+SYMBOL_DIRECTORY_TTL = float(os.getenv('SYMBOL_DIRECTORY_TTL', 86400))
+
+# 目录包含的市场，顺序即同等匹配程度下结果的排序
+MARKETS = ('A', 'HK', 'ETF', 'LOF', 'US')
+
+# 拼音首字母需要pypinyin（可选依赖）
+PINYIN_AVAILABLE = importlib.util.find_spec('pypinyin') is not None
+
+
+def name_initials(name: str) -> str:
+    """
+    名称的拼音首字母，如 "贵州茅台" -> "gzmt"
+    非汉字字符原样保留，未安装pypinyin时返回空字符串
+    """
+    if not PINYIN_AVAILABLE or not name:
+        return ''
+    from pypinyin import Style, lazy_pinyin
+    return ''.join(lazy_pinyin(name, style=Style.FIRST_LETTER, errors='default')).lower()
+
+
+class _Listing:
+    """某个市场的证券列表，字符串经过驻留以便在各市场和快照之间共享"""
+
+    def __init__(self, codes: List[str], names: List[str], initials: Optional[List[str]] = None,
+                 loaded_at: Optional[float] = None):
+        self.loaded_at = loaded_at or time.time()
+        self.codes = [sys.intern(code) for code in codes]
+        self.names = [sys.intern(name) for name in names]
+        if initials is None:
+            initials = [name_initials(name) for name in names]
+        self.initials = [sys.intern(i) for i in initials]
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"loaded_at": self.loaded_at, "codes": self.codes, "names": self.names, "initials": self.initials}
+
+
+class _DirectoryIndex:
+    """全部市场合并后的索引，各列按行对齐"""
+
+    def __init__(self, listings: Dict[str, _Listing]):
+        self.codes: List[str] = []
+        self.names: List[str] = []
+        self.initials: List[str] = []
+        self.markets = array('B')
+        for market_id, market in enumerate(MARKETS):
+            listing = listings.get(market)
+            if listing is None:
+                continue
+            self.codes.extend(listing.codes)
+            self.names.extend(listing.names)
+            self.initials.extend(listing.initials)
+            self.markets.extend([market_id] * len(listing))
+        self.index = SymbolIndex(self.codes, self.names, self.initials)
+
+    def row(self, row: int) -> Dict[str, str]:
+        return {"code": self.codes[row], "name": self.names[row], "market_type": MARKETS[self.markets[row]],
+                "initials": self.initials[row]}
+
+
+class SymbolDirectory:
+    """
+    证券目录
+    汇总A股、港股、美股、ETF和LOF的代码和名称，支持按代码、名称和拼音首字母自动补全；
+    每天在后台刷新，并保存到磁盘，重启后无需等待上游接口即可使用
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl: float = SYMBOL_DIRECTORY_TTL):
+        """
+        初始化证券目录
+
+        Args:
+            path: 目录文件路径，默认为数据目录下的symbol_directory.json
+            ttl: 刷新周期（秒）
+        """
+        self.path = path or os.path.join(get_data_dir(), 'symbol_directory.json')
+        self.snapshots = SnapshotStore("证券目录", self._load_market, ttl)
+        self._listings: Dict[str, _Listing] = {}
+        self._index: Optional[_DirectoryIndex] = None
+        self._rebuild_lock = asyncio.Lock()
+        if not PINYIN_AVAILABLE:
+            logger.warning("未安装pypinyin，证券目录不支持拼音首字母搜索（pip install pypinyin）")
+
+    async def start(self) -> None:
+        """从磁盘恢复目录并启动后台刷新，尚未加载的市场在后台拉取"""
+        await self._restore()
+        self.snapshots.start(MARKETS)
+
+    async def stop(self) -> None:
+        """停止后台刷新"""
+        await self.snapshots.stop()
+
+    async def _restore(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            data = await asyncio.to_thread(self._read_file)
+        except Exception as e:
+            logger.warning(f"读取证券目录文件失败: {str(e)}")
+            return
+        for market, item in data.get("markets", {}).items():
+            if market not in MARKETS:
+                continue
+            listing = _Listing(item["codes"], item["names"], item["initials"] if PINYIN_AVAILABLE else None,
+                               item["loaded_at"])
+            self._listings[market] = listing
+            self.snapshots.put(market, listing, listing.loaded_at)
+        await self._rebuild()
+        logger.info(f"已从磁盘恢复证券目录: {len(self._index.codes)} 条")
+
+    def _read_file(self) -> Dict[str, Any]:
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_file(self) -> None:
+        markets = {market: listing.to_dict() for market, listing in self._listings.items()}
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"markets": markets}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    async def _load_market(self, market: str) -> _Listing:
+        """拉取某个市场的证券列表，重建合并索引并保存到磁盘"""
+        df = await self.snapshots.fetch_shared(market, lambda: self._fetch_market(market))
+        listing = await asyncio.to_thread(_Listing, str_column(df, 'code'), str_column(df, 'name'))
+        if not listing:
+            raise Exception(f"{market}证券列表为空")
+        self._listings[market] = listing
+        await self._rebuild()
+        try:
+            await asyncio.to_thread(self._write_file)
+        except Exception as e:
+            logger.warning(f"保存证券目录文件失败: {str(e)}")
+        return listing
+
+    async def _rebuild(self) -> None:
+        # 串行重建，最后一次重建总是包含所有市场的最新列表
+        async with self._rebuild_lock:
+            self._index = await asyncio.to_thread(_DirectoryIndex, dict(self._listings))
+
+    @staticmethod
+    def _fetch_market(market: str) -> pd.DataFrame:
+        """获取某个市场的代码和名称（同步方法，将被异步方法调用）"""
+        import akshare as ak
+
+        if market == 'A':
+            df = ak.stock_info_a_code_name()
+        elif market == 'HK':
+            df = ak.stock_hk_spot_em().rename(columns={"代码": "code", "名称": "name"})
+        elif market == 'US':
+            df = ak.stock_us_spot_em().rename(columns={"代码": "code", "名称": "name"})
+            # 行情接口的代码带交易所前缀（105.AAPL），分析时使用的是股票代码本身
+            df['code'] = df['code'].astype(str).str.split('.', n=1).str[-1]
+        elif market == 'ETF':
+            df = ak.fund_etf_spot_em().rename(columns={"代码": "code", "名称": "name"})
+        else:
+            df = ak.fund_lof_spot_em().rename(columns={"代码": "code", "名称": "name"})
+        return df[['code', 'name']]
+
+    def autocomplete(self, keyword: str, market_type: Optional[str] = None, limit: int = 10) -> List[Dict[str, str]]:
+        """
+        按代码、名称或拼音首字母自动补全
+
+        Args:
+            keyword: 输入的关键词
+            market_type: 只返回该市场的结果，为空时搜索全部市场
+            limit: 最多返回的条数
+
+        Returns:
+            [{"code", "name", "market_type", "initials"}]，目录尚未加载时返回空列表
+        """
+        directory = self._index
+        if directory is None:
+            return []
+        accept = None
+        if market_type:
+            if market_type not in MARKETS:
+                return []
+            market_id = MARKETS.index(market_type)
+            markets = directory.markets
+            accept = lambda row: markets[row] == market_id  # noqa: E731
+        return [directory.row(row) for row in directory.index.search(keyword, limit, accept)]
+
+    def stats(self) -> Dict[str, Any]:
+        """返回各市场的目录大小、年龄和刷新耗时"""
+        return {
+            "pinyin": PINYIN_AVAILABLE,
+            "markets": self.snapshots.stats()
+        }
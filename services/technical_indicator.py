@@ -1,6 +1,8 @@
+import time
 import pandas as pd
-from typing import Dict, Optional, Any
+from typing import Dict, Optional, Any, Tuple
 from utils.logger import get_logger
+from utils.stage_metrics import get_stage_metrics
 
 # 获取日志器
 logger = get_logger()
@@ -139,6 +141,7 @@ class TechnicalIndicator:
         Returns:
             添加了技术指标的DataFrame
         """
+        started = time.perf_counter()
         try:
             # 复制数据框
             result_df = df.copy()
@@ -183,4 +186,28 @@ class TechnicalIndicator:
         except Exception as e:
             logger.error(f"计算技术指标时出错: {str(e)}")
             logger.exception(e)
-            raise 
\ No newline at end of file
+            raise
+        finally:
+            get_stage_metrics().observe("indicators", (time.perf_counter() - started) * 1000)
+
+    def batch_calculate_indicators(self, stock_dfs: Dict[str, pd.DataFrame]) -> Tuple[Dict[str, pd.DataFrame], Dict[str, str]]:
+        """
+        批量计算多只股票的技术指标
+        
+        Args:
+            stock_dfs: 字典，键为股票代码，值为原始价格数据
+            
+        Returns:
+            (计算成功的结果字典, 计算失败的错误信息字典)
+        """
+        results = {}
+        errors = {}
+        
+        for stock_code, df in stock_dfs.items():
+            try:
+                results[stock_code] = self.calculate_indicators(df)
+            except Exception as e:
+                logger.error(f"计算 {stock_code} 技术指标时出错: {str(e)}")
+                errors[stock_code] = str(e)
+                
+        return results, errors
@@ -1,58 +1,72 @@
 import asyncio
+import os
 import pandas as pd
 from typing import List, Dict, Any, Optional
 from utils.logger import get_logger
+from utils.snapshot_store import SnapshotStore
+from utils.frame_records import FLOAT, PERCENT, STR
+from utils.symbol_index import SymbolSnapshot
 
 # 获取日志器
 logger = get_logger()
 
+# 美股行情快照的有效期（秒），到期前在后台刷新
+US_STOCK_SNAPSHOT_TTL = float(os.getenv('US_STOCK_SNAPSHOT_TTL', 300))
+
+# 搜索结果和详情的字段：输出字段 -> (列名, 类型)
+US_SEARCH_FIELDS = {
+    'name': ('name', STR),
+    'symbol': ('symbol', STR),
+    'price': ('price', FLOAT),
+    'market_value': ('market_value', FLOAT)
+}
+US_DETAIL_FIELDS = {
+    'name': ('name', STR),
+    'symbol': ('symbol', STR),
+    'price': ('price', FLOAT),
+    'price_change': ('price_change', FLOAT),
+    'price_change_percent': ('price_change_percent', PERCENT),
+    'open': ('open', FLOAT),
+    'high': ('high', FLOAT),
+    'low': ('low', FLOAT),
+    'pre_close': ('pre_close', FLOAT),
+    'market_value': ('market_value', FLOAT),
+    'pe_ratio': ('pe_ratio', FLOAT),
+    'volume': ('volume', FLOAT),
+    'turnover': ('turnover', FLOAT)
+}
+
 class USStockServiceAsync:
     """
     美股服务
     提供美股数据的搜索和获取功能
+    后台定时拉取全量行情并建立索引，搜索和详情请求只查内存快照，不访问上游接口
     """
     
-    def __init__(self):
-        """初始化美股服务"""
-        logger.debug("初始化USStockServiceAsync")
+    def __init__(self, ttl: float = US_STOCK_SNAPSHOT_TTL):
+        """
+        初始化美股服务
         
-        # 可选：添加缓存以减少频繁请求
-        self._cache = None
-        self._cache_timestamp = None
+        Args:
+            ttl: 快照有效期（秒）
+        """
+        logger.debug("初始化USStockServiceAsync")
+        self.snapshots = SnapshotStore("美股行情", self._load_snapshot, ttl)
     
     async def search_us_stocks(self, keyword: str) -> List[Dict[str, Any]]:
         """
         异步搜索美股代码
         
         Args:
-            keyword: 搜索关键词
+            keyword: 搜索关键词，匹配代码或名称
             
         Returns:
-            匹配的股票列表
+            匹配的股票列表（最多10个）
         """
         try:
             logger.info(f"异步搜索美股: {keyword}")
-            
-            # 使用线程池执行同步的akshare调用
-            df = await asyncio.to_thread(self._get_us_stocks_data)
-            
-            # 模糊匹配搜索
-            mask = df['name'].str.contains(keyword, case=False, na=False)
-            results = df[mask]
-            
-            # 格式化返回结果并处理 NaN 值
-            formatted_results = []
-            for _, row in results.iterrows():
-                formatted_results.append({
-                    'name': row['name'] if pd.notna(row['name']) else '',
-                    'symbol': str(row['symbol']) if pd.notna(row['symbol']) else '',
-                    'price': float(row['price']) if pd.notna(row['price']) else 0.0,
-                    'market_value': float(row['market_value']) if pd.notna(row['market_value']) else 0.0
-                })
-                # 限制只返回前10个结果
-                if len(formatted_results) >= 10:
-                    break
-            
+            snapshot = await self._get_snapshot()
+            formatted_results = snapshot.search(keyword, limit=10)
             logger.info(f"美股搜索完成，找到 {len(formatted_results)} 个匹配项（限制显示前10个）")
             return formatted_results
             
@@ -62,6 +76,32 @@ class USStockServiceAsync:
             logger.exception(e)
             raise Exception(error_msg)
     
+    async def _get_snapshot(self) -> SymbolSnapshot:
+        """获取当前快照，仅在服务刚启动、尚无快照时等待首次加载"""
+        return await self.snapshots.get('US')
+    
+    async def _load_snapshot(self, key: str) -> SymbolSnapshot:
+        """拉取全量美股行情并建立索引"""
+        df = await self.snapshots.fetch_shared(key, self._get_us_stocks_data)
+        return await asyncio.to_thread(self._build_snapshot, df)
+    
+    @staticmethod
+    def _build_snapshot(df: pd.DataFrame) -> SymbolSnapshot:
+        """按市值从高到低排序，并预先格式化搜索结果和详情"""
+        return SymbolSnapshot.from_frame(df, US_SEARCH_FIELDS, US_DETAIL_FIELDS)
+    
+    def start(self) -> None:
+        """在当前事件循环中启动后台刷新，并预先加载行情快照"""
+        self.snapshots.start(['US'])
+    
+    async def stop(self) -> None:
+        """停止后台刷新"""
+        await self.snapshots.stop()
+    
+    def stats(self) -> Dict[str, Any]:
+        """返回快照年龄和刷新耗时"""
+        return self.snapshots.stats()
+    
     def _get_us_stocks_data(self) -> pd.DataFrame:
         """
         获取美股数据（同步方法，将被异步方法调用）
@@ -115,35 +155,11 @@ class USStockServiceAsync:
         try:
             logger.info(f"获取美股详情: {symbol}")
             
-            # 使用线程池执行同步的akshare调用
-            df = await asyncio.to_thread(self._get_us_stocks_data)
-            
-            # 精确匹配股票代码
-            result = df[df['symbol'] == symbol]
-            
-            if len(result) == 0:
+            snapshot = await self._get_snapshot()
+            stock_detail = snapshot.detail(symbol)
+            if stock_detail is None:
                 raise Exception(f"未找到股票代码: {symbol}")
             
-            # 获取第一行数据
-            row = result.iloc[0]
-            
-            # 格式化为字典
-            stock_detail = {
-                'name': row['name'] if pd.notna(row['name']) else '',
-                'symbol': str(row['symbol']) if pd.notna(row['symbol']) else '',
-                'price': float(row['price']) if pd.notna(row['price']) else 0.0,
-                'price_change': float(row['price_change']) if pd.notna(row['price_change']) else 0.0,
-                'price_change_percent': float(row['price_change_percent'].strip('%'))/100 if pd.notna(row['price_change_percent']) else 0.0,
-                'open': float(row['open']) if pd.notna(row['open']) else 0.0,
-                'high': float(row['high']) if pd.notna(row['high']) else 0.0,
-                'low': float(row['low']) if pd.notna(row['low']) else 0.0,
-                'pre_close': float(row['pre_close']) if pd.notna(row['pre_close']) else 0.0,
-                'market_value': float(row['market_value']) if pd.notna(row['market_value']) else 0.0,
-                'pe_ratio': float(row['pe_ratio']) if pd.notna(row['pe_ratio']) else 0.0,
-                'volume': float(row['volume']) if pd.notna(row['volume']) else 0.0,
-                'turnover': float(row['turnover']) if pd.notna(row['turnover']) else 0.0
-            }
-            
             logger.info(f"获取美股详情成功: {symbol}")
             return stock_detail
             
@@ -151,4 +167,4 @@ class USStockServiceAsync:
             error_msg = f"获取美股详情失败: {str(e)}"
             logger.error(error_msg)
             logger.exception(e)
-            raise Exception(error_msg) 
\ No newline at end of file
+            raise Exception(error_msg)
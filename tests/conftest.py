@@ -0,0 +1,58 @@
+import asyncio
+import json
+
+import httpx
+import numpy as np
+import pandas as pd
+import pytest
+
+import services.ai_analyzer as ai_module
+import services.llm_response_cache as llm_response_cache
+import utils.shared_cache as shared_cache
+
+
+@pytest.fixture(autouse=True)
+def _disable_llm_response_cache(monkeypatch):
+    """测试之间相同的提示词不应命中AI响应缓存，需要缓存的测试自行注入临时缓存"""
+    monkeypatch.setattr(llm_response_cache, "LLM_CACHE_ENABLED", False)
+    monkeypatch.setattr(llm_response_cache, "_cache", None)
+
+
+@pytest.fixture(autouse=True)
+def _disable_shared_cache(monkeypatch):
+    """测试之间不共享跨进程缓存，需要缓存的测试自行创建临时缓存"""
+    monkeypatch.setattr(shared_cache, "SHARED_CACHE_ENABLED", False)
+    monkeypatch.setattr(shared_cache, "_cache", None)
+
+
+@pytest.fixture
+def make_frame():
+    """构造AI分析所需的60个交易日技术指标DataFrame，offset平移收盘价以区分不同股票"""
+    def make(offset: float = 0.0) -> pd.DataFrame:
+        close = np.linspace(10, 20, 60) + offset
+        return pd.DataFrame({"Close": close, "MA5": close, "MA20": close - 1, "RSI": 60.0, "Volatility": 1.5,
+                             "Volume_Ratio": 1.2, "Change_pct": 0.5},
+                            index=pd.date_range(end="2024-09-30", periods=60))
+    return make
+
+
+@pytest.fixture
+def stub_llm(monkeypatch):
+    """把AI分析器的HTTP客户端换成httpx.MockTransport，传入处理请求的函数（可以是协程函数）"""
+    def install(handler) -> None:
+        transport = httpx.MockTransport(handler)
+        monkeypatch.setattr(ai_module, "get_http_client", lambda url, timeout: httpx.AsyncClient(transport=transport))
+    return install
+
+
+@pytest.fixture
+def sse_body():
+    """按OpenAI流式格式逐个输出token的响应体，first_delay为首token前的等待秒数"""
+    def make(tokens, first_delay: float = 0.0):
+        async def body():
+            await asyncio.sleep(first_delay)
+            for token in tokens:
+                yield ("data: " + json.dumps({"choices": [{"delta": {"content": token}}]}) + "\n\n").encode()
+            yield b"data: [DONE]\n\n"
+        return body()
+    return make
@@ -0,0 +1,75 @@
+import asyncio
+import time
+
+import pytest
+
+from services.admission_controller import AdmissionController, AdmissionRejected
+from services.llm_scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE
+
+
+def test_interactive_requests_run_before_queued_batches():
+    async def run():
+        controller = AdmissionController(max_concurrency=1, max_per_user=5, max_queue=10)
+        running = controller.admit("a", PRIORITY_BATCH)
+        batch = controller.admit("b", PRIORITY_BATCH)
+        interactive = controller.admit("c", PRIORITY_INTERACTIVE)
+        # 保持生成器存活，关闭生成器会使请求退出队列
+        waiters = [ticket.wait() for ticket in (interactive, batch)]
+        positions = [await waiter.__anext__() for waiter in waiters]
+        running.release()
+        return running.granted, positions, interactive.granted, batch.granted
+
+    granted, positions, interactive_granted, batch_granted = asyncio.run(run())
+    assert granted
+    assert positions == [1, 2]
+    assert interactive_granted and not batch_granted
+
+
+def test_per_user_limit_does_not_block_other_users():
+    async def run():
+        controller = AdmissionController(max_concurrency=3, max_per_user=1, max_queue=10)
+        first = controller.admit("heavy", PRIORITY_BATCH)
+        second = controller.admit("heavy", PRIORITY_BATCH)
+        other = controller.admit("light", PRIORITY_BATCH)
+        before = (first.granted, second.granted, other.granted)
+        first.release()
+        return before, second.granted, controller.stats()
+
+    before, second_granted, stats = asyncio.run(run())
+    assert before == (True, False, True)
+    assert second_granted
+    assert stats["running"] == 2 and stats["queued"] == 0
+
+
+def test_full_queue_rejects_fast_with_estimated_wait_and_cancelled_waiters_leave():
+    async def run():
+        controller = AdmissionController(max_concurrency=1, max_per_user=1, max_queue=2, max_queue_per_user=1)
+        controller.admit("a", PRIORITY_INTERACTIVE)
+        queued = [controller.admit(user, PRIORITY_INTERACTIVE) for user in ("b", "c")]
+        started = time.perf_counter()
+        with pytest.raises(AdmissionRejected) as rejected:
+            controller.admit("d", PRIORITY_INTERACTIVE)
+        elapsed = time.perf_counter() - started
+        with pytest.raises(AdmissionRejected) as per_user:
+            controller.admit("b", PRIORITY_BATCH)
+
+        # 排队中的请求被取消（客户端断开）后退出队列，腾出位置
+        waiting = asyncio.create_task(_drain(queued[0]))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        accepted = controller.admit("d", PRIORITY_INTERACTIVE)
+        return rejected.value, per_user.value, elapsed, accepted.granted, controller.stats()
+
+    rejected, per_user, elapsed, granted, stats = asyncio.run(run())
+    assert elapsed < 0.01
+    # 运行中的一个请求加排在前面的两个请求，按默认预计耗时估算
+    assert rejected.retry_after == pytest.approx(60, abs=1)
+    assert per_user.message == "您的排队请求已达上限"
+    assert not granted
+    assert stats["queued"] == 2 and stats["rejected"] == 2
+
+
+async def _drain(ticket):
+    async for _ in ticket.wait():
+        pass
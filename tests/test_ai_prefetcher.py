@@ -0,0 +1,98 @@
+import asyncio
+import json
+from datetime import date, datetime
+
+import services.ai_prefetcher as prefetch_module
+from services.ai_prefetcher import AIPrefetcher, PrefetchStore, in_windows, parse_windows
+from services.llm_scheduler import PRIORITY_PREFETCH, get_endpoint_scheduler
+from utils.trading_calendar import CN_TZ
+
+
+class FakeAnalyzer:
+    def __init__(self):
+        self.calls = []
+
+    async def analyze_stock(self, stock_code, market_type='A', stream=False, priority=0):
+        self.calls.append((stock_code, market_type, priority))
+        yield json.dumps({"stock_code": stock_code, "score": 80})
+        yield json.dumps({"stock_code": stock_code, "status": "completed"})
+
+
+def _prefetcher(tmp_path, monkeypatch, **kwargs):
+    async def closed_session(market_type):
+        return date(2024, 9, 30)
+
+    monkeypatch.setattr(prefetch_module, "get_closed_session", closed_session)
+    analyzer = FakeAnalyzer()
+    prefetcher = AIPrefetcher(store=PrefetchStore(str(tmp_path / "prefetch.db")),
+                              analyzer_factory=lambda: analyzer, **kwargs)
+    return prefetcher, analyzer
+
+
+def test_windows_wrap_midnight():
+    windows = parse_windows("12:00-13:00, 22:00-06:00")
+    assert in_windows(windows, datetime(2024, 10, 8, 12, 30, tzinfo=CN_TZ))
+    assert in_windows(windows, datetime(2024, 10, 8, 2, 0, tzinfo=CN_TZ))
+    assert not in_windows(windows, datetime(2024, 10, 8, 10, 0, tzinfo=CN_TZ))
+    assert in_windows([], datetime(2024, 10, 8, 10, 0, tzinfo=CN_TZ))
+
+
+def test_candidates_ranked_by_requests_and_scan_scores(tmp_path):
+    store = PrefetchStore(str(tmp_path / "prefetch.db"))
+    store.record_requests(["600519", "000001"], "A")
+    store.record_requests(["600519"], "A")
+    store.record_scan_results([("300750", 90.0), ("000001", 80.0)], "A")
+
+    ranked = store.rank_candidates(0, 10)
+    assert [(r['stock_code'], round(r['rank'], 2)) for r in ranked] == [
+        ("600519", 2.0), ("000001", 1.8), ("300750", 0.9)
+    ]
+
+
+def test_run_once_prefetches_within_budget_once_per_session(tmp_path, monkeypatch):
+    prefetcher, analyzer = _prefetcher(tmp_path, monkeypatch, daily_budget=2, batch=5, idle_seconds=0)
+    prefetcher.store.record_requests(["600519", "600519", "000001", "300750"], "A")
+
+    assert asyncio.run(prefetcher.run_once()) == 2
+    assert analyzer.calls == [("600519", "A", PRIORITY_PREFETCH), ("000001", "A", PRIORITY_PREFETCH)]
+    # 预算用完后不再预生成
+    assert asyncio.run(prefetcher.run_once()) == 0
+
+    # 同一交易日已预生成的股票不会重复分析
+    prefetcher.daily_budget = 10
+    assert asyncio.run(prefetcher.run_once()) == 1
+    assert analyzer.calls[-1][0] == "300750"
+    assert prefetcher.stats()["prefetched"] == 3
+
+
+def test_run_once_waits_for_idle(tmp_path, monkeypatch):
+    prefetcher, analyzer = _prefetcher(tmp_path, monkeypatch, idle_seconds=60)
+
+    async def run():
+        await prefetcher.record_request(["600519"], "A")
+        return await prefetcher.run_once()
+
+    # 刚有用户请求，不预生成
+    assert asyncio.run(run()) == 0
+
+    # AI端点有进行中的请求时也不预生成
+    async def busy():
+        prefetcher.idle_seconds = 0
+        scheduler = get_endpoint_scheduler("http://prefetch-busy.test", "k")
+        ticket = scheduler.enqueue("someone")
+        blocked = await prefetcher.run_once()
+        ticket.release()
+        return blocked, await prefetcher.run_once()
+
+    assert asyncio.run(busy()) == (0, 1)
+    assert analyzer.calls == [("600519", "A", PRIORITY_PREFETCH)]
+
+
+def test_requests_served_by_other_workers_keep_prefetcher_waiting(tmp_path, monkeypatch):
+    prefetcher, analyzer = _prefetcher(tmp_path, monkeypatch, idle_seconds=60)
+    # 另一个工作进程处理的请求写入同一个存储
+    PrefetchStore(str(tmp_path / "prefetch.db")).record_requests(["600519"], "A")
+
+    assert asyncio.run(prefetcher.run_once()) == 0
+    assert not prefetcher.is_idle()
+    assert analyzer.calls == []
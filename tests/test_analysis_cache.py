@@ -0,0 +1,132 @@
+import asyncio
+import json
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+import services.ai_analyzer as ai_module
+import services.stock_analyzer_service as analyzer_module
+from services.analysis_cache import AnalysisResultCache
+from services.ai_analyzer import AIAnalyzer
+from services.stock_analyzer_service import StockAnalyzerService
+
+
+def _price_frame(last_day):
+    index = pd.date_range(end=last_day, periods=90, freq="D")
+    close = np.linspace(10, 20, 90)
+    return pd.DataFrame({"Open": close, "High": close, "Low": close, "Close": close,
+                         "Volume": np.full(90, 1000.0)}, index=index)
+
+
+def _run(service, stream=True):
+    async def collect():
+        return [json.loads(chunk) async for chunk in service.analyze_stock("600519", "A", stream=stream)]
+    return asyncio.run(collect())
+
+
+def test_closed_session_analysis_is_replayed_from_cache(tmp_path, monkeypatch):
+    cache = AnalysisResultCache(str(tmp_path / "analysis_cache.db"))
+    calls = []
+
+    async def fake_closed_session(market_type):
+        return date(2024, 9, 30)
+
+    async def fake_fetch(self, stock_code, market_type='A', start_date=None, end_date=None):
+        calls.append("fetch")
+        return _price_frame("2024-09-30")
+
+    async def fake_ai(self, df, stock_code, market_type='A', stream=False, priority=0):
+        calls.append("ai")
+        yield json.dumps({"stock_code": stock_code, "status": "analyzing", "rsi": 50})
+        yield json.dumps({"stock_code": stock_code, "ai_analysis_chunk": "趋势", "status": "analyzing"})
+        yield json.dumps({"stock_code": stock_code, "ai_analysis_chunk": "向上", "status": "analyzing"})
+        yield json.dumps({"stock_code": stock_code, "status": "completed", "score": 60, "recommendation": "持有"})
+        yield json.dumps({"stock_code": stock_code, "timings": {"model": "test-model", "endpoint": "llm.test"}})
+
+    monkeypatch.setattr(analyzer_module, "get_analysis_cache", lambda: cache)
+    monkeypatch.setattr(analyzer_module, "get_closed_session", fake_closed_session)
+    monkeypatch.setattr("services.stock_data_provider.StockDataProvider.get_stock_data", fake_fetch)
+    monkeypatch.setattr(AIAnalyzer, "get_ai_analysis", fake_ai)
+
+    service = StockAnalyzerService(custom_api_url="http://llm.test", custom_api_model="test-model")
+    first = _run(service)
+    second = _run(service)
+
+    assert calls == ["fetch", "ai"]
+    assert second[0]["score"] == first[0]["score"]
+    assert "".join(f.get("ai_analysis_chunk", "") for f in second) == "趋势向上"
+    assert second[-1]["status"] == "completed" and second[-1]["cached"] is True
+
+    non_stream = _run(service, stream=False)
+    assert non_stream[-1]["analysis"] == "趋势向上"
+    assert cache.stats()["hits"] == 2
+
+    # 同一模型的其他API地址（如用户自定义的端点）不会回放该结果
+    other = StockAnalyzerService(custom_api_url="http://other.test", custom_api_model="test-model")
+    _run(other)
+    assert calls == ["fetch", "ai", "fetch", "ai"]
+
+
+def test_in_session_analysis_is_not_cached(tmp_path, monkeypatch):
+    cache = AnalysisResultCache(str(tmp_path / "analysis_cache.db"))
+
+    async def in_session(market_type):
+        return None
+
+    async def fake_fetch(self, stock_code, market_type='A', start_date=None, end_date=None):
+        return _price_frame("2024-10-08")
+
+    async def fake_ai(self, df, stock_code, market_type='A', stream=False, priority=0):
+        yield json.dumps({"stock_code": stock_code, "status": "analyzing"})
+        yield json.dumps({"stock_code": stock_code, "status": "completed", "score": 60, "recommendation": "持有"})
+
+    monkeypatch.setattr(analyzer_module, "get_analysis_cache", lambda: cache)
+    monkeypatch.setattr(analyzer_module, "get_closed_session", in_session)
+    monkeypatch.setattr("services.stock_data_provider.StockDataProvider.get_stock_data", fake_fetch)
+    monkeypatch.setattr(AIAnalyzer, "get_ai_analysis", fake_ai)
+
+    _run(StockAnalyzerService())
+    assert cache.stats()["entries"] == 0
+
+
+class _ReplayCache:
+    """只返回固定条目的AI响应缓存"""
+
+    def __init__(self, origin):
+        self.origin = origin
+
+    def lookup(self, cache_keys):
+        return "test-model", "## 投资建议\n持有", self.origin
+
+    def put(self, *args):
+        raise AssertionError("命中缓存时不应写入")
+
+
+def test_response_cache_replay_is_cached_only_for_its_origin(tmp_path, monkeypatch, stub_llm):
+    async def fake_closed_session(market_type):
+        return date(2024, 9, 30)
+
+    async def fake_fetch(self, stock_code, market_type='A', start_date=None, end_date=None):
+        return _price_frame("2024-09-30")
+
+    def no_request(request):
+        raise AssertionError("命中AI响应缓存时不应请求API")
+
+    stub_llm(no_request)
+    monkeypatch.setattr(analyzer_module, "get_closed_session", fake_closed_session)
+    monkeypatch.setattr("services.stock_data_provider.StockDataProvider.get_stock_data", fake_fetch)
+
+    def entries_after_replay(origin):
+        cache = AnalysisResultCache(str(tmp_path / f"analysis_{len(origin)}.db"))
+        monkeypatch.setattr(analyzer_module, "get_analysis_cache", lambda: cache)
+        monkeypatch.setattr(ai_module, "get_llm_response_cache", lambda: _ReplayCache(origin))
+        frames = _run(StockAnalyzerService(custom_api_url="http://custom.test", custom_api_key="k",
+                                           custom_api_model="test-model"))
+        assert frames[-2]["status"] == "completed" and frames[-1]["timings"]["cache_hit"] is True
+        return cache.stats()["entries"]
+
+    # 其他端点生成的同名模型输出，以及来源未知的输出，都不能记为自定义端点的分析结果
+    assert entries_after_replay("http://provider-a.test/v1/chat/completions") == 0
+    assert entries_after_replay("") == 0
+    assert entries_after_replay("http://custom.test/v1/chat/completions") == 1
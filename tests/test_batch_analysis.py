@@ -0,0 +1,121 @@
+import asyncio
+import json
+
+import httpx
+
+from services.ai_analyzer import AIAnalyzer
+from services.prompt_builder import PromptBuilder, SectionDemuxer, section_marker
+
+
+def test_demuxer_splits_sections_across_fragments():
+    text = ("好的，以下是分析。\n" + section_marker("600519") + "\n茅台趋势向上\n建议买入\n\n"
+            "### " + section_marker("000001") + "\n平安震荡\n")
+    demuxer = SectionDemuxer(["600519", "000001"])
+    pieces = []
+    for i in range(0, len(text), 3):
+        pieces += demuxer.feed(text[i:i + 3])
+    pieces += demuxer.flush()
+
+    merged = {}
+    for code, piece in pieces:
+        merged[code] = merged.get(code, "") + piece
+    assert merged == {"600519": "茅台趋势向上\n建议买入\n\n", "000001": "平安震荡\n"}
+
+
+def test_batch_prompt_states_instructions_once(make_frame):
+    summary = {"trend": "upward", "rsi_level": 60.0}
+    stocks = [(make_frame(i), code, summary) for i, code in enumerate(["600519", "000001", "300750"])]
+    batch, tokens = PromptBuilder().build_batch(stocks, "A")
+    single, _ = PromptBuilder().build(stocks[0][0], "600519", "A", summary)
+
+    assert batch.count("威科夫") == 1
+    assert all(section_marker(code) in batch for _, code, _ in stocks)
+    assert tokens < 3 * len(single)
+
+
+def test_batch_stream_is_demultiplexed_per_stock(stub_llm, make_frame):
+    answer = (section_marker("600519") + "\n茅台分析，建议买入\n" +
+              section_marker("000001") + "\n平安分析\n")
+    requests = []
+
+    async def body():
+        for i in range(0, len(answer), 4):
+            yield ("data: " + json.dumps({"choices": [{"delta": {"content": answer[i:i + 4]}}]}) + "\n\n").encode()
+        yield b"data: [DONE]\n\n"
+
+    def handler(request):
+        requests.append(json.loads(request.content))
+        return httpx.Response(200, content=body())
+
+    stub_llm(handler)
+
+    async def run():
+        analyzer = AIAnalyzer(custom_api_url="http://llm.test", custom_api_key="k")
+        stocks = [("600519", make_frame(0)), ("000001", make_frame(1))]
+        return [json.loads(f) async for f in analyzer.get_batch_ai_analysis(stocks, "A", stream=True)]
+
+    frames = asyncio.run(run())
+    assert len(requests) == 1
+
+    def text_of(code):
+        return "".join(f.get("ai_analysis_chunk", "") for f in frames if f.get("stock_code") == code)
+
+    assert text_of("600519") == "茅台分析，建议买入\n"
+    assert text_of("000001") == "平安分析\n"
+    completed = {f["stock_code"]: f for f in frames if f.get("status") == "completed"}
+    assert completed["600519"]["recommendation"] == "观望" and set(completed) == {"600519", "000001"}
+    assert frames[-1]["stock_codes"] == ["600519", "000001"] and frames[-1]["timings"]["batch_size"] == 2
+
+
+def test_stream_error_fails_unfinished_sections_without_caching(stub_llm, make_frame, monkeypatch):
+    chunks = [section_marker("600519") + "\n茅台分析\n", section_marker("000001") + "\n平安分"]
+    stored = []
+
+    async def body():
+        for chunk in chunks:
+            yield ("data: " + json.dumps({"choices": [{"delta": {"content": chunk}}]}) + "\n\n").encode()
+        yield ("data: " + json.dumps({"error": {"message": "overloaded"}}) + "\n\n").encode()
+        yield b"data: [DONE]\n\n"
+
+    async def store_cache(self, cache_keys, endpoint, text):
+        stored.append(text)
+
+    stub_llm(lambda request: httpx.Response(200, content=body()))
+    monkeypatch.setattr(AIAnalyzer, "_store_cache", store_cache)
+
+    async def run():
+        analyzer = AIAnalyzer(custom_api_url="http://llm.test", custom_api_key="k")
+        stocks = [("600519", make_frame(0)), ("000001", make_frame(1)), ("000002", make_frame(2))]
+        return [json.loads(f) async for f in analyzer.get_batch_ai_analysis(stocks, "A", stream=True)]
+
+    frames = asyncio.run(run())
+    statuses = {f["stock_code"]: f["status"] for f in frames if f.get("status") in ("completed", "error")}
+    assert statuses == {"600519": "completed", "000001": "error", "000002": "error"}
+    errors = [f for f in frames if f.get("status") == "error"]
+    assert len(errors) == 2 and all("overloaded" in f["error"] for f in errors)
+    assert stored == []
+
+
+def test_stock_missing_from_batch_answer_is_analyzed_alone(stub_llm, make_frame):
+    calls = []
+
+    def handler(request):
+        prompt = json.loads(request.content)["messages"][0]["content"]
+        calls.append(prompt)
+        if len(calls) == 1:
+            content = section_marker("600519") + "\n只有茅台\n"
+        else:
+            content = "平安单独分析"
+        return httpx.Response(200, json={"choices": [{"message": {"content": content}}]})
+
+    stub_llm(handler)
+
+    async def run():
+        analyzer = AIAnalyzer(custom_api_url="http://llm.test", custom_api_key="k")
+        stocks = [("600519", make_frame(0)), ("000001", make_frame(1))]
+        return [json.loads(f) async for f in analyzer.get_batch_ai_analysis(stocks, "A", stream=False)]
+
+    frames = asyncio.run(run())
+    analyses = {f["stock_code"]: f["analysis"] for f in frames if f.get("status") == "completed"}
+    assert analyses == {"600519": "只有茅台\n", "000001": "平安单独分析"}
+    assert len(calls) == 2 and "000001" in calls[1]
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import threading
+import time
+
+import httpx
+import pandas as pd
+
+from services.ai_analyzer import AIAnalyzer
+from services.stock_data_provider import StockDataProvider
+from utils.cancel_metrics import get_cancel_metrics
+from utils.frame_encoder import encode_frame
+from utils.stream_transport import StreamRegistry
+
+
+def _delta(metrics_before, field):
+    return get_cancel_metrics().snapshot()[field] - metrics_before[field]
+
+
+def test_stream_is_cancelled_after_client_leaves_but_survives_quick_resume():
+    before = get_cancel_metrics().snapshot()
+    cleaned_up = []
+
+    async def endless(name):
+        try:
+            for i in range(1000):
+                yield encode_frame({"seq": i})
+                await asyncio.sleep(0.01)
+        finally:
+            cleaned_up.append(name)
+
+    async def read_some(buffer, count, after=0):
+        events = buffer.replay(after)
+        received = [await events.__anext__() for _ in range(count)]
+        await events.aclose()
+        return received[-1][0]
+
+    async def run():
+        registry = StreamRegistry(abandon_after=0.05)
+        resumed_id = registry.open(endless("resumed"))
+        abandoned_id = registry.open(endless("abandoned"))
+        last = await read_some(registry.get(resumed_id), 2)
+        await read_some(registry.get(abandoned_id), 2)
+        # 宽限期内重新接入的流继续运行
+        await asyncio.sleep(0.02)
+        events = registry.get(resumed_id).replay(last)
+        assert (await events.__anext__())[0] == last + 1
+        await asyncio.sleep(0.1)
+        stats = registry.stats()
+        await events.aclose()
+        await registry.close()
+        return stats
+
+    stats = asyncio.run(run())
+    assert cleaned_up[0] == "abandoned"
+    assert stats["abandoned"] == 1 and stats["running"] == 1
+    assert _delta(before, "analysis_streams") == 1
+
+
+def test_cancel_skips_queued_symbol_fetches(monkeypatch):
+    before = get_cancel_metrics().snapshot()
+    release = threading.Event()
+    calls = []
+
+    def slow_fetch(self, stock_code, market_type='A', start_date=None, end_date=None):
+        calls.append(stock_code)
+        release.wait(5)
+        return pd.DataFrame({"Close": [1.0]})
+
+    monkeypatch.setattr(StockDataProvider, "_get_stock_data_sync", slow_fetch)
+
+    async def run():
+        provider = StockDataProvider()
+        task = asyncio.create_task(provider.get_multiple_stocks_data([f"{i:06d}" for i in range(20)],
+                                                                     max_concurrency=3))
+        while len(calls) < 3:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        release.set()
+
+    asyncio.run(run())
+    assert len(calls) == 3
+    assert _delta(before, "fetches_skipped") == 17
+    assert _delta(before, "fetches_abandoned") == 3
+
+
+def test_cancel_aborts_llm_stream(stub_llm, make_frame):
+    before = get_cancel_metrics().snapshot()
+    closed = []
+
+    async def hanging_body():
+        try:
+            yield b'data: ' + json.dumps({"choices": [{"delta": {"content": "趋势向上"}}]}).encode() + b'\n\n'
+            await asyncio.sleep(60)
+        finally:
+            closed.append(True)
+
+    stub_llm(lambda request: httpx.Response(200, content=hanging_body()))
+
+    df = make_frame(20)
+
+    async def run():
+        analyzer = AIAnalyzer(custom_api_url="http://llm.test", custom_api_key="k")
+        got_chunk = asyncio.Event()
+
+        async def consume():
+            async for frame in analyzer.get_ai_analysis(df, "000001", stream=True):
+                if b"ai_analysis_chunk" in frame:
+                    got_chunk.set()
+
+        task = asyncio.create_task(consume())
+        await asyncio.wait_for(got_chunk.wait(), 5)
+        started = time.perf_counter()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return time.perf_counter() - started
+
+    elapsed = asyncio.run(run())
+    assert elapsed < 1
+    assert closed == [True]
+    assert _delta(before, "llm_streams") == 1
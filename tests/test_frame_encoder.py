@@ -0,0 +1,34 @@
+import json
+from datetime import date
+
+import numpy as np
+
+import utils.frame_encoder as encoder_module
+from utils.frame_encoder import decode_frame, encode_frame
+
+FRAME = {
+    "stock_code": "600519",
+    "score": np.int64(85),
+    "price": np.float64(1688.5),
+    "change_percent": np.float64("nan"),
+    "rsi": float("inf"),
+    "volumes": np.array([1, 2, 3], dtype=np.int32),
+    "date": date(2024, 9, 30),
+    "ai_analysis_chunk": "趋势向上",
+}
+EXPECTED = {"stock_code": "600519", "score": 85, "price": 1688.5, "change_percent": None, "rsi": None,
+            "volumes": [1, 2, 3], "date": "2024-09-30", "ai_analysis_chunk": "趋势向上"}
+
+
+def test_numpy_and_nan_frames_encode_to_ndjson_bytes():
+    data = encode_frame(FRAME)
+    assert isinstance(data, bytes) and data.endswith(b"\n") and data.count(b"\n") == 1
+    assert json.loads(data) == EXPECTED
+    assert decode_frame(data) == EXPECTED
+
+
+def test_stdlib_fallback_matches(monkeypatch):
+    monkeypatch.setattr(encoder_module, "orjson", None)
+    data = encode_frame(FRAME)
+    assert data.endswith(b"\n")
+    assert json.loads(data) == EXPECTED
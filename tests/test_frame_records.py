@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+
+from utils.frame_records import FLOAT, PERCENT, STR, frame_records
+
+
+def test_frame_records_cleans_each_column_once():
+    df = pd.DataFrame({
+        "symbol": ["105.AAPL", None, "105.MSFT"],
+        "name": ["苹果", "未知", np.nan],
+        "price": [180.5, np.nan, "410"],
+        "pct": ["1.50%", None, "bad"],
+        "ratio": [1.5, np.nan, -2.0],
+    })
+    records = frame_records(df, {
+        "symbol": ("symbol", STR), "name": ("name", STR), "price": ("price", FLOAT),
+        "pct": ("pct", PERCENT), "ratio": ("ratio", PERCENT), "missing": ("no_such_column", FLOAT),
+    })
+    assert records == [
+        {"symbol": "105.AAPL", "name": "苹果", "price": 180.5, "pct": 0.015, "ratio": 0.015, "missing": 0.0},
+        {"symbol": "", "name": "未知", "price": 0.0, "pct": 0.0, "ratio": 0.0, "missing": 0.0},
+        {"symbol": "105.MSFT", "name": "", "price": 410.0, "pct": 0.0, "ratio": -0.02, "missing": 0.0},
+    ]
+    assert all(type(r["price"]) is float for r in records)
@@ -0,0 +1,103 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from utils.http_client import HTTPClientPool
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_pool_reuses_connections_per_endpoint(server_url):
+    pool = HTTPClientPool()
+
+    async def run():
+        url = f"{server_url}/v1/chat/completions"
+        client = pool.get_client(url, 10)
+        for _ in range(3):
+            response = await pool.get_client(url, 10).post(url, json={})
+            assert response.status_code == 200
+        assert pool.get_client(url, 10) is client
+        assert pool.get_client(url, 30) is not client
+        await pool.aclose()
+
+    asyncio.run(run())
+
+    stats = pool.stats()["clients"][f"{server_url} (timeout=10s)"]
+    assert stats["requests"] == 3
+    assert stats["connections_opened"] == 1
+    assert stats["connections_reused"] == 2
+
+
+def test_pool_recreates_client_for_new_event_loop(server_url):
+    pool = HTTPClientPool()
+
+    async def fetch():
+        return pool.get_client(server_url, 10)
+
+    first = asyncio.run(fetch())
+    second = asyncio.run(fetch())
+    assert first is not second
+
+
+def test_pool_evicts_idle_clients_beyond_limit(server_url):
+    pool = HTTPClientPool(max_clients=2)
+
+    async def run():
+        busy = pool.get_client(f"{server_url}/busy", 30)
+        async with busy.stream("POST", f"{server_url}/busy", json={}) as response:
+            # 流式响应未关闭前，客户端有进行中的请求，不会被淘汰
+            clients = [pool.get_client(server_url, timeout) for timeout in (10, 20)]
+            await asyncio.sleep(0.05)
+            assert not busy.is_closed
+            assert clients[0].is_closed
+            await response.aread()
+        pool.get_client(server_url, 40)
+        await asyncio.sleep(0.05)
+        return busy, clients
+
+    busy, clients = asyncio.run(run())
+
+    assert busy.is_closed
+    assert not clients[1].is_closed
+    assert len(pool.stats()["clients"]) == 2
+
+
+def test_pool_closes_client_replaced_after_loop_change(server_url):
+    pool = HTTPClientPool()
+
+    async def fetch():
+        client = pool.get_client(server_url, 30)
+        await client.post(f"{server_url}/v1", json={})
+        await asyncio.sleep(0.05)
+        return client
+
+    first = asyncio.run(fetch())
+    asyncio.run(fetch())
+
+    assert first.is_closed
@@ -0,0 +1,116 @@
+import asyncio
+import json
+import sqlite3
+import time
+
+import httpx
+
+import services.ai_analyzer as ai_module
+from services.ai_analyzer import AIAnalyzer
+from services.llm_response_cache import LLMResponseCache, replay_text, response_cache_key
+
+
+def test_key_depends_on_model_temperature_and_prompt():
+    key = response_cache_key("m", 0.7, "prompt")
+    assert key == response_cache_key("m", 0.7, "prompt")
+    assert len({key, response_cache_key("m2", 0.7, "prompt"), response_cache_key("m", 0.2, "prompt"),
+                response_cache_key("m", 0.7, "prompt2")}) == 4
+
+
+def test_lru_eviction_by_size_and_persistence(tmp_path):
+    db_path = str(tmp_path / "llm.db")
+    cache = LLMResponseCache(db_path, max_bytes=250)
+    for name in ("a", "b", "c"):
+        cache.put(name, "m", name * 100)
+        time.sleep(0.01)
+    # c写入后超出上限，淘汰最久未访问的a
+    assert cache.lookup({"m": "a"}) is None
+    assert cache.lookup({"m": "b"}) == ("m", "b" * 100, "")
+    time.sleep(0.01)
+    cache.put("d", "m", "d" * 100)
+    # b刚被访问过，淘汰的是c
+    assert cache.lookup({"m": "c"}) is None
+    stats = cache.stats()
+    assert stats["entries"] == 2 and stats["bytes"] == 200 and stats["evictions"] == 2
+    cache.close()
+
+    reopened = LLMResponseCache(db_path, max_bytes=250)
+    assert reopened.total_bytes == 200
+    assert reopened.lookup({"other": "x", "m": "d"}) == ("m", "d" * 100, "")
+
+
+def test_eviction_counts_entries_written_by_other_workers(tmp_path):
+    db_path = str(tmp_path / "llm.db")
+    first = LLMResponseCache(db_path, max_bytes=250)
+    second = LLMResponseCache(db_path, max_bytes=250)
+    first.put("a", "m", "a" * 100)
+    time.sleep(0.01)
+    second.put("b", "m", "b" * 100)
+    time.sleep(0.01)
+    first.put("c", "m", "c" * 100)
+    # first写入c时按数据库中的实际总大小淘汰，包括second写入的b
+    assert first.total_bytes == second.total_bytes == 200
+    assert second.lookup({"m": "a"}) is None
+
+
+def test_lookup_returns_originating_endpoint(tmp_path):
+    db_path = str(tmp_path / "llm.db")
+    cache = LLMResponseCache(db_path)
+    cache.put("k", "m", "text", "https://a.test/v1/chat/completions")
+    assert cache.lookup({"m": "k"}) == ("m", "text", "https://a.test/v1/chat/completions")
+    cache.close()
+
+    # 旧版本的数据库补充端点字段，已有条目的来源未知
+    conn = sqlite3.connect(str(tmp_path / "old.db"))
+    conn.execute("CREATE TABLE llm_responses (cache_key TEXT PRIMARY KEY, model TEXT NOT NULL, response TEXT NOT NULL, "
+                 "size INTEGER NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL, "
+                 "hits INTEGER NOT NULL DEFAULT 0)")
+    conn.execute("INSERT INTO llm_responses VALUES ('k', 'm', 'old', 3, 0, 0, 0)")
+    conn.commit()
+    conn.close()
+    assert LLMResponseCache(str(tmp_path / "old.db")).lookup({"m": "k"}) == ("m", "old", "")
+
+
+def test_paced_replay():
+    async def run(cps):
+        started = time.perf_counter()
+        pieces = [piece async for piece in replay_text("x" * 100, chunk_chars=20, chars_per_sec=cps)]
+        return pieces, time.perf_counter() - started
+
+    pieces, elapsed = asyncio.run(run(0))
+    assert "".join(pieces) == "x" * 100 and len(pieces) == 5 and elapsed < 0.05
+    _, elapsed = asyncio.run(run(1000))
+    assert elapsed >= 0.075
+
+
+def test_hit_replays_stream_without_calling_api(monkeypatch, tmp_path, stub_llm, make_frame):
+    requests = []
+
+    async def handler(request):
+        requests.append(json.loads(request.content))
+        body = ("data: " + json.dumps({"choices": [{"delta": {"content": "## 投资建议\n持有"}}]}) + "\n\n"
+                "data: [DONE]\n\n")
+        return httpx.Response(200, content=body.encode())
+
+    stub_llm(handler)
+    cache = LLMResponseCache(str(tmp_path / "llm.db"))
+    monkeypatch.setattr(ai_module, "get_llm_response_cache", lambda: cache)
+
+    async def run():
+        analyzer = AIAnalyzer(custom_api_url="http://cached.test", custom_api_key="k", custom_api_model="m")
+        first = [json.loads(f) async for f in analyzer.get_ai_analysis(make_frame(), "600519", stream=True)]
+        second = [json.loads(f) async for f in analyzer.get_ai_analysis(make_frame(), "600519", stream=True)]
+        plain = [json.loads(f) async for f in analyzer.get_ai_analysis(make_frame(), "600519", stream=False)]
+        return first, second, plain
+
+    first, second, plain = asyncio.run(run())
+    assert len(requests) == 1
+    text = lambda frames: "".join(f.get("ai_analysis_chunk", "") for f in frames)
+    assert text(second) == text(first) == "## 投资建议\n持有\n"
+    assert [f.get("status") for f in second[:-1]] == [f.get("status") for f in first[:-1]]
+    assert second[-2]["recommendation"] == "持有"
+    assert second[-1]["timings"]["cache_hit"] is True and "cache_hit" not in first[-1]["timings"]
+    # 命中时报告最初生成该输出的端点
+    assert second[-1]["timings"]["endpoint"] == first[-1]["timings"]["endpoint"] == "cached.test"
+    assert plain[1]["analysis"] == "## 投资建议\n持有"
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import time
+
+import httpx
+
+from services.ai_analyzer import AIAnalyzer
+from services.llm_router import LLMEndpoint, LLMRouter
+
+
+def _stub_servers(stub_llm, routes):
+    """按host把请求路由到本地桩实现"""
+    seen = []
+
+    async def handler(request):
+        seen.append(request.url.host)
+        return await routes[request.url.host](request)
+
+    stub_llm(handler)
+    return seen
+
+
+def _analyze(router, frame, stream=True):
+    async def run():
+        analyzer = AIAnalyzer()
+        analyzer.router = router
+        return [json.loads(f) async for f in analyzer.get_ai_analysis(frame, "600519", stream=stream)]
+    return asyncio.run(run())
+
+
+def test_failover_to_healthy_endpoint(stub_llm, sse_body, make_frame):
+    async def broken(request):
+        return httpx.Response(503, json={"error": {"message": "overloaded"}}, headers={"Retry-After": "30"})
+
+    async def healthy(request):
+        if json.loads(request.content)["stream"]:
+            return httpx.Response(200, content=sse_body(["建议", "持有"]))
+        return httpx.Response(200, json={"choices": [{"message": {"content": "建议持有"}}]})
+
+    _stub_servers(stub_llm, {"a.test": broken, "b.test": healthy})
+    primary = LLMEndpoint("http://a.test", "ka", "model-a", weight=1000)
+    backup = LLMEndpoint("http://b.test", "kb", "model-b", weight=0.001)
+    router = LLMRouter([primary, backup], hedge_enabled=False)
+
+    frames = _analyze(router, make_frame())
+    assert "".join(f.get("ai_analysis_chunk", "") for f in frames) == "建议持有\n"
+    assert frames[-1]["timings"]["model"] == "model-b"
+    assert router.failovers == 1
+    assert not primary.available() and primary.cooldown_until - time.monotonic() > 25
+
+    # 冷却中的端点排在最后，非流式请求直接命中健康端点
+    frames = _analyze(router, make_frame(), stream=False)
+    assert frames[-2]["analysis"] == "建议持有"
+    assert router.failovers == 1
+
+
+def test_all_endpoints_failing_reports_error(stub_llm, make_frame):
+    async def broken(request):
+        raise httpx.ConnectError("connection refused")
+
+    _stub_servers(stub_llm, {"a.test": broken, "b.test": broken})
+    router = LLMRouter([LLMEndpoint("http://a.test", "k", "m"), LLMEndpoint("http://b.test", "k", "m")],
+                       hedge_enabled=False)
+    frames = _analyze(router, make_frame())
+    assert frames[-1]["status"] == "error"
+    assert "connection refused" in frames[-1]["error"]
+
+
+def test_hedged_request_wins_when_primary_is_slow(stub_llm, sse_body, make_frame):
+    async def slow(request):
+        return httpx.Response(200, content=sse_body(["慢"], first_delay=2.0))
+
+    async def fast(request):
+        return httpx.Response(200, content=sse_body(["快速", "响应"]))
+
+    seen = _stub_servers(stub_llm, {"slow.test": slow, "fast.test": fast})
+    router = LLMRouter([LLMEndpoint("http://slow.test", "k", "m", weight=1000),
+                        LLMEndpoint("http://fast.test", "k", "m", weight=0.001)],
+                       hedge_enabled=True, hedge_min_delay_ms=50, hedge_default_delay_ms=100)
+
+    start = time.monotonic()
+    frames = _analyze(router, make_frame())
+    assert time.monotonic() - start < 1.5
+    assert seen == ["slow.test", "fast.test"]
+    assert "".join(f.get("ai_analysis_chunk", "") for f in frames) == "快速响应\n"
+    assert frames[-1]["timings"]["endpoint"] == "fast.test"
+    assert router.hedges_started == 1 and router.hedges_won == 1
+
+
+def test_candidates_respect_weights_and_cooldown():
+    zero = LLMEndpoint("http://zero.test", "k", "m", weight=0)
+    cooling = LLMEndpoint("http://cool.test", "k", "m")
+    cooling.record_failure(retry_after=60)
+    active = LLMEndpoint("http://ok.test", "k", "m")
+    router = LLMRouter([zero, cooling, active])
+    order = router.candidates()
+    assert order[0] is active and order[-1] in (zero, cooling)
+    assert set(order) == {zero, cooling, active}
+
+
+def test_endpoints_on_same_host_get_distinct_names(stub_llm, sse_body, make_frame):
+    async def by_model(request):
+        if json.loads(request.content)["model"] == "slow-model":
+            return httpx.Response(200, content=sse_body(["慢"], first_delay=2.0))
+        return httpx.Response(200, content=sse_body(["快速", "响应"]))
+
+    _stub_servers(stub_llm, {"same.test": by_model})
+    endpoints = [LLMEndpoint("http://same.test", "k", "slow-model", weight=1000),
+                 LLMEndpoint("http://same.test", "k", "fast-model", weight=0.001),
+                 LLMEndpoint("http://same.test", "k2", "fast-model", weight=0)]
+    router = LLMRouter(endpoints, hedge_enabled=True, hedge_min_delay_ms=50, hedge_default_delay_ms=100)
+    assert [ep.name for ep in endpoints] == ["same.test/slow-model", "same.test/fast-model",
+                                             "same.test/fast-model#2"]
+
+    # 主请求和对冲请求在同一主机上，各自的计时互不覆盖
+    frames = _analyze(router, make_frame())
+    assert "".join(f.get("ai_analysis_chunk", "") for f in frames) == "快速响应\n"
+    assert router.hedges_won == 1 and frames[-1]["timings"]["model"] == "fast-model"
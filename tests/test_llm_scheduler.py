@@ -0,0 +1,151 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+
+import httpx
+
+import services.llm_scheduler as scheduler_module
+from services.ai_analyzer import AIAnalyzer
+from services.llm_scheduler import (PRIORITY_BATCH, PRIORITY_INTERACTIVE, EndpointScheduler, TokenBucket,
+                                    get_endpoint_scheduler, parse_duration, scheduler_stats)
+
+
+def test_parse_rate_limit_durations():
+    assert parse_duration("6m0s") == 360
+    assert parse_duration("1s") == 1
+    assert abs(parse_duration("20ms") - 0.02) < 1e-9
+    assert parse_duration("1.5") == 1.5
+    assert parse_duration("soon") is None
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(60)
+    assert bucket.wait_time(1) == 0
+    bucket.consume(60)
+    assert 0.9 < bucket.wait_time(1) <= 1.0
+    # 超过容量的请求在桶满时放行，而不是永远等待
+    assert TokenBucket(100).wait_time(1000) == 0
+    assert TokenBucket(0).wait_time(10 ** 9) == 0
+
+
+def test_interactive_first_then_round_robin_across_users():
+    async def run():
+        scheduler = EndpointScheduler("fair.test", max_concurrency=1)
+        holder = scheduler.enqueue("someone", PRIORITY_BATCH)
+        assert holder.granted
+
+        order = []
+        tickets = [(name, scheduler.enqueue(user, priority)) for name, user, priority in [
+            ("a1", "alice", PRIORITY_BATCH), ("a2", "alice", PRIORITY_BATCH), ("a3", "alice", PRIORITY_BATCH),
+            ("b1", "bob", PRIORITY_BATCH), ("c1", "carol", PRIORITY_INTERACTIVE),
+        ]]
+        positions = {name: scheduler.position(ticket._waiter) for name, ticket in tickets}
+        assert positions == {"c1": 1, "a1": 2, "b1": 3, "a2": 4, "a3": 5}
+
+        async def worker(name, ticket):
+            async for _ in ticket.wait():
+                pass
+            order.append(name)
+            await asyncio.sleep(0)
+            ticket.release()
+
+        tasks = [asyncio.create_task(worker(name, ticket)) for name, ticket in tickets]
+        await asyncio.sleep(0)
+        holder.release()
+        await asyncio.gather(*tasks)
+        return order, scheduler.stats()
+
+    order, stats = asyncio.run(run())
+    assert order == ["c1", "a1", "b1", "a2", "a3"]
+    assert stats["in_flight"] == 0 and stats["queued"] == 0 and stats["granted"] == 6
+
+
+def test_rate_limit_headers_pause_dispatch():
+    async def run():
+        scheduler = EndpointScheduler("headers.test", rpm=100)
+        scheduler.update_from_headers({"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "50ms"})
+        started = time.monotonic()
+        ticket = scheduler.enqueue("u")
+        positions = [position async for position in ticket.wait()]
+        ticket.release()
+        return positions, time.monotonic() - started
+
+    positions, elapsed = asyncio.run(run())
+    assert positions == [1]
+    assert elapsed >= 0.04
+
+
+def test_429_is_requeued_instead_of_failing(stub_llm, sse_body, make_frame):
+    calls = []
+
+    async def handler(request):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            return httpx.Response(429, json={"error": {"message": "rate limited"}}, headers={"Retry-After": "0.05"})
+        return httpx.Response(200, content=sse_body(["建议", "持有"]))
+
+    stub_llm(handler)
+
+    async def run():
+        analyzer = AIAnalyzer(custom_api_url="http://ratelimited.test", custom_api_key="k", custom_api_model="m")
+        return [json.loads(f) async for f in analyzer.get_ai_analysis(make_frame(), "600519", stream=True)]
+
+    frames = asyncio.run(run())
+    assert len(calls) == 2 and calls[1] - calls[0] >= 0.04
+    assert not any(frame.get("status") == "error" for frame in frames)
+    assert frames[-2]["status"] == "completed"
+    assert get_endpoint_scheduler("http://ratelimited.test/v1/chat/completions", "k").rate_limited == 1
+
+
+def test_queue_position_is_streamed_while_waiting(stub_llm, sse_body, make_frame):
+    async def handler(request):
+        return httpx.Response(200, content=sse_body(["建议持有"]))
+
+    stub_llm(handler)
+
+    async def run():
+        analyzer = AIAnalyzer(custom_api_url="http://busy.test", custom_api_key="k", custom_api_model="m",
+                              user_id="alice")
+        scheduler = analyzer._get_scheduler(analyzer.router.endpoints[0])
+        # 占满该端点的并发名额
+        holders = [scheduler.enqueue("bob", PRIORITY_BATCH) for _ in range(scheduler.max_concurrency)]
+        frames = []
+
+        async def consume():
+            async for frame in analyzer.get_ai_analysis(make_frame(), "600519", stream=True):
+                frames.append(json.loads(frame))
+
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.05)
+        queued = list(frames)
+        for holder in holders:
+            holder.release()
+        await task
+        return queued, frames
+
+    queued, frames = asyncio.run(run())
+    assert queued[-1] == {"stock_code": "600519", "status": "waiting", "queue_position": 1}
+    assert {"stock_code": "600519", "status": "analyzing", "queue_position": 0} in frames
+    assert frames[-2]["status"] == "completed"
+
+
+def test_registry_evicts_idle_schedulers_and_keys_stats_by_key(monkeypatch):
+    monkeypatch.setattr(scheduler_module, "_schedulers", OrderedDict())
+    monkeypatch.setattr(scheduler_module, "AI_MAX_SCHEDULERS", 2)
+
+    async def run():
+        busy = get_endpoint_scheduler("http://shared.test", "key-0", "shared")
+        ticket = busy.enqueue("alice")
+        for index in range(1, 5):
+            get_endpoint_scheduler("http://shared.test", f"key-{index}", "shared")
+        stats = scheduler_stats()
+        ticket.release()
+        return busy, stats
+
+    busy, stats = asyncio.run(run())
+    # 进行中的调度器不会被淘汰，空闲的按最久未使用淘汰
+    assert len(stats) == 2
+    assert get_endpoint_scheduler("http://shared.test", "key-0") is busy
+    # 同一端点的不同密钥在统计中不会相互覆盖
+    assert all(name.startswith("shared#") for name in stats) and len(set(stats)) == 2
@@ -0,0 +1,40 @@
+import asyncio
+import time
+
+from utils.loop_monitor import LoopLagMonitor
+from utils.compute_executor import run_compute, chunked
+
+
+def test_monitor_reports_lag_and_blocking_stack():
+    async def run():
+        monitor = LoopLagMonitor(interval_ms=10, block_debug=True, block_threshold_ms=50)
+        monitor.start()
+        await asyncio.sleep(0.05)
+        time.sleep(0.2)  # 阻塞事件循环
+        await asyncio.sleep(0.05)
+        await monitor.stop()
+        return monitor.stats()
+
+    stats = asyncio.run(run())
+
+    assert stats["samples"] > 0
+    assert stats["max_ms"] >= 150
+    assert stats["blocked_count"] == 1
+
+
+def test_run_compute_keeps_loop_responsive():
+    async def run():
+        monitor = LoopLagMonitor(interval_ms=10)
+        monitor.start()
+        await asyncio.gather(*(run_compute(time.sleep, 0.05) for _ in range(4)))
+        await monitor.stop()
+        return monitor.stats()
+
+    assert asyncio.run(run())["max_ms"] < 50
+
+
+def test_chunked_preserves_all_items():
+    items = {str(i): i for i in range(45)}
+    chunks = list(chunked(items, 20))
+    assert [len(c) for c in chunks] == [20, 20, 5]
+    assert {k: v for c in chunks for k, v in c.items()} == items
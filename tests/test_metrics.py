@@ -0,0 +1,103 @@
+import asyncio
+import os
+
+import pandas as pd
+
+import services.stock_data_provider as stock_data_provider
+from services.stock_data_provider import StockDataProvider
+from utils.llm_metrics import Histogram
+from utils.prometheus import MERGE_MAX, MetricsWriter, read_worker_metrics, write_worker_metrics
+from utils.stage_metrics import STAGE_BUCKETS_MS, StageMetrics
+
+
+def test_histogram_exposition_is_cumulative_and_in_seconds():
+    histogram = Histogram((100, 1000, float("inf")))
+    for ms in (50, 500, 700, 5000):
+        histogram.observe(ms)
+    writer = MetricsWriter(prefix="test_")
+    writer.histogram("stage_duration_seconds", "耗时", [({"market": 'A"1'}, histogram)])
+    lines = writer.render().splitlines()
+
+    assert lines[:2] == ["# HELP test_stage_duration_seconds 耗时", "# TYPE test_stage_duration_seconds histogram"]
+    assert lines[2:] == [
+        'test_stage_duration_seconds_bucket{le="0.1",market="A\\"1"} 1',
+        'test_stage_duration_seconds_bucket{le="1",market="A\\"1"} 3',
+        'test_stage_duration_seconds_bucket{le="+Inf",market="A\\"1"} 4',
+        'test_stage_duration_seconds_sum{market="A\\"1"} 6.25',
+        'test_stage_duration_seconds_count{market="A\\"1"} 4',
+    ]
+
+
+def test_stage_metrics_keep_series_per_label_set():
+    metrics = StageMetrics()
+    with metrics.time("indicators"):
+        pass
+    metrics.observe("data_fetch", 30, market="A", source="stock_zh_a_hist")
+    metrics.observe("data_fetch", 40, source="stock_zh_a_hist", market="A")
+    metrics.observe("data_fetch", 900, market="US", source="stock_us_daily")
+    metrics.inc("frames_streamed", transport="sse")
+    metrics.inc("frames_streamed", 2, transport="sse")
+
+    series = {labels["market"]: histogram for labels, histogram in metrics.histograms("data_fetch")}
+    assert metrics.stages() == ["data_fetch", "indicators"]
+    assert series["A"].count == 2 and series["US"].count == 1
+    assert series["A"].buckets == STAGE_BUCKETS_MS
+    assert metrics.counters("frames_streamed") == [({"transport": "sse"}, 3)]
+
+
+def test_data_fetch_is_timed_per_market_and_source(monkeypatch):
+    metrics = StageMetrics()
+    monkeypatch.setattr(stock_data_provider, "get_stage_metrics", lambda: metrics)
+
+    def fake_fetch(self, stock_code, market_type='A', start_date=None, end_date=None):
+        if stock_code == "bad":
+            df = pd.DataFrame()
+            df.error = "获取失败"
+            return df
+        return pd.DataFrame({"Close": [1.0]})
+
+    monkeypatch.setattr(StockDataProvider, "_get_stock_data_sync", fake_fetch)
+    provider = StockDataProvider()
+
+    async def run():
+        await provider.get_stock_data("000001", "A")
+        await provider.get_stock_data("bad", "ETF")
+
+    asyncio.run(run())
+    labels = sorted((l["market"], l["source"]) for l, _ in metrics.histograms("data_fetch"))
+    assert labels == [("A", "stock_zh_a_hist"), ("ETF", "fund_etf_hist_em")]
+    statuses = {l["market"]: (l["status"], value) for l, value in metrics.counters("data_fetches")}
+    assert statuses == {"A": ("ok", 1), "ETF": ("error", 1)}
+
+
+def test_worker_metrics_merge_counters_histograms_and_gauges(tmp_path, monkeypatch):
+    def worker(fetches, queued, entries, lag_ms):
+        histogram = Histogram((100, float("inf")))
+        histogram.observe(lag_ms)
+        writer = MetricsWriter(prefix="test_")
+        writer.counter("data_fetches", "获取次数", [({"market": "A"}, fetches)])
+        writer.histogram("fetch_duration_seconds", "耗时", [({}, histogram)])
+        writer.gauge("queue_depth", "排队数", [({}, queued)])
+        writer.gauge("cache_entries", "条目数", [({}, entries)], merge=MERGE_MAX)
+        return writer
+
+    # 另一个进程写出的指标文件，经文件往返后合并
+    write_worker_metrics(worker(3, 2, 10, 500), str(tmp_path))
+    (tmp_path / f"{os.getpid()}.json").rename(tmp_path / "999999.json")
+    (_, families, alive), = read_worker_metrics(str(tmp_path))
+
+    live = worker(1, 1, 10, 50)
+    live.merge(families, alive=True)
+    text = live.render()
+    assert 'test_data_fetches_total{market="A"} 4' in text
+    assert 'test_fetch_duration_seconds_bucket{le="0.1"} 1' in text
+    assert 'test_fetch_duration_seconds_count 2' in text
+    assert 'test_queue_depth 3' in text
+    assert 'test_cache_entries 10' in text
+
+    # 已退出进程的计数保留，当前值丢弃
+    exited = worker(1, 1, 10, 50)
+    exited.merge(families, alive=False)
+    text = exited.render()
+    assert 'test_data_fetches_total{market="A"} 4' in text
+    assert 'test_queue_depth 1' in text
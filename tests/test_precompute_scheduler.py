@@ -0,0 +1,150 @@
+import asyncio
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from services.precompute_scheduler import PrecomputeScheduler, PrecomputeStore
+from utils.trading_calendar import CN_TZ, TradingCalendar
+
+
+def _calendar(trade_dates):
+    calendar = TradingCalendar()
+    calendar._trade_dates = set(trade_dates)
+    calendar._last_trade_date = max(trade_dates)
+    calendar._next_refresh = datetime.now() + timedelta(days=1)
+    return calendar
+
+
+# 2024-10-01 ~ 2024-10-07 国庆休市
+TRADE_DATES = [date(2024, 9, 27), date(2024, 9, 30), date(2024, 10, 8), date(2024, 10, 9)]
+
+
+def _after_close(monkeypatch, now=datetime(2024, 10, 9, 15, 40, tzinfo=CN_TZ)):
+    """固定当前时间为最后一个交易日收盘后"""
+    monkeypatch.setattr("utils.trading_calendar.now_cn", lambda: now)
+    monkeypatch.setattr("services.precompute_scheduler.now_cn", lambda: now)
+
+
+def test_latest_closed_session_skips_holidays():
+    calendar = _calendar(TRADE_DATES)
+
+    holiday = datetime(2024, 10, 3, 16, 0, tzinfo=CN_TZ)
+    assert calendar.latest_closed_session('A', holiday) == date(2024, 9, 30)
+
+    before_close = datetime(2024, 10, 8, 14, 0, tzinfo=CN_TZ)
+    assert calendar.latest_closed_session('A', before_close) == date(2024, 9, 30)
+    assert calendar.is_in_session('A', before_close)
+
+    after_close = datetime(2024, 10, 8, 15, 30, tzinfo=CN_TZ)
+    assert calendar.latest_closed_session('A', after_close) == date(2024, 10, 8)
+    assert not calendar.is_in_session('A', after_close)
+
+
+def test_us_session_spans_beijing_midnight():
+    calendar = _calendar(TRADE_DATES)
+
+    # 周二北京时间06:00，周一的美股交易日已收盘
+    assert calendar.latest_closed_session('US', datetime(2024, 10, 8, 6, 0, tzinfo=CN_TZ)) == date(2024, 10, 7)
+    assert calendar.is_in_session('US', datetime(2024, 10, 8, 2, 0, tzinfo=CN_TZ))
+    assert not calendar.is_in_session('US', datetime(2024, 10, 8, 12, 0, tzinfo=CN_TZ))
+
+
+def test_watchlist_not_due_on_holiday_after_previous_run(tmp_path, monkeypatch):
+    store = PrecomputeStore(str(tmp_path / "precompute.db"))
+    scheduler = PrecomputeScheduler(store=store, watchlists_path=str(tmp_path / "watchlists.json"))
+    scheduler.calendar = _calendar(TRADE_DATES)
+    config = {"market_type": "A", "stock_codes": ["600519"]}
+
+    monkeypatch.setattr("services.precompute_scheduler.now_cn", lambda: datetime(2024, 9, 30, 15, 40, tzinfo=CN_TZ))
+    assert scheduler._is_due("自选", config)
+
+    store.save_run("自选", "A", "2024-09-30", 1, 1, 0.1)
+    monkeypatch.setattr("services.precompute_scheduler.now_cn", lambda: datetime(2024, 10, 2, 15, 40, tzinfo=CN_TZ))
+    assert not scheduler._is_due("自选", config)
+
+
+def test_run_watchlist_stores_indicators(tmp_path, monkeypatch):
+    _after_close(monkeypatch)
+    store = PrecomputeStore(str(tmp_path / "precompute.db"))
+    scheduler = PrecomputeScheduler(store=store, watchlists_path=str(tmp_path / "watchlists.json"))
+    scheduler.calendar = _calendar(TRADE_DATES)
+
+    index = pd.date_range(end="2024-10-09", periods=90, freq="D")
+    close = np.linspace(10, 20, 90)
+    df = pd.DataFrame({"Open": close, "High": close, "Low": close, "Close": close, "Volume": np.full(90, 1000.0)}, index=index)
+
+    async def fake_fetch(stock_codes, market_type='A', start_date=None, end_date=None, max_concurrency=5):
+        return {code: df for code in stock_codes}
+
+    scheduler.data_provider.get_multiple_stocks_data = fake_fetch
+    succeeded = asyncio.run(scheduler.run_watchlist("自选", {"market_type": "A", "stock_codes": ["600519"]}))
+
+    trade_date = scheduler.calendar.latest_closed_session('A').isoformat()
+    stored = store.get("600519", "A", trade_date)
+    assert succeeded == 1
+    assert "MA20" in stored.columns and len(stored) == 90
+    assert store.get_last_run("自选")["trade_date"] == trade_date
+
+
+def test_run_watchlist_keeps_only_latest_sessions(tmp_path, monkeypatch):
+    _after_close(monkeypatch)
+    store = PrecomputeStore(str(tmp_path / "precompute.db"))
+    scheduler = PrecomputeScheduler(store=store, watchlists_path=str(tmp_path / "watchlists.json"))
+    scheduler.calendar = _calendar(TRADE_DATES)
+    scheduler.keep_days = 2
+
+    df = pd.DataFrame({"Close": np.linspace(10, 20, 90)}, index=pd.date_range(end="2024-10-09", periods=90, freq="D"))
+    for trade_date in ("2024-09-26", "2024-09-27", "2024-09-30"):
+        store.save("600519", "A", trade_date, {}, df)
+    store.save("AAPL", "US", "2024-09-26", {}, df)
+
+    async def fake_fetch(stock_codes, market_type='A', start_date=None, end_date=None, max_concurrency=5):
+        return {code: df for code in stock_codes}
+
+    scheduler.indicator.calculate_indicators = lambda frame: frame.assign(MA20=frame["Close"])
+    scheduler.scorer.calculate_score = lambda frame: 50
+    scheduler.data_provider.get_multiple_stocks_data = fake_fetch
+    asyncio.run(scheduler.run_watchlist("自选", {"market_type": "A", "stock_codes": ["600519"]}))
+
+    trade_date = scheduler.calendar.latest_closed_session('A').isoformat()
+    kept = [row["trade_date"] for row in store.query(
+        "SELECT trade_date FROM precomputed WHERE market_type = 'A' ORDER BY trade_date")]
+    assert kept == sorted({"2024-09-30", trade_date})
+    # 其他市场的结果不受影响
+    assert store.get("AAPL", "US", "2024-09-26") is not None
+
+
+def test_stale_bars_are_skipped_and_run_retried(tmp_path, monkeypatch):
+    store = PrecomputeStore(str(tmp_path / "precompute.db"))
+    scheduler = PrecomputeScheduler(store=store, watchlists_path=str(tmp_path / "watchlists.json"))
+    scheduler.calendar = _calendar(TRADE_DATES)
+    scheduler.stale_attempts = 2
+    config = {"market_type": "A", "stock_codes": ["600519", "000001"]}
+    _after_close(monkeypatch)
+
+    def frame(last_day):
+        return pd.DataFrame({"Close": np.linspace(10, 20, 90)}, index=pd.date_range(end=last_day, periods=90, freq="D"))
+
+    # 000001的当日K线尚未发布
+    async def fake_fetch(stock_codes, market_type='A', start_date=None, end_date=None, max_concurrency=5):
+        return {"600519": frame("2024-10-09"), "000001": frame("2024-10-08")}
+
+    scheduler.indicator.calculate_indicators = lambda df: df.assign(MA20=df["Close"])
+    scheduler.scorer.calculate_score = lambda df: 50
+    scheduler.data_provider.get_multiple_stocks_data = fake_fetch
+
+    assert asyncio.run(scheduler.run_watchlist("自选", config)) == 1
+    assert store.get("000001", "A", "2024-10-09") is None
+    assert store.get("600519", "A", "2024-10-09") is not None
+    # 不记录本次运行，等待重试间隔后再次计算
+    assert store.get_last_run("自选") is None
+    assert not scheduler._is_due("自选", config)
+    scheduler.stale_retry_seconds = 0
+    scheduler._pending["自选"] = (*scheduler._pending["自选"][:2], 0.0)
+    assert scheduler._is_due("自选", config)
+
+    # 用尽尝试次数后（如停牌股票）按已有结果完成
+    asyncio.run(scheduler.run_watchlist("自选", config))
+    assert store.get_last_run("自选")["trade_date"] == "2024-10-09"
+    assert not scheduler._is_due("自选", config)
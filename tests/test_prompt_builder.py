@@ -0,0 +1,43 @@
+from benchmarks.bench_prompt import legacy_prompt, make_frame
+from services.prompt_builder import PromptBuilder, estimate_tokens
+
+SUMMARY = {'trend': 'upward', 'volatility': '1.23%', 'volume_trend': 'increasing', 'rsi_level': 55.12}
+
+
+def test_compact_prompt_is_rounded_table_and_much_smaller():
+    df = make_frame()
+    prompt, tokens = PromptBuilder().build(df, '600519', 'A', SUMMARY)
+
+    lines = prompt.splitlines()
+    header = next(line for line in lines if line.startswith('日期|'))
+    assert header.split('|')[:5] == ['日期', '开', '高', '低', '收']
+    assert '2024-09-30|' in prompt
+    assert 'BB_Upper' not in prompt and 'Histogram' not in prompt
+    assert tokens == estimate_tokens(prompt)
+    assert tokens * 3 < estimate_tokens(legacy_prompt(df, '600519', SUMMARY))
+
+
+def test_token_budget_trims_bars_then_columns(monkeypatch):
+    df = make_frame()
+    full, full_tokens = PromptBuilder().build(df, '00700', 'HK', SUMMARY)
+
+    monkeypatch.setenv('PROMPT_TOKEN_BUDGET_HK', str(full_tokens - 80))
+    trimmed, trimmed_tokens = PromptBuilder().build(df, '00700', 'HK', SUMMARY)
+    assert trimmed_tokens <= full_tokens - 80
+    assert '港币' in trimmed
+    assert trimmed.count('\n2024-') < full.count('\n2024-')
+
+    tight, _ = PromptBuilder(token_budget=1).build(df, '00700', 'HK', SUMMARY)
+    header = next(line for line in tight.splitlines() if line.startswith('日期|'))
+    assert header == '日期|开|高|低|收|涨跌%|量'
+    assert tight.count('\n2024-') == 5
+
+
+def test_change_column_is_percent_not_absolute_change():
+    df = make_frame()
+    # A股数据中Change是涨跌额，Change_pct才是涨跌幅
+    df['Change'] = 999.0
+    prompt, _ = PromptBuilder(recent_bars=5).build(df, '600519', 'A', {})
+    header, first = [line for line in prompt.splitlines() if line.startswith(('日期|', '20'))][:2]
+    change = first.split('|')[header.split('|').index('涨跌%')]
+    assert change == f"{df['Change_pct'].iloc[-5]:.2f}"
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import time
+
+from services.scan_job_service import ScanJobService, ScanJobStore
+from services.stock_analyzer_service import StockAnalyzerService
+from services.ai_analyzer import AIAnalyzer
+
+
+def _patch_analyzer(monkeypatch, evaluated):
+    async def fake_evaluate(self, stock_code, market_type='A', min_score=0):
+        evaluated.append(stock_code)
+        score = int(stock_code[-2:])
+        return {"stock_code": stock_code, "score": score, "recommendation": "观望", "status": "waiting"}, object()
+
+    async def fake_ai(self, df, stock_code, market_type='A', stream=False):
+        yield json.dumps({"stock_code": stock_code, "ai_analysis_chunk": f"analysis {stock_code}", "status": "analyzing"})
+        yield json.dumps({"stock_code": stock_code, "status": "completed"})
+
+    async def fake_batch(self, stocks, market_type='A', stream=False):
+        for stock_code, df in stocks:
+            async for chunk in fake_ai(self, df, stock_code, market_type, stream):
+                yield chunk
+        yield json.dumps({"stock_codes": [code for code, _ in stocks], "timings": {}})
+
+    monkeypatch.setattr(StockAnalyzerService, "evaluate_stock", fake_evaluate)
+    monkeypatch.setattr(AIAnalyzer, "get_ai_analysis", fake_ai)
+    monkeypatch.setattr(AIAnalyzer, "get_batch_ai_analysis", fake_batch)
+
+
+def test_job_checkpoints_and_streams_results(tmp_path, monkeypatch):
+    evaluated = []
+    _patch_analyzer(monkeypatch, evaluated)
+
+    async def run():
+        service = ScanJobService(store=ScanJobStore(str(tmp_path / "jobs.db")), max_workers=1)
+        await service.start()
+        job_id = await service.submit(["000010", "000020", "000030"])
+        frames = [frame async for frame in service.subscribe(job_id)]
+        job = await service.get_job(job_id)
+        await service.stop()
+        return frames, job
+
+    frames, job = asyncio.run(run())
+
+    assert job["status"] == "completed"
+    assert job["progress"] == {"total": 3, "completed": 3, "failed": 0}
+    assert {r["stock_code"]: r["ai_analysis"] for r in job["results"]}["000030"] == "analysis 000030"
+    assert any(frame.get("scan_completed") for frame in frames)
+    assert frames[-1]["job_status"] == "completed"
+
+
+def test_job_resumes_only_unfinished_symbols(tmp_path, monkeypatch):
+    evaluated = []
+    _patch_analyzer(monkeypatch, evaluated)
+
+    store = ScanJobStore(str(tmp_path / "jobs.db"))
+    store.create_job("job1", ["000010", "000020", "000030"], "A", 0, None, None, None)
+    store.update_status("job1", "running")
+    store.save_result("job1", "000010", {"stock_code": "000010", "score": 10, "status": "waiting"})
+    store.save_ai_analysis("job1", "000010", "analysis 000010")
+
+    async def run():
+        service = ScanJobService(store=store, max_workers=1)
+        await service.start()
+        frames = [frame async for frame in service.subscribe("job1")]
+        await service.stop()
+        return frames
+
+    asyncio.run(run())
+
+    assert sorted(evaluated) == ["000020", "000030"]
+    assert store.get_job("job1")["status"] == "completed"
+    assert len(store.get_results("job1")) == 3
+
+
+def test_job_leased_by_another_worker_is_not_run_twice(tmp_path, monkeypatch):
+    evaluated = []
+    _patch_analyzer(monkeypatch, evaluated)
+
+    store = ScanJobStore(str(tmp_path / "jobs.db"))
+    store.create_job("job1", ["000010"], "A", 0, None, None, None)
+    assert store.claim_job("job1", "other-worker", 60)
+
+    async def run():
+        service = ScanJobService(store=ScanJobStore(str(tmp_path / "jobs.db")), max_workers=1)
+        await service.start()
+        await asyncio.sleep(0.05)
+        await service.stop()
+
+    asyncio.run(run())
+    assert evaluated == []
+    assert store.get_job("job1")["status"] == "pending"
+
+    # 持有租约的进程退出后租约过期，由其他进程接手
+    store.execute("UPDATE scan_jobs SET lease_expires = 0 WHERE job_id = 'job1'")
+
+    async def resume():
+        service = ScanJobService(store=store, max_workers=1)
+        await service.start()
+        frames = [frame async for frame in service.subscribe("job1")]
+        await service.stop()
+        return frames
+
+    frames = asyncio.run(resume())
+    assert evaluated == ["000010"]
+    assert frames[-1]["job_status"] == "completed"
+    assert store.get_job("job1")["lease_owner"] is None
+
+
+def test_resumed_job_with_custom_api_url_fails_instead_of_using_server_key(tmp_path, monkeypatch):
+    evaluated = []
+    _patch_analyzer(monkeypatch, evaluated)
+
+    store = ScanJobStore(str(tmp_path / "jobs.db"))
+    store.create_job("job1", ["000010"], "A", 0, "https://user.example.com/v1", None, None)
+    store.update_status("job1", "running")
+
+    async def run():
+        service = ScanJobService(store=store, max_workers=1)
+        await service.start()
+        frames = [frame async for frame in service.subscribe("job1")]
+        await service.stop()
+        return frames, service
+
+    frames, service = asyncio.run(run())
+    job = store.get_job("job1")
+    assert evaluated == []
+    assert job["status"] == "failed" and "API密钥" in job["error"]
+    assert frames[-1]["job_status"] == "failed"
+    assert not service._api_keys and not service._cancelled
+
+
+def test_cancelling_pending_job_clears_in_memory_state(tmp_path, monkeypatch):
+    _patch_analyzer(monkeypatch, [])
+
+    async def run():
+        service = ScanJobService(store=ScanJobStore(str(tmp_path / "jobs.db")), max_workers=1)
+        # 未启动工作池，任务保持排队状态
+        service._queue = asyncio.Queue()
+        job_id = await service.submit(["000010"], api_url="https://user.example.com/v1", api_key="sk-user")
+        await service.cancel(job_id)
+        return service, job_id
+
+    service, job_id = asyncio.run(run())
+    assert service.store.get_job(job_id)["status"] == "cancelled"
+    assert not service._api_keys and not service._cancelled
+
+
+def test_run_stops_when_lease_is_taken_over(tmp_path, monkeypatch):
+    started = []
+
+    async def slow_evaluate(self, stock_code, market_type='A', min_score=0):
+        started.append(stock_code)
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(StockAnalyzerService, "evaluate_stock", slow_evaluate)
+    store = ScanJobStore(str(tmp_path / "jobs.db"))
+
+    async def run():
+        service = ScanJobService(store=store, max_workers=1, symbol_concurrency=1, lease_seconds=0.06)
+        await service.start()
+        job_id = await service.submit(["000010", "000020"])
+        while not started:
+            await asyncio.sleep(0.01)
+        # 本进程续租前，租约过期并被其他进程接手
+        store.execute("UPDATE scan_jobs SET lease_owner = 'other-worker', lease_expires = ? WHERE job_id = ?",
+                      (time.time() + 60, job_id))
+        frames = [frame async for frame in service.subscribe(job_id)]
+        await service.stop()
+        return job_id, frames, service
+
+    job_id, frames, service = asyncio.run(asyncio.wait_for(run(), 5))
+    job = store.get_job(job_id)
+    assert started == ["000010"]
+    assert frames[-1]["job_status"] == "running"
+    assert not service._running and not service._lost
+    assert job["status"] == "running" and job["lease_owner"] == "other-worker"
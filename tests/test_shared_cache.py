@@ -0,0 +1,54 @@
+import threading
+import time
+
+from utils.process_lock import ProcessLock
+from utils.shared_cache import SharedCache
+
+
+def test_concurrent_fetches_share_one_upstream_call(tmp_path):
+    db_path = str(tmp_path / "shared.db")
+    # 两个实例模拟两个工作进程
+    caches = [SharedCache(db_path), SharedCache(db_path)]
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"rows": 3}
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda c=cache: results.append(c.get_or_fetch("bars", "A:000001", fetch, ttl=60)))
+        for cache in caches
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [{"rows": 3}, {"rows": 3}]
+    assert caches[0].stats()["entries"] == 1
+
+
+def test_expired_stale_and_uncacheable_values_are_refetched(tmp_path):
+    cache = SharedCache(str(tmp_path / "shared.db"))
+    cache.put("snapshots", "us", [1], ttl=-1)
+    assert cache.get("snapshots", "us") is None
+
+    cache.put("snapshots", "us", [2], ttl=60)
+    assert cache.get("snapshots", "us") == [2]
+    assert cache.get("snapshots", "us", max_age=-1) is None
+
+    assert cache.get_or_fetch("snapshots", "fund", lambda: [], ttl=60, cacheable=lambda value: len(value) > 0) == []
+    assert cache.get("snapshots", "fund") is None
+
+
+def test_process_lock_is_exclusive(tmp_path):
+    path = str(tmp_path / "scheduler.lock")
+    leader, follower = ProcessLock("scheduler", path), ProcessLock("scheduler", path)
+    assert leader.acquire()
+    assert not follower.acquire()
+    leader.release()
+    assert follower.acquire() and follower.held
+    follower.release()
@@ -0,0 +1,85 @@
+import asyncio
+
+import pandas as pd
+
+from services.fund_service_async import FundServiceAsync
+from utils.snapshot_store import SnapshotStore
+
+
+def test_stale_snapshot_served_while_refreshing():
+    loads = []
+    release = None
+
+    async def loader(key):
+        loads.append(key)
+        if len(loads) > 1:
+            await release.wait()
+        return f"{key}-v{len(loads)}"
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        store = SnapshotStore("测试", loader, ttl=10)
+        assert await store.get("ETF") == "ETF-v1"
+
+        # 接近过期：立即返回旧快照，并发请求只触发一次后台刷新
+        store._entries["ETF"].loaded_at -= 9
+        stale = await asyncio.gather(*(store.get("ETF") for _ in range(5)))
+        refreshing = store.stats()["ETF"]["refreshing"]
+        release.set()
+        await store._refreshing["ETF"]
+        return stale, refreshing, await store.get("ETF"), store.stats()
+
+    stale, refreshing, fresh, stats = asyncio.run(run())
+    assert stale == ["ETF-v1"] * 5 and refreshing
+    assert fresh == "ETF-v2" and loads == ["ETF", "ETF"]
+    assert stats["ETF"]["refreshes"] == 2 and stats["ETF"]["last_refresh_ms"] is not None
+
+
+def test_failed_refresh_keeps_last_snapshot():
+    calls = []
+
+    async def loader(key):
+        calls.append(key)
+        if len(calls) == 2:
+            raise RuntimeError("upstream down")
+        return "good"
+
+    async def run():
+        store = SnapshotStore("测试", loader, ttl=10)
+        await store.get("LOF")
+        store._entries["LOF"].loaded_at -= 100
+        value = await store.get("LOF")
+        await asyncio.gather(store._refreshing["LOF"], return_exceptions=True)
+        return value, store.stats()["LOF"]
+
+    value, stats = asyncio.run(run())
+    assert value == "good"
+    assert stats["failures"] == 1 and stats["last_error"] == "upstream down" and stats["stale"]
+
+
+def test_etf_and_lof_snapshots_are_independent(monkeypatch):
+    service = FundServiceAsync()
+    frame = lambda code, name: pd.DataFrame({  # noqa: E731
+        "symbol": [code], "name": [name], "price": [1.0], "price_change": [0.01],
+        "price_change_percent": ["1.00%"], "volume": [100.0], "market_value": [1e8],
+        "total_value": [2e8], "discount_rate": ["-0.50%"]
+    })
+    fetched = []
+    monkeypatch.setattr(service, "_get_etf_data", lambda: fetched.append("ETF") or frame("510300", "沪深300ETF"))
+    monkeypatch.setattr(service, "_get_lof_data", lambda: fetched.append("LOF") or frame("161725", "白酒LOF"))
+
+    async def run():
+        etf = await service.search_funds("300", "ETF")
+        lof = await service.get_fund_detail("161725", "LOF")
+        # ETF刷新不影响LOF快照的年龄
+        service.snapshots._entries["ETF"].loaded_at -= 10000
+        await service.search_funds("300", "ETF")
+        await service.snapshots._refreshing["ETF"]
+        return etf, lof, service.stats()
+
+    etf, lof, stats = asyncio.run(run())
+    assert etf[0]["symbol"] == "510300"
+    assert lof["discount_rate"] == -0.005 and abs(lof["price_change_percent"] - 0.01) < 1e-12
+    assert fetched == ["ETF", "LOF", "ETF"]
+    assert stats["ETF"]["refreshes"] == 2 and stats["LOF"]["refreshes"] == 1
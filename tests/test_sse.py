@@ -0,0 +1,89 @@
+import asyncio
+import json
+import random
+
+import httpx
+
+from services.ai_analyzer import AIAnalyzer
+from utils.sse import SSEDecoder, TextCoalescer, iterate_with_timeout
+
+
+def _events(contents):
+    return "".join(
+        "data: " + json.dumps({"choices": [{"delta": {"content": c}}]}, ensure_ascii=False) + "\r\n\r\n"
+        for c in contents
+    ) + "data: [DONE]\r\n\r\n"
+
+
+def test_decoder_reassembles_events_split_at_any_position():
+    contents = [f"片段{i}" for i in range(200)]
+    body = ": keep-alive\n\n" + _events(contents)
+    rng = random.Random(3)
+    decoder, decoded, pos = SSEDecoder(), [], 0
+    while pos < len(body):
+        size = rng.randint(1, 40)
+        decoded += decoder.feed(body[pos:pos + size])
+        pos += size
+    decoded += decoder.flush()
+
+    assert decoded[-1] == "[DONE]"
+    assert [json.loads(d)["choices"][0]["delta"]["content"] for d in decoded[:-1]] == contents
+
+
+def test_decoder_joins_multiline_data_and_flushes_unterminated_event():
+    decoder = SSEDecoder()
+    assert decoder.feed("event: message\ndata: a\ndata: b\n\ndata: c") == ["a\nb"]
+    assert decoder.flush() == ["c"]
+
+
+def test_decoder_emits_each_bare_json_line_as_an_event():
+    lines = [json.dumps({"choices": [{"delta": {"content": c}}]}) for c in ("a", "b", "c")]
+    decoder = SSEDecoder()
+    events = decoder.feed("\n".join(lines[:2]) + "\n" + lines[2][:5])
+    events += decoder.feed(lines[2][5:] + "\n")
+    assert events == lines
+    assert decoder.flush() == []
+
+
+def test_coalescer_flushes_on_size_and_time():
+    async def run():
+        async def tokens():
+            for _ in range(10):
+                yield "x"
+            await asyncio.sleep(0.1)
+            yield "y"
+
+        coalescer = TextCoalescer(max_chars=4, max_delay_ms=20)
+        frames = []
+        async for item in iterate_with_timeout(tokens(), coalescer.timeout):
+            text = coalescer.flush() if item is None else coalescer.add(item)
+            if text:
+                frames.append(text)
+        frames.append(coalescer.flush())
+        return frames
+
+    assert asyncio.run(run()) == ["xxxx", "xxxx", "xx", "y"]
+
+
+def test_stream_analysis_survives_fragmented_sse(stub_llm, make_frame):
+    contents = [f"第{i}段，" for i in range(50)] + ["建议买入"]
+    body = _events(contents).encode()
+
+    async def fragmented():
+        for i in range(0, len(body), 7):
+            yield body[i:i + 7]
+
+    stub_llm(lambda request: httpx.Response(200, content=fragmented()))
+
+    df = make_frame()
+
+    async def run():
+        analyzer = AIAnalyzer(custom_api_url="http://llm.test", custom_api_key="k")
+        return [json.loads(f) async for f in analyzer.get_ai_analysis(df, "600519", stream=True)]
+
+    frames = asyncio.run(run())
+    chunks = [f["ai_analysis_chunk"] for f in frames if "ai_analysis_chunk" in f]
+    assert "".join(chunks) == "".join(contents) + "\n"
+    assert len(chunks) < len(contents)
+    assert frames[-2]["status"] == "completed"
+    assert "timings" in frames[-1]
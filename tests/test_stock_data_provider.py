@@ -0,0 +1,27 @@
+import sys
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from services.stock_data_provider import StockDataProvider
+
+
+@pytest.mark.parametrize("market_type, source", [("HK", "stock_hk_daily"), ("US", "stock_us_daily")])
+def test_hk_us_frames_get_percent_change_from_close(monkeypatch, market_type, source):
+    raw = pd.DataFrame({
+        "date": pd.date_range("2024-10-07", periods=3),
+        "open": [100.0, 100.0, 110.0],
+        "high": [101.0, 111.0, 111.0],
+        "low": [99.0, 99.0, 98.0],
+        "close": [100.0, 110.0, 99.0],
+        "volume": [1000, 2000, 3000],
+    })
+    # 行情接口需要网络，用固定数据代替
+    monkeypatch.setitem(sys.modules, "akshare", SimpleNamespace(**{source: lambda symbol, adjust: raw.copy()}))
+
+    df = StockDataProvider()._get_stock_data_sync("00700", market_type, "20241001", "20241010")
+
+    assert not hasattr(df, "error")
+    assert pd.isna(df["Change_pct"].iloc[0])
+    assert df["Change_pct"].iloc[1:].tolist() == pytest.approx([10.0, -10.0])
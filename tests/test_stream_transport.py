@@ -0,0 +1,85 @@
+import asyncio
+import zlib
+
+from utils.frame_encoder import decode_frame, encode_frame
+from utils.sse import SSEDecoder
+from utils.stream_transport import (TRANSPORT_NDJSON, TRANSPORT_SSE, StreamRegistry, accepts_gzip, encode_stream,
+                                    negotiate_transport)
+
+
+async def _slow_frames(frames, delay):
+    for frame in frames:
+        await asyncio.sleep(delay)
+        yield encode_frame(frame)
+
+
+async def _collect(stream):
+    return [chunk async for chunk in stream]
+
+
+def test_negotiation():
+    assert negotiate_transport(None) == TRANSPORT_NDJSON
+    assert negotiate_transport("text/event-stream") == TRANSPORT_SSE
+    assert negotiate_transport("text/event-stream", "ndjson") == TRANSPORT_NDJSON
+    assert accepts_gzip("br, gzip;q=0.8") and not accepts_gzip("gzip;q=0") and not accepts_gzip(None)
+
+
+def test_sse_events_carry_ids_and_heartbeats_when_idle():
+    frames = [{"stream_type": "single", "stock_code": "600519"}, {"stock_code": "600519", "status": "completed"}]
+
+    async def run():
+        registry = StreamRegistry()
+        stream_id = registry.open(_slow_frames(frames, 0.05))
+        return await _collect(encode_stream(registry.get(stream_id).replay(), TRANSPORT_SSE, heartbeat=0.01))
+
+    chunks = asyncio.run(run())
+    assert b": heartbeat\n\n" in chunks
+    body = b"".join(chunks).decode()
+    assert "id: 1\n" in body and "id: 2\n" in body
+    decoder = SSEDecoder()
+    assert [decode_frame(data) for data in decoder.feed(body) + decoder.flush()] == frames
+
+
+def test_gzip_flushes_each_frame():
+    frames = [{"stock_code": "600519", "ai_analysis_chunk": "趋势向上" * i} for i in range(1, 5)]
+
+    async def run():
+        registry = StreamRegistry()
+        stream_id = registry.open(_slow_frames(frames, 0))
+        return await _collect(encode_stream(registry.get(stream_id).replay(), TRANSPORT_NDJSON, compress=True,
+                                            heartbeat=5))
+
+    chunks = asyncio.run(run())
+    decompressor = zlib.decompressobj(wbits=31)
+    # 每个压缩块单独解压即得到完整的一帧，无需等待后续数据
+    for chunk, frame in zip(chunks, frames):
+        assert decode_frame(decompressor.decompress(chunk)) == frame
+    decompressor.decompress(chunks[-1])
+    assert decompressor.eof
+
+
+def test_resume_after_last_event_id_and_expiry(monkeypatch):
+    frames = [{"seq": i} for i in range(5)]
+
+    async def failing():
+        for frame in frames[:3]:
+            yield encode_frame(frame)
+        raise RuntimeError("上游断开")
+
+    async def run():
+        registry = StreamRegistry(ttl=60)
+        stream_id = registry.open(_slow_frames(frames, 0))
+        first = [event async for event in registry.get(stream_id).replay()]
+        resumed = [event async for event in registry.get(stream_id).replay(after=3)]
+        failed_id = registry.open(failing())
+        failed = [event async for event in registry.get(failed_id).replay()]
+        registry.ttl = 0
+        await asyncio.sleep(0.01)
+        return first, resumed, failed, registry.get(stream_id)
+
+    first, resumed, failed, expired = asyncio.run(run())
+    assert [event_id for event_id, _ in first] == [1, 2, 3, 4, 5]
+    assert [(event_id, decode_frame(frame)) for event_id, frame in resumed] == [(4, {"seq": 3}), (5, {"seq": 4})]
+    # 数据源出错时流正常结束，已产生的帧仍可回放
+    assert len(failed) == 3
+    assert expired is None
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from utils.stream_utils import merge_streams
+
+
+async def _ticker(name, count, delay):
+    for i in range(count):
+        await asyncio.sleep(delay)
+        yield f"{name}{i}"
+
+
+def test_merge_streams_interleaves_by_arrival():
+    async def run():
+        return [item async for item in merge_streams([_ticker("a", 3, 0.03), _ticker("b", 3, 0.02)])]
+
+    items = asyncio.run(run())
+    assert sorted(items) == ["a0", "a1", "a2", "b0", "b1", "b2"]
+    # 两路并发输出，而不是先输出完一路再输出另一路
+    assert items.index("b2") < items.index("a2")
+    assert items.index("a0") < items.index("b2")
+
+
+def test_merge_streams_propagates_errors():
+    async def failing():
+        yield "ok"
+        raise ValueError("boom")
+
+    async def run():
+        return [item async for item in merge_streams([failing()])]
+
+    with pytest.raises(ValueError):
+        asyncio.run(run())
+
+
+def test_closing_merged_stream_cancels_children():
+    cancelled = []
+
+    async def slow():
+        try:
+            yield "first"
+            await asyncio.sleep(10)
+            yield "never"
+        finally:
+            cancelled.append(True)
+
+    async def run():
+        merged = merge_streams([slow()])
+        assert await merged.__anext__() == "first"
+        await merged.aclose()
+
+    asyncio.run(run())
+    assert cancelled == [True]
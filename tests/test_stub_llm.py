@@ -0,0 +1,75 @@
+import asyncio
+import json
+
+from benchmarks.stub_llm_server import StubLLMConfig, render_tokens, run_stub_server
+from services.ai_analyzer import AIAnalyzer
+from services.llm_scheduler import AI_RATE_LIMIT_RETRIES
+
+
+def _analyze(base_url, frame, codes=("600519",), stream=True):
+    async def run():
+        analyzer = AIAnalyzer(custom_api_url=base_url, custom_api_key="stub", custom_api_model="stub-model")
+        if len(codes) == 1:
+            frames = analyzer.get_ai_analysis(frame, codes[0], stream=stream)
+        else:
+            frames = analyzer.get_batch_ai_analysis([(code, frame) for code in codes], stream=stream)
+        return [json.loads(frame) async for frame in frames]
+    return asyncio.run(run())
+
+
+def _text(frames, code="600519"):
+    return "".join(f["ai_analysis_chunk"] for f in frames if f.get("stock_code") == code and "ai_analysis_chunk" in f)
+
+
+def test_fragmented_stream_is_reassembled_exactly(make_frame):
+    config = StubLLMConfig(first_token_ms=0, tokens_per_sec=0, output_tokens=200, fragment_bytes=7, seed=3)
+    with run_stub_server(config) as (base_url, stub):
+        frames = _analyze(base_url, make_frame())
+    assert _text(frames) == "".join(render_tokens("", 200))
+    completed = [f for f in frames if f.get("status") == "completed"]
+    assert completed and completed[0]["recommendation"] == "持有"
+    assert stub.stats["completed"] == 1
+
+
+def test_streaming_throughput_and_frame_coalescing(make_frame):
+    config = StubLLMConfig(first_token_ms=20, tokens_per_sec=2000, output_tokens=400, fragment_bytes=32, seed=1)
+    with run_stub_server(config) as (base_url, stub):
+        async def run():
+            analyzer = AIAnalyzer(custom_api_url=base_url, custom_api_key="stub", custom_api_model="stub-model")
+
+            async def one(code):
+                return [json.loads(f) async for f in analyzer.get_ai_analysis(make_frame(), code, stream=True)]
+            return await asyncio.gather(*(one(f"60000{i}") for i in range(3)))
+
+        results = asyncio.run(run())
+    expected = "".join(render_tokens("", 400))
+    for i, frames in enumerate(results):
+        timings = frames[-1]["timings"]
+        assert _text(frames, f"60000{i}") == expected
+        # 400个token按字符数/时间阈值合并，帧数远少于token数
+        assert sum("ai_analysis_chunk" in f for f in frames) < 60
+        assert timings["chunk_count"] == 401 and timings["total_ms"] < 3000
+
+
+def test_non_stream_and_batch_requests(make_frame):
+    config = StubLLMConfig(first_token_ms=0, tokens_per_sec=0, output_tokens=50)
+    with run_stub_server(config) as (base_url, stub):
+        single = _analyze(base_url, make_frame(), stream=False)
+        batch = _analyze(base_url, make_frame(), codes=("600519", "000001"))
+    assert single[1]["status"] == "completed" and single[1]["analysis"] == "".join(render_tokens("", 50))
+    completed = {f["stock_code"] for f in batch if f.get("status") == "completed"}
+    assert completed == {"600519", "000001"}
+    # 批量分析一次请求完成，无需为遗漏的股票补充请求
+    assert stub.stats["requests"] == 2
+
+
+def test_injected_errors_and_rate_limits(make_frame):
+    with run_stub_server(StubLLMConfig(first_token_ms=0, error_rate=1.0)) as (base_url, stub):
+        frames = _analyze(base_url, make_frame())
+    assert frames[-1]["status"] == "error" and "Injected server error" in frames[-1]["error"]
+
+    with run_stub_server(StubLLMConfig(first_token_ms=0, rate_limit_rate=1.0, retry_after=0.01)) as (base_url, stub):
+        frames = _analyze(base_url, make_frame())
+    assert frames[-1]["status"] == "error" and "Rate limit" in frames[-1]["error"]
+    # 每次429都按Retry-After等待后重新排队，直到用尽重试次数
+    assert stub.stats["rate_limited"] == AI_RATE_LIMIT_RETRIES + 1
@@ -0,0 +1,94 @@
+import asyncio
+import json
+import random
+import time
+
+import pandas as pd
+
+import services.symbol_directory as directory_module
+from services.symbol_directory import SymbolDirectory
+
+
+LISTINGS = {
+    "A": (["600519", "000001", "600036"], ["贵州茅台", "平安银行", "招商银行"], ["gzmt", "payh", "zsyh"]),
+    "HK": (["00700", "09988"], ["腾讯控股", "阿里巴巴-W"], ["txkg", "albb-w"]),
+    "US": (["AAPL"], ["苹果"], ["pg"]),
+}
+
+
+def _write_directory(path, loaded_at):
+    markets = {market: {"loaded_at": loaded_at, "codes": codes, "names": names, "initials": initials}
+               for market, (codes, names, initials) in LISTINGS.items()}
+    path.write_text(json.dumps({"markets": markets}, ensure_ascii=False), encoding="utf-8")
+
+
+def test_cold_start_from_disk_without_upstream_calls(tmp_path, monkeypatch):
+    monkeypatch.setattr(directory_module, "PINYIN_AVAILABLE", True)
+    path = tmp_path / "symbol_directory.json"
+    _write_directory(path, time.time())
+    fetched = []
+    monkeypatch.setattr(SymbolDirectory, "_fetch_market", staticmethod(lambda market: fetched.append(market)))
+
+    async def run():
+        directory = SymbolDirectory(str(path))
+        await directory._restore()
+        return directory
+
+    directory = asyncio.run(run())
+    assert fetched == []
+    assert [r["code"] for r in directory.autocomplete("600")] == ["600519", "600036"]
+    assert directory.autocomplete("gzmt")[0] == {"code": "600519", "name": "贵州茅台", "market_type": "A",
+                                                 "initials": "gzmt"}
+    # 按市场过滤，名称包含匹配
+    assert [r["code"] for r in directory.autocomplete("银行", "A")] == ["000001", "600036"]
+    assert [r["code"] for r in directory.autocomplete("0", "HK")] == ["00700", "09988"]
+    assert directory.autocomplete("aapl")[0]["market_type"] == "US"
+    assert directory.autocomplete("银行", "XX") == []
+
+
+def test_refresh_rebuilds_index_and_persists(tmp_path, monkeypatch):
+    path = tmp_path / "symbol_directory.json"
+    frames = {"A": pd.DataFrame({"code": ["600519"], "name": ["贵州茅台"]}),
+              "ETF": pd.DataFrame({"code": ["510300"], "name": ["沪深300ETF"]})}
+    monkeypatch.setattr(SymbolDirectory, "_fetch_market", staticmethod(lambda market: frames[market]))
+
+    async def run():
+        directory = SymbolDirectory(str(path))
+        await asyncio.gather(directory.snapshots.refresh("A"), directory.snapshots.refresh("ETF"))
+        return directory
+
+    directory = asyncio.run(run())
+    assert [r["code"] for r in directory.autocomplete("300")] == ["510300"]
+    saved = json.loads(path.read_text(encoding="utf-8"))["markets"]
+    assert saved["A"]["codes"] == ["600519"] and saved["ETF"]["names"] == ["沪深300ETF"]
+
+
+def test_autocomplete_p99_under_5ms(tmp_path, monkeypatch):
+    monkeypatch.setattr(directory_module, "PINYIN_AVAILABLE", True)
+    rng = random.Random(7)
+    chars = "中国平安银行科技医药电子能源汽车证券基金控股集团"
+    markets = {}
+    for market, size in [("A", 5000), ("HK", 2500), ("US", 10000), ("ETF", 1000), ("LOF", 400)]:
+        codes = [f"{market}{i:06d}" for i in range(size)]
+        names = ["".join(rng.choice(chars) for _ in range(4)) for _ in range(size)]
+        markets[market] = {"loaded_at": time.time(), "codes": codes, "names": names,
+                           "initials": ["".join(rng.choice("abcdefghz") for _ in range(4)) for _ in range(size)]}
+    path = tmp_path / "symbol_directory.json"
+    path.write_text(json.dumps({"markets": markets}, ensure_ascii=False), encoding="utf-8")
+
+    async def run():
+        directory = SymbolDirectory(str(path))
+        await directory._restore()
+        return directory
+
+    directory = asyncio.run(run())
+    queries = ["".join(rng.choice(chars) for _ in range(rng.randint(1, 3))) for _ in range(300)]
+    queries += [f"{rng.randint(0, 99999):05d}"[:rng.randint(1, 5)] for _ in range(300)]
+    queries += ["".join(rng.choice("abcdefghz") for _ in range(rng.randint(1, 3))) for _ in range(300)]
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        directory.autocomplete(query)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    assert latencies[int(len(latencies) * 0.99)] < 0.005
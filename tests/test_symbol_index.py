@@ -0,0 +1,64 @@
+import asyncio
+import time
+
+import numpy as np
+import pandas as pd
+
+from services.us_stock_service_async import USStockServiceAsync
+from utils.symbol_index import SymbolIndex
+
+
+def _us_frame():
+    return pd.DataFrame({
+        "name": ["苹果", "微软", "应用材料", "苹果概念ETF", None],
+        "symbol": ["105.AAPL", "105.MSFT", "105.AMAT", "107.AAPX", "106.XYZ"],
+        "price": [180.5, 410.0, np.nan, 20.0, 1.0],
+        "price_change": [1.0, -2.0, 0.5, 0.1, 0.0],
+        "price_change_percent": [0.56, -0.49, np.nan, 0.5, 0.0],
+        "market_value": [2.8e12, 3.1e12, 1.5e11, 1e8, np.nan],
+        "open": 1.0, "high": 2.0, "low": 0.5, "pre_close": 1.0,
+        "pe_ratio": 30.0, "volume": 1000.0, "turnover": 2000.0,
+    })
+
+
+def test_search_ranks_exact_symbol_then_prefix_then_contains():
+    index = SymbolIndex(["105.AAPL", "107.AAPX", "105.MSFT", "106.BAAP"], ["苹果", "AAP Holdings", "微软", "Baap"])
+    assert index.search("aapl") == [0]
+    assert index.search("AAP") == [0, 1, 3]
+    assert index.search("微") == [2]
+    assert index.search("apx") == [1]
+    assert index.search("zzz") == []
+    # 片段都命中但不连续的行不匹配
+    assert index.search("apa") == []
+    assert index.lookup("msft") == 2
+    assert index.lookup("105.MSFT") == 2
+    assert index.lookup("GOOG") is None
+
+
+def test_us_service_serves_from_snapshot(monkeypatch):
+    service = USStockServiceAsync()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.05)
+        return _us_frame()
+
+    monkeypatch.setattr(service, "_get_us_stocks_data", fetch)
+
+    async def run():
+        # 并发的首个请求共享同一次加载
+        first = await asyncio.gather(*(service.search_us_stocks("苹果") for _ in range(5)))
+        detail = await service.get_us_stock_detail("AAPL")
+        searches = [await service.search_us_stocks("a") for _ in range(100)]
+        return first, detail, searches
+
+    first, detail, searches = asyncio.run(run())
+    assert len(calls) == 1
+    assert [r["symbol"] for r in first[0]] == ["105.AAPL", "107.AAPX"]
+    assert detail["symbol"] == "105.AAPL"
+    assert abs(detail["price_change_percent"] - 0.0056) < 1e-9
+    # 按市值从高到低，缺失值格式化为0
+    assert [r["symbol"] for r in searches[0]] == ["105.AAPL", "105.AMAT", "107.AAPX"]
+    assert searches[0][1]["price"] == 0.0
+    assert service.stats()["US"]["size"] == 5
@@ -0,0 +1,54 @@
+import asyncio
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+# 因客户端断开而取消的工作
+CANCEL_FIELDS = (
+    "analysis_streams",   # 没有客户端接收而被取消的分析流
+    "llm_streams",        # 中途关闭的AI流式请求（含仍在排队的请求）
+    "llm_calls",          # 被取消的AI非流式请求
+    "fetches_skipped",    # 尚未开始就被跳过的行情数据获取
+    "fetches_abandoned",  # 已在线程池中执行、结果被丢弃的行情数据获取
+)
+
+
+class CancellationMetrics:
+    """统计因客户端断开而取消的工作量"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {field: 0 for field in CANCEL_FIELDS}
+
+    def add(self, field: str, amount: int = 1) -> None:
+        """累加一项取消计数"""
+        with self._lock:
+            self._counts[field] += amount
+
+    def snapshot(self) -> Dict[str, int]:
+        """返回各项累计取消次数"""
+        with self._lock:
+            return dict(self._counts)
+
+
+_metrics = CancellationMetrics()
+
+
+def get_cancel_metrics() -> CancellationMetrics:
+    """获取进程级共享的取消统计"""
+    return _metrics
+
+
+@contextmanager
+def count_cancelled(field: str) -> Iterator[None]:
+    """
+    代码块被取消（任务取消或异步生成器被关闭）时累加一次计数，异常照常抛出
+
+    Args:
+        field: CANCEL_FIELDS中的一项
+    """
+    try:
+        yield
+    except (asyncio.CancelledError, GeneratorExit):
+        _metrics.add(field)
+        raise
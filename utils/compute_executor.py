@@ -0,0 +1,53 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypeVar
+
+T = TypeVar('T')
+
+# 技术指标和评分计算专用线程池，与akshare等IO调用使用的默认线程池分开，避免互相占满
+COMPUTE_WORKERS = int(os.getenv('COMPUTE_WORKERS', min(4, os.cpu_count() or 1)))
+# 批量计算时每批处理的股票数，批与批之间让出事件循环
+COMPUTE_CHUNK_SIZE = int(os.getenv('COMPUTE_CHUNK_SIZE', 20))
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_compute_executor() -> ThreadPoolExecutor:
+    """获取计算线程池"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=COMPUTE_WORKERS, thread_name_prefix='compute')
+    return _executor
+
+
+async def run_compute(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    在计算线程池中执行CPU密集型函数，避免阻塞事件循环
+
+    Args:
+        func: 同步函数
+        *args: 位置参数
+        **kwargs: 关键字参数
+
+    Returns:
+        函数返回值
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_compute_executor(), partial(func, *args, **kwargs))
+
+
+def chunked(items: Dict[str, Any], size: int = COMPUTE_CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """将字典按固定大小分批"""
+    keys: List[str] = list(items)
+    for i in range(0, len(keys), size):
+        yield {key: items[key] for key in keys[i:i + size]}
+
+
+def shutdown_compute_executor() -> None:
+    """关闭计算线程池"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
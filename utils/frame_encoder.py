@@ -0,0 +1,61 @@
+import json
+import math
+from datetime import date, datetime
+from typing import Any, Union
+import numpy as np
+from utils.logger import get_logger
+
+# 获取日志器
+logger = get_logger()
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 取决于运行环境
+    orjson = None
+    logger.warning("未安装orjson，流式帧使用标准库json编码（pip install orjson）")
+
+# orjson选项：原生序列化NumPy标量和数组、字典键可以不是字符串、每帧末尾追加换行
+_ORJSON_OPTIONS = (orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE
+                   if orjson is not None else 0)
+
+
+def _default(obj: Any) -> Any:
+    """处理JSON库不能直接序列化的类型"""
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"无法序列化的类型: {type(obj).__name__}")
+
+
+def _sanitize(obj: Any) -> Any:
+    """标准库json的回退路径：NumPy类型转为Python类型，NaN/Infinity转为null（与orjson一致）"""
+    if isinstance(obj, dict):
+        return {k if isinstance(k, str) else str(_sanitize(k)): _sanitize(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_sanitize(v) for v in obj]
+    if isinstance(obj, (np.generic, np.ndarray)):
+        return _sanitize(_default(obj))
+    if isinstance(obj, float) and not math.isfinite(obj):
+        return None
+    return obj
+
+
+def encode_frame(frame: Any) -> bytes:
+    """
+    将一帧流式输出编码为UTF-8字节，末尾带换行（NDJSON）
+
+    NumPy的整数、浮点数和数组按原生值输出，NaN和Infinity输出为null
+    """
+    if orjson is not None:
+        return orjson.dumps(frame, default=_default, option=_ORJSON_OPTIONS)
+    return (json.dumps(_sanitize(frame), default=_default, ensure_ascii=False, allow_nan=False) + '\n').encode()
+
+
+def decode_frame(data: Union[bytes, str]) -> Any:
+    """解析encode_frame输出的一帧"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
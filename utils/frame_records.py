@@ -0,0 +1,54 @@
+from typing import Any, Dict, List, Tuple
+import pandas as pd
+
+# 字段类型：字符串、浮点数、百分比（"1.23%" 或 1.23 -> 0.0123）
+STR = 'str'
+FLOAT = 'float'
+PERCENT = 'percent'
+
+
+def float_column(df: pd.DataFrame, column: str, percent: bool = False) -> List[float]:
+    """
+    将行情列转为浮点数列表，缺失或无法解析的值为0.0
+
+    Args:
+        df: 行情数据
+        column: 列名，不存在时全部为0.0
+        percent: 是否为百分比列（如 "1.23%" 或 1.23），转换为小数 0.0123
+    """
+    if column not in df.columns:
+        return [0.0] * len(df)
+    values = df[column]
+    if percent and not pd.api.types.is_numeric_dtype(values):
+        values = values.astype(str).str.rstrip('%')
+    values = pd.to_numeric(values, errors='coerce')
+    if percent:
+        values = values / 100
+    return values.fillna(0.0).astype(float).tolist()
+
+
+def str_column(df: pd.DataFrame, column: str) -> List[str]:
+    """将列转为字符串列表，缺失值为空字符串"""
+    if column not in df.columns:
+        return [''] * len(df)
+    values = df[column]
+    return values.where(values.notna(), '').astype(str).tolist()
+
+
+def frame_records(df: pd.DataFrame, fields: Dict[str, Tuple[str, str]]) -> List[Dict[str, Any]]:
+    """
+    将行情数据按列清洗后转为记录列表，替代逐行iterrows和逐单元格的pd.notna/float判断
+
+    Args:
+        df: 行情数据
+        fields: 输出字段 -> (列名, 类型)，类型为STR、FLOAT或PERCENT
+
+    Returns:
+        每行一个字典，数值均为Python float，缺失值为0.0或空字符串
+    """
+    keys = list(fields)
+    columns = [
+        str_column(df, column) if kind == STR else float_column(df, column, percent=kind == PERCENT)
+        for column, kind in fields.values()
+    ]
+    return [dict(zip(keys, values)) for values in zip(*columns)]
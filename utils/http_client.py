@@ -0,0 +1,226 @@
+import asyncio
+import importlib.util
+import os
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+from utils.logger import get_logger
+
+# 获取日志器
+logger = get_logger()
+
+# 连接池配置
+HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', 20))
+HTTP_MAX_KEEPALIVE = int(os.getenv('HTTP_MAX_KEEPALIVE', 10))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 60))
+HTTP2_ENABLED = os.getenv('HTTP2_ENABLED', 'false').lower() == 'true'
+# 最多保留多少个共享客户端（每个API地址和超时配置各一个），超出后关闭最久未使用的空闲客户端
+HTTP_MAX_CLIENTS = int(os.getenv('HTTP_MAX_CLIENTS', 32))
+
+# 每个TCP连接建立时httpcore都会触发该事件，用于统计连接复用情况
+_CONNECT_EVENT = "connection.connect_tcp.complete"
+
+
+class _ClientStats:
+    """单个连接池客户端的请求与建连计数"""
+
+    def __init__(self):
+        self.requests = 0
+        self.connections_opened = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        reused = max(0, self.requests - self.connections_opened)
+        return {
+            "requests": self.requests,
+            "connections_opened": self.connections_opened,
+            "connections_reused": reused,
+            "reuse_ratio": round(reused / self.requests, 4) if self.requests else 0.0
+        }
+
+
+class _TrackedStream(httpx.AsyncByteStream):
+    """响应体关闭时减少进行中的请求数"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, transport: '_TrackedTransport'):
+        self._stream = stream
+        self._transport = transport
+        self._closed = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self._transport.in_flight -= 1
+        await self._stream.aclose()
+
+
+class _TrackedTransport(httpx.AsyncBaseTransport):
+    """统计进行中请求数的传输层，流式响应在响应体关闭前都算作进行中"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+        # 已发出但响应体尚未读完或关闭的请求数
+        self.in_flight = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.in_flight += 1
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            self.in_flight -= 1
+            raise
+        response.stream = _TrackedStream(response.stream, self)
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+class HTTPClientPool:
+    """
+    进程级共享的HTTP客户端池
+    按(基础URL, 超时配置)复用httpx.AsyncClient，保持长连接，避免每次请求重复进行DNS、TCP和TLS握手；
+    用户可以提交任意API地址，客户端数量超出上限时关闭最久未使用且没有进行中请求的客户端
+    """
+
+    def __init__(self, max_connections: int = HTTP_MAX_CONNECTIONS,
+                 max_keepalive: int = HTTP_MAX_KEEPALIVE,
+                 keepalive_expiry: float = HTTP_KEEPALIVE_EXPIRY,
+                 http2: bool = HTTP2_ENABLED,
+                 max_clients: int = HTTP_MAX_CLIENTS):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry
+        )
+        if http2 and importlib.util.find_spec('h2') is None:
+            logger.warning("未安装h2，HTTP/2不可用，回退到HTTP/1.1（pip install httpx[http2]）")
+            http2 = False
+        self.http2 = http2
+        self.max_clients = max(1, max_clients)
+        # 按最近使用顺序排列
+        self._clients: 'OrderedDict[Tuple[str, float], Tuple[httpx.AsyncClient, asyncio.AbstractEventLoop, _TrackedTransport]]' = OrderedDict()
+        self._stats: Dict[Tuple[str, float], _ClientStats] = {}
+        # 正在后台关闭的客户端任务，保持引用直到完成
+        self._closing: Set[asyncio.Future] = set()
+
+    @staticmethod
+    def _base_url(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def get_client(self, url: str, timeout: float) -> httpx.AsyncClient:
+        """
+        获取目标URL对应的共享客户端
+
+        Args:
+            url: 请求URL，按其scheme和host:port分组
+            timeout: 超时时间（秒），不同超时配置使用不同的客户端
+
+        Returns:
+            共享的httpx.AsyncClient，调用方不应关闭
+        """
+        key = (self._base_url(url), float(timeout))
+        loop = asyncio.get_running_loop()
+        entry = self._clients.get(key)
+        # 连接绑定在创建它的事件循环上，事件循环变化（如测试中多次asyncio.run）时重新创建
+        if entry is not None and not entry[0].is_closed and entry[1] is loop:
+            self._clients.move_to_end(key)
+            return entry[0]
+        if entry is not None:
+            self._close_later(entry[0], entry[1])
+
+        stats = self._stats.setdefault(key, _ClientStats())
+
+        async def trace(event_name: str, info: Dict[str, Any]) -> None:
+            if event_name == _CONNECT_EVENT:
+                stats.connections_opened += 1
+
+        async def on_request(request: httpx.Request) -> None:
+            stats.requests += 1
+            request.extensions["trace"] = trace
+
+        transport = _TrackedTransport(httpx.AsyncHTTPTransport(limits=self.limits, http2=self.http2))
+        client = httpx.AsyncClient(
+            timeout=float(timeout),
+            transport=transport,
+            event_hooks={"request": [on_request]}
+        )
+        self._clients[key] = (client, loop, transport)
+        self._clients.move_to_end(key)
+        logger.debug(f"创建共享HTTP客户端: {key[0]}, timeout={key[1]}, http2={self.http2}")
+        self._evict_idle()
+        return client
+
+    def _evict_idle(self) -> None:
+        """客户端数量超出上限时，从最久未使用的开始关闭空闲客户端；有进行中请求的客户端保留"""
+        for key in list(self._clients):
+            if len(self._clients) <= self.max_clients:
+                return
+            client, loop, transport = self._clients[key]
+            if transport.in_flight > 0 and not loop.is_closed():
+                continue
+            del self._clients[key]
+            self._stats.pop(key, None)
+            self._close_later(client, loop)
+            logger.debug(f"关闭空闲的共享HTTP客户端: {key[0]}, timeout={key[1]}")
+
+    def _close_later(self, client: httpx.AsyncClient, loop: asyncio.AbstractEventLoop) -> None:
+        """在后台关闭被替换或淘汰的客户端"""
+        if client.is_closed:
+            return
+        if loop is not asyncio.get_running_loop() and loop.is_running():
+            # 客户端属于另一个仍在运行的事件循环，在该循环中关闭
+            asyncio.run_coroutine_threadsafe(self._aclose_quietly(client), loop)
+            return
+        # 创建客户端的事件循环已结束时，连接已无法正常关闭，仍尝试释放套接字
+        task = asyncio.ensure_future(self._aclose_quietly(client))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    @staticmethod
+    async def _aclose_quietly(client: httpx.AsyncClient) -> None:
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.debug(f"关闭HTTP客户端时出错: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """返回各客户端的连接复用统计"""
+        return {
+            "http2": self.http2,
+            "clients": {f"{base_url} (timeout={timeout:g}s)": stats.to_dict()
+                        for (base_url, timeout), stats in self._stats.items()}
+        }
+
+    async def aclose(self) -> None:
+        """关闭所有客户端及其连接"""
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client, loop, _ in clients:
+            if loop is asyncio.get_running_loop():
+                await client.aclose()
+        if self._closing:
+            await asyncio.gather(*self._closing, return_exceptions=True)
+
+
+_pool: Optional[HTTPClientPool] = None
+
+
+def get_http_client_pool() -> HTTPClientPool:
+    """获取进程级共享的HTTP客户端池"""
+    global _pool
+    if _pool is None:
+        _pool = HTTPClientPool()
+    return _pool
+
+
+def get_http_client(url: str, timeout: float) -> httpx.AsyncClient:
+    """获取目标URL对应的共享HTTP客户端"""
+    return get_http_client_pool().get_client(url, timeout)
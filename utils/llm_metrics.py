@@ -0,0 +1,220 @@
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+# 延迟直方图的分桶上界（毫秒）
+LATENCY_BUCKETS_MS: Tuple[float, ...] = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, math.inf)
+# 生成速度直方图的分桶上界（片段/秒）
+RATE_BUCKETS: Tuple[float, ...] = (1, 5, 10, 20, 50, 100, 200, 500, math.inf)
+
+
+def _percentile(ordered: Sequence[float], q: float) -> float:
+    index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Histogram:
+    """累计分桶直方图，同时保留最近的样本用于计算分位数"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS_MS, window: int = 500):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._recent: Deque[float] = deque(maxlen=window)
+
+    def observe(self, value: float) -> None:
+        """记录一个样本"""
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self._recent.append(value)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """最近样本的分位数，没有样本时返回None"""
+        if not self._recent:
+            return None
+        return _percentile(sorted(self._recent), q)
+
+    def copy(self) -> 'Histogram':
+        """复制分桶计数（不含最近样本），用于在锁外导出"""
+        histogram = Histogram(self.buckets, window=1)
+        histogram.counts = list(self.counts)
+        histogram.count = self.count
+        histogram.sum = self.sum
+        return histogram
+
+    def snapshot(self) -> Dict[str, Any]:
+        """返回直方图统计"""
+        ordered = sorted(self._recent)
+        return {
+            "count": self.count,
+            "avg": round(self.sum / self.count, 2) if self.count else None,
+            "p50": round(_percentile(ordered, 0.5), 2) if ordered else None,
+            "p95": round(_percentile(ordered, 0.95), 2) if ordered else None,
+            "buckets": {("+Inf" if math.isinf(bound) else f"{bound:g}"): count
+                        for bound, count in zip(self.buckets, self.counts)}
+        }
+
+
+# 每次调用记录的延迟指标
+LATENCY_FIELDS = ("queue_ms", "headers_ms", "ttft_ms", "generation_ms", "total_ms")
+
+
+class LLMMetrics:
+    """按(模型, 端点)汇总的AI调用延迟指标"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    def _get_series(self, model: str, endpoint: str) -> Dict[str, Any]:
+        key = (model, endpoint)
+        series = self._series.get(key)
+        if series is None:
+            series = {field: Histogram() for field in LATENCY_FIELDS}
+            series["chunks_per_sec"] = Histogram(RATE_BUCKETS)
+            series["calls"] = 0
+            series["errors"] = 0
+            self._series[key] = series
+        return series
+
+    def record(self, model: str, endpoint: str, timings: Dict[str, Any]) -> None:
+        """记录一次调用的耗时"""
+        with self._lock:
+            series = self._get_series(model, endpoint)
+            series["calls"] += 1
+            if timings.get("error"):
+                series["errors"] += 1
+            for field in LATENCY_FIELDS + ("chunks_per_sec",):
+                value = timings.get(field)
+                if value is not None:
+                    series[field].observe(value)
+
+    def count(self, model: str, endpoint: str, field: str) -> int:
+        """获取某个指标的累计样本数"""
+        with self._lock:
+            series = self._series.get((model, endpoint))
+            return series[field].count if series is not None else 0
+
+    def percentile(self, model: str, endpoint: str, field: str, q: float) -> Optional[float]:
+        """获取某个指标最近样本的分位数"""
+        with self._lock:
+            series = self._series.get((model, endpoint))
+            return series[field].percentile(q) if series is not None else None
+
+    def histograms(self, field: str) -> List[Tuple[str, str, Histogram]]:
+        """某个指标各(模型, 端点)的直方图副本"""
+        with self._lock:
+            return [(model, endpoint, series[field].copy()) for (model, endpoint), series in self._series.items()]
+
+    def calls(self) -> List[Tuple[str, str, int, int]]:
+        """各(模型, 端点)的累计调用数和失败数"""
+        with self._lock:
+            return [(model, endpoint, series["calls"], series["errors"])
+                    for (model, endpoint), series in self._series.items()]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """返回所有模型和端点的统计"""
+        with self._lock:
+            return {
+                f"{model}@{endpoint}": {
+                    name: value.snapshot() if isinstance(value, Histogram) else value
+                    for name, value in series.items()
+                }
+                for (model, endpoint), series in self._series.items()
+            }
+
+
+_metrics = LLMMetrics()
+
+
+def get_llm_metrics() -> LLMMetrics:
+    """获取进程级共享的AI调用指标"""
+    return _metrics
+
+
+def endpoint_label(url: Optional[str]) -> str:
+    """将API URL转换为不含路径和凭据的端点标签"""
+    if not url:
+        return "unknown"
+    parts = urlsplit(url if "://" in url else f"http://{url}")
+    return parts.hostname + (f":{parts.port}" if parts.port else "") if parts.hostname else url
+
+
+class LLMCallTimer:
+    """
+    记录单次AI调用各阶段的时间点
+    排队（等待并发许可）-> 发出请求 -> 收到响应头 -> 首个内容片段 -> 最后一个内容片段
+    """
+
+    def __init__(self, model: str, endpoint: str, metrics: Optional[LLMMetrics] = None):
+        self.model = model
+        self.endpoint = endpoint
+        self.metrics = metrics or _metrics
+        self.queued_at = time.perf_counter()
+        self.request_at: Optional[float] = None
+        self.headers_at: Optional[float] = None
+        self.first_delta_at: Optional[float] = None
+        self.last_delta_at: Optional[float] = None
+        self.chunk_count = 0
+        self.output_chars = 0
+        self._result: Optional[Dict[str, Any]] = None
+
+    def request_started(self) -> None:
+        """获得并发许可，开始发送请求"""
+        self.request_at = time.perf_counter()
+
+    def headers_received(self) -> None:
+        """收到响应头"""
+        self.headers_at = time.perf_counter()
+
+    def delta(self, content: str) -> None:
+        """收到一个内容片段"""
+        now = time.perf_counter()
+        if self.first_delta_at is None:
+            self.first_delta_at = now
+        self.last_delta_at = now
+        self.chunk_count += 1
+        self.output_chars += len(content)
+
+    def finish(self, error: bool = False) -> Dict[str, Any]:
+        """
+        结束计时并记录到指标中，重复调用返回首次的结果
+
+        Returns:
+            各阶段耗时（毫秒）
+        """
+        if self._result is not None:
+            return self._result
+        end = time.perf_counter()
+        start = self.request_at or end
+
+        def ms(begin: Optional[float], finish: Optional[float]) -> Optional[float]:
+            if begin is None or finish is None:
+                return None
+            return round((finish - begin) * 1000, 2)
+
+        generation_ms = ms(self.first_delta_at, self.last_delta_at)
+        self._result = {
+            "model": self.model,
+            "endpoint": self.endpoint,
+            "queue_ms": ms(self.queued_at, start),
+            "headers_ms": ms(self.request_at, self.headers_at),
+            "ttft_ms": ms(self.request_at, self.first_delta_at),
+            "generation_ms": generation_ms,
+            "total_ms": ms(self.request_at, end),
+            "chunk_count": self.chunk_count,
+            "output_chars": self.output_chars,
+            "chunks_per_sec": round((self.chunk_count - 1) / (generation_ms / 1000), 2)
+            if generation_ms and self.chunk_count > 1 else None,
+            "error": error
+        }
+        self.metrics.record(self.model, self.endpoint, self._result)
+        return self._result
@@ -0,0 +1,105 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Dict, Optional
+from utils.logger import get_logger
+
+# 获取日志器
+logger = get_logger()
+
+
+class LoopLagMonitor:
+    """
+    事件循环延迟监控
+    定时测量sleep的实际唤醒延迟，统计p50/p99；调试模式下由看门狗线程记录长时间阻塞事件循环的调用栈
+    """
+
+    def __init__(self, interval_ms: Optional[float] = None, window: int = 600,
+                 block_debug: Optional[bool] = None, block_threshold_ms: Optional[float] = None):
+        """
+        初始化事件循环延迟监控
+
+        Args:
+            interval_ms: 采样间隔（毫秒），默认读取LOOP_LAG_INTERVAL_MS
+            window: 保留的最近采样数
+            block_debug: 是否记录阻塞调用栈，默认读取LOOP_BLOCK_DEBUG
+            block_threshold_ms: 阻塞阈值（毫秒），默认读取LOOP_BLOCK_THRESHOLD_MS
+        """
+        self.interval = (interval_ms or float(os.getenv('LOOP_LAG_INTERVAL_MS', 100))) / 1000
+        self.block_debug = block_debug if block_debug is not None else os.getenv('LOOP_BLOCK_DEBUG', 'false').lower() == 'true'
+        self.block_threshold = (block_threshold_ms or float(os.getenv('LOOP_BLOCK_THRESHOLD_MS', 200))) / 1000
+
+        self._samples = deque(maxlen=window)
+        self._max_lag = 0.0
+        self._blocked_count = 0
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        """在当前事件循环中启动监控"""
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._sample())
+        if self.block_debug:
+            self._watchdog = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+            self._watchdog.start()
+        logger.info(f"事件循环延迟监控已启动: 采样间隔 {self.interval * 1000:.0f}ms, 阻塞调试: {self.block_debug}")
+
+    async def stop(self) -> None:
+        """停止监控"""
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _sample(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - start - self.interval)
+            self._samples.append(lag)
+            self._max_lag = max(self._max_lag, lag)
+            self._heartbeat = time.monotonic()
+
+    def _watch(self) -> None:
+        reported_heartbeat = None
+        while not self._stopped.wait(self.block_threshold / 2):
+            heartbeat = self._heartbeat
+            blocked_for = time.monotonic() - heartbeat - self.interval
+            if blocked_for < self.block_threshold or heartbeat == reported_heartbeat:
+                continue
+
+            # 同一次阻塞只记录一次
+            reported_heartbeat = heartbeat
+            self._blocked_count += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = ''.join(traceback.format_stack(frame)) if frame is not None else '无法获取调用栈'
+            logger.warning(f"事件循环已阻塞 {blocked_for * 1000:.0f}ms，当前调用栈:\n{stack}")
+
+    @staticmethod
+    def _percentile(sorted_samples, q: float) -> float:
+        if not sorted_samples:
+            return 0.0
+        index = min(len(sorted_samples) - 1, int(round(q * (len(sorted_samples) - 1))))
+        return sorted_samples[index]
+
+    def stats(self) -> Dict[str, float]:
+        """获取事件循环延迟统计（毫秒）"""
+        samples = sorted(self._samples)
+        return {
+            "p50_ms": round(self._percentile(samples, 0.5) * 1000, 2),
+            "p99_ms": round(self._percentile(samples, 0.99) * 1000, 2),
+            "max_ms": round(self._max_lag * 1000, 2),
+            "samples": len(samples),
+            "blocked_count": self._blocked_count
+        }
@@ -0,0 +1,61 @@
+import os
+from typing import IO, Optional
+from utils.logger import get_logger
+from utils.sqlite_store import get_data_dir
+
+# 获取日志器
+logger = get_logger()
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+
+class ProcessLock:
+    """
+    基于文件锁的跨进程互斥
+    多个工作进程中只有一个能持有锁，用于只需运行一份的后台任务（如收盘后预计算）；
+    持有锁的进程退出时操作系统自动释放，重新启动的工作进程可以接替
+    """
+
+    def __init__(self, name: str, path: Optional[str] = None):
+        """
+        Args:
+            name: 锁名称
+            path: 锁文件路径，默认为数据目录下的 {name}.lock
+        """
+        self.name = name
+        self.path = path or os.path.join(get_data_dir(), f"{name}.lock")
+        self._file: Optional[IO] = None
+
+    @property
+    def held(self) -> bool:
+        return self._file is not None
+
+    def acquire(self) -> bool:
+        """尝试获取锁，不等待；已被其他进程持有时返回False"""
+        if self._file is not None:
+            return True
+        if fcntl is None:
+            # 不支持文件锁的平台只运行单个进程
+            self._file = open(self.path, 'a')
+            return True
+        lock_file = open(self.path, 'a')
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._file = lock_file
+        logger.info(f"进程 {os.getpid()} 获得 {self.name} 锁")
+        return True
+
+    def release(self) -> None:
+        """释放锁"""
+        if self._file is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
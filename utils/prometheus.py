@@ -0,0 +1,185 @@
+import json
+import math
+import os
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from utils.llm_metrics import Histogram
+from utils.sqlite_store import get_data_dir
+
+# Prometheus文本格式的Content-Type
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# 指标名前缀
+METRIC_PREFIX = "stock_scanner_"
+# 合并多个工作进程时当前值的合并方式：求和（如队列深度）或取最大值（如共用数据库的条目数、延迟）
+MERGE_SUM = "sum"
+MERGE_MAX = "max"
+
+
+def _escape(value: object) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    labels = list(labels)
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return f"{value:g}" if isinstance(value, float) else str(value)
+
+
+def _label_key(labels: Dict[str, object]) -> str:
+    """标签的序列化键，按名称排序，可写入JSON并在进程之间比较"""
+    return json.dumps(sorted((name, str(value)) for name, value in labels.items()), ensure_ascii=False)
+
+
+class MetricsWriter:
+    """
+    Prometheus文本格式（0.0.4）输出
+    不依赖prometheus_client，直接导出各模块已有的直方图和计数；毫秒直方图按Prometheus惯例换算为秒。
+    指标可序列化后由其他工作进程合并：计数器和直方图求和，当前值按指标声明的方式合并，已退出进程的当前值丢弃
+    """
+
+    def __init__(self, prefix: str = METRIC_PREFIX):
+        self.prefix = prefix
+        # 指标名 -> {"type", "help", "merge", "samples": {标签键: 值}}，直方图的值为 {"le", "counts", "sum", "count"}
+        self.families: Dict[str, Dict[str, Any]] = {}
+
+    def _family(self, name: str, help_text: str, metric_type: str, merge: str = MERGE_SUM) -> Dict[str, Any]:
+        family = self.families.get(name)
+        if family is None:
+            family = self.families[name] = {"type": metric_type, "help": help_text, "merge": merge, "samples": {}}
+        return family
+
+    def counter(self, name: str, help_text: str, samples: Iterable[Tuple[Dict[str, object], float]]) -> None:
+        """记录计数器，名称自动补全 _total 后缀"""
+        family = self._family(name + "_total", help_text, "counter")
+        for labels, value in samples:
+            family["samples"][_label_key(labels)] = value
+
+    def gauge(self, name: str, help_text: str, samples: Iterable[Tuple[Dict[str, object], float]],
+              merge: str = MERGE_SUM) -> None:
+        """记录当前值，merge为多个工作进程之间的合并方式"""
+        family = self._family(name, help_text, "gauge", merge)
+        for labels, value in samples:
+            if value is not None:
+                family["samples"][_label_key(labels)] = value
+
+    def histogram(self, name: str, help_text: str, samples: Iterable[Tuple[Dict[str, object], Histogram]],
+                  scale: float = 0.001) -> None:
+        """
+        记录直方图
+
+        Args:
+            name: 指标名（不含前缀）
+            help_text: 说明
+            samples: (标签, 直方图)
+            scale: 分桶上界和总和的换算系数，默认毫秒换算为秒
+        """
+        family = self._family(name, help_text, "histogram")
+        for labels, histogram in samples:
+            family["samples"][_label_key(labels)] = {
+                "le": ["+Inf" if math.isinf(bound) else f"{bound * scale:g}" for bound in histogram.buckets],
+                "counts": list(histogram.counts),
+                "sum": histogram.sum * scale,
+                "count": histogram.count
+            }
+
+    def merge(self, families: Dict[str, Dict[str, Any]], alive: bool = True) -> None:
+        """
+        合并另一个工作进程的指标
+
+        Args:
+            families: 另一个进程的 MetricsWriter.families
+            alive: 该进程是否仍在运行，已退出进程只保留计数器和直方图
+        """
+        for name, other in families.items():
+            if other["type"] == "gauge" and not alive:
+                continue
+            family = self._family(name, other["help"], other["type"], other.get("merge", MERGE_SUM))
+            samples = family["samples"]
+            for key, value in other["samples"].items():
+                current = samples.get(key)
+                if current is None:
+                    samples[key] = value
+                elif other["type"] == "histogram":
+                    if current["le"] == value["le"]:
+                        current["counts"] = [a + b for a, b in zip(current["counts"], value["counts"])]
+                        current["sum"] += value["sum"]
+                        current["count"] += value["count"]
+                elif family["merge"] == MERGE_MAX:
+                    samples[key] = max(current, value)
+                else:
+                    samples[key] = current + value
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for name, family in self.families.items():
+            if not family["samples"]:
+                continue
+            name = self.prefix + name
+            lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {family['type']}")
+            for key, value in family["samples"].items():
+                labels = [tuple(item) for item in json.loads(key)]
+                if family["type"] != "histogram":
+                    lines.append(f"{name}{_format_labels(sorted(labels))} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for le, count in zip(value["le"], value["counts"]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(sorted(labels + [('le', le)]))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {value['sum']:g}")
+                lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def get_metrics_dir() -> str:
+    """各工作进程指标文件所在的目录"""
+    directory = os.path.join(get_data_dir(), "metrics")
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def write_worker_metrics(writer: MetricsWriter, directory: Optional[str] = None) -> None:
+    """将本进程的指标写入 {pid}.json，供处理抓取请求的进程合并"""
+    directory = directory or get_metrics_dir()
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(writer.families, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def read_worker_metrics(directory: Optional[str] = None) -> Iterator[Tuple[int, Dict[str, Any], bool]]:
+    """
+    读取其他工作进程写入的指标
+
+    Returns:
+        (进程号, 指标, 进程是否仍在运行) 的迭代器，不含本进程
+    """
+    directory = directory or get_metrics_dir()
+    for filename in os.listdir(directory):
+        pid_text, ext = os.path.splitext(filename)
+        if ext != ".json" or not pid_text.isdigit() or int(pid_text) == os.getpid():
+            continue
+        try:
+            with open(os.path.join(directory, filename), encoding='utf-8') as f:
+                families = json.load(f)
+        except (OSError, ValueError):
+            continue
+        yield int(pid_text), families, _pid_alive(int(pid_text))
@@ -0,0 +1,178 @@
+import os
+import pickle
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+from utils.logger import get_logger
+from utils.sqlite_store import SQLiteStore
+
+# 获取日志器
+logger = get_logger()
+
+# 是否启用跨进程共享缓存（多个工作进程复用行情数据和列表快照）
+SHARED_CACHE_ENABLED = os.getenv('SHARED_CACHE_ENABLED', 'true').lower() == 'true'
+# 等待其他进程完成同一数据获取的最长时间（秒），超时后自行获取
+SHARED_FETCH_LEASE_SECONDS = float(os.getenv('SHARED_FETCH_LEASE_SECONDS', 60))
+# 每写入多少次清理一次过期条目
+_PURGE_EVERY = 200
+
+
+class SharedCache(SQLiteStore):
+    """
+    跨进程共享缓存
+    以SQLite（WAL模式）保存pickle序列化的值，同一台机器上的所有工作进程共用；
+    同一数据同时只由一个进程获取，其他进程等待其写入缓存后直接读取
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS entries (
+        namespace TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value BLOB NOT NULL,
+        stored_at REAL NOT NULL,
+        expires_at REAL NOT NULL,
+        PRIMARY KEY (namespace, key)
+    );
+    CREATE TABLE IF NOT EXISTS fetch_leases (
+        name TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        super().__init__("shared_cache.db", db_path)
+        self.owner = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.hits = 0
+        self.misses = 0
+        self.waited = 0
+        self._puts = 0
+
+    def get(self, namespace: str, key: str, max_age: Optional[float] = None) -> Optional[Any]:
+        """
+        读取缓存
+
+        Args:
+            namespace: 命名空间
+            key: 键
+            max_age: 可接受的最大年龄（秒），为空时只要未过期即可
+
+        Returns:
+            缓存的值，不存在、已过期或过旧时返回None
+        """
+        now = time.time()
+        row = self.query_one(
+            "SELECT value FROM entries WHERE namespace = ? AND key = ? AND expires_at > ? AND stored_at >= ?",
+            (namespace, key, now, now - max_age if max_age is not None else 0)
+        )
+        return pickle.loads(row['value']) if row else None
+
+    def put(self, namespace: str, key: str, value: Any, ttl: float) -> None:
+        """写入缓存，ttl秒后过期"""
+        now = time.time()
+        self.execute(
+            "INSERT OR REPLACE INTO entries (namespace, key, value, stored_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+            (namespace, key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), now, now + ttl)
+        )
+        self._puts += 1
+        if self._puts % _PURGE_EVERY == 0:
+            self.purge_expired()
+
+    def get_or_fetch(self, namespace: str, key: str, fetch: Callable[[], Any], ttl: float,
+                     max_age: Optional[float] = None, cacheable: Callable[[Any], bool] = lambda value: True,
+                     lease_seconds: float = SHARED_FETCH_LEASE_SECONDS, poll_interval: float = 0.2) -> Any:
+        """
+        读取缓存，未命中时获取数据并写入缓存（同步方法，在线程池中调用）
+
+        Args:
+            namespace: 命名空间
+            key: 键
+            fetch: 获取数据的函数
+            ttl: 写入缓存的有效期（秒）
+            max_age: 可接受的最大年龄（秒）
+            cacheable: 判断获取结果是否可以缓存的函数，如出错的结果不缓存
+            lease_seconds: 其他进程正在获取时最长等待的秒数
+            poll_interval: 等待期间检查缓存的间隔（秒）
+
+        Returns:
+            缓存的值或新获取的值
+        """
+        cached = self.get(namespace, key, max_age)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        name = f"{namespace}:{key}"
+        deadline = time.monotonic() + lease_seconds
+        while not self._try_lease(name, lease_seconds):
+            # 其他进程正在获取同一数据，等待其写入缓存
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(poll_interval)
+            cached = self.get(namespace, key, max_age)
+            if cached is not None:
+                self.waited += 1
+                return cached
+
+        try:
+            self.misses += 1
+            value = fetch()
+            if value is not None and cacheable(value):
+                self.put(namespace, key, value, ttl)
+            return value
+        finally:
+            self._release_lease(name)
+
+    def _try_lease(self, name: str, seconds: float) -> bool:
+        now = time.time()
+        return self.execute(
+            "INSERT INTO fetch_leases (name, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE fetch_leases.expires_at < ? OR fetch_leases.owner = excluded.owner",
+            (name, self.owner, now + seconds, now)
+        ) == 1
+
+    def _release_lease(self, name: str) -> None:
+        self.execute("DELETE FROM fetch_leases WHERE name = ? AND owner = ?", (name, self.owner))
+
+    def purge_expired(self) -> int:
+        """删除过期条目"""
+        return self.execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),))
+
+    def stats(self) -> Dict[str, Any]:
+        row = self.query_one("SELECT COUNT(*) AS entries, COALESCE(SUM(LENGTH(value)), 0) AS bytes FROM entries")
+        return {
+            "entries": row['entries'],
+            "bytes": row['bytes'],
+            "hits": self.hits,
+            "misses": self.misses,
+            "waited": self.waited
+        }
+
+
+_cache: Optional[SharedCache] = None
+
+
+def get_shared_cache() -> Optional[SharedCache]:
+    """获取进程内共享的缓存实例，未启用时返回None"""
+    global _cache
+    if _cache is None and SHARED_CACHE_ENABLED:
+        try:
+            _cache = SharedCache()
+        except Exception as e:
+            logger.warning(f"初始化跨进程共享缓存失败: {str(e)}")
+            return None
+    return _cache
+
+
+def shared_fetch(namespace: str, key: str, fetch: Callable[[], Any], ttl: float,
+                 max_age: Optional[float] = None, cacheable: Callable[[Any], bool] = lambda value: True) -> Any:
+    """
+    经过跨进程共享缓存获取数据（同步方法），未启用共享缓存时直接调用fetch
+
+    参数含义同 SharedCache.get_or_fetch
+    """
+    cache = get_shared_cache()
+    if cache is None:
+        return fetch()
+    return cache.get_or_fetch(namespace, key, fetch, ttl, max_age, cacheable)
@@ -0,0 +1,162 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+from utils.logger import get_logger
+from utils.shared_cache import shared_fetch
+
+# 获取日志器
+logger = get_logger()
+
+
+class _Entry:
+    """某个键的当前快照和刷新统计"""
+
+    def __init__(self):
+        self.value: Any = None
+        self.loaded_at: Optional[float] = None
+        self.refreshes = 0
+        self.failures = 0
+        self.last_refresh_ms: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+
+class SnapshotStore:
+    """
+    按键（如市场类型）保存的数据快照，过期前后台刷新（stale-while-revalidate）
+    - 只有某个键还没有任何快照时，请求才会等待加载
+    - 快照超过 ttl * refresh_ahead 后触发后台刷新，刷新期间和刷新失败时继续返回上一份快照
+    - 同一个键的并发刷新合并为一次
+    """
+
+    def __init__(self, name: str, loader: Callable[[str], Awaitable[Any]], ttl: float,
+                 refresh_ahead: float = 0.8):
+        """
+        Args:
+            name: 快照名称，用于日志
+            loader: 按键加载快照的协程函数
+            ttl: 快照有效期（秒）
+            refresh_ahead: 快照年龄达到有效期的该比例时开始刷新
+        """
+        self.name = name
+        self.loader = loader
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self._entries: Dict[str, _Entry] = {}
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def _entry(self, key: str) -> _Entry:
+        return self._entries.setdefault(key, _Entry())
+
+    def age(self, key: str) -> Optional[float]:
+        """快照年龄（秒），尚未加载时为None"""
+        entry = self._entries.get(key)
+        if entry is None or entry.loaded_at is None:
+            return None
+        return time.time() - entry.loaded_at
+
+    def _due(self, key: str) -> bool:
+        age = self.age(key)
+        return age is None or age >= self.ttl * self.refresh_ahead
+
+    async def get(self, key: str) -> Any:
+        """获取快照，接近过期时在后台刷新"""
+        entry = self._entry(key)
+        if entry.value is None:
+            return await self.refresh(key)
+        if self._due(key):
+            self._start_refresh(key)
+        return entry.value
+
+    async def fetch_shared(self, key: str, fetch: Callable[[], Any]) -> Any:
+        """
+        在线程池中获取快照的源数据，经过跨进程共享缓存：
+        其他工作进程在 ttl * (1 - refresh_ahead) 秒内获取过的数据直接复用，不再访问上游接口
+
+        Args:
+            key: 快照的键
+            fetch: 获取源数据的同步函数，返回DataFrame，空表不缓存
+        """
+        return await asyncio.to_thread(shared_fetch, self.name, key, fetch, self.ttl,
+                                       self.ttl * (1 - self.refresh_ahead), lambda df: len(df) > 0)
+
+    def put(self, key: str, value: Any, loaded_at: float) -> None:
+        """放入已有的快照（如从磁盘恢复），按原加载时间决定何时刷新"""
+        entry = self._entry(key)
+        entry.value = value
+        entry.loaded_at = loaded_at
+
+    def _start_refresh(self, key: str) -> asyncio.Task:
+        task = self._refreshing.get(key)
+        if task is None or task.done():
+            task = asyncio.create_task(self._load(key))
+            self._refreshing[key] = task
+        return task
+
+    async def refresh(self, key: str) -> Any:
+        """立即刷新快照，与进行中的刷新合并；失败时抛出异常"""
+        # shield: 单个等待方被取消不会中断共享的刷新
+        return await asyncio.shield(self._start_refresh(key))
+
+    async def _load(self, key: str) -> Any:
+        entry = self._entry(key)
+        started = time.monotonic()
+        try:
+            value = await self.loader(key)
+        except Exception as e:
+            entry.failures += 1
+            entry.last_error = str(e)
+            logger.error(f"刷新{self.name}快照 {key} 失败: {str(e)}")
+            raise
+        finally:
+            entry.last_refresh_ms = round((time.monotonic() - started) * 1000, 1)
+        entry.value = value
+        entry.loaded_at = time.time()
+        entry.refreshes += 1
+        entry.last_error = None
+        logger.info(f"{self.name}快照 {key} 已更新, 耗时 {entry.last_refresh_ms}ms")
+        return value
+
+    def start(self, keys: Iterable[str] = ()) -> None:
+        """
+        在当前事件循环中启动后台刷新
+
+        Args:
+            keys: 启动时预先加载的键，其余键在首次请求后纳入后台刷新
+        """
+        for key in keys:
+            self._entry(key)
+        self._task = asyncio.create_task(self.run_forever())
+
+    async def stop(self) -> None:
+        """停止后台刷新"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def run_forever(self) -> None:
+        """定时检查各个键，在快照过期前刷新"""
+        interval = min(60.0, max(1.0, self.ttl * (1 - self.refresh_ahead) / 2))
+        while True:
+            due = [key for key in list(self._entries) if self._due(key)]
+            if due:
+                await asyncio.gather(*(self._start_refresh(key) for key in due), return_exceptions=True)
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回各个键的快照年龄和刷新耗时"""
+        result = {}
+        for key, entry in self._entries.items():
+            age = self.age(key)
+            result[key] = {
+                "size": len(entry.value) if entry.value is not None else 0,
+                "age_seconds": round(age, 1) if age is not None else None,
+                "stale": age is None or age >= self.ttl,
+                "refreshing": key in self._refreshing and not self._refreshing[key].done(),
+                "refreshes": entry.refreshes,
+                "failures": entry.failures,
+                "last_refresh_ms": entry.last_refresh_ms,
+                "last_error": entry.last_error
+            }
+        return result
@@ -0,0 +1,76 @@
+import os
+import sqlite3
+import threading
+from typing import Any, Iterable, List, Optional
+
+
+def get_data_dir() -> str:
+    """
+    获取本地数据目录
+
+    默认为项目根目录下的data目录，可通过环境变量DATA_DIR覆盖
+    """
+    data_dir = os.getenv('DATA_DIR') or os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data'
+    )
+    os.makedirs(data_dir, exist_ok=True)
+    return data_dir
+
+
+class SQLiteStore:
+    """
+    SQLite本地存储基类
+    封装连接创建、WAL模式和线程安全的读写，供各类本地持久化存储复用
+    """
+
+    # 子类覆盖：建表语句
+    SCHEMA = ""
+
+    def __init__(self, db_name: str, db_path: Optional[str] = None):
+        """
+        初始化SQLite存储
+
+        Args:
+            db_name: 数据库文件名，位于数据目录下
+            db_path: 自定义数据库文件路径，优先于db_name
+        """
+        self.db_path = db_path or os.path.join(get_data_dir(), db_name)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        if self.SCHEMA:
+            self._conn.executescript(self.SCHEMA)
+
+    def execute(self, sql: str, params: Iterable[Any] = ()) -> int:
+        """执行写操作，返回受影响的行数"""
+        with self._lock:
+            cursor = self._conn.execute(sql, tuple(params))
+            return cursor.rowcount
+
+    def executemany(self, sql: str, seq_of_params: Iterable[Iterable[Any]]) -> None:
+        """在一个事务中批量执行写操作"""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(sql, [tuple(p) for p in seq_of_params])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def query(self, sql: str, params: Iterable[Any] = ()) -> List[sqlite3.Row]:
+        """执行查询，返回全部结果行"""
+        with self._lock:
+            return self._conn.execute(sql, tuple(params)).fetchall()
+
+    def query_one(self, sql: str, params: Iterable[Any] = ()) -> Optional[sqlite3.Row]:
+        """执行查询，返回第一行结果"""
+        rows = self.query(sql, params)
+        return rows[0] if rows else None
+
+    def close(self) -> None:
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,190 @@
+import asyncio
+import os
+import re
+import time
+from typing import AsyncGenerator, AsyncIterable, Callable, List, Optional, TypeVar
+
+T = TypeVar('T')
+
+# 流式输出合并阈值：累计字符数达到上限或距上次发送超过时间间隔时发送一帧
+STREAM_FLUSH_CHARS = int(os.getenv('AI_STREAM_FLUSH_CHARS', 200))
+STREAM_FLUSH_MS = float(os.getenv('AI_STREAM_FLUSH_MS', 50))
+
+# SSE规范允许的三种换行符
+_LINE_BREAK = re.compile(r'\r\n|\r|\n')
+
+
+class SSEDecoder:
+    """
+    增量式SSE（Server-Sent Events）解码器
+    网络分块可能在任意位置切断事件，未完成的行会保留到下一次输入
+    """
+
+    def __init__(self):
+        self._partial = ""
+        self._data: List[str] = []
+
+    def feed(self, text: str) -> List[str]:
+        """
+        输入一段文本，返回其中已完整接收的事件数据
+
+        Args:
+            text: 响应体的一段文本
+
+        Returns:
+            完整事件的data内容列表
+        """
+        self._partial += text
+        # 以\r结尾时可能紧跟着\n，留到下一段再切分
+        end = len(self._partial) - 1 if self._partial.endswith('\r') else len(self._partial)
+        lines = _LINE_BREAK.split(self._partial[:end])
+        # 最后一段没有换行符，尚未接收完整
+        self._partial = lines.pop() + self._partial[end:]
+
+        events = []
+        for line in lines:
+            event = self._process_line(line)
+            if event is not None:
+                events.append(event)
+        return events
+
+    def flush(self) -> List[str]:
+        """响应结束时处理剩余内容，返回最后一个未以空行结束的事件"""
+        events = self.feed("\n") if self._partial else []
+        if self._data:
+            events.append("\n".join(self._data))
+            self._data = []
+        return events
+
+    def _process_line(self, line: str) -> Optional[str]:
+        # 空行表示一个事件结束
+        if not line:
+            if not self._data:
+                return None
+            data = "\n".join(self._data)
+            self._data = []
+            return data
+        # 注释行
+        if line.startswith(':'):
+            return None
+        # 兼容直接返回JSON行（NDJSON）而非SSE格式的接口：每行是一个独立事件，没有空行分隔
+        if line.lstrip().startswith('{'):
+            return line
+        field, _, value = line.partition(':')
+        if field == 'data':
+            self._data.append(value[1:] if value.startswith(' ') else value)
+        return None
+
+
+async def decode_sse(chunks: AsyncIterable[str]) -> AsyncGenerator[str, None]:
+    """
+    将响应文本流解码为SSE事件数据流
+
+    Args:
+        chunks: 响应体文本分块，如 response.aiter_text()
+
+    Returns:
+        事件data内容的异步生成器
+    """
+    decoder = SSEDecoder()
+    async for chunk in chunks:
+        for data in decoder.feed(chunk):
+            yield data
+    for data in decoder.flush():
+        yield data
+
+
+_END = object()
+
+
+class _SourceError:
+    """数据源抛出的异常，转交给消费者重新抛出"""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class TextCoalescer:
+    """将高频的小文本片段合并为较大的帧，按字符数或时间阈值发送"""
+
+    def __init__(self, max_chars: int = STREAM_FLUSH_CHARS, max_delay_ms: float = STREAM_FLUSH_MS):
+        self.max_chars = max_chars
+        self.max_delay = max_delay_ms / 1000
+        self._parts: List[str] = []
+        self._size = 0
+        self._first_at = 0.0
+
+    def add(self, text: str) -> Optional[str]:
+        """
+        添加一个文本片段
+
+        Returns:
+            达到发送阈值时返回合并后的文本，否则返回None
+        """
+        if not self._parts:
+            self._first_at = time.monotonic()
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self.max_chars or time.monotonic() - self._first_at >= self.max_delay:
+            return self.flush()
+        return None
+
+    def flush(self) -> Optional[str]:
+        """取出所有待发送的文本，没有时返回None"""
+        if not self._parts:
+            return None
+        text = "".join(self._parts)
+        self._parts = []
+        self._size = 0
+        return text
+
+    def timeout(self) -> Optional[float]:
+        """距离按时间阈值发送还剩的秒数，没有待发送文本时返回None"""
+        if not self._parts:
+            return None
+        return max(0.0, self._first_at + self.max_delay - time.monotonic())
+
+
+async def iterate_with_timeout(source: AsyncIterable[T],
+                               timeout: Callable[[], Optional[float]]) -> AsyncGenerator[Optional[T], None]:
+    """
+    迭代异步数据源，等待下一项超过timeout()秒时产出None，便于调用方按时间发送缓冲内容
+    数据源在后台任务中读取，已到达的数据直接从队列取出，不为每一项创建等待任务
+
+    Args:
+        source: 异步数据源
+        timeout: 返回本次最长等待秒数的函数，返回None表示一直等待
+
+    Returns:
+        数据项或超时标记None的异步生成器
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=256)
+
+    async def pump() -> None:
+        try:
+            async for item in source:
+                await queue.put(item)
+        except Exception as e:
+            await queue.put(_SourceError(e))
+        else:
+            await queue.put(_END)
+
+    task = asyncio.create_task(pump())
+    try:
+        while True:
+            if not queue.empty():
+                item = queue.get_nowait()
+            else:
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout())
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+            if item is _END:
+                return
+            if isinstance(item, _SourceError):
+                raise item.error
+            yield item
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
@@ -0,0 +1,90 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+from utils.llm_metrics import Histogram
+
+# 各阶段耗时的分桶上界（毫秒）：从毫秒级的指标计算到分钟级的AI分析
+STAGE_BUCKETS_MS: Tuple[float, ...] = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000,
+                                       math.inf)
+
+# 标签按名称排序后的元组，作为序列的键
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+class StageMetrics:
+    """
+    分析流水线各阶段的耗时直方图和计数器
+    数据获取、指标计算、评分、AI分析等阶段按名称和标签分别统计，可在任意线程中记录
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = STAGE_BUCKETS_MS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+
+    def observe(self, stage: str, ms: float, **labels) -> None:
+        """记录一次阶段耗时（毫秒）"""
+        key = (stage, _labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets, window=100)
+            histogram.observe(ms)
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        """累加计数器"""
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    @contextmanager
+    def time(self, stage: str, **labels) -> Iterator[None]:
+        """记录代码块的耗时，抛出异常时同样记录"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, (time.perf_counter() - started) * 1000, **labels)
+
+    def histograms(self, stage: str) -> List[Tuple[Dict[str, str], Histogram]]:
+        """某个阶段各标签组合的直方图副本"""
+        with self._lock:
+            return [(dict(labels), histogram.copy())
+                    for (name, labels), histogram in self._histograms.items() if name == stage]
+
+    def counters(self, name: str) -> List[Tuple[Dict[str, str], float]]:
+        """某个计数器各标签组合的累计值"""
+        with self._lock:
+            return [(dict(labels), value) for (counter, labels), value in self._counters.items() if counter == name]
+
+    def stages(self) -> List[str]:
+        with self._lock:
+            return sorted({name for name, _ in self._histograms})
+
+    def counter_names(self) -> List[str]:
+        with self._lock:
+            return sorted({name for name, _ in self._counters})
+
+    def snapshot(self) -> Dict[str, Dict[str, object]]:
+        """返回各阶段的统计，键为 阶段{标签}"""
+        with self._lock:
+            return {
+                name + ("{" + ",".join(f"{k}={v}" for k, v in labels) + "}" if labels else ""): histogram.snapshot()
+                for (name, labels), histogram in self._histograms.items()
+            }
+
+
+_metrics = StageMetrics()
+
+
+def get_stage_metrics() -> StageMetrics:
+    """获取进程级共享的阶段指标"""
+    return _metrics
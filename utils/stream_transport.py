@@ -0,0 +1,290 @@
+import asyncio
+import os
+import time
+import uuid
+import zlib
+from typing import Any, AsyncGenerator, AsyncIterable, Callable, Dict, List, Optional, Tuple
+from utils.cancel_metrics import get_cancel_metrics
+from utils.logger import get_logger
+from utils.stage_metrics import get_stage_metrics
+from utils.sse import iterate_with_timeout
+
+# 获取日志器
+logger = get_logger()
+
+# 流式响应空闲多久（秒）发送一次心跳，需小于反向代理的读超时
+STREAM_HEARTBEAT_SECONDS = float(os.getenv('STREAM_HEARTBEAT_SECONDS', 15))
+# 分析结束后保留多久（秒）供断线的客户端续传
+STREAM_RESUME_TTL = float(os.getenv('STREAM_RESUME_TTL', 300))
+# 没有客户端接收多久（秒）后取消仍在运行的分析，期间断线的客户端可以续传
+STREAM_ABANDON_SECONDS = float(os.getenv('STREAM_ABANDON_SECONDS', 10))
+# 最多同时保留的可续传流数量
+STREAM_MAX_BUFFERS = int(os.getenv('STREAM_MAX_BUFFERS', 200))
+# 客户端支持时是否对流式响应进行gzip压缩（每帧结束时刷新）
+STREAM_COMPRESSION = os.getenv('STREAM_COMPRESSION', 'false').lower() == 'true'
+
+TRANSPORT_NDJSON = 'ndjson'
+TRANSPORT_SSE = 'sse'
+
+MEDIA_TYPES = {
+    TRANSPORT_NDJSON: 'application/x-ndjson',
+    TRANSPORT_SSE: 'text/event-stream',
+}
+
+# NDJSON的心跳是一个空行，SSE的心跳是注释行，客户端都会忽略
+HEARTBEATS = {
+    TRANSPORT_NDJSON: b'\n',
+    TRANSPORT_SSE: b': heartbeat\n\n',
+}
+
+# 禁止代理缓冲和改写流式响应
+STREAM_HEADERS = {
+    'Cache-Control': 'no-cache, no-transform',
+    'X-Accel-Buffering': 'no',
+}
+
+
+def negotiate_transport(accept: Optional[str], requested: Optional[str] = None) -> str:
+    """
+    选择流式响应格式：显式指定的transport参数优先，其次是Accept请求头，默认NDJSON
+    """
+    if requested in MEDIA_TYPES:
+        return requested
+    if accept and MEDIA_TYPES[TRANSPORT_SSE] in accept:
+        return TRANSPORT_SSE
+    return TRANSPORT_NDJSON
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """客户端是否接受gzip编码（忽略q=0）"""
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        if coding.strip().lower() == 'gzip':
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+
+def format_event(event_id: Optional[int], frame: bytes, transport: str) -> bytes:
+    """
+    按传输格式包装一帧，帧本身是encode_frame输出的一行JSON
+
+    SSE格式带id字段，客户端断线后通过Last-Event-ID续传；NDJSON的事件ID即帧的序号（从1开始）
+    """
+    if transport == TRANSPORT_SSE:
+        prefix = b'data: ' if event_id is None else b'id: %d\ndata: ' % event_id
+        return prefix + frame + b'\n'
+    return frame
+
+
+async def encode_stream(events: AsyncIterable[Tuple[Optional[int], bytes]], transport: str,
+                        compress: bool = False,
+                        heartbeat: float = STREAM_HEARTBEAT_SECONDS) -> AsyncGenerator[bytes, None]:
+    """
+    将帧流编码为响应体
+
+    空闲超过heartbeat秒时发送心跳，避免代理因读超时断开长时间等待模型输出的连接；
+    启用压缩时每帧结束都执行同步刷新，客户端无需等待压缩缓冲区填满即可解码
+
+    Args:
+        events: (事件ID, 帧)的异步数据源，事件ID为None时不输出id字段
+        transport: TRANSPORT_NDJSON 或 TRANSPORT_SSE
+        compress: 是否gzip压缩
+        heartbeat: 心跳间隔（秒）
+
+    Returns:
+        响应体字节块的异步生成器
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    metrics = get_stage_metrics()
+    async for item in iterate_with_timeout(events, lambda: heartbeat):
+        data = HEARTBEATS[transport] if item is None else format_event(item[0], item[1], transport)
+        if compressor is not None:
+            data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        metrics.inc("stream_heartbeats" if item is None else "frames_streamed", transport=transport)
+        metrics.inc("stream_bytes", len(data), transport=transport)
+        yield data
+    if compressor is not None:
+        yield compressor.flush()
+
+
+def stream_headers(transport: str, compress: bool, stream_id: Optional[str] = None) -> Dict[str, str]:
+    """流式响应的响应头"""
+    headers = dict(STREAM_HEADERS)
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+        headers['Vary'] = 'Accept-Encoding'
+    if stream_id is not None:
+        headers['X-Stream-Id'] = stream_id
+    return headers
+
+
+class StreamBuffer:
+    """单个流式响应的帧缓冲，支持从任意位置回放，断线的客户端可以续传"""
+
+    def __init__(self, on_detached: Optional[Callable[[], None]] = None,
+                 on_attached: Optional[Callable[[], None]] = None):
+        """
+        初始化帧缓冲
+
+        Args:
+            on_detached: 最后一个接收者断开且流尚未结束时调用
+            on_attached: 有接收者接入时调用
+        """
+        self.frames: List[bytes] = []
+        self.finished = False
+        self.finished_at: Optional[float] = None
+        self.subscribers = 0
+        self.condition = asyncio.Condition()
+        self._on_detached = on_detached
+        self._on_attached = on_attached
+
+    async def publish(self, frame: bytes) -> None:
+        async with self.condition:
+            self.frames.append(frame)
+            self.condition.notify_all()
+
+    async def finish(self) -> None:
+        async with self.condition:
+            self.finished = True
+            self.finished_at = time.monotonic()
+            self.condition.notify_all()
+
+    async def replay(self, after: int = 0) -> AsyncGenerator[Tuple[int, bytes], None]:
+        """
+        从第after帧之后开始回放并继续跟随，直到流结束
+
+        Returns:
+            (事件ID, 帧)的异步生成器，事件ID从1开始
+        """
+        index = max(0, after)
+        self.subscribers += 1
+        if self._on_attached is not None:
+            self._on_attached()
+        try:
+            while True:
+                async with self.condition:
+                    while index >= len(self.frames) and not self.finished:
+                        await self.condition.wait()
+                    frames = self.frames[index:]
+                    finished = self.finished
+                for frame in frames:
+                    index += 1
+                    yield index, frame
+                if finished and index >= len(self.frames):
+                    return
+        finally:
+            # 客户端断开时响应生成器被取消或关闭，在此感知
+            self.subscribers -= 1
+            if not self.subscribers and not self.finished and self._on_detached is not None:
+                self._on_detached()
+
+
+class StreamRegistry:
+    """
+    可续传流式响应的注册表
+    分析在后台任务中运行并写入缓冲，与客户端连接解耦；结束后保留STREAM_RESUME_TTL秒。
+    没有客户端接收超过STREAM_ABANDON_SECONDS秒时取消后台任务，不再为无人读取的输出获取数据和生成token
+    """
+
+    def __init__(self, ttl: float = STREAM_RESUME_TTL, max_streams: int = STREAM_MAX_BUFFERS,
+                 abandon_after: float = STREAM_ABANDON_SECONDS):
+        self.ttl = ttl
+        self.max_streams = max_streams
+        self.abandon_after = abandon_after
+        self._buffers: Dict[str, StreamBuffer] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._abandon_timers: Dict[str, asyncio.TimerHandle] = {}
+        self.abandoned = 0
+
+    def open(self, source: AsyncIterable[bytes]) -> str:
+        """
+        在后台消费帧数据源
+
+        Returns:
+            流ID，用于续传
+        """
+        self._purge()
+        stream_id = uuid.uuid4().hex
+        buffer = StreamBuffer(on_detached=lambda: self._schedule_abandon(stream_id),
+                              on_attached=lambda: self._cancel_abandon(stream_id))
+        self._buffers[stream_id] = buffer
+        task = asyncio.create_task(self._produce(stream_id, source, buffer))
+        self._tasks[stream_id] = task
+        task.add_done_callback(lambda _: self._on_done(stream_id))
+        # 客户端始终没有开始接收时同样视为断开
+        self._schedule_abandon(stream_id)
+        return stream_id
+
+    def get(self, stream_id: str) -> Optional[StreamBuffer]:
+        """获取仍在保留期内的流，不存在或已过期时返回None"""
+        self._purge()
+        return self._buffers.get(stream_id)
+
+    async def _produce(self, stream_id: str, source: AsyncIterable[bytes], buffer: StreamBuffer) -> None:
+        try:
+            async for frame in source:
+                await buffer.publish(frame)
+        except Exception as e:
+            logger.error(f"流式响应 {stream_id} 生成失败: {str(e)}")
+            logger.exception(e)
+        finally:
+            await asyncio.shield(buffer.finish())
+
+    def _on_done(self, stream_id: str) -> None:
+        self._tasks.pop(stream_id, None)
+        self._cancel_abandon(stream_id)
+
+    def _schedule_abandon(self, stream_id: str) -> None:
+        if stream_id not in self._tasks:
+            return
+        self._cancel_abandon(stream_id)
+        self._abandon_timers[stream_id] = asyncio.get_running_loop().call_later(
+            self.abandon_after, self._abandon, stream_id
+        )
+
+    def _cancel_abandon(self, stream_id: str) -> None:
+        handle = self._abandon_timers.pop(stream_id, None)
+        if handle is not None:
+            handle.cancel()
+
+    def _abandon(self, stream_id: str) -> None:
+        self._abandon_timers.pop(stream_id, None)
+        task = self._tasks.get(stream_id)
+        buffer = self._buffers.get(stream_id)
+        if task is None or task.done() or (buffer is not None and buffer.subscribers):
+            return
+        logger.info(f"流式响应 {stream_id} 已无客户端接收，取消分析")
+        self.abandoned += 1
+        get_cancel_metrics().add("analysis_streams")
+        task.cancel()
+
+    def _purge(self) -> None:
+        now = time.monotonic()
+        expired = [stream_id for stream_id, buffer in self._buffers.items()
+                   if buffer.finished and now - buffer.finished_at > self.ttl]
+        for stream_id in expired:
+            del self._buffers[stream_id]
+        # 超过上限时优先淘汰最早结束的流，仍在运行的流不淘汰
+        overflow = len(self._buffers) - self.max_streams
+        if overflow > 0:
+            finished = sorted((buffer.finished_at, stream_id) for stream_id, buffer in self._buffers.items()
+                              if buffer.finished)
+            for _, stream_id in finished[:overflow]:
+                del self._buffers[stream_id]
+
+    async def close(self) -> None:
+        """取消所有仍在运行的后台任务"""
+        for stream_id in list(self._abandon_timers):
+            self._cancel_abandon(stream_id)
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "buffered": len(self._buffers),
+            "running": len(self._tasks),
+            "abandoned": self.abandoned,
+            "frames": sum(len(buffer.frames) for buffer in self._buffers.values()),
+        }
@@ -0,0 +1,55 @@
+import asyncio
+from typing import AsyncGenerator, AsyncIterator, List, TypeVar
+
+T = TypeVar('T')
+
+_DONE = object()
+
+
+class _StreamError:
+    """子流抛出的异常，转交给合并流的消费者重新抛出"""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+async def merge_streams(streams: List[AsyncIterator[T]]) -> AsyncGenerator[T, None]:
+    """
+    并发消费多个异步生成器，按到达顺序交错输出
+
+    合并流被关闭或取消时，会取消所有仍在运行的子流
+
+    Args:
+        streams: 异步生成器列表
+
+    Returns:
+        合并后的异步生成器
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump(stream: AsyncIterator[T]) -> None:
+        try:
+            async for item in stream:
+                await queue.put(item)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            queue.put_nowait(_StreamError(e))
+        finally:
+            queue.put_nowait(_DONE)
+
+    tasks = [asyncio.create_task(pump(stream)) for stream in streams]
+    remaining = len(tasks)
+    try:
+        while remaining:
+            item = await queue.get()
+            if item is _DONE:
+                remaining -= 1
+            elif isinstance(item, _StreamError):
+                raise item.error
+            else:
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,173 @@
+import heapq
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from utils.frame_records import frame_records
+
+
+def _grams(text: str) -> set:
+    """文本的单字和双字片段"""
+    return set(text) | {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class SymbolIndex:
+    """
+    代码/名称搜索索引
+    - 代码哈希表用于精确查找
+    - 按字典序排列的代码、名称（及别名）数组相当于压平的前缀树，前缀匹配用二分查找定位区间
+    - 单字和双字倒排索引用于其余的子串匹配
+    行号即结果的默认排序（通常按市值从高到低），同一匹配类别中行号小的在前
+    """
+
+    def __init__(self, symbols: List[str], names: List[str], aliases: Optional[List[str]] = None):
+        """
+        构建索引
+
+        Args:
+            symbols: 各行的代码，如 "105.AAPL"
+            names: 各行的名称
+            aliases: 各行名称的别名（如拼音首字母），按名称同等对待
+        """
+        self._symbols = [symbol.lower() for symbol in symbols]
+        self._names = [name.lower() for name in names]
+        self._aliases = [alias.lower() for alias in aliases] if aliases is not None else None
+        self._by_symbol: Dict[str, int] = {}
+        code_keys: List[Tuple[str, int]] = []
+        name_keys: List[Tuple[str, int]] = []
+        postings: Dict[str, List[int]] = {}
+        for row, (symbol, name) in enumerate(zip(self._symbols, self._names)):
+            for code in self._codes(symbol):
+                self._by_symbol.setdefault(code, row)
+                code_keys.append((code, row))
+            name_keys.append((name, row))
+            grams = _grams(symbol) | _grams(name)
+            if self._aliases is not None and self._aliases[row]:
+                name_keys.append((self._aliases[row], row))
+                grams |= _grams(self._aliases[row])
+            for gram in grams:
+                postings.setdefault(gram, []).append(row)
+        code_keys.sort()
+        name_keys.sort()
+        self._code_keys = [key for key, _ in code_keys]
+        self._code_rows = array('I', (row for _, row in code_keys))
+        self._name_keys = [key for key, _ in name_keys]
+        self._name_rows = array('I', (row for _, row in name_keys))
+        # 倒排列表用定长整数数组保存，内存约为list的四分之一
+        self._postings: Dict[str, array] = {gram: array('I', rows) for gram, rows in postings.items()}
+
+    @staticmethod
+    def _codes(symbol: str) -> List[str]:
+        """代码及去掉交易所前缀后的简码（105.AAPL -> aapl）"""
+        if '.' in symbol:
+            return [symbol, symbol.split('.', 1)[1]]
+        return [symbol]
+
+    def __len__(self) -> int:
+        return len(self._symbols)
+
+    def lookup(self, symbol: str) -> Optional[int]:
+        """按代码（不区分大小写，可省略交易所前缀）精确查找行号"""
+        return self._by_symbol.get(symbol.strip().lower())
+
+    @staticmethod
+    def _range(keys: List[str], keyword: str, exact: bool = False) -> Tuple[int, int]:
+        """有序键数组中等于（exact）或以keyword开头的区间"""
+        lo = bisect_left(keys, keyword)
+        hi = bisect_right(keys, keyword) if exact else bisect_left(keys, keyword + '\uffff')
+        return lo, hi
+
+    def search(self, keyword: str, limit: int = 10, accept: Optional[Callable[[int], bool]] = None) -> List[int]:
+        """
+        搜索代码、名称或别名包含关键词的行
+
+        Args:
+            keyword: 关键词，不区分大小写
+            limit: 最多返回的行数
+            accept: 行过滤条件，如只保留某个市场
+
+        Returns:
+            行号列表，依次为代码完全匹配、代码前缀匹配、名称或别名前缀匹配、其他包含匹配，同类按行顺序
+        """
+        keyword = keyword.strip().lower()
+        if not keyword or limit <= 0:
+            return []
+        results: List[int] = []
+        taken = set()
+
+        def collect(rows: Iterable[int]) -> None:
+            matched = {row for row in rows if row not in taken and (accept is None or accept(row))}
+            for row in heapq.nsmallest(limit - len(results), matched):
+                results.append(row)
+                taken.add(row)
+
+        lo, hi = self._range(self._code_keys, keyword, exact=True)
+        collect(self._code_rows[lo:hi])
+        if len(results) < limit:
+            lo, hi = self._range(self._code_keys, keyword)
+            collect(self._code_rows[lo:hi])
+        if len(results) < limit:
+            lo, hi = self._range(self._name_keys, keyword)
+            collect(self._name_rows[lo:hi])
+        if len(results) >= limit:
+            return results
+
+        # 其余子串匹配：从最短的倒排列表出发，按行号顺序取够为止，用子串判断过滤掉片段都命中但不连续的行
+        grams = [keyword] if len(keyword) == 1 else [keyword[i:i + 2] for i in range(len(keyword) - 1)]
+        postings = [self._postings.get(gram) for gram in grams]
+        if not all(postings):
+            return results
+        for row in min(postings, key=len):
+            if row in taken or (accept is not None and not accept(row)):
+                continue
+            alias = self._aliases[row] if self._aliases is not None else ''
+            if keyword in self._symbols[row] or keyword in self._names[row] or keyword in alias:
+                results.append(row)
+                if len(results) >= limit:
+                    break
+        return results
+
+
+class SymbolSnapshot:
+    """
+    一次行情列表的不可变快照
+    预先格式化好搜索结果和详情，请求路径上只做索引查找
+    """
+
+    def __init__(self, summaries: List[Dict[str, Any]], details: List[Dict[str, Any]]):
+        """
+        Args:
+            summaries: 各行的搜索结果，需包含symbol和name
+            details: 各行的详情，与summaries一一对应
+        """
+        self.summaries = summaries
+        self.details = details
+        self.index = SymbolIndex([row['symbol'] for row in summaries], [row['name'] for row in summaries])
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, summary_fields: Dict[str, Tuple[str, str]],
+                   detail_fields: Dict[str, Tuple[str, str]], order_by: str = 'market_value') -> 'SymbolSnapshot':
+        """
+        由行情数据构建快照
+
+        Args:
+            df: 行情数据
+            summary_fields: 搜索结果字段，见frame_records
+            detail_fields: 详情字段
+            order_by: 按该列从高到低排序，决定同等匹配下结果的先后
+        """
+        if order_by in df.columns:
+            order = pd.to_numeric(df[order_by], errors='coerce').fillna(0.0)
+            df = df.iloc[np.argsort(-order.to_numpy(), kind='stable')]
+        return cls(frame_records(df, summary_fields), frame_records(df, detail_fields))
+
+    def __len__(self) -> int:
+        return len(self.summaries)
+
+    def search(self, keyword: str, limit: int = 10) -> List[Dict[str, Any]]:
+        return [dict(self.summaries[row]) for row in self.index.search(keyword, limit)]
+
+    def detail(self, symbol: str) -> Optional[Dict[str, Any]]:
+        row = self.index.lookup(symbol)
+        return dict(self.details[row]) if row is not None else None
@@ -0,0 +1,149 @@
+import threading
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Optional, Set
+from utils.logger import get_logger
+
+# 获取日志器
+logger = get_logger()
+
+# 北京时间（无夏令时，使用固定时区即可）
+CN_TZ = timezone(timedelta(hours=8))
+
+# A股、基金的交易日历
+A_SHARE_MARKETS = ('A', 'ETF', 'LOF')
+
+# 各市场交易时段（北京时间），美股跨越北京时间午夜，收盘按冬令时取05:00
+SESSION_HOURS = {
+    'A': (time(9, 15), time(15, 0)),
+    'ETF': (time(9, 15), time(15, 0)),
+    'LOF': (time(9, 15), time(15, 0)),
+    'HK': (time(9, 0), time(16, 10)),
+    'US': (time(21, 30), time(5, 0)),
+}
+
+
+def now_cn() -> datetime:
+    """获取当前北京时间"""
+    return datetime.now(CN_TZ)
+
+
+class TradingCalendar:
+    """
+    交易日历
+    A股和场内基金使用新浪交易日历（含节假日），港股和美股按工作日近似
+    """
+
+    # 交易日历刷新间隔
+    REFRESH_INTERVAL = timedelta(days=1)
+    # 获取失败后的重试间隔
+    RETRY_INTERVAL = timedelta(minutes=10)
+
+    def __init__(self):
+        """初始化交易日历"""
+        self._trade_dates: Optional[Set[date]] = None
+        self._last_trade_date: Optional[date] = None
+        self._next_refresh: Optional[datetime] = None
+        self._lock = threading.Lock()
+
+    def _get_trade_dates(self) -> Optional[Set[date]]:
+        """获取A股交易日集合，获取失败时返回None，调用方退化为按工作日判断"""
+        with self._lock:
+            now = datetime.now()
+            if self._next_refresh is not None and now < self._next_refresh:
+                return self._trade_dates
+            try:
+                import akshare as ak
+                import pandas as pd
+                df = ak.tool_trade_date_hist_sina()
+                self._trade_dates = set(pd.to_datetime(df['trade_date']).dt.date)
+                self._last_trade_date = max(self._trade_dates)
+                self._next_refresh = now + self.REFRESH_INTERVAL
+                logger.debug(f"加载A股交易日历完成，共 {len(self._trade_dates)} 个交易日")
+            except Exception as e:
+                logger.warning(f"获取A股交易日历失败，按工作日判断: {str(e)}")
+                self._next_refresh = now + self.RETRY_INTERVAL
+            return self._trade_dates
+
+    def is_trading_day(self, day: date, market_type: str = 'A') -> bool:
+        """
+        判断是否为交易日
+
+        Args:
+            day: 日期
+            market_type: 市场类型
+
+        Returns:
+            是否为交易日
+        """
+        if market_type in A_SHARE_MARKETS:
+            trade_dates = self._get_trade_dates()
+            if trade_dates and self._last_trade_date >= day:
+                return day in trade_dates
+        return day.weekday() < 5
+
+    def previous_trading_day(self, day: date, market_type: str = 'A') -> date:
+        """获取指定日期之前（不含当天）最近的交易日"""
+        day -= timedelta(days=1)
+        while not self.is_trading_day(day, market_type):
+            day -= timedelta(days=1)
+        return day
+
+    def latest_closed_session(self, market_type: str = 'A', now: Optional[datetime] = None) -> date:
+        """
+        获取最近一个已收盘交易日的日期（美股为美东交易日期）
+
+        Args:
+            market_type: 市场类型
+            now: 当前北京时间，默认为当前时间
+
+        Returns:
+            交易日期
+        """
+        now = now or now_cn()
+        close_time = SESSION_HOURS.get(market_type, SESSION_HOURS['A'])[1]
+
+        if market_type == 'US':
+            # 美股交易日d在北京时间d+1日收盘
+            candidate = (now - timedelta(hours=close_time.hour, minutes=close_time.minute)).date() - timedelta(days=1)
+            while not self.is_trading_day(candidate, market_type):
+                candidate -= timedelta(days=1)
+            return candidate
+
+        today = now.date()
+        if self.is_trading_day(today, market_type) and now.time() >= close_time:
+            return today
+        return self.previous_trading_day(today, market_type)
+
+    def is_in_session(self, market_type: str = 'A', now: Optional[datetime] = None) -> bool:
+        """
+        判断市场当前是否处于交易时段（含集合竞价）
+
+        Args:
+            market_type: 市场类型
+            now: 当前北京时间，默认为当前时间
+
+        Returns:
+            是否处于交易时段
+        """
+        now = now or now_cn()
+        open_time, close_time = SESSION_HOURS.get(market_type, SESSION_HOURS['A'])
+
+        if market_type == 'US':
+            if now.time() >= open_time:
+                return self.is_trading_day(now.date(), market_type)
+            if now.time() < close_time:
+                return self.is_trading_day(now.date() - timedelta(days=1), market_type)
+            return False
+
+        return self.is_trading_day(now.date(), market_type) and open_time <= now.time() < close_time
+
+
+_calendar: Optional[TradingCalendar] = None
+
+
+def get_trading_calendar() -> TradingCalendar:
+    """获取进程内共享的交易日历"""
+    global _calendar
+    if _calendar is None:
+        _calendar = TradingCalendar()
+    return _calendar
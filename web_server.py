@@ -4,17 +4,44 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any, Generator
+from typing import List, Optional, Dict, Any, AsyncGenerator, Generator
 from services.stock_analyzer_service import StockAnalyzerService
 from services.us_stock_service_async import USStockServiceAsync
 from services.fund_service_async import FundServiceAsync
+from services.symbol_directory import SymbolDirectory
+from services.scan_job_service import ScanJobService
+from services.precompute_scheduler import PrecomputeScheduler
+from services.analysis_cache import get_analysis_cache
+from services.llm_response_cache import get_llm_response_cache
+from utils.loop_monitor import LoopLagMonitor
+from utils.compute_executor import shutdown_compute_executor
+from utils.http_client import get_http_client, get_http_client_pool
+from utils.llm_metrics import get_llm_metrics
+from utils.cancel_metrics import get_cancel_metrics
+from utils.stage_metrics import get_stage_metrics
+from utils.prometheus import (CONTENT_TYPE as METRICS_CONTENT_TYPE, MERGE_MAX, MetricsWriter, read_worker_metrics,
+                              write_worker_metrics)
+from utils.shared_cache import get_shared_cache
+from utils.process_lock import ProcessLock
+from utils.sqlite_store import get_data_dir
+from services.llm_router import get_default_router
+from services.llm_scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, scheduler_stats
+from services.admission_controller import AdmissionController, AdmissionRejected, AdmissionTicket, retry_after_header
+from utils.frame_encoder import encode_frame
+from utils.stream_transport import (StreamRegistry, STREAM_COMPRESSION, MEDIA_TYPES, accepts_gzip, encode_stream,
+                                    negotiate_transport, stream_headers)
+from services.ai_prefetcher import get_ai_prefetcher
+from contextlib import asynccontextmanager
 import os
+import argparse
+import asyncio
+import importlib.util
+import time
 import httpx
 from utils.logger import get_logger
 from utils.api_utils import APIUtils
 from dotenv import load_dotenv
 import uvicorn
-import json
 import secrets
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
@@ -24,8 +51,26 @@ load_dotenv()
 # 获取日志器
 logger = get_logger()
 
+def _load_secret_key() -> str:
+    """
+    JWT签名密钥：优先读取JWT_SECRET_KEY，未配置时使用数据目录中持久化的随机密钥，
+    保证多个工作进程签发的令牌可以互相验证
+    """
+    secret = os.getenv("JWT_SECRET_KEY")
+    if secret:
+        return secret
+    path = os.path.join(get_data_dir(), "jwt_secret")
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+    except FileExistsError:
+        pass
+    with open(path) as f:
+        return f.read().strip()
+
 # JWT相关配置
-SECRET_KEY = os.getenv("JWT_SECRET_KEY", secrets.token_hex(32))
+SECRET_KEY = _load_secret_key()
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 10080  # Token过期时间一周
 
@@ -35,13 +80,112 @@ print(LOGIN_PASSWORD)
 # 是否需要登录
 REQUIRE_LOGIN = bool(LOGIN_PASSWORD.strip())
 
+# /metrics 的访问令牌（Authorization: Bearer <token>），为空时不校验
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+# 各工作进程写出指标文件的间隔（秒），处理抓取请求的进程合并所有进程的指标
+METRICS_PUBLISH_SECONDS = float(os.getenv("METRICS_PUBLISH_SECONDS", 5))
+
+
+# 初始化异步服务
+us_stock_service = USStockServiceAsync()
+fund_service = FundServiceAsync()
+symbol_directory = SymbolDirectory()
+scan_job_service = ScanJobService()
+
+# 收盘后预计算调度器，也可通过 python -m services.precompute_scheduler 独立运行
+PRECOMPUTE_ENABLED = os.getenv('PRECOMPUTE_ENABLED', 'false').lower() == 'true'
+precompute_scheduler = PrecomputeScheduler() if PRECOMPUTE_ENABLED else None
+
+# 空闲时预生成热门股票的AI分析，由PREFETCH_ENABLED控制
+ai_prefetcher = get_ai_prefetcher()
+
+# 事件循环延迟监控
+loop_monitor = LoopLagMonitor()
+
+# 分析流的帧缓冲，客户端断线后可按事件ID续传
+stream_registry = StreamRegistry()
+
+# 分析请求的准入控制：全局和每用户并发上限，单只分析优先于批量扫描
+admission_controller = AdmissionController()
+
+# 多工作进程时只有持有该锁的进程运行预计算、AI预取和缓存清理等后台任务
+leader_lock = ProcessLock("scheduler")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动和关闭后台服务"""
+    loop_monitor.start()
+    is_leader = leader_lock.acquire()
+    analysis_cache = get_analysis_cache()
+    if analysis_cache is not None and is_leader:
+        await asyncio.to_thread(analysis_cache.purge_expired)
+    await scan_job_service.start()
+    # 美股和基金列表快照在后台加载和刷新，搜索请求不直接访问上游接口
+    us_stock_service.start()
+    fund_service.start()
+    await symbol_directory.start()
+    if precompute_scheduler is not None and is_leader:
+        precompute_scheduler.start()
+    if ai_prefetcher is not None and is_leader:
+        ai_prefetcher.start()
+    metrics_publisher = asyncio.create_task(publish_metrics())
+    yield
+    metrics_publisher.cancel()
+    await asyncio.gather(metrics_publisher, return_exceptions=True)
+    if ai_prefetcher is not None:
+        await ai_prefetcher.stop()
+    if precompute_scheduler is not None:
+        await precompute_scheduler.stop()
+    await symbol_directory.stop()
+    await fund_service.stop()
+    await us_stock_service.stop()
+    await scan_job_service.stop()
+    await stream_registry.close()
+    await loop_monitor.stop()
+    await get_http_client_pool().aclose()
+    shutdown_compute_executor()
+    leader_lock.release()
 
 app = FastAPI(
     title="Stock Scanner API",
     description="异步股票分析API",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# 请求耗时指标中间件
+class RequestMetricsMiddleware:
+    """按路由、方法和状态码记录请求耗时，流式响应记录到响应结束（ASGI中间件，不影响流式输出和断开检测）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            get_stage_metrics().observe(
+                "http_request", (time.perf_counter() - started) * 1000,
+                method=scope["method"], status=status,
+                route=(route.path or "static") if route is not None else "unmatched"
+            )
+
+
+app.add_middleware(RequestMetricsMiddleware)
+
 # 添加CORS中间件
 app.add_middleware(
     CORSMiddleware,
@@ -51,14 +195,43 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 初始化异步服务
-us_stock_service = USStockServiceAsync()
-fund_service = FundServiceAsync()
+def stream_response(http_request: Request, events, stream_id: Optional[str] = None) -> StreamingResponse:
+    """
+    按客户端协商的格式返回流式响应
+
+    transport参数或Accept: text/event-stream选择SSE，默认NDJSON；
+    启用STREAM_COMPRESSION且客户端接受gzip时按帧刷新压缩
+    """
+    transport = negotiate_transport(http_request.headers.get('accept'), http_request.query_params.get('transport'))
+    compress = STREAM_COMPRESSION and accepts_gzip(http_request.headers.get('accept-encoding'))
+    return StreamingResponse(encode_stream(events, transport, compress), media_type=MEDIA_TYPES[transport],
+                             headers=stream_headers(transport, compress, stream_id))
+
+async def admission_frames(ticket: AdmissionTicket, stock_codes: List[str]) -> AsyncGenerator[bytes, None]:
+    """等待准入许可，排队时按股票输出排队位置帧（与AI端点排队帧格式相同），轮到时位置为0"""
+    queued = False
+    async for position in ticket.wait():
+        queued = True
+        for code in stock_codes:
+            yield encode_frame({"stock_code": code, "status": "waiting", "queue_position": position})
+    if queued:
+        for code in stock_codes:
+            yield encode_frame({"stock_code": code, "status": "analyzing", "queue_position": 0})
 
 # 定义请求和响应模型
 class AnalyzeRequest(BaseModel):
     stock_codes: List[str]
     market_type: str = "A"
+    ai_top_n: Optional[int] = Field(default=None, ge=0, le=50)
+    api_url: Optional[str] = None
+    api_key: Optional[str] = None
+    api_model: Optional[str] = None
+    api_timeout: Optional[str] = None
+
+class ScanJobRequest(BaseModel):
+    stock_codes: List[str]
+    market_type: str = "A"
+    min_score: int = 0
     api_url: Optional[str] = None
     api_key: Optional[str] = None
     api_model: Optional[str] = None
@@ -132,13 +305,32 @@ async def verify_token(token: Optional[str] = Depends(optional_oauth2_scheme)):
     except JWTError:
         raise credentials_exception
 
+def resolve_session(http_request: Request) -> str:
+    """
+    获取请求所属的会话，用于共享配额时按用户公平排队和每用户并发、排队上限
+    只有开启登录时令牌中的sid能证明身份；未开启登录时任何人都能通过 /api/login 获取新令牌，
+    不带令牌或cookie即可得到新身份，因此按客户端地址区分（只信任FORWARDED_ALLOW_IPS中的代理转发的地址），
+    同一出口地址后的多个用户共享每用户上限
+    """
+    if REQUIRE_LOGIN:
+        scheme, _, token = http_request.headers.get('authorization', '').partition(' ')
+        if scheme.lower() == 'bearer' and token:
+            try:
+                sid = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sid")
+            except JWTError:
+                sid = None
+            if sid:
+                return sid
+    host = http_request.client.host if http_request.client else "unknown"
+    return f"ip:{host}"
+
 # 用户登录接口
 @app.post("/api/login")
 async def login(request: LoginRequest):
     """用户登录接口"""
     # 如果未设置密码，表示不需要登录
     if not REQUIRE_LOGIN:
-        access_token = create_access_token(data={"sub": "guest"})
+        access_token = create_access_token(data={"sub": "guest", "sid": secrets.token_urlsafe(12)})
         return {"access_token": access_token, "token_type": "bearer"}
         
     if request.password != LOGIN_PASSWORD:
@@ -148,7 +340,7 @@ async def login(request: LoginRequest):
     # 创建访问令牌
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": "user"}, expires_delta=access_token_expires
+        data={"sub": "user", "sid": secrets.token_urlsafe(12)}, expires_delta=access_token_expires
     )
     logger.info("用户登录成功")
     return {"access_token": access_token, "token_type": "bearer"}
@@ -173,7 +365,7 @@ async def get_config():
 
 # AI分析股票
 @app.post("/api/analyze")
-async def analyze(request: AnalyzeRequest, username: str = Depends(verify_token)):
+async def analyze(request: AnalyzeRequest, http_request: Request, username: str = Depends(verify_token)):
     try:
         logger.info("开始处理分析请求")
         stock_codes = request.stock_codes
@@ -196,17 +388,25 @@ async def analyze(request: AnalyzeRequest, username: str = Depends(verify_token)
         logger.debug(f"自定义API配置: URL={custom_api_url}, 模型={custom_api_model}, API Key={'已提供' if custom_api_key else '未提供'}, Timeout={custom_api_timeout}")
         
         # 创建新的分析器实例，使用自定义配置
+        # 共享AI端点配额时按会话公平排队，会话来自登录令牌，未开启登录时为客户端地址
+        session_id = resolve_session(http_request)
+        user_id = f"{username}:{session_id}"
         custom_analyzer = StockAnalyzerService(
             custom_api_url=custom_api_url,
             custom_api_key=custom_api_key,
             custom_api_model=custom_api_model,
-            custom_api_timeout=custom_api_timeout
+            custom_api_timeout=custom_api_timeout,
+            user_id=user_id
         )
         
         if not stock_codes:
             logger.warning("未提供股票代码")
             raise HTTPException(status_code=400, detail="请输入代码")
         
+        # 请求历史用于挑选预生成的候选股票
+        if ai_prefetcher is not None:
+            await ai_prefetcher.record_request(stock_codes, market_type)
+        
         # 定义流式生成器
         async def generate_stream():
             if len(stock_codes) == 1:
@@ -214,9 +414,9 @@ async def analyze(request: AnalyzeRequest, username: str = Depends(verify_token)
                 stock_code = stock_codes[0].strip()
                 logger.info(f"开始单股流式分析: {stock_code}")
                 
-                stock_code_json = json.dumps(stock_code)
-                init_message = f'{{"stream_type": "single", "stock_code": {stock_code_json}}}\n'
-                yield init_message
+                yield encode_frame({"stream_type": "single", "stock_code": stock_code})
+                async for frame in admission_frames(ticket, [stock_code]):
+                    yield frame
                 
                 logger.debug(f"开始处理股票 {stock_code} 的流式响应")
                 chunk_count = 0
@@ -224,16 +424,16 @@ async def analyze(request: AnalyzeRequest, username: str = Depends(verify_token)
                 # 使用异步生成器
                 async for chunk in custom_analyzer.analyze_stock(stock_code, market_type, stream=True):
                     chunk_count += 1
-                    yield chunk + '\n'
+                    yield chunk
                 
                 logger.info(f"股票 {stock_code} 流式分析完成，共发送 {chunk_count} 个块")
             else:
                 # 批量分析流式处理
                 logger.info(f"开始批量流式分析: {stock_codes}")
                 
-                stock_codes_json = json.dumps(stock_codes)
-                init_message = f'{{"stream_type": "batch", "stock_codes": {stock_codes_json}}}\n'
-                yield init_message
+                yield encode_frame({"stream_type": "batch", "stock_codes": stock_codes})
+                async for frame in admission_frames(ticket, [code.strip() for code in stock_codes]):
+                    yield frame
                 
                 logger.debug(f"开始处理批量股票的流式响应")
                 chunk_count = 0
@@ -243,15 +443,38 @@ async def analyze(request: AnalyzeRequest, username: str = Depends(verify_token)
                     [code.strip() for code in stock_codes], 
                     min_score=0, 
                     market_type=market_type,
-                    stream=True
+                    stream=True,
+                    ai_top_n=request.ai_top_n
                 ):
                     chunk_count += 1
-                    yield chunk + '\n'
+                    yield chunk
                 
                 logger.info(f"批量流式分析完成，共发送 {chunk_count} 个块")
         
-        logger.info("成功创建流式响应生成器")
-        return StreamingResponse(generate_stream(), media_type='application/json')
+        async def admitted_stream():
+            try:
+                async for frame in generate_stream():
+                    yield frame
+            finally:
+                ticket.release()
+        
+        # 准入控制：超出并发上限时排队，排队已满时立即返回429和预计等待时间
+        priority = PRIORITY_INTERACTIVE if len(stock_codes) == 1 else PRIORITY_BATCH
+        try:
+            ticket = admission_controller.admit(user_id, priority)
+        except AdmissionRejected as e:
+            return JSONResponse(
+                status_code=429,
+                content={"detail": f"{e.message}，预计等待约 {retry_after_header(e.retry_after)} 秒",
+                         "retry_after": round(e.retry_after, 1)},
+                headers={"Retry-After": retry_after_header(e.retry_after)}
+            )
+        
+        # 分析在后台写入帧缓冲，客户端断线后可通过 /api/analyze/streams/{stream_id} 续传；
+        # 超过STREAM_ABANDON_SECONDS没有客户端接收时取消分析，中止AI请求并跳过尚未开始的数据获取
+        stream_id = stream_registry.open(admitted_stream())
+        logger.info(f"成功创建流式响应 {stream_id}")
+        return stream_response(http_request, stream_registry.get(stream_id).replay(), stream_id)
             
     except Exception as e:
         error_msg = f"分析时出错: {str(e)}"
@@ -259,6 +482,78 @@ async def analyze(request: AnalyzeRequest, username: str = Depends(verify_token)
         logger.exception(e)
         raise HTTPException(status_code=500, detail=error_msg)
 
+# 续传分析流
+@app.get("/api/analyze/streams/{stream_id}")
+async def resume_analyze_stream(stream_id: str, http_request: Request, last_event_id: Optional[int] = None,
+                                username: str = Depends(verify_token)):
+    """从Last-Event-ID（或last_event_id参数）之后继续接收分析流，NDJSON的事件ID即已收到的帧数"""
+    buffer = stream_registry.get(stream_id)
+    if buffer is None:
+        raise HTTPException(status_code=404, detail="分析流不存在或已过期")
+    header = http_request.headers.get('last-event-id')
+    if last_event_id is None and header and header.strip().isdigit():
+        last_event_id = int(header)
+    return stream_response(http_request, buffer.replay(last_event_id or 0), stream_id)
+
+# 提交后台扫描任务
+@app.post("/api/scan_jobs")
+async def create_scan_job(request: ScanJobRequest, username: str = Depends(verify_token)):
+    """提交后台扫描任务，立即返回任务ID"""
+    stock_codes = list(dict.fromkeys(code.strip() for code in request.stock_codes if code.strip()))
+    if not stock_codes:
+        raise HTTPException(status_code=400, detail="请输入代码")
+    
+    job_id = await scan_job_service.submit(
+        stock_codes,
+        market_type=request.market_type,
+        min_score=request.min_score,
+        api_url=request.api_url,
+        api_key=request.api_key,
+        api_model=request.api_model,
+        api_timeout=request.api_timeout
+    )
+    return {"job_id": job_id, "status": "pending"}
+
+# 查询后台扫描任务
+@app.get("/api/scan_jobs/{job_id}")
+async def get_scan_job(job_id: str, username: str = Depends(verify_token)):
+    """查询任务状态、进度和已完成的结果"""
+    job = await scan_job_service.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+# 订阅后台扫描任务进度
+@app.get("/api/scan_jobs/{job_id}/stream")
+async def stream_scan_job(job_id: str, http_request: Request, username: str = Depends(verify_token)):
+    """以流式响应订阅任务进度，可随时重新接入运行中的任务"""
+    job = await scan_job_service.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    
+    async def generate_stream():
+        # 重新接入时任务事件从头回放，因此不输出事件ID
+        async for frame in scan_job_service.subscribe(job_id):
+            yield None, encode_frame(frame)
+    
+    return stream_response(http_request, generate_stream())
+
+# 取消后台扫描任务
+@app.post("/api/scan_jobs/{job_id}/cancel")
+async def cancel_scan_job(job_id: str, username: str = Depends(verify_token)):
+    """取消任务"""
+    if not await scan_job_service.cancel(job_id):
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return {"job_id": job_id, "cancelled": True}
+
+# 查询预计算状态
+@app.get("/api/precompute/status")
+async def get_precompute_status(username: str = Depends(verify_token)):
+    """返回各自选列表最近一次收盘后预计算的情况"""
+    if precompute_scheduler is None:
+        return {"enabled": False, "watchlists": []}
+    return {"enabled": True, "watchlists": await precompute_scheduler.get_status()}
+
 # 搜索美股代码
 @app.get("/api/search_us_stocks")
 async def search_us_stocks(keyword: str = "", username: str = Depends(verify_token)):
@@ -289,6 +584,13 @@ async def search_funds(keyword: str = "", market_type: str = "", username: str =
         logger.error(f"搜索基金代码时出错: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# 证券代码自动补全（A股、港股、美股、ETF、LOF）
+@app.get("/api/symbols/autocomplete")
+async def autocomplete_symbols(q: str = "", market_type: str = "", limit: int = 10,
+                               username: str = Depends(verify_token)):
+    # 只查内存索引，不进入线程池
+    return {"results": symbol_directory.autocomplete(q, market_type or None, max(1, min(limit, 50)))}
+
 # 获取美股详情
 @app.get("/api/us_stock_detail/{symbol}")
 async def get_us_stock_detail(symbol: str, username: str = Depends(verify_token)):
@@ -344,22 +646,22 @@ async def test_api_connection(request: TestAPIRequest, username: str = Depends(v
         test_url = APIUtils.format_api_url(api_url)
         logger.debug(f"完整API测试URL: {test_url}")
         
-        # 使用异步HTTP客户端发送测试请求
-        async with httpx.AsyncClient(timeout=float(api_timeout)) as client:
-            response = await client.post(
-                test_url,
-                headers={
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": api_model or "",
-                    "messages": [
-                        {"role": "user", "content": "Hello, this is a test message. Please respond with 'API connection successful'."}
-                    ],
-                    "max_tokens": 20
-                }
-            )
+        # 使用共享的长连接客户端发送测试请求，测试建立的连接可被后续分析复用
+        client = get_http_client(test_url, float(api_timeout))
+        response = await client.post(
+            test_url,
+            headers={
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json"
+            },
+            json={
+                "model": api_model or "",
+                "messages": [
+                    {"role": "user", "content": "Hello, this is a test message. Please respond with 'API connection successful'."}
+                ],
+                "max_tokens": 20
+            }
+        )
         
         # 检查响应
         if response.status_code == 200:
@@ -388,6 +690,168 @@ async def test_api_connection(request: TestAPIRequest, username: str = Depends(v
             content={"success": False, "message": f"API 测试连接时出错: {str(e)}"}
         )
 
+# 运行状态统计
+@app.get("/api/stats")
+async def get_stats(username: str = Depends(verify_token)):
+    """返回事件循环延迟等运行状态统计"""
+    analysis_cache = get_analysis_cache()
+    llm_response_cache = get_llm_response_cache()
+    shared_cache = get_shared_cache()
+    return {
+        "worker": {"pid": os.getpid(), "leader": leader_lock.held},
+        "event_loop": loop_monitor.stats(),
+        "analysis_cache": await asyncio.to_thread(analysis_cache.stats) if analysis_cache is not None else None,
+        "http_clients": get_http_client_pool().stats(),
+        "llm": get_llm_metrics().snapshot(),
+        "llm_endpoints": get_default_router().stats(),
+        "llm_schedulers": scheduler_stats(),
+        "llm_response_cache": await asyncio.to_thread(llm_response_cache.stats) if llm_response_cache is not None else None,
+        "symbol_snapshots": {**us_stock_service.stats(), **fund_service.stats()},
+        "symbol_directory": symbol_directory.stats(),
+        "shared_cache": await asyncio.to_thread(shared_cache.stats) if shared_cache is not None else None,
+        "streams": stream_registry.stats(),
+        "cancelled": get_cancel_metrics().snapshot(),
+        "admission": admission_controller.stats(),
+        "scan_jobs": scan_job_service.stats(),
+        "stages": get_stage_metrics().snapshot(),
+        "prefetch": await asyncio.to_thread(ai_prefetcher.stats) if ai_prefetcher is not None else None
+    }
+
+# 流水线各阶段的直方图说明，名称为 stage_metrics 中的阶段名
+STAGE_HELP = {
+    "data_fetch": "历史行情上游获取耗时（秒），按市场和akshare函数",
+    "indicators": "单只股票技术指标计算耗时（秒）",
+    "scoring": "单只股票评分耗时（秒）",
+    "ai_ttft": "AI分析首token耗时（秒），按来源和单只/批量",
+    "ai_total": "AI分析总耗时（秒），按来源和单只/批量",
+    "http_request": "HTTP请求耗时（秒），流式响应计到响应结束",
+}
+COUNTER_HELP = {
+    "data_fetches": "历史行情上游获取次数",
+    "frames_streamed": "流式响应发送的帧数",
+    "stream_heartbeats": "流式响应发送的心跳数",
+    "stream_bytes": "流式响应发送的字节数",
+}
+
+
+def _cache_samples(writer: MetricsWriter, caches: Dict[str, Optional[Dict[str, Any]]]) -> None:
+    stats = {name: value for name, value in caches.items() if value is not None}
+    writer.counter("cache_hits", "缓存命中次数", [({"cache": name}, s["hits"]) for name, s in stats.items()])
+    writer.counter("cache_misses", "缓存未命中次数", [({"cache": name}, s["misses"]) for name, s in stats.items()])
+    # 各进程共用同一个数据库，条目数取最大值而不是求和
+    writer.gauge("cache_entries", "缓存条目数", [({"cache": name}, s["entries"]) for name, s in stats.items()],
+                 merge=MERGE_MAX)
+
+
+async def collect_metrics() -> MetricsWriter:
+    """
+    收集本进程的指标
+    各阶段耗时和计数在记录时累计，队列深度、活跃流和缓存命中等在收集时从各服务的统计中读取
+    """
+    writer = MetricsWriter()
+    stages = get_stage_metrics()
+    for stage in stages.stages():
+        writer.histogram(f"{stage}_duration_seconds", STAGE_HELP.get(stage, f"{stage}耗时（秒）"),
+                         stages.histograms(stage))
+    for name in stages.counter_names():
+        writer.counter(name, COUNTER_HELP.get(name, name), stages.counters(name))
+
+    # AI接口调用（每个端点的每次尝试）
+    llm = get_llm_metrics()
+    for field, help_text in (("queue_ms", "等待并发许可"), ("ttft_ms", "首token"), ("total_ms", "请求总")):
+        writer.histogram(f"llm_{field[:-3]}_seconds", f"AI接口{help_text}耗时（秒），按模型和端点",
+                         [({"model": model, "endpoint": endpoint}, histogram)
+                          for model, endpoint, histogram in llm.histograms(field)])
+    calls = llm.calls()
+    writer.counter("llm_calls", "AI接口调用次数", [({"model": m, "endpoint": e}, c) for m, e, c, _ in calls])
+    writer.counter("llm_errors", "AI接口调用失败次数", [({"model": m, "endpoint": e}, f) for m, e, _, f in calls])
+    schedulers = scheduler_stats()
+    writer.gauge("llm_in_flight", "AI接口进行中的请求数",
+                 [({"endpoint": name}, s["in_flight"]) for name, s in schedulers.items()])
+    writer.gauge("llm_queue_depth", "等待AI接口并发或限流许可的请求数",
+                 [({"endpoint": name}, s["queued"]) for name, s in schedulers.items()])
+    writer.counter("llm_rate_limited", "AI接口限流次数",
+                   [({"endpoint": name}, s["rate_limited"]) for name, s in schedulers.items()])
+
+    # 分析请求准入、流和后台任务
+    admission = admission_controller.stats()
+    writer.gauge("analyze_running", "运行中的分析请求数", [({}, admission["running"])])
+    writer.gauge("analyze_queue_depth", "排队中的分析请求数", [({}, admission["queued"])])
+    writer.counter("analyze_admitted", "获得许可的分析请求数", [({}, admission["admitted"])])
+    writer.counter("analyze_rejected", "因排队已满被拒绝的分析请求数", [({}, admission["rejected"])])
+    streams = stream_registry.stats()
+    writer.gauge("streams_active", "生成中的分析流数", [({}, streams["running"])])
+    writer.gauge("streams_buffered", "可续传的分析流数", [({}, streams["buffered"])])
+    writer.counter("cancelled", "因客户端断开而取消的工作量",
+                   [({"kind": kind}, count) for kind, count in get_cancel_metrics().snapshot().items()])
+    jobs = scan_job_service.stats()
+    writer.gauge("scan_jobs_queue_depth", "排队中的扫描任务数", [({}, jobs["queued"])])
+    writer.gauge("scan_jobs_active", "本进程负责的未完成扫描任务数", [({}, jobs["active"])])
+    lag = loop_monitor.stats()
+    writer.gauge("event_loop_lag_seconds", "事件循环延迟（秒），多个工作进程时取最大值",
+                 [({"quantile": "0.5"}, lag["p50_ms"] / 1000), ({"quantile": "0.99"}, lag["p99_ms"] / 1000)],
+                 merge=MERGE_MAX)
+
+    # 缓存命中
+    analysis_cache = get_analysis_cache()
+    llm_response_cache = get_llm_response_cache()
+    shared_cache = get_shared_cache()
+    _cache_samples(writer, {
+        "analysis": await asyncio.to_thread(analysis_cache.stats) if analysis_cache is not None else None,
+        "llm_response": await asyncio.to_thread(llm_response_cache.stats) if llm_response_cache is not None else None,
+        "shared": await asyncio.to_thread(shared_cache.stats) if shared_cache is not None else None,
+    })
+    snapshots = {**us_stock_service.stats(), **fund_service.stats()}
+    writer.gauge("snapshot_age_seconds", "列表快照的年龄（秒），多个工作进程时取最大值",
+                 [({"snapshot": key}, s["age_seconds"]) for key, s in snapshots.items()], merge=MERGE_MAX)
+    writer.counter("snapshot_refresh_failures", "列表快照刷新失败次数",
+                   [({"snapshot": key}, s["failures"]) for key, s in snapshots.items()])
+    return writer
+
+
+async def render_metrics() -> str:
+    """
+    以Prometheus文本格式导出所有工作进程合并后的指标
+    本进程的指标实时收集，其他进程的指标读取其最近写出的文件（最多滞后METRICS_PUBLISH_SECONDS秒）；
+    已退出进程的计数器和直方图保留，计数在进程重启后仍单调递增
+    """
+    writer = await collect_metrics()
+    # 先写出本进程的最新值：下一次抓取若由其他进程处理，读到的本进程计数不会小于这次返回的值
+    await asyncio.to_thread(write_worker_metrics, writer)
+    workers = 1
+    for _, families, alive in await asyncio.to_thread(lambda: list(read_worker_metrics())):
+        writer.merge(families, alive)
+        workers += alive
+    writer.gauge("workers", "运行中的工作进程数", [({}, workers)])
+    return writer.render()
+
+
+async def publish_metrics() -> None:
+    """定期写出本进程的指标，退出时写出最后一次"""
+    try:
+        while True:
+            await asyncio.sleep(METRICS_PUBLISH_SECONDS)
+            try:
+                writer = await collect_metrics()
+                await asyncio.to_thread(write_worker_metrics, writer)
+            except Exception as e:
+                logger.warning(f"写出指标文件失败: {str(e)}")
+    finally:
+        try:
+            write_worker_metrics(await collect_metrics())
+        except Exception as e:
+            logger.warning(f"写出指标文件失败: {str(e)}")
+
+
+# Prometheus指标
+@app.get("/metrics")
+async def metrics(http_request: Request):
+    """Prometheus文本格式的指标，多工作进程时返回所有进程合并后的指标"""
+    if METRICS_TOKEN and not secrets.compare_digest(
+            http_request.headers.get("authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=401, detail="无效的指标访问令牌")
+    return Response(await render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
 # 检查是否需要登录
 @app.get("/api/need_login")
 async def need_login():
@@ -405,4 +869,38 @@ else:
 
 
 if __name__ == '__main__':
-    uvicorn.run("web_server:app", host="0.0.0.0", port=8888, reload=True)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Stock Scanner API 服务")
+    parser.add_argument('--prod', action='store_true', help="生产模式：不自动重载，使用uvloop和httptools")
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WEB_WORKERS', 1)),
+                        help="生产模式的工作进程数，默认读取WEB_WORKERS，未设置时为1")
+    parser.add_argument('--host', default=os.getenv('WEB_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('WEB_PORT', 8888)))
+    args = parser.parse_args()
+
+    if args.prod:
+        # uvloop和httptools随uvicorn[standard]安装，缺失时回退到标准实现
+        has_uvloop = importlib.util.find_spec('uvloop') is not None
+        has_httptools = importlib.util.find_spec('httptools') is not None
+        logger.info(f"生产模式启动: {args.workers} 个工作进程, uvloop={has_uvloop}, httptools={has_httptools}")
+        if args.workers > 1:
+            # 流续传缓冲和准入控制的状态保存在各进程内存中，尚未跨进程共享
+            logger.warning(
+                f"{args.workers} 个工作进程各自保存流续传缓冲和准入控制状态：续传请求落到其他进程时返回404，"
+                f"并发和排队上限按进程计算（实际为配置值的 {args.workers} 倍）"
+            )
+        uvicorn.run(
+            "web_server:app",
+            host=args.host,
+            port=args.port,
+            workers=args.workers,
+            reload=False,
+            loop="uvloop" if has_uvloop else "asyncio",
+            http="httptools" if has_httptools else "h11",
+            # 只信任反向代理（nginx）转发的客户端地址，直接访问的客户端无法伪造X-Forwarded-For
+            proxy_headers=True,
+            forwarded_allow_ips=os.getenv('FORWARDED_ALLOW_IPS', '127.0.0.1'),
+            timeout_keep_alive=75,
+            access_log=False
+        )
+    else:
+        uvicorn.run("web_server:app", host=args.host, port=args.port, reload=True)
\ No newline at end of file